@@ -23,7 +23,7 @@ class ChatLobbyPlugin(GameLobbyPlugin):
         self.gameIdx += 1
         newRoom = ChatRoom("chat:{}".format(self.gameIdx),
                            "Chat Room #{}".format(self.gameIdx))
-        self.rooms[self.gameIdx] = newRoom
+        self.rooms[self.gameIdx] = newRoom.path
 
         self.txQueue.put_nowait(InternalRegisterGi(newRoom,
                                                    initiatorWs=qmsg.initiatorWs))
@@ -1,14 +1,18 @@
 """Defines a chat room in bari"""
 
-from fwk.GamePlugin import GamePlugin
-from fwk.Msg import InternalGiStatus
+from fwk.GamePlugin import (
+        GamePlugin,
+        handles,
+)
+from fwk.Msg import (
+        ClientRxMsg,
+        InternalGiStatus,
+)
 
 class ChatRoom(GamePlugin):
     """Defines a chat room"""
-    def processMsg(self, qmsg):
-        if super(ChatRoom, self).processMsg(qmsg):
-            return True
-
+    @handles(ClientRxMsg)
+    def processClientMsg(self, qmsg):
         self.broadcast(qmsg.jmsg, initiatorWs=qmsg.initiatorWs)
         return True
 
@@ -1,4 +1,9 @@
-from fwk.Exceptions import InvalidDataException
+import json
+
+from fwk.Exceptions import (
+        InvalidDataException,
+        SchemaError,
+)
 from fwk.MsgSrc import MsgSrc
 
 CLUBS = "C"
@@ -7,42 +12,77 @@ HEARTS = "H"
 SPADES = "S"
 JOKER = "JOKER"
 
+SUITS = (CLUBS, DIAMONDS, HEARTS, SPADES)
+
 class Card:
-    def __init__(self, suit, rank):
+    """A playing card.
+
+    There is one shared instance per card: Card(suit, rank) and
+    Card.fromJmsg() return it. Cards compare by identity and hash by
+    their code (0-51 by suit then rank, 52 for the joker). Instances
+    are immutable.
+    """
+    __slots__ = ("suit", "rank", "code", "_strep")
+    # Set by _make() (through object.__setattr__: cards are immutable).
+    # Declared so that tools see the attributes
+    suit: str
+    rank: int
+    code: int
+    _strep: str
+
+    def __new__(cls, suit, rank):
+        try:
+            return CardByKey[(suit, rank)]
+        except (KeyError, TypeError):
+            pass
+
         if suit not in {CLUBS, DIAMONDS,
                         HEARTS, SPADES, JOKER}:
             raise InvalidDataException("Bad card suit", suit)
 
-        if rank not in {0, 1, 2, 3, 4, 5, 6, 7,
-                        8, 9, 10, 11, 12, 13}:
-            raise InvalidDataException("Bad card rank", rank)
-
-        if suit == JOKER and rank != 0:
+        if suit == JOKER:
             raise InvalidDataException("Bad rank for a joker", rank)
 
-        if suit != JOKER and rank == 0:
-            raise InvalidDataException("Bad rank", rank)
+        raise InvalidDataException("Bad card rank", rank)
 
-        self.suit = suit
-        self.rank = rank
+    @classmethod
+    def _make(cls, suit, rank, code):
+        card = object.__new__(cls)
+        object.__setattr__(card, "suit", suit)
+        object.__setattr__(card, "rank", rank)
+        object.__setattr__(card, "code", code)
+        object.__setattr__(card, "_strep", "JOKER" if suit == JOKER else "{}{}".format(rank, suit))
+        return card
 
-    def __eq__(self, other):
-        return str(self) == str(other)
+    def __setattr__(self, name, value):
+        raise AttributeError("Card is immutable")
 
     def __hash__(self):
-        return hash(str(self))
+        return self.code
 
     def __str__(self):
-        if self.suit == "JOKER":
-            return "JOKER"
-        return "{}{}".format(self.rank, self.suit)
+        return self._strep
+
+    def __repr__(self):
+        return self._strep
+
+    def __reduce__(self):
+        return (Card, (self.suit, self.rank))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @staticmethod
+    def fromCode(code):
+        return CardByCode[code]
 
     @staticmethod
     def deckCards(numDecks=0):
         for _ in range(numDecks):
-            for suit in (CLUBS, DIAMONDS, HEARTS, SPADES):
-                for rank in range(1, 14):
-                    yield Card(suit, rank)
+            yield from CardByCode[:52]
 
     @staticmethod
     def fromJmsg(jmsg):
@@ -54,13 +94,153 @@ class Card:
     def toJmsg(self):
         return [self.suit, self.rank]
 
+CardByCode = [Card._make(suit, rank, code) # pylint: disable=protected-access
+              for code, (suit, rank) in enumerate([(suit, rank)
+                                                   for suit in SUITS
+                                                   for rank in range(1, 14)] +
+                                                  [(JOKER, 0)])]
+CardByKey = {(card.suit, card.rank): card for card in CardByCode}
+NUM_CARD_CODES = len(CardByCode)
+NUM_RANKS = 14 # 0 (joker) to 13
+
+# Card codes of each rank and each suit (JOKER included), in ascending order
+CodesByRank = [tuple(card.code for card in CardByCode if card.rank == rank)
+               for rank in range(NUM_RANKS)]
+CodesBySuit = {suit: tuple(card.code for card in CardByCode if card.suit == suit)
+               for suit in SUITS + (JOKER,)}
+
+# JSON representation and encoding of each card, shared by every CardBag.
+# Must not be modified
+JmsgByCode = [card.toJmsg() for card in CardByCode]
+EncodedByCode = [json.dumps(jmsg) for jmsg in JmsgByCode]
+
+class CardBag:
+    """Cards in the order they were added, with a count per card.
+
+    contains(), add() and remove() take time linear in the number of
+    cards passed in (remove() also makes one pass over the bag).
+    Duplicate cards (multiple decks) are counted.
+
+    The JSON encoding of each card (EncodedByCode) is kept along with
+    the cards, in place. toJmsg() and encoded() build the bag's JSON
+    representation and encoding from them (a list and a string join,
+    O(len(bag))) once per change and cache them. A change doesn't
+    modify them, so a message holding them keeps the cards it was built
+    with.
+
+    rankCounts[rank] and suitCounts[suit] count the cards of each rank
+    and suit (see CodesByRank, CodesBySuit) for rules that look at
+    the hand by rank or suit.
+    """
+    def __init__(self, cards=()):
+        self.cards = []
+        self.counts = [0] * NUM_CARD_CODES
+        self.rankCounts = [0] * NUM_RANKS
+        self.suitCounts = dict.fromkeys(CodesBySuit, 0)
+        self._encodedCards = []
+        self._jmsgs = None
+        self._encoded = None
+        self.add(cards)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def __getitem__(self, idx):
+        return self.cards[idx]
+
+    def __contains__(self, card):
+        return self.counts[card.code] > 0
+
+    def count(self, card):
+        return self.counts[card.code]
+
+    def contains(self, cards):
+        """Returns True if every card in cards is in the bag, taking
+        duplicates into account"""
+        needed = {}
+        for card in cards:
+            num = needed.get(card, 0) + 1
+            if num > self.counts[card.code]:
+                return False
+            needed[card] = num
+        return True
+
+    def add(self, cards):
+        numCards = len(self.cards)
+        for card in cards:
+            self.cards.append(card)
+            self.counts[card.code] += 1
+            self.rankCounts[card.rank] += 1
+            self.suitCounts[card.suit] += 1
+            self._encodedCards.append(EncodedByCode[card.code])
+        if len(self.cards) != numCards:
+            self._jmsgs = None
+            self._encoded = None
+
+    def remove(self, cards):
+        """Remove the first occurrence of each card in cards. Raises
+        ValueError (and leaves the bag as is) if a card isn't present"""
+        cards = list(cards)
+        if not self.contains(cards):
+            raise ValueError("Cards not present", [str(card) for card in cards])
+
+        pending = [0] * NUM_CARD_CODES
+        for card in cards:
+            pending[card.code] += 1
+            self.counts[card.code] -= 1
+            self.rankCounts[card.rank] -= 1
+            self.suitCounts[card.suit] -= 1
+
+        kept = []
+        keptEncoded = []
+        for card, encodedCard in zip(self.cards, self._encodedCards):
+            if pending[card.code]:
+                pending[card.code] -= 1
+            else:
+                kept.append(card)
+                keptEncoded.append(encodedCard)
+        self.cards = kept
+        self._encodedCards = keptEncoded
+        self._jmsgs = None
+        self._encoded = None
+
+    def toJmsg(self):
+        """JSON representation of the cards. Must not be modified"""
+        if self._jmsgs is None:
+            self._jmsgs = [JmsgByCode[card.code] for card in self.cards]
+        return self._jmsgs
+
+    def encoded(self):
+        """JSON encoding of toJmsg(), joined from the encoded cards once
+        per change"""
+        if self._encoded is None:
+            self._encoded = "[" + ", ".join(self._encodedCards) + "]"
+        return self._encoded
+
+def cardField(onError=None):
+    """fwk.Schema decoder for a card. The error reply is onError(value)
+    or, without onError, the reason the card is invalid"""
+    def decode(value):
+        try:
+            return Card.fromJmsg(value)
+        except InvalidDataException as exc:
+            if onError:
+                raise onError(value) from exc
+            raise SchemaError(*exc.toJmsg()) from exc
+    return decode
+
 class CardGroupBase:
     """
     How cards are stored is not captured in CardGroupBase
     """
     def __init__(self, conns, playerConns):
-        self.connsMsgSrc = MsgSrc(conns) if conns else None
-        self.playerConnsMsgSrc = MsgSrc(playerConns) if playerConns else None
+        # Headless connections don't need the messages built
+        self.connsMsgSrc = MsgSrc(conns) if conns and not conns.headless() else None
+        self.playerConnsMsgSrc = (MsgSrc(playerConns)
+                                  if playerConns and not playerConns.headless() else None)
         self.refresh()
 
     def refresh(self):
@@ -83,15 +263,7 @@ class CardGroupBase:
     @staticmethod
     def contains(cards1, cards2):
         """Returns cards1 contains cards2"""
-        cards1_ = cards1[:]
-        for card in cards2:
-            try:
-                idx = cards1_.index(card)
-            except ValueError:
-                return False
-            cards1_.pop(idx)
-
-        return True
+        return cardListContains(cards1, cards2)
 
 def cardListContains(cardBiggerList, cardSmallerList):
     """
@@ -99,14 +271,16 @@ def cardListContains(cardBiggerList, cardSmallerList):
     cardSmallerList. The function ensures that duplicates are
     treated correctly
     """
-    biggerList = cardBiggerList[:]
+    if isinstance(cardBiggerList, CardBag):
+        return cardBiggerList.contains(cardSmallerList)
+
+    counts = [0] * NUM_CARD_CODES
+    for card in cardBiggerList:
+        counts[card.code] += 1
 
     for card in cardSmallerList:
-        try:
-            idx = biggerList.index(card)
-        except ValueError:
+        counts[card.code] -= 1
+        if counts[card.code] < 0:
             return False
 
-        biggerList.pop(idx)
-
     return True
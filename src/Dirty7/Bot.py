@@ -0,0 +1,173 @@
+"""Dirty7 bots (see fwk/Bot.py).
+
+A bot sees what its player sees: its hand, the revealed cards and how
+many cards are in the deck, in the hidden pile and in each hand. It
+declares when the greedy policy (Dirty7/Simulation.py) would. Otherwise
+it plays one of these candidate moves: the greedy policy's and the
+plays dropping the most points, each drawing or picking a revealed
+card. Candidates are scored by flat Monte Carlo: until the time budget
+runs out, the cards the bot can't see are dealt at random and, after
+each candidate, every player (the bot last) makes a greedy move. The
+candidate leaving the bot with the fewest points on average is played
+(its round score if the round ends). Without time, the greedy policy's
+move is played.
+
+Looking further ahead plays worse: the cards dealt at random to the
+other players are worth more than the cards greedy players keep, so
+rounds played out to the end run longer than real ones.
+"""
+
+import random
+import time
+
+from fwk.Common import Map
+from fwk.Trace import mutedTraces
+from Common.Card import (
+        JOKER,
+        Card,
+        CardBag,
+)
+from Dirty7 import Simulation
+from Dirty7.Dirty7Game import StatePlayerTurn
+from Dirty7.Dirty7Round import RoundParameters
+from Dirty7.Dirty7Rules import (
+        dropKey,
+        keyCards,
+)
+from Dirty7.Storage import (
+        cardCodes,
+        handCodes,
+        paramsValues,
+)
+
+BOT_MAX_DROPS = 5 # Candidate drops are those worth the most points
+BOT_ROLLOUT_TURNS = 1 # Greedy moves made by each player after a candidate move
+
+def botView(room, ws):
+    """What the bot at ws knows of the round when it is its turn"""
+    player = room.playerByWs.get(ws)
+    if not player or not isinstance(room.gameState, StatePlayerTurn):
+        return None
+    round_ = room.currRound
+    if round_.turn.current() != player.name:
+        return None
+
+    tableCards = round_.tableCards
+    return Map(name=player.name,
+               params=paramsValues(round_.roundParams),
+               turnOrder=list(round_.turn.playerNameInTurnOrder),
+               turnIdx=round_.turn.turnIdx,
+               hand=handCodes(round_, player.name),
+               revealed=cardCodes(tableCards.revealedCards),
+               deckCount=tableCards.deckCardCount(),
+               hiddenCount=len(tableCards.hiddenCards),
+               cardCountByName={name: len(prs.hand.cards)
+                                for name, prs in round_.playerRoundStatus.items()})
+
+def deal(view, rng):
+    """The round's cards (see Dirty7Round.Round) with the cards the bot
+    can't see dealt at random"""
+    hand = [Card.fromCode(code) for code in view.hand]
+    revealed = [Card.fromCode(code) for code in view.revealed]
+    unseen = CardBag(list(Card.deckCards(view.params["numDecks"])) +
+                     [Card(JOKER, 0)] * view.params["numJokers"])
+    unseen.remove(hand + revealed)
+    unseen = list(unseen)
+    rng.shuffle(unseen)
+
+    handCardsByName = {}
+    for name, count in view.cardCountByName.items():
+        if name == view.name:
+            handCardsByName[name] = hand
+        else:
+            handCardsByName[name], unseen = unseen[:count], unseen[count:]
+    return Map(deckCards=unseen[:view.deckCount],
+               revealedCards=revealed,
+               hiddenCards=unseen[view.deckCount:],
+               handCardsByName=handCardsByName,
+               scoreByPlayerName={name: None for name in view.cardCountByName})
+
+def roundGame(view, roundParams, cards, rng):
+    """A Simulation.Game of the rest of the round with cards dealt"""
+    game = Simulation.Game(roundParams, view.turnOrder, maxRounds=1, deal=False, rng=rng)
+    saved = Map(cards, deckCards=list(cards.deckCards), hiddenCards=list(cards.hiddenCards))
+    game.startRound(roundParams.roundNum, view.turnOrder, view.turnIdx,
+                    roundParameters=roundParams, saved=saved)
+    return game
+
+def moveKey(move):
+    if move[0] == "DECLARE":
+        return move
+    _, drop, numDrawCards, pickCards = move
+    return ("PLAY", dropKey(drop), numDrawCards, dropKey(pickCards))
+
+def candidateMoves(game, view, rng):
+    """The greedy move followed by the other candidate moves"""
+    round_ = game.currRound
+    hand = round_.playerRoundStatus[view.name].hand
+    moves = [Simulation.greedyPolicy(game, rng)]
+    if moves[0][0] == "DECLARE":
+        return moves
+
+    score = hand.scoringSystem.score
+    drops = sorted(hand.legalDrops(round_.rule), key=lambda key: (-score(keyCards(key)), key))
+    gains = [(1, [])] if view.deckCount else []
+    gains += [(0, [Card.fromCode(code)]) for code in sorted(set(view.revealed))]
+    for key in drops[:BOT_MAX_DROPS]:
+        for numDrawCards, pickCards in gains:
+            moves.append(("PLAY", keyCards(key), numDrawCards, pickCards))
+
+    keys = set()
+    candidates = []
+    for move in moves:
+        if moveKey(move) not in keys:
+            keys.add(moveKey(move))
+            candidates.append(move)
+    return candidates
+
+def rollout(view, roundParams, cards, move, rng):
+    """The bot's points after it makes move and each player makes
+    BOT_ROLLOUT_TURNS greedy moves"""
+    game = roundGame(view, roundParams, cards, rng)
+    round_ = game.currRound
+    game.move(move)
+    for _ in range(BOT_ROLLOUT_TURNS * len(view.turnOrder)):
+        if round_.isRoundOver or not game.move(Simulation.greedyPolicy(game, rng)):
+            break
+    if round_.isRoundOver:
+        return round_.roundScore.scoreByPlayerName[view.name]
+    return round_.playerRoundStatus[view.name].hand.score()
+
+def moveJmsg(move):
+    """The client message making a Simulation move"""
+    if move[0] == "DECLARE":
+        return ["DECLARE"]
+    _, drop, numDrawCards, pickCards = move
+    return ["PLAY", {"dropCards": [card.toJmsg() for card in drop],
+                     "numDrawCards": numDrawCards,
+                     "pickCards": [card.toJmsg() for card in pickCards]}]
+
+def decide(view, timeBudgetSec, seed):
+    """The move (a client message) of the bot in view, chosen within
+    timeBudgetSec"""
+    deadline = time.monotonic() + timeBudgetSec
+    rng = random.Random(seed)
+    with mutedTraces():
+        roundParams = RoundParameters.fromRow(Map(view.params))
+        game = roundGame(view, roundParams, deal(view, rng), rng)
+        candidates = candidateMoves(game, view, rng)
+
+        totals = [0] * len(candidates)
+        while len(candidates) > 1 and time.monotonic() < deadline:
+            cards = deal(view, rng)
+            scores = []
+            for move in candidates:
+                if time.monotonic() >= deadline:
+                    break
+                scores.append(rollout(view, roundParams, cards, move, rng))
+            else:
+                # Candidates are compared on the same deals
+                totals = [total + score for total, score in zip(totals, scores)]
+
+    best = min(range(len(candidates)), key=lambda idx: (totals[idx], idx))
+    return moveJmsg(candidates[best])
@@ -7,6 +7,9 @@ class GameStateBase:
     def toJmsg(self):
         return str(self)
 
+    def toInt(self):
+        return GameStateTypes.index(self.__class__)
+
     def __str__(self):
         assert self.__class__.__name__.startswith("State")
         return self.__class__.__name__[5:]
@@ -30,6 +33,16 @@ class StateRoundStop(GameStateBase):
 class StateGameOver(GameStateBase):
     pass
 
+# Game states by the int they are stored as
+GameStateTypes = (
+    StateWaitingForPlayers,
+    StateGameBegin,
+    StateRoundStart,
+    StatePlayerTurn,
+    StateRoundStop,
+    StateGameOver,
+)
+
 class Player:
     def __init__(self, txQueue, name, passwd):
         self.name = name
@@ -7,9 +7,22 @@ from fwk.Msg import (
 )
 from fwk.MsgType import MTYPE_HOST_BAD
 from fwk.Exceptions import InvalidDataException
+from fwk.Storage import DB_SYNCHRONOUS_DEFAULT
+from fwk.Trace import (
+        Level,
+        trace,
+)
+from Dirty7.Dirty7Game import (
+        GameStateTypes,
+        StateGameOver,
+)
 from Dirty7.Dirty7Round import RoundParameters
 from Dirty7.Dirty7Room import Dirty7Room
-from Dirty7.Storage import Storage
+from Dirty7.Storage import (
+        FLUSH_DELAY_SEC_DEFAULT,
+        Storage,
+        gameIdx,
+)
 
 DefaultStorageFile = "d7.sqlite3"
 
@@ -18,6 +31,31 @@ class Dirty7Lobby(GameLobbyPlugin):
     gameIdx = 0
     rooms = {}
 
+    def postQueueSetup(self):
+        if self.storage:
+            self.restoreRooms()
+
+    def restoreRooms(self):
+        """Register the rooms whose games were running when the server
+        stopped. Rooms nobody joined are closed instead"""
+        self.gameIdx = self.storage.maxGameIdx()
+        gameStates = {GameStateTypes.index(state) for state in GameStateTypes
+                      if state is not StateGameOver}
+        for saved in self.storage.loadRooms(gameStates):
+            if not saved.players:
+                trace(Level.info, "Closing abandoned", saved.path)
+                self.storage.roomStore(saved.path).closeRoom()
+                continue
+            idx = gameIdx(saved.path)
+            room = Dirty7Room(saved.path,
+                              "Dirty7 Room #{}".format(idx),
+                              self.storage,
+                              RoundParameters.fromRow(saved.hostParams),
+                              saved=saved)
+            self.rooms[idx] = room.path
+            trace(Level.info, "Restoring", saved.path)
+            self.txQueue.put_nowait(InternalRegisterGi(room))
+
     def processHost(self, qmsg):
         try:
             hostParameters = RoundParameters.fromJmsg(qmsg.jmsg)
@@ -28,14 +66,17 @@ class Dirty7Lobby(GameLobbyPlugin):
             return True
 
         self.gameIdx += 1
+        if self.storage:
+            self.storage.saveMaxGameIdx(self.gameIdx)
         newRoom = Dirty7Room("dirty7:{}".format(self.gameIdx),
                              "Dirty7 Room #{}".format(self.gameIdx),
                              self.storage,
                              hostParameters)
-        self.rooms[self.gameIdx] = newRoom
+        self.rooms[self.gameIdx] = newRoom.path
 
         self.txQueue.put_nowait(InternalRegisterGi(newRoom, initiatorWs=qmsg.initiatorWs))
         return True
 
-def plugin(storage_file):
-    return Dirty7Lobby("dirty7", "Dirty7", Storage(storage_file))
+def plugin(storage_file, flushDelaySec=FLUSH_DELAY_SEC_DEFAULT,
+           synchronous=DB_SYNCHRONOUS_DEFAULT):
+    return Dirty7Lobby("dirty7", "Dirty7", Storage(storage_file, flushDelaySec, synchronous))
@@ -1,26 +1,42 @@
 """Dirty7 game instance"""
 
-import random
 import re
-
-from fwk.Exceptions import InvalidDataException
-from fwk.GamePlugin import GamePlugin
+import string
+
+from fwk.Bot import Bots
+from fwk.Common import Map
+from fwk.Exceptions import SchemaError
+from fwk.GamePlugin import (
+        GamePlugin,
+        handles,
+)
 from fwk.Msg import (
         ClientTxMsg,
+        constJmsg,
         InternalGiStatus,
 )
 from fwk.MsgSrc import (
         Jmai,
         MsgSrc,
 )
+from fwk.Schema import (
+        Schema,
+        dictOf,
+        error,
+        intField,
+        listOf,
+)
 from fwk.Trace import (
         Level,
         trace,
 )
 from Common.Card import (
         Card,
+        cardField,
 )
+from Dirty7 import Bot
 from Dirty7.Dirty7Game import (
+        GameStateTypes,
         StateGameBegin,
         StateGameOver,
         StatePlayerTurn,
@@ -31,6 +47,7 @@ from Dirty7.Dirty7Game import (
 )
 from Dirty7.Dirty7Round import (
         Round,
+        RoundParameters,
         Turn,
 )
 from Dirty7.Events import (
@@ -42,10 +59,24 @@ from Dirty7.Events import (
         StartRound,
         StopRound,
 )
+from Dirty7.Storage import (
+        handCodes,
+        paramsValues,
+        roundValues,
+)
 
 validPlayerNameRe = re.compile("^[a-zA-Z0-9_]+$")
 validPasswdRe = re.compile("^[a-zA-Z0-9_]+$")
 
+PLAY_SCHEMA = Schema("PLAY", [
+    ("playDesc", dictOf([
+        ("dropCards", listOf(cardField(), onError=error("Invalid cards being dropped")), []),
+        ("numDrawCards", intField(onError=error("Drawing invalid number of cards")), 0),
+        ("pickCards", listOf(cardField(), onError=error("Invalid cards being drawn")), []),
+    ], onError=error("Invalid move description", withData=False),
+       onUnknown=error("Unrecognized play description"))),
+])
+
 class Dirty7Room(GamePlugin):
     """
     When a websocket has connected but hasn't joined:
@@ -53,9 +84,15 @@ class Dirty7Room(GamePlugin):
     As soon as the websocket sends a valid JOIN message,
         playerByWs[ws] == Player(..)
     """
-    def __init__(self, path, name, storage, hostParameters):
+    def __init__(self, path, name, storage, hostParameters, saved=None):
+        """
+        saved : Map (optional)
+            Saved state (from Storage.loadRooms) of a room being restored
+        """
         GamePlugin.__init__(self, path, name, storage=storage)
         self.hostParameters = hostParameters
+        self.store = storage.roomStore(path) if storage else None
+        self.saved = saved
 
         self.gameState = StateWaitingForPlayers()
         self.playerByName = {}
@@ -64,6 +101,7 @@ class Dirty7Room(GamePlugin):
         self.currRoundTurn = None
 
         self.winners = None
+        self.bots = Bots(self, Bot.botView, Bot.decide, hostParameters.botTimeBudgetSec)
 
     @property
     def currRound(self):
@@ -77,10 +115,10 @@ class Dirty7Room(GamePlugin):
                                   startRound.turnIdx)
 
         # Get round parameters
-        roundParameters = self.hostParameters.roundParameters(roundNum)
+        roundParameters = self.hostParameters.roundParameters(roundNum, self.rng)
 
         round_ = Round(self.path, self.conns, roundParameters,
-                       self.playerByName, self.currRoundTurn)
+                       self.playerByName, self.currRoundTurn, rng=self.rng)
         self.rounds.append(round_)
 
     def startGame(self):
@@ -95,11 +133,34 @@ class Dirty7Room(GamePlugin):
                     totalScoreByName[name] += score
         return totalScoreByName
 
+    def lowestScorers(self):
+        """Names of the players with the lowest total score"""
+        totalScore = self.totalScore()
+        lowestScore = min(totalScore.values())
+        return [name for name, score in totalScore.items() if score == lowestScore]
+
+    def saveEvent(self, event, winners=None):
+        """Write the room state that event changed behind to storage"""
+        if not self.store:
+            return
+        if isinstance(event, PlayerJoin):
+            self.store.savePlayer(event.player)
+        elif isinstance(event, StartRound):
+            self.store.saveParams(self.currRound.roundParams)
+            self.store.saveRound(self.currRound)
+            self.store.saveRoom(self.gameState.toInt())
+        elif isinstance(event, StopRound):
+            self.store.saveRound(self.currRound)
+        elif isinstance(event, GameOver):
+            self.store.saveRoom(self.gameState.toInt(), winners)
+
     def processEvent(self, event):
         trace(Level.game, "processEvent", str(event), "in state", self.gameState)
+        self.logEvent(str(event))
         if isinstance(event, PlayerJoin):
             # A new player has joined
             assert isinstance(self.gameState, StateWaitingForPlayers)
+            self.saveEvent(event)
 
             if len(self.playerByName) == self.hostParameters.numPlayers:
                 self.processEvent(GameBegin())
@@ -114,8 +175,10 @@ class Dirty7Room(GamePlugin):
             self.startGame()
             self.gameState = StateGameBegin()
             turnOrderNames = list(self.playerByName)
-            random.shuffle(turnOrderNames)
+            self.rng.shuffle(turnOrderNames)
             self.processEvent(StartRound(1, turnOrderNames, 0))
+            for player in self.playerByName.values():
+                self.takeoverIfDropped(player)
             return
 
         if isinstance(event, StartRound):
@@ -123,6 +186,7 @@ class Dirty7Room(GamePlugin):
             self.gameState = StateRoundStart()
             self.newRound(event)
             self.gameState = StatePlayerTurn()
+            self.saveEvent(event)
             self.publishGiStatus()
             return
 
@@ -137,6 +201,7 @@ class Dirty7Room(GamePlugin):
             # Stop the current round (mark it as round-over) so that
             # irrelevant notifications are not sent out
             self.currRound.makeRoundOver()
+            self.saveEvent(event)
 
             # Check if the end of game limit is hit. Trigger
             # GameOver in which case
@@ -158,13 +223,9 @@ class Dirty7Room(GamePlugin):
             self.gameState = StateGameOver()
             self.publishGiStatus()
 
-            totalScore = self.totalScore()
-            lowestScore = min(totalScore.values())
-
-            winners = [name for name, score in totalScore.items() if score == lowestScore]
-            jmsg = ["GAME-OVER", winners]
-
-            self.winners.setMsgs([Jmai(jmsg, initiatorWs=None)])
+            winners = self.lowestScorers()
+            self.saveEvent(event, winners)
+            self.winners.setMsgs([Jmai(["GAME-OVER", winners], initiatorWs=None)])
             return
 
         if isinstance(event, Declare):
@@ -176,6 +237,7 @@ class Dirty7Room(GamePlugin):
         trace(Level.error, "Invalid event received", str(event))
         assert False
 
+    @handles("JOIN")
     def processJoin(self, qmsg):
         """
         ["JOIN", playerName, passwd, (avatar)]
@@ -183,19 +245,21 @@ class Dirty7Room(GamePlugin):
         ws = qmsg.initiatorWs
 
         if isinstance(self.gameState, StateGameOver):
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD",
-                                                 "Game over already"], {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("JOIN-BAD",
+                                                          "Game over already"),
+                                                {ws}, initiatorWs=ws))
             return True
 
         if ws not in self.playerByWs or self.playerByWs[ws]:
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD",
-                                                 "Unexpected JOIN message from client that "
-                                                 "has already joined"], {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("JOIN-BAD",
+                                                          "Unexpected JOIN message from client "
+                                                          "that has already joined"),
+                                                {ws}, initiatorWs=ws))
             return True
 
 
         if len(qmsg.jmsg) != 3:
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD", "Invalid message length"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("JOIN-BAD", "Invalid message length"),
                                                 {ws}, initiatorWs=ws))
             return True
 
@@ -218,7 +282,7 @@ class Dirty7Room(GamePlugin):
             player.playerConns.addConn(ws)
             self.playerByWs[ws] = player
             self.playerByName[playerName] = player
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-OKAY"], {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("JOIN-OKAY"), {ws}, initiatorWs=ws))
 
             self.processEvent(PlayerJoin(player))
             return True
@@ -226,20 +290,26 @@ class Dirty7Room(GamePlugin):
         if playerName not in self.playerByName and not isinstance(self.gameState,
                                                                   StateWaitingForPlayers):
             # New player trying to join after the game has started
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD", "Invalid player name/password or "
-                                                 "trying to join a running game"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("JOIN-BAD",
+                                                          "Invalid player name/password or "
+                                                          "trying to join a running game"),
                                                 {ws}, initiatorWs=ws))
             return True
 
         if playerName in self.playerByName and passwd != self.playerByName[playerName].passwd:
             # Bad password
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD", "Bad password"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("JOIN-BAD", "Bad password"),
                                                 {ws}, initiatorWs=ws))
             return True
 
         assert playerName in self.playerByName
         assert passwd == self.playerByName[playerName].passwd
-        self.txQueue.put_nowait(ClientTxMsg(["JOIN-OKAY"], {ws}, initiatorWs=ws))
+        self.txQueue.put_nowait(ClientTxMsg(constJmsg("JOIN-OKAY"), {ws}, initiatorWs=ws))
+
+        if not self.bots.isBot(ws):
+            # The player is back: the bot playing for it leaves
+            self.bots.cancelTakeover(playerName)
+            self.bots.remove(playerName)
 
         # Move ws to player
         player = self.playerByName[playerName]
@@ -248,6 +318,25 @@ class Dirty7Room(GamePlugin):
 
         return True
 
+    @handles("ADD-BOT")
+    def processAddBot(self, qmsg):
+        """
+        ["ADD-BOT"]
+        A bot joins as a new player (see fwk.Bot.Bots.processAddBot)
+        """
+        return self.bots.processAddBot(qmsg, isinstance(self.gameState, StateWaitingForPlayers),
+                                       self.hostParameters.numPlayers)
+
+    def botJoinJmsg(self, name):
+        """A bot taking over a player joins with the player's password"""
+        player = self.playerByName.get(name)
+        if player:
+            return ["JOIN", name, player.passwd]
+        passwd = "".join(self.rng.choice(string.ascii_letters + string.digits)
+                         for _ in range(16))
+        return ["JOIN", name, passwd]
+
+    @handles("PLAY")
     def processPlay(self, qmsg):
         """
         ["PLAY", {"dropCards": list of cards,
@@ -261,72 +350,31 @@ class Dirty7Room(GamePlugin):
         ws = qmsg.initiatorWs
 
         if not isinstance(self.gameState, StatePlayerTurn):
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "Can't make moves now"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("PLAY-BAD", "Can't make moves now"),
                                                 {ws}, initiatorWs=ws))
             return True
 
         if self.playerByWs[ws] is None:
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "You must join the game first"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("PLAY-BAD",
+                                                          "You must join the game first"),
                                                 {ws}, initiatorWs=ws))
             return True
 
         if self.playerByWs[ws].name != self.currRound.turn.current():
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "It is not your turn"],
-                                                {ws}, initiatorWs=ws))
-            return True
-
-        if len(qmsg.jmsg) != 2:
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "Invalid message length"],
-                                                {ws}, initiatorWs=ws))
-            return True
-
-        playDesc = qmsg.jmsg[1]
-        if not isinstance(playDesc, dict):
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "Invalid move description"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("PLAY-BAD", "It is not your turn"),
                                                 {ws}, initiatorWs=ws))
             return True
-        playDesc = dict(playDesc)
-
-        # dropCards
-        dropCards = playDesc.pop("dropCards", [])
-        if not isinstance(dropCards, list):
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "Invalid cards being dropped",
-                                                 dropCards], {ws}, initiatorWs=ws))
-            return True
 
         try:
-            dropCards = [Card.fromJmsg(cd) for cd in dropCards]
-        except InvalidDataException as exc:
+            playDesc = PLAY_SCHEMA.decode(qmsg.jmsg).playDesc
+        except SchemaError as exc:
             self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD"] + exc.toJmsg(),
                                                 {ws}, initiatorWs=ws))
             return True
 
-        # numDrawCards
-        numDrawCards = playDesc.pop("numDrawCards", 0)
-        if not isinstance(numDrawCards, int):
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "Drawing invalid number of cards",
-                                                 numDrawCards], {ws}, initiatorWs=ws))
-            return True
-
-        # pickCards
-        pickCards = playDesc.pop("pickCards", [])
-        if not isinstance(pickCards, list):
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "Invalid cards being drawn",
-                                                 pickCards], {ws}, initiatorWs=ws))
-            return True
-
-        try:
-            pickCards = [Card.fromJmsg(cd) for cd in pickCards]
-        except InvalidDataException as exc:
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD"] + exc.toJmsg(),
-                                                {ws}, initiatorWs=ws))
-            return True
-
-        # If item remain in play-description, complain
-        if playDesc:
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "Unrecognized play description",
-                                                 playDesc], {ws}, initiatorWs=ws))
-            return True
+        dropCards = playDesc["dropCards"]
+        numDrawCards = playDesc["numDrawCards"]
+        pickCards = playDesc["pickCards"]
 
         # If the deck doesn't have numDrawCards
         if self.currRound.tableCards.deckCardCount() < numDrawCards:
@@ -345,7 +393,7 @@ class Dirty7Room(GamePlugin):
                                                 dropCards, numDrawCards, pickCards)
 
         if not event:
-            self.txQueue.put_nowait(ClientTxMsg(["PLAY-BAD", "Invalid play"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("PLAY-BAD", "Invalid play"),
                                                 {ws}, initiatorWs=ws))
         else:
             jmsg = ["UPDATE", self.currRound.roundParams.roundNum,
@@ -356,9 +404,12 @@ class Dirty7Room(GamePlugin):
                              event.toJmsg()}]
             self.broadcast(jmsg)
             self.processEvent(event)
+            if self.store:
+                self.store.saveRound(self.currRound, [self.playerByWs[ws].name])
 
         return True
 
+    @handles("DECLARE")
     def processDeclare(self, qmsg):
         """
         ["DECLARE"]
@@ -370,29 +421,30 @@ class Dirty7Room(GamePlugin):
         ws = qmsg.initiatorWs
 
         if not isinstance(self.gameState, StatePlayerTurn):
-            self.txQueue.put_nowait(ClientTxMsg(["DECLARE-BAD", "Can't make moves now"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("DECLARE-BAD", "Can't make moves now"),
                                                 {ws}, initiatorWs=ws))
             return True
 
         if self.playerByWs[ws] is None:
-            self.txQueue.put_nowait(ClientTxMsg(["DECLARE-BAD", "You must join the game first"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("DECLARE-BAD",
+                                                          "You must join the game first"),
                                                 {ws}, initiatorWs=ws))
             return True
 
         if self.playerByWs[ws].name != self.currRound.turn.current():
-            self.txQueue.put_nowait(ClientTxMsg(["DECLARE-BAD", "It is not your turn"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("DECLARE-BAD", "It is not your turn"),
                                                 {ws}, initiatorWs=ws))
             return True
 
         if len(qmsg.jmsg) != 1:
-            self.txQueue.put_nowait(ClientTxMsg(["DECLARE-BAD", "Invalid message length"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("DECLARE-BAD", "Invalid message length"),
                                                 {ws}, initiatorWs=ws))
             return True
 
         event = self.currRound.rule.processDeclare(self.currRound, self.playerByWs[ws])
 
         if not event:
-            self.txQueue.put_nowait(ClientTxMsg(["DECLARE-BAD", "Invalid declare"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("DECLARE-BAD", "Invalid declare"),
                                                 {ws}, initiatorWs=ws))
         else:
             jmsg = ["UPDATE", self.currRound.roundParams.roundNum,
@@ -402,25 +454,74 @@ class Dirty7Room(GamePlugin):
 
         return True
 
-    def processMsg(self, qmsg):
-        if super(Dirty7Room, self).processMsg(qmsg):
-            return True
-
-        if qmsg.jmsg[0] == "JOIN":
-            return self.processJoin(qmsg)
-
-        if qmsg.jmsg[0] == "PLAY":
-            return self.processPlay(qmsg)
-
-        if qmsg.jmsg[0] == "DECLARE":
-            return self.processDeclare(qmsg)
-
-        return False
-
     def postQueueSetup(self):
+        if self.saved:
+            self.restore(self.saved)
+            self.saved = None
+        elif self.store:
+            self.store.saveParams(self.hostParameters)
+            self.store.saveRoom(self.gameState.toInt())
         self.publishGiStatus()
         self.winners = MsgSrc(self.conns)
 
+    def restore(self, saved):
+        """Rebuild players and rounds saved by RoomStore"""
+        trace(Level.game, self.path, "restoring", len(saved.rounds), "rounds")
+        for row in saved.players:
+            self.playerByName[row.alias] = Player(self.txQueue, row.alias, row.passwd)
+
+        for rnd in saved.rounds:
+            roundParams = RoundParameters.fromRow(rnd.params)
+            turn = Turn(self.conns, roundParams.roundNum, rnd.round.playerNameInTurnOrder,
+                        rnd.round.turnIdx, isRoundOver=rnd.round.isRoundOver)
+            cards = Map(deckCards=[Card.fromCode(code) for code in rnd.round.deckCards],
+                        revealedCards=[Card.fromCode(code) for code in rnd.round.tableCards],
+                        hiddenCards=[Card.fromCode(code) for code in rnd.round.hiddenCards],
+                        handCardsByName={name: [Card.fromCode(code) for code in codes]
+                                         for name, codes in rnd.hands.items()},
+                        scoreByPlayerName=rnd.round.roundScore)
+            self.rounds.append(Round(self.path, self.conns, roundParams, self.playerByName,
+                                     turn, isRoundOver=rnd.round.isRoundOver, saved=cards,
+                                     rng=self.rng))
+
+        if self.rounds:
+            self.currRoundTurn = self.currRound.turn
+        self.gameState = GameStateTypes[saved.gameState]()
+
+    def snapshot(self):
+        """The room as a JSON Map shaped like the rooms returned by
+        Storage.loadRooms and the clients connected to it"""
+        return {"gameState": self.gameState.toInt(),
+                "hostParams": paramsValues(self.hostParameters),
+                "players": [{"alias": player.name, "passwd": player.passwd}
+                            for player in self.playerByName.values()],
+                "rounds": [{"params": paramsValues(round_.roundParams),
+                            "round": roundValues(round_),
+                            "hands": {name: handCodes(round_, name)
+                                      for name in round_.playerRoundStatus}}
+                           for round_ in self.rounds],
+                "conns": {str(ws): player.name if player else None
+                          for ws, player in self.playerByWs.items()}}
+
+    def restoreSnapshot(self, snapshot, makeWs=None):
+        self.playerByName = {}
+        self.rounds = []
+        self.restore(Map(gameState=snapshot["gameState"],
+                         players=[Map(row) for row in snapshot["players"]],
+                         rounds=[Map(params=Map(rnd["params"]), round=Map(rnd["round"]),
+                                     hands=rnd["hands"])
+                                 for rnd in snapshot["rounds"]]))
+        if makeWs is None:
+            return
+
+        for wsName, playerName in snapshot["conns"].items():
+            ws = makeWs(wsName)
+            self.processConnect(ws)
+            if playerName:
+                player = self.playerByName[playerName]
+                player.playerConns.addConn(ws)
+                self.playerByWs[ws] = player
+
     def postProcessConnect(self, ws):
         # ws connected but not joined as a player yet
         self.playerByWs[ws] = None
@@ -432,6 +533,7 @@ class Dirty7Room(GamePlugin):
                 self.playerByWs[ws].playerConns.delConn(ws)
             except KeyError:
                 pass
+            self.takeoverIfDropped(self.playerByWs[ws])
 
         try:
             del self.playerByWs[ws]
@@ -440,6 +542,21 @@ class Dirty7Room(GamePlugin):
 
         self.publishGiStatus()
 
+    def takeoverIfDropped(self, player):
+        """A bot takes over a player of a running game that has no
+        websocket left (see fwk.Bot.Bots.takeoverIfDropped)"""
+        self.bots.takeoverIfDropped(
+            player.name, player.playerConns.count(),
+            not isinstance(self.gameState, (StateWaitingForPlayers, StateGameOver)))
+
+    def isGameOver(self):
+        return isinstance(self.gameState, StateGameOver)
+
+    def close(self):
+        GamePlugin.close(self)
+        if self.store:
+            self.store.closeRoom()
+
     def spectatorCount(self):
         return sum(1 for plyr in self.playerByWs.values() if not plyr)
 
@@ -5,6 +5,10 @@ defined here.
 from collections import defaultdict
 import random
 
+from fwk.Bot import (
+        BOT_TIME_BUDGET_SEC_DEFAULT,
+        timeBudgetSec,
+)
 from fwk.Common import Map
 from fwk.Exceptions import InvalidDataException
 from fwk.MsgSrc import (
@@ -22,6 +26,7 @@ from Common.Card import (
         SPADES,
         JOKER,
         Card,
+        CardBag,
         CardGroupBase,
 )
 from Dirty7.Dirty7Rules import (
@@ -30,12 +35,6 @@ from Dirty7.Dirty7Rules import (
         SupportedScoringSystems,
 )
 
-def removeCards(cards1, cards2):
-    """returns cards1 - cards2"""
-    for card in cards2:
-        idx = cards1.index(card)
-        cards1.pop(idx)
-
 class Turn(MsgSrc):
     """Tracks turn order and whose turn it is"""
     def __init__(self, conns, roundNum, playerNameInTurnOrder, turnIdx,
@@ -68,7 +67,18 @@ class Round:
     def __init__(self, path, conns, roundParams,
                  playerByName,
                  turn,
-                 isRoundOver=False):
+                 isRoundOver=False,
+                 saved=None,
+                 rng=None):
+        """
+        saved : Map (optional)
+            Cards and score of a round being restored from storage:
+            deckCards, revealedCards, hiddenCards, handCardsByName and
+            scoreByPlayerName. A new round is dealt from a fresh deck
+        rng : random.Random (optional)
+            Deals and reshuffles the deck instead of the random module
+            (e.g. the room's Plugin.rng)
+        """
         assert len(roundParams.state.ruleNames) == 1
 
         self.path = path
@@ -76,33 +86,48 @@ class Round:
         self.roundParams = roundParams
         self.playerByName = playerByName
         self.turn = turn
-        self.isRoundOver = isRoundOver
+        self.isRoundOver = False
 
         self.roundParametersAnnouncer = RoundParametersAnnouncer(conns, roundParams)
 
-        deckCards = roundParams.createStartingCards()
+        if saved is None:
+            saved = self.deal(roundParams, playerByName, rng or random)
 
         self.playerRoundStatus = {}
         for name, player in self.playerByName.items():
-            handCards = [deckCards.pop() for _ in range(roundParams.numCardsToStart)]
             self.playerRoundStatus[name] = PlayerRoundStatus(
                 conns,
                 roundParams.roundNum,
                 player,
-                handCards,
+                saved.handCardsByName[name],
                 SupportedScoringSystems[roundParams.scoringSystems[0]])
 
-        revealedCards = [deckCards.pop()]
-
         self.tableCards = TableCards(conns, roundParams.roundNum,
-                                     deckCards=deckCards,
-                                     revealedCards=revealedCards)
+                                     deckCards=saved.deckCards,
+                                     revealedCards=saved.revealedCards,
+                                     hiddenCards=saved.hiddenCards,
+                                     rng=rng)
 
         self.roundScore = RoundScore(conns, roundParams.roundNum,
-                                     {name: None for name in self.playerByName})
+                                     saved.scoreByPlayerName)
 
         self.rule = SupportedRules[next(iter(roundParams.state.ruleNames))]
 
+        if isRoundOver:
+            self.makeRoundOver()
+
+    @staticmethod
+    def deal(roundParams, playerByName, rng):
+        deckCards = roundParams.createStartingCards(rng)
+        handCardsByName = {name: [deckCards.pop() for _ in range(roundParams.numCardsToStart)]
+                           for name in playerByName}
+        revealedCards = [deckCards.pop()]
+        return Map(deckCards=deckCards,
+                   revealedCards=revealedCards,
+                   hiddenCards=[],
+                   handCardsByName=handCardsByName,
+                   scoreByPlayerName={name: None for name in playerByName})
+
     @property
     def roundNum(self):
         return self.roundParams.roundNum
@@ -156,9 +181,11 @@ class RoundParameters:
                  penaltyPoints,
                  stopPoints,
                  scoringSystems,
+                 botTimeBudgetSec=BOT_TIME_BUDGET_SEC_DEFAULT,
                  roundNum=0):
         self.msgSrc = None
         self.roundNum = roundNum
+        self.botTimeBudgetSec = timeBudgetSec(botTimeBudgetSec)
 
         if not isinstance(ruleNames, list) or not ruleNames:
             raise InvalidDataException("Invalid choices for rule names. Must be a list of choices",
@@ -227,6 +254,9 @@ class RoundParameters:
             self.ruleEngine = SupportedRules[next(iter(ruleNames))]
 
     def __getattr__(self, name):
+        if name == "state":
+            # Not set yet (e.g. while unpickling)
+            raise AttributeError(name)
         return getattr(self.state, name)
 
     def setPostInitParams(self, conns, roundNum):
@@ -237,26 +267,35 @@ class RoundParameters:
 
     @staticmethod
     def fromJmsg(jmsg):
-        if not isinstance(jmsg, list) or len(jmsg) != len(RoundParameters.ctrArgs):
+        """From the HOST parameters: the ctrArgs values in order,
+        optionally followed by botTimeBudgetSec"""
+        argNames = RoundParameters.ctrArgs + ("botTimeBudgetSec",)
+        if not isinstance(jmsg, list) or len(jmsg) not in (len(argNames) - 1, len(argNames)):
             raise InvalidDataException("Invalid round parameters type or length", jmsg)
 
-        return RoundParameters(**dict(zip(RoundParameters.ctrArgs, jmsg)))
+        return RoundParameters(**dict(zip(argNames, jmsg)))
+
+    @staticmethod
+    def fromRow(row):
+        """From a row of the RoundParameters table in Dirty7.Storage"""
+        return RoundParameters(**{arg: getattr(row, arg) for arg in RoundParameters.ctrArgs},
+                               roundNum=row.roundNum)
 
     def toJmsg(self):
         return [self.roundNum, dict(self.state)]
 
-    def roundParameters(self, roundNum):
-        """Create round parameters from hostParameters"""
-        ruleName = random.choice(self.state.ruleNames)
-        return SupportedRules[ruleName].makeRoundParameters(self, roundNum)
+    def roundParameters(self, roundNum, rng=random):
+        """Create round parameters from hostParameters, choosing with rng"""
+        ruleName = rng.choice(self.state.ruleNames)
+        return SupportedRules[ruleName].makeRoundParameters(self, roundNum, rng)
 
-    def createStartingCards(self):
+    def createStartingCards(self, rng=random):
         cards = []
         for rank in range(1, 14):
             cards.extend([Card(suit, rank) for suit in (CLUBS, DIAMONDS, HEARTS, SPADES)])
         cards = cards * self.numDecks
         cards.extend([Card(JOKER, 0) for _ in range(self.numJokers)])
-        random.shuffle(cards)
+        rng.shuffle(cards)
         return cards
 
 class RoundParametersAnnouncer(MsgSrc):
@@ -289,10 +328,12 @@ class TableCards(CardGroupBase):
                  deckCards=None,
                  revealedCards=None,
                  hiddenCards=None,
-                 isRoundOver=False):
+                 isRoundOver=False,
+                 rng=None):
         self.roundNum = roundNum
+        self.rng = rng
         self.deckCards = deckCards
-        self.revealedCards = revealedCards
+        self.revealedCards = None if revealedCards is None else CardBag(revealedCards)
         self.hiddenCards = hiddenCards or []
         self.isRoundOver = isRoundOver
         CardGroupBase.__init__(self, conns, playerConns=None)
@@ -302,7 +343,7 @@ class TableCards(CardGroupBase):
         self.refresh()
 
     def revealedCardsContains(self, cards):
-        return CardGroupBase.contains(self.revealedCards, cards)
+        return self.revealedCards.contains(cards)
 
     def deckCardCount(self):
         return len(self.deckCards)
@@ -316,13 +357,13 @@ class TableCards(CardGroupBase):
             playerGainCards.append(self.deckCards.pop(0))
 
         # Remove picked cards from revealed cards
-        removeCards(self.revealedCards, pickCards) # revealedCards is updated in place
+        self.revealedCards.remove(pickCards)
 
         # Push remaining revealed cards to the hiddenCards
         self.hiddenCards.extend(self.revealedCards)
 
         # revealedCards <-- dropCards
-        self.revealedCards = dropCards
+        self.revealedCards = CardBag(dropCards)
 
         # Shuffle deck if needed
         if self.deckCardCount() == 0:
@@ -330,7 +371,7 @@ class TableCards(CardGroupBase):
             # Take all hidden cards
             self.deckCards = self.hiddenCards
             self.hiddenCards = []
-            random.shuffle(self.deckCards)
+            (self.rng or random).shuffle(self.deckCards)
 
         self.refresh()
         return playerGainCards
@@ -343,9 +384,10 @@ class TableCards(CardGroupBase):
                 self.hiddenCards is None):
             return None
 
-        return [Jmai(["TABLE-CARDS", self.roundNum,
-                      len(self.deckCards), len(self.hiddenCards),
-                      [card.toJmsg() for card in self.revealedCards]], None)]
+        return [Jmai.withEncodedLast(["TABLE-CARDS", self.roundNum,
+                                      len(self.deckCards), len(self.hiddenCards),
+                                      self.revealedCards.toJmsg()],
+                                     self.revealedCards.encoded())]
 
     def _playerConnsJmsgs(self):
         return None
@@ -371,6 +413,7 @@ class PlayerHand(CardGroupBase):
         self.cards = None
         self.scoringSystem = scoringSystem
         self.isRoundOver = isRoundOver
+        self._legalDrops = None # (rule, drop keys) until the cards change
         CardGroupBase.__init__(self, conns, playerConns)
         self.setCards(cards)
 
@@ -378,11 +421,19 @@ class PlayerHand(CardGroupBase):
         return self.scoringSystem.score(self.cards)
 
     def setCards(self, cards):
-        self.cards = cards
+        self.cards = CardBag(cards)
+        self._legalDrops = None
         self.refresh()
 
+    def legalDrops(self, rule):
+        """Keys (Dirty7Rules.dropKey()) of the drops rule allows from
+        this hand. Computed once per change of the hand"""
+        if self._legalDrops is None or self._legalDrops[0] is not rule:
+            self._legalDrops = (rule, rule.legalDrops(self.cards))
+        return self._legalDrops[1]
+
     def contains(self, cards): # pylint: disable=arguments-differ
-        return CardGroupBase.contains(self.cards, cards)
+        return self.cards.contains(cards)
 
     def makeRoundOver(self):
         """Reveals the hand to all players"""
@@ -390,8 +441,9 @@ class PlayerHand(CardGroupBase):
         self.refresh()
 
     def delta(self, dropCards, gainCards):
-        removeCards(self.cards, dropCards)
-        self.cards += gainCards
+        self.cards.remove(dropCards)
+        self.cards.add(gainCards)
+        self._legalDrops = None
         self.refresh()
 
     def _connsJmsgs(self):
@@ -399,9 +451,10 @@ class PlayerHand(CardGroupBase):
             return None
 
         if self.isRoundOver:
-            return [Jmai(["PLAYER-CARDS", self.roundNum,
-                          self.playerName, len(self.cards),
-                          [card.toJmsg() for card in self.cards]], None)]
+            return [Jmai.withEncodedLast(["PLAYER-CARDS", self.roundNum,
+                                          self.playerName, len(self.cards),
+                                          self.cards.toJmsg()],
+                                         self.cards.encoded())]
 
         return [Jmai(["PLAYER-CARDS", self.roundNum,
                       self.playerName, len(self.cards)], None)]
@@ -415,6 +468,7 @@ class PlayerHand(CardGroupBase):
             # hand to all in _setConnsData
             return None
 
-        return [Jmai(["PLAYER-CARDS", self.roundNum,
-                      self.playerName, len(self.cards),
-                      [card.toJmsg() for card in self.cards]], None)]
+        return [Jmai.withEncodedLast(["PLAYER-CARDS", self.roundNum,
+                                      self.playerName, len(self.cards),
+                                      self.cards.toJmsg()],
+                                     self.cards.encoded())]
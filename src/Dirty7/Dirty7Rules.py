@@ -4,6 +4,7 @@ data should be passed in to methods but
 not retained locally.
 """
 
+import itertools
 import random
 
 from Common import Card
@@ -64,6 +65,41 @@ SupportedScoringSystems = {
 
 ###########################################################
 # Move validators and processors
+#
+# A drop is keyed by the sorted codes of its cards (dropKey()), so
+# duplicate cards (multiple decks) give one key per distinct drop.
+
+def dropKey(cards):
+    return tuple(sorted(card.code for card in cards))
+
+def keyCards(key):
+    """The cards of the drop keyed by key (dropKey())"""
+    return [Card.Card.fromCode(code) for code in key]
+
+def multisets(codes, counts, minCardCount, maxCardCount):
+    """Keys of the drops of minCardCount..maxCardCount cards (any
+    number if maxCardCount is None) from codes (ascending), using code
+    at most counts[code] times. Only drops of those sizes are built"""
+    choices = [code for code in codes if counts[code]]
+    # Cards left in choices[idx:]
+    available = [0] * (len(choices) + 1)
+    for idx in range(len(choices) - 1, -1, -1):
+        available[idx] = available[idx + 1] + counts[choices[idx]]
+    minSize = max(minCardCount or 1, 1)
+    maxSize = available[0] if maxCardCount is None else min(available[0], maxCardCount)
+
+    def extend(idx, drop):
+        """Drops adding cards of choices[idx:] to drop"""
+        if len(drop) >= minSize:
+            yield drop
+        for nextIdx in range(idx, len(choices)):
+            if len(drop) + available[nextIdx] < minSize:
+                return
+            code = choices[nextIdx]
+            for num in range(1, min(counts[code], maxSize - len(drop)) + 1):
+                yield from extend(nextIdx + 1, drop + (code,) * num)
+
+    yield from extend(0, ())
 
 class MoveProcessor:
     def __init__(self, ruleName, minCardCount=1, maxCardCount=None):
@@ -71,75 +107,30 @@ class MoveProcessor:
         self.minCardCount = minCardCount
         self.maxCardCount = maxCardCount
 
-    def makePlay(self, tableCards, playerHand, dropCards, numDrawCards, pickCards):
-        gainCards = tableCards.delta(dropCards, pickCards, numDrawCards)
-        playerHand.delta(dropCards, gainCards)
-
-
-    def validatePlay(self, round_, player, dropCards, numDrawCards, pickCards):
+    def legalDrops(self, cards):
+        """Yields the keys (dropKey()) of the drops from cards (a
+        CardBag) this move allows. Keys may repeat"""
         raise NotImplementedError
 
-    def processPlay(self, round_, player, dropCards, numDrawCards, pickCards):
-        """Returns None if the play message was not processed.
-        If it is handled, return an Event type.
-        """
-        trace(Level.play, self.ruleName, "player", player.name,
-              "dropCards", list(map(str, dropCards)),
-              "numDrawCards", numDrawCards,
-              "pickCards", list(map(str, pickCards)))
+    def validatePlay(self, dropCards):
+        raise NotImplementedError
 
-        # Must drop at least one card
+    def validDrop(self, dropCards):
+        """Whether this move allows dropping dropCards, checked card by
+        card. legalDrops() must yield exactly the drops this allows"""
         if not dropCards:
             trace(Level.debug, "Must drop some cards")
-            return None
-
-        # Apply move processor specific validation
-        if not self.validatePlay(round_, player, dropCards, numDrawCards, pickCards):
-            return None
-
-        playerRoundStatus = round_.playerRoundStatus[player.name]
-        if not playerRoundStatus.hand.contains(dropCards):
-            trace(Level.debug, "Playing cards not in the hand {}".format(list(map(str, dropCards))))
-            return None
-
-        # self.minCardCount .. self.maxCardCount check
-        dropCardCount = len(dropCards)
+            return False
 
-        if self.minCardCount is not None and dropCardCount < self.minCardCount:
+        if self.minCardCount is not None and len(dropCards) < self.minCardCount:
             trace(Level.debug, "Must drop at least {} cards".format(self.minCardCount))
-            return None
+            return False
 
-        if self.maxCardCount is not None and dropCardCount > self.maxCardCount:
+        if self.maxCardCount is not None and len(dropCards) > self.maxCardCount:
             trace(Level.debug, "Can drop at most {} cards".format(self.maxCardCount))
-            return None
-
-        # Can't pick and draw at the same time
-        if numDrawCards > 0 and len(pickCards) > 0:
-            trace(Level.debug, "Can't draw cards and pick cards at the same time")
-            return None
-
-        # Must pick or draw a card
-        if numDrawCards == 0 and pickCards == []:
-            trace(Level.debug, "Must draw a card or pick a card")
-            return None
-
-        # Can draw only 1 card
-        if numDrawCards != 1 and len(pickCards) == 0:
-            trace(Level.debug, "Must draw only 1 card")
-            return None
-
-        tableCards = round_.tableCards
-
-        # pickCards must be of length 1 and be visible
-        if numDrawCards == 0 and len(pickCards) > 1:
-            trace(Level.debug, "Must pick only 1 card")
-            return None
-
-        ## The move is valid. Make it happen
-
-        self.makePlay(tableCards, playerRoundStatus.hand, dropCards, numDrawCards, pickCards)
+            return False
 
-        return AdvanceTurn(1)
+        return self.validatePlay(dropCards)
 
 
 class SameRankMove(MoveProcessor):
@@ -150,7 +141,13 @@ class SameRankMove(MoveProcessor):
                                            minCardCount=minCardCount,
                                            maxCardCount=maxCardCount)
 
-    def validatePlay(self, round_, player, dropCards, numDrawCards, pickCards):
+    def legalDrops(self, cards):
+        for rank, rankCount in enumerate(cards.rankCounts):
+            if rankCount:
+                yield from multisets(Card.CodesByRank[rank], cards.counts,
+                                     self.minCardCount, self.maxCardCount)
+
+    def validatePlay(self, dropCards):
         # All dropCards should have the same rank
         if len(set(card.rank for card in dropCards)) > 1:
             trace(Level.debug, "All cards must have the same rank")
@@ -167,7 +164,23 @@ class SeqMove(MoveProcessor):
                                       minCardCount=minCardCount,
                                       maxCardCount=maxCardCount)
 
-    def validatePlay(self, round_, player, dropCards, numDrawCards, pickCards):
+    def legalDrops(self, cards):
+        rankCounts = cards.rankCounts
+        codesByRank = [[code for code in codes if cards.counts[code]]
+                       for codes in Card.CodesByRank]
+        for first in range(Card.NUM_RANKS):
+            # One card of each rank in first..last
+            last = first
+            while last < Card.NUM_RANKS and rankCounts[last]:
+                length = last - first + 1
+                if self.maxCardCount is not None and length > self.maxCardCount:
+                    break
+                if length >= self.minCardCount:
+                    for codes in itertools.product(*codesByRank[first:last + 1]):
+                        yield tuple(sorted(codes))
+                last += 1
+
+    def validatePlay(self, dropCards):
         # Cards played must have exactly 1 card of each rank
         ranksSeen = [card.rank for card in dropCards]
         if len(ranksSeen) != len(set(ranksSeen)):
@@ -191,7 +204,16 @@ class SameSuitMove(MoveProcessor):
                                            minCardCount=minCardCount,
                                            maxCardCount=maxCardCount)
 
-    def validatePlay(self, round_, player, dropCards, numDrawCards, pickCards):
+    def legalDrops(self, cards):
+        jokerCodes = Card.CodesBySuit[Card.JOKER]
+        for suit in Card.SUITS:
+            if cards.suitCounts[suit]:
+                yield from multisets(Card.CodesBySuit[suit] + jokerCodes, cards.counts,
+                                     self.minCardCount, self.maxCardCount)
+        # Only jokers
+        yield from multisets(jokerCodes, cards.counts, self.minCardCount, self.maxCardCount)
+
+    def validatePlay(self, dropCards):
         # Cards played must have exactly 1 suit (and jokers)
         suitsSeen = set(card.suit for card in dropCards) - {Card.JOKER}
         if len(suitsSeen) > 1:
@@ -216,17 +238,17 @@ class RuleEngine:
         self.name = name
         self.moveProcessorList = moveProcessorList
 
-    def makeRoundParameters(self, hostParams, roundNum):
+    def makeRoundParameters(self, hostParams, roundNum, rng=random):
         roundParameters = Dirty7Round.RoundParameters(
             [self.shortName],
             hostParams.numPlayers,
             hostParams.state.numDecks,
             hostParams.state.numJokers,
             hostParams.state.numCardsToStart,
-            [random.choice(hostParams.state.declareMaxPoints)],
+            [rng.choice(hostParams.state.declareMaxPoints)],
             hostParams.state.penaltyPoints,
             hostParams.state.stopPoints,
-            [random.choice(hostParams.scoringSystems)],
+            [rng.choice(hostParams.scoringSystems)],
             roundNum=roundNum)
         return roundParameters
 
@@ -252,22 +274,70 @@ class RuleEngine:
         # Points are sufficiently low
         return Declare(player, handScore)
 
+    def validDrop(self, dropCards):
+        """Whether a move processor of this rule allows dropping dropCards"""
+        return any(moveProcessor.validDrop(dropCards)
+                   for moveProcessor in self.moveProcessorList)
+
+    def legalDrops(self, cards):
+        """Set of the keys (dropKey()) of every drop from cards (a
+        CardBag) allowed by a move processor of this rule. Used for
+        hints and bots: plays are checked with validDrop()"""
+        keys = set()
+        for moveProcessor in self.moveProcessorList:
+            keys.update(moveProcessor.legalDrops(cards))
+        return keys
+
     def processPlay(self, round_, player, dropCards, numDrawCards, pickCards):
         """On valid play, make the change thru round_ and have that generate the
         required notification messages.
         If the move is invalid, return None
 
+        The drop is checked directly (validDrop()): the hand changes on
+        every play, so its legal drops would be rebuilt for each one
+
         Returns : EVENT (such as AdvanceTurn)
         """
-        for moveProcessor in self.moveProcessorList:
-            result = moveProcessor.processPlay(round_, player,
-                                               dropCards,
-                                               numDrawCards,
-                                               pickCards)
-            if result is not None:
-                return result
-
-        return None
+        trace(Level.play, self.shortName, "player", player.name,
+              "dropCards", list(map(str, dropCards)),
+              "numDrawCards", numDrawCards,
+              "pickCards", list(map(str, pickCards)))
+
+        playerHand = round_.playerRoundStatus[player.name].hand
+        if not playerHand.contains(dropCards):
+            trace(Level.debug, "Playing cards not in the hand", list(map(str, dropCards)))
+            return None
+
+        if not self.validDrop(dropCards):
+            trace(Level.debug, "Invalid drop", list(map(str, dropCards)))
+            return None
+
+        # Can't pick and draw at the same time
+        if numDrawCards > 0 and len(pickCards) > 0:
+            trace(Level.debug, "Can't draw cards and pick cards at the same time")
+            return None
+
+        # Must pick or draw a card
+        if numDrawCards == 0 and pickCards == []:
+            trace(Level.debug, "Must draw a card or pick a card")
+            return None
+
+        # Can draw only 1 card
+        if numDrawCards != 1 and len(pickCards) == 0:
+            trace(Level.debug, "Must draw only 1 card")
+            return None
+
+        # pickCards must be of length 1 and be visible
+        if numDrawCards == 0 and len(pickCards) > 1:
+            trace(Level.debug, "Must pick only 1 card")
+            return None
+
+        ## The move is valid. Make it happen
+
+        gainCards = round_.tableCards.delta(dropCards, pickCards, numDrawCards)
+        playerHand.delta(dropCards, gainCards)
+
+        return AdvanceTurn(1)
 
 # pending rule ideas
 #     {
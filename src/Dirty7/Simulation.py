@@ -0,0 +1,216 @@
+"""Dirty7 games played headless (see fwk/Simulation.py).
+
+Game plays through Dirty7Round.Round and its rule engine the way
+Dirty7Room does, without a room, websockets or storage. Moves are
+chosen by a policy per player:
+
+    policy(game, rng) -> ("PLAY", dropCards, numDrawCards, pickCards)
+                         or ("DECLARE",)
+
+for the player whose turn it is. Invalid moves are counted and the
+player is asked again.
+
+    hostParameters = RoundParameters(["basic"], 4, 1, 0, 7, [None], 40, 100, ["standard"])
+    results = runGames(functools.partial(playGame, hostParameters=hostParameters),
+                       range(10000))
+"""
+
+import random
+import traceback
+
+from fwk.MsgSrc import Connections
+from Dirty7.Dirty7Game import Player
+from Dirty7.Dirty7Round import (
+        Round,
+        Turn,
+)
+from Dirty7.Dirty7Rules import keyCards
+
+SIMULATION_PATH = "dirty7:sim"
+SIMULATION_MAX_MOVES = 5000 # A game is abandoned after this many moves (valid or not)
+
+GREEDY_DECLARE_POINTS = 10 # Declare at or under this when there's no declare cut-off
+GREEDY_MAX_PLAYS = 10 # ... or once each player has played this many times in a round
+GREEDY_PICK_POINTS = 2
+
+RANDOM_DECLARE_PROBABILITY = 0.05
+RANDOM_MAX_DROP_CARDS = 4
+
+class Game:
+    """A Dirty7 game between players named playerNames. The game is over
+    after maxRounds rounds, if given. Unless deal is False (see
+    startRound()), round 1 is dealt. Decks are reshuffled with rng (the
+    random module by default)"""
+    def __init__(self, hostParameters, playerNames, maxRounds=None, deal=True, rng=None):
+        assert len(playerNames) == hostParameters.numPlayers
+        self.hostParameters = hostParameters
+        self.maxRounds = maxRounds
+        self.rng = rng
+        self.conns = Connections(None)
+        self.playerByName = {name: Player(None, name, name) for name in playerNames}
+        self.rounds = []
+        self.roundPlays = 0 # Valid plays in the current round
+        self.winners = None
+
+        if deal:
+            turnOrderNames = list(self.playerByName)
+            random.shuffle(turnOrderNames)
+            self.startRound(1, turnOrderNames, 0)
+
+    @property
+    def currRound(self):
+        return self.rounds[-1]
+
+    def gameOver(self):
+        return self.winners is not None
+
+    def currentPlayer(self):
+        return self.playerByName[self.currRound.turn.current()]
+
+    def hand(self, name=None):
+        """The cards of player name (the current player by default)"""
+        name = name or self.currRound.turn.current()
+        return self.currRound.playerRoundStatus[name].hand.cards
+
+    def startRound(self, roundNum, turnOrderNames, turnIdx, roundParameters=None, saved=None):
+        """Deal round roundNum, or continue a round from its parameters
+        and saved cards (see Dirty7Round.Round)"""
+        turn = Turn(self.conns, roundNum, turnOrderNames, turnIdx)
+        roundParameters = roundParameters or self.hostParameters.roundParameters(roundNum)
+        self.rounds.append(Round(SIMULATION_PATH, self.conns, roundParameters,
+                                 self.playerByName, turn, saved=saved, rng=self.rng))
+        self.roundPlays = 0
+
+    def totalScore(self):
+        totalScoreByName = {name: 0 for name in self.playerByName}
+        for round_ in self.rounds:
+            for name, score in (round_.roundScore.scoreByPlayerName or {}).items():
+                if score:
+                    totalScoreByName[name] += score
+        return totalScoreByName
+
+    def play(self, dropCards, numDrawCards, pickCards):
+        """The current player plays. Returns False if the play is invalid"""
+        round_ = self.currRound
+        if (round_.tableCards.deckCardCount() < numDrawCards or
+                not round_.tableCards.revealedCardsContains(pickCards)):
+            return False
+
+        event = round_.rule.processPlay(round_, self.currentPlayer(),
+                                        dropCards, numDrawCards, pickCards)
+        if not event:
+            return False
+
+        round_.turn.advance(event)
+        self.roundPlays += 1
+        return True
+
+    def declare(self):
+        """The current player declares. Returns False if they can't"""
+        round_ = self.currRound
+        event = round_.rule.processDeclare(round_, self.currentPlayer())
+        if not event:
+            return False
+
+        round_.declare(event)
+        self.stopRound()
+        return True
+
+    def stopRound(self):
+        round_ = self.currRound
+        round_.makeRoundOver()
+
+        totalScore = self.totalScore()
+        if (max(totalScore.values()) >= self.hostParameters.stopPoints or
+                len(self.rounds) == self.maxRounds):
+            lowestScore = min(totalScore.values())
+            self.winners = [name for name, score in totalScore.items() if score == lowestScore]
+            return
+
+        self.startRound(round_.roundNum + 1, round_.turn.playerNameInTurnOrder,
+                        (round_.turn.turnIdx + 1) % self.hostParameters.numPlayers)
+
+    def move(self, move):
+        if move[0] == "DECLARE":
+            return self.declare()
+        _, dropCards, numDrawCards, pickCards = move
+        return self.play(dropCards, numDrawCards, pickCards)
+
+# -------------------------------------
+# Policies
+
+def greedyPolicy(game, rng):
+    """Declares at or under the declare cut-off (GREEDY_DECLARE_POINTS or
+    after GREEDY_MAX_PLAYS if there is none). Otherwise makes the legal
+    drop worth the most points and picks a revealed card worth GREEDY_PICK_POINTS or less
+    (else draws)"""
+    round_ = game.currRound
+    hand = round_.playerRoundStatus[round_.turn.current()].hand
+    cutoff = round_.roundParams.declareMaxPoints[0]
+    if cutoff is None:
+        if (hand.score() <= GREEDY_DECLARE_POINTS or
+                game.roundPlays >= GREEDY_MAX_PLAYS * len(game.playerByName)):
+            return ("DECLARE",)
+    elif hand.score() <= cutoff:
+        return ("DECLARE",)
+
+    score = hand.scoringSystem.score
+    drops = [keyCards(key) for key in sorted(hand.legalDrops(round_.rule))]
+    rng.shuffle(drops)
+    dropCards = max(drops, key=score)
+
+    tableCards = round_.tableCards
+    revealedCards = sorted(tableCards.revealedCards, key=lambda card: score([card]))
+    if revealedCards and (score(revealedCards[:1]) <= GREEDY_PICK_POINTS or
+                          not tableCards.deckCardCount()):
+        return ("PLAY", dropCards, 0, revealedCards[:1])
+    return ("PLAY", dropCards, 1, [])
+
+def randomPolicy(game, rng):
+    """Random, often invalid, moves to fuzz the rule engines"""
+    if rng.random() < RANDOM_DECLARE_PROBABILITY:
+        return ("DECLARE",)
+
+    cards = list(game.hand())
+    dropCards = rng.sample(cards, rng.randint(1, min(len(cards), RANDOM_MAX_DROP_CARDS)))
+    revealedCards = list(game.currRound.tableCards.revealedCards)
+    if revealedCards and rng.random() < 0.5:
+        return ("PLAY", dropCards, 0, [rng.choice(revealedCards)])
+    return ("PLAY", dropCards, 1, [])
+
+# -------------------------------------
+# Playing games
+
+def playGame(seed, hostParameters, policies=None, maxMoves=SIMULATION_MAX_MOVES):
+    """Play a game of hostParameters.numPlayers players ("p0", "p1", ...)
+    with policies[i] choosing the moves of player i (greedyPolicy by
+    default). Returns a dict with the result. An exception raised while
+    playing (e.g. a failed assertion in a rule engine) is returned as
+    "error"
+    """
+    random.seed(seed)
+    rng = random.Random(seed)
+    names = ["p{}".format(idx) for idx in range(hostParameters.numPlayers)]
+    policyByName = dict(zip(names, policies or [greedyPolicy] * len(names)))
+
+    game = Game(hostParameters, names)
+    moves = 0
+    badMoves = 0
+    error = None
+    try:
+        while not game.gameOver() and moves < maxMoves:
+            moves += 1
+            if not game.move(policyByName[game.currRound.turn.current()](game, rng)):
+                badMoves += 1
+    except Exception: # pylint: disable=broad-exception-caught
+        error = traceback.format_exc()
+
+    return {"seed": seed,
+            "finished": game.gameOver(),
+            "winners": game.winners,
+            "totalScore": game.totalScore(),
+            "turnOrder": game.rounds[0].turn.playerNameInTurnOrder,
+            "rounds": len(game.rounds),
+            "moves": moves,
+            "badMoves": badMoves,
+            "error": error}
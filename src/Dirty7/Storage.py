@@ -1,13 +1,27 @@
-import sqlite3
+import atexit
 
+from fwk.Common import Map
 from fwk.Storage import (
         Bool,
+        DB_SYNCHRONOUS_DEFAULT,
+        DbExecutor,
+        Index,
         Int,
         Json,
+        PrimaryKey,
         Table,
         Txt,
+        WriteBehind,
 )
 
+# Rows are buffered in memory and written this long after a change
+FLUSH_DELAY_SEC_DEFAULT = 1.0
+
+# RoundParameters.paramsId is derived from the room's game index and the
+# round number (0 for the host parameters) so that whichever process runs
+# a room can write its rows without coordinating ids with other processes
+MAX_ROUNDS = 1 << 16
+
 class Lobby(Table):
     fields = [
         Int("maxGameIdx", qualifier="not null"),
@@ -21,12 +35,13 @@ class RoundParameters(Table):
         Int("numDecks"),
         Int("numJokers"),
         Int("numCardsToStart"),
-        Int("declareMaxPoints"),
+        Json("declareMaxPoints"),
         Int("penaltyPoints"),
         Int("stopPoints"),
         Json("scoringSystems"),
         Int("roundNum"),
         Txt("ruleEngine"),
+        PrimaryKey("paramsId"),
     ]
 
 class Room(Table):
@@ -35,6 +50,9 @@ class Room(Table):
         Int("hostParamsId"),
         Int("gameState"),
         Json("winners"),
+        Bool("closed"), # Collected or abandoned: not restored
+        PrimaryKey("path"),
+        Index("gameState"),
     ]
 
 class Round(Table):
@@ -48,6 +66,7 @@ class Round(Table):
         Json("tableCards"),
         Json("hiddenCards"),
         Json("roundScore"), # scoreByPlayerName
+        PrimaryKey("path", "roundParamsId"),
     ]
 
 class Player(Table):
@@ -55,6 +74,7 @@ class Player(Table):
         Txt("path", qualifier="not null"),
         Txt("alias", qualifier="not null"),
         Txt("passwd", qualifier="not null"),
+        PrimaryKey("path", "alias"),
     ]
 
 class PlayerRoundStatus(Table):
@@ -63,28 +83,222 @@ class PlayerRoundStatus(Table):
         Int("roundNum"),
         Txt("alias"),
         Json("handCards"),
+        PrimaryKey("path", "roundNum", "alias"),
     ]
 
+def roundParamsId(path, roundNum):
+    """paramsId of the RoundParameters row of round roundNum in the room
+    at path (e.g. "dirty7:3")"""
+    assert roundNum < MAX_ROUNDS
+    return gameIdx(path) * MAX_ROUNDS + roundNum
+
+def gameIdx(path):
+    return int(path.rpartition(":")[2])
+
+def cardCodes(cards):
+    return [card.code for card in cards]
+
+def paramsValues(roundParams):
+    """RoundParameters row (without the paramsId) of roundParams"""
+    values = dict(roundParams.state)
+    values["roundNum"] = roundParams.roundNum
+    values["ruleEngine"] = roundParams.ruleEngine.shortName if roundParams.ruleEngine else None
+    return values
+
+def roundValues(round_):
+    """Round row (without the keys) of round_"""
+    tableCards = round_.tableCards
+    return {"playerNameInTurnOrder": round_.turn.playerNameInTurnOrder,
+            "turnIdx": round_.turn.turnIdx,
+            "isRoundOver": round_.isRoundOver,
+            "deckCards": cardCodes(tableCards.deckCards),
+            "tableCards": cardCodes(tableCards.revealedCards),
+            "hiddenCards": cardCodes(tableCards.hiddenCards),
+            "roundScore": round_.roundScore.scoreByPlayerName}
+
+def handCodes(round_, name):
+    return cardCodes(round_.playerRoundStatus[name].hand.cards)
+
+# Storage of each file opened in this process. Rooms unpickled in a
+# worker process share one Storage (one writer thread and WriteBehind)
+StorageByFilename = {}
+
+def openStorage(filename, flushDelaySec=FLUSH_DELAY_SEC_DEFAULT,
+                synchronous=DB_SYNCHRONOUS_DEFAULT):
+    """The Storage of filename in this process, created the first time"""
+    storage = StorageByFilename.get(filename)
+    if storage is None:
+        storage = Storage(filename, flushDelaySec, synchronous)
+    return storage
+
+def closeStorages():
+    """Write what is buffered and wait for it to be committed, in every
+    Storage of this process. Run at exit"""
+    while StorageByFilename:
+        _, storage = StorageByFilename.popitem()
+        storage.close()
+
+atexit.register(closeStorages)
+
 class Storage:
     """Storage helper for all Dirty7 games"""
+    notLogged = True # Not part of a room's event log (fwk.EventLog)
 
-    def __init__(self, filename):
+    def __init__(self, filename, flushDelaySec=FLUSH_DELAY_SEC_DEFAULT,
+                 synchronous=DB_SYNCHRONOUS_DEFAULT):
         self.__filename = filename
-        self.__conn = sqlite3.connect(self.__filename)
-        self.__cursor = self.__conn.cursor()
+        self.__flushDelaySec = flushDelaySec
+        self.__synchronous = synchronous
+        self.__db = DbExecutor(self.__filename, synchronous=synchronous)
+        self.writeBehind = WriteBehind(self.__db, flushDelaySec)
+        self.__lobbyBuffer = self.writeBehind.buffer()
 
-        self.__lobbyTbl = Lobby(self.cursor)
-        self.__roundParamsTbl = RoundParameters(self.cursor)
-        self.__roomTbl = Room(self.cursor)
-        self.__roundTbl = Round(self.cursor)
-        self.__playerTbl = Player(self.cursor)
-        self.__playerRoundStatusTbl = PlayerRoundStatus(self.cursor)
+        self.__lobbyTbl = Lobby(self.__db)
+        self.__roundParamsTbl = RoundParameters(self.__db)
+        self.__roomTbl = Room(self.__db)
+        self.__roundTbl = Round(self.__db)
+        self.__playerTbl = Player(self.__db)
+        self.__playerRoundStatusTbl = PlayerRoundStatus(self.__db)
+        StorageByFilename[filename] = self
 
-        self.commit()
+    def __reduce__(self):
+        # Pickled (e.g. to move a room to a worker process) as the
+        # filename. Unpickled as the process' Storage of the file
+        return (openStorage, (self.__filename, self.__flushDelaySec, self.__synchronous))
 
     @property
-    def cursor(self):
-        return self.__cursor
+    def db(self):
+        return self.__db
 
     def commit(self):
-        self.__conn.commit()
+        """Block until everything written so far is committed"""
+        self.__db.sync()
+
+    def flush(self):
+        return self.writeBehind.flush()
+
+    def close(self):
+        """Flush and commit everything, then stop the writer thread"""
+        self.flush()
+        self.__db.close()
+        if StorageByFilename.get(self.__filename) is self:
+            del StorageByFilename[self.__filename]
+
+    def roomStore(self, path):
+        return RoomStore(self, path)
+
+    # ---------------------------------
+    # Lobby
+
+    def maxGameIdx(self):
+        rows = self.__lobbyTbl.get(["maxGameIdx"])
+        return rows[0][0] if rows else 0
+
+    def saveMaxGameIdx(self, maxGameIdx):
+        self.__lobbyBuffer.upsert(self.__lobbyTbl, {}, {"maxGameIdx": maxGameIdx})
+
+    # ---------------------------------
+    # Restoring rooms
+
+    def loadRooms(self, gameStates):
+        """Saved state of the rooms in one of gameStates (ints) that
+        weren't closed. Returns
+        a list of Map(path, gameState, hostParams, players, rounds) where
+        rounds are ordered by round number and
+            hostParams : RoundParametersRow
+            players : list of PlayerRow
+            rounds : list of Map(params, round, hands)
+                params : RoundParametersRow
+                round : RoundRow
+                hands : dict of alias --> list of card codes
+        """
+        def params(paramsId):
+            return self.__roundParamsTbl.get(["*"], where={"paramsId": paramsId})[0]
+
+        rooms = []
+        for room in sorted((room for gameState in gameStates
+                            for room in self.__roomTbl.get(["*"],
+                                                           where={"gameState": gameState})
+                            if not room.closed),
+                           key=lambda room: gameIdx(room.path)):
+            handsByRoundNum = {}
+            for prs in self.__playerRoundStatusTbl.get(["*"], where={"path": room.path}):
+                handsByRoundNum.setdefault(prs.roundNum, {})[prs.alias] = prs.handCards
+
+            rounds = []
+            for round_ in self.__roundTbl.get(["*"], where={"path": room.path}):
+                roundParams = params(round_.roundParamsId)
+                rounds.append(Map(params=roundParams, round=round_,
+                                  hands=handsByRoundNum.get(roundParams.roundNum, {})))
+            rounds.sort(key=lambda rnd: rnd.params.roundNum)
+
+            rooms.append(Map(path=room.path,
+                             gameState=room.gameState,
+                             hostParams=params(room.hostParamsId),
+                             players=self.__playerTbl.get(["*"], where={"path": room.path}),
+                             rounds=rounds))
+        return rooms
+
+    # ---------------------------------
+    # Writes buffered in a RoomStore
+
+    def saveRoom(self, buffer, path, gameState, winners):
+        buffer.upsert(self.__roomTbl, {"path": path},
+                      {"hostParamsId": roundParamsId(path, 0),
+                       "gameState": gameState,
+                       "winners": winners})
+
+    def closeRoom(self, buffer, path):
+        buffer.upsert(self.__roomTbl, {"path": path}, {"closed": True})
+
+    def saveParams(self, buffer, path, roundParams):
+        buffer.upsert(self.__roundParamsTbl,
+                      {"paramsId": roundParamsId(path, roundParams.roundNum)},
+                      paramsValues(roundParams))
+
+    def savePlayer(self, buffer, path, player):
+        buffer.upsert(self.__playerTbl, {"path": path, "alias": player.name},
+                      {"passwd": player.passwd})
+
+    def saveRound(self, buffer, path, round_):
+        buffer.upsert(self.__roundTbl,
+                      {"path": path, "roundParamsId": roundParamsId(path, round_.roundNum)},
+                      roundValues(round_))
+
+    def saveHand(self, buffer, path, round_, name):
+        buffer.upsert(self.__playerRoundStatusTbl,
+                      {"path": path, "roundNum": round_.roundNum, "alias": name},
+                      {"handCards": handCodes(round_, name)})
+
+class RoomStore:
+    """Write-behind persistence of one Dirty7 room. Writes are buffered
+    per room and flushed to the database by Storage.writeBehind"""
+    notLogged = True
+
+    def __init__(self, storage, path):
+        self.storage = storage
+        self.path = path
+        self.buffer = storage.writeBehind.buffer()
+
+    def __reduce__(self):
+        return (RoomStore, (self.storage, self.path))
+
+    def saveRoom(self, gameState, winners=None):
+        """gameState : int"""
+        self.storage.saveRoom(self.buffer, self.path, gameState, winners)
+
+    def closeRoom(self):
+        """The room was collected or abandoned: don't restore it"""
+        self.storage.closeRoom(self.buffer, self.path)
+
+    def saveParams(self, roundParams):
+        self.storage.saveParams(self.buffer, self.path, roundParams)
+
+    def savePlayer(self, player):
+        self.storage.savePlayer(self.buffer, self.path, player)
+
+    def saveRound(self, round_, playerNames=None):
+        """Save the round and the hands of playerNames (default: all players)"""
+        self.storage.saveRound(self.buffer, self.path, round_)
+        for name in round_.playerRoundStatus if playerNames is None else playerNames:
+            self.storage.saveHand(self.buffer, self.path, round_, name)
@@ -0,0 +1,28 @@
+"""Durak bots (see fwk/Bot.py). A bot plays the greedy policy of
+Durak/Simulation.py on what its player sees"""
+
+import random
+
+from Durak import Simulation
+
+def botView(room, ws):
+    """What the bot at ws knows of the round when it has something to do"""
+    player = room.playerByWs.get(ws)
+    if not player or not room.round or room.round.gameOver():
+        return None
+    return Simulation.playerView(room.round, player)
+
+def moveJmsg(move):
+    """The client message making a Simulation move"""
+    if move[0] == "ATTACK":
+        return ["ATTACK", [card.toJmsg() for card in move[1]]]
+    if move[0] == "DEFEND":
+        return ["DEFEND", [[attackCard.toJmsg(), defendCard.toJmsg()]
+                           for attackCard, defendCard in move[1]]]
+    return [move[0]]
+
+def decide(view, timeBudgetSec, seed): # pylint: disable=unused-argument
+    """The move (a client message) of the bot in view. The greedy policy
+    takes no time to think"""
+    move = Simulation.greedyMove(view, random.Random(seed))
+    return moveJmsg(move) if move else None
@@ -36,7 +36,7 @@ class DurakLobbyPlugin(GameLobbyPlugin):
         newRoom = Room(f"durak:{self.gameIdx}",
                        f"Durak Room #{self.gameIdx}",
                        hostParameters)
-        self.rooms[self.gameIdx] = newRoom
+        self.rooms[self.gameIdx] = newRoom.path
         self.txQueue.put_nowait(InternalRegisterGi(newRoom, initiatorWs=qmsg.initiatorWs))
 
         return True
@@ -4,7 +4,7 @@ from fwk.MsgSrc import (
         MsgSrc,
 )
 
-from Common.Card import cardListContains
+from Common.Card import CardBag
 
 class Player:
     def __init__(self, txQueue, allConns, name):
@@ -50,31 +50,28 @@ class PlayerHand:
     """
     def __init__(self, allConns, playerConns, name):
         self.name = name
-        self.cards = []
+        self.cards = CardBag()
 
         self.broadcastMsgSrc = MsgSrc(allConns)
         self.playerMsgSrc = MsgSrc(playerConns)
 
     def resetCards(self):
-        self.cards = []
+        self.cards = CardBag()
         self.refresh()
 
     def setCards(self, cards):
-        self.cards = cards
+        self.cards = CardBag(cards)
         self.refresh()
 
     def hasCards(self, cards):
-        return cardListContains(self.cards, cards)
+        return self.cards.contains(cards)
 
     def removeCards(self, cards):
-        for card in cards:
-            idx = self.cards.index(card)
-            self.cards.pop(idx)
-
+        self.cards.remove(cards)
         self.refresh()
 
     def addCards(self, cards):
-        self.cards.extend(cards)
+        self.cards.add(cards)
         self.refresh()
 
     def refresh(self):
@@ -85,7 +82,7 @@ class PlayerHand:
             Jmai(msg[:], None),
         ])
 
-        msg += [[card.toJmsg() for card in self.cards],]
+        msg += [self.cards.toJmsg(),]
         self.playerMsgSrc.setMsgs([
-            Jmai(msg, None),
+            Jmai.withEncodedLast(msg, self.cards.encoded()),
         ])
@@ -1,22 +1,61 @@
 """Defines a durak room in bari"""
 
 from enum import Enum
-import random
 
-from fwk.Exceptions import InvalidDataException
-from fwk.GamePlugin import GamePlugin
+from fwk.Bot import Bots
+from fwk.Exceptions import SchemaError
+from fwk.GamePlugin import (
+        GamePlugin,
+        handles,
+)
 from fwk.Msg import (
         ClientTxMsg,
+        constJmsg,
         InternalGiStatus,
 )
+from fwk.Schema import (
+        Schema,
+        error,
+        listOf,
+)
 
-from Common.Card import Card
+from Common.Card import cardField
 
+from Durak import Bot
 from Durak.GameOverMsgSrc import GameOverMsgSrc
 from Durak.HostParametersMsgSrc import HostParametersMsgSrc
 from Durak.Player import Player
 from Durak.Round import Round
 
+# Fixed replies, encoded once and sent by reference
+JOIN_BAD_GAME_OVER = constJmsg("JOIN-BAD", "Game over")
+JOIN_BAD_JOINED = constJmsg("JOIN-BAD", "Unexpected JOIN from joined player")
+JOIN_BAD_LENGTH = constJmsg("JOIN-BAD", "Invalid message length")
+ATTACK_BAD_NOT_RUNNING = constJmsg("ATTACK-BAD", "Game not running")
+ATTACK_BAD_NOT_JOINED = constJmsg("ATTACK-BAD", "Must join the game first")
+DEFEND_BAD_NOT_RUNNING = constJmsg("DEFEND-BAD", "Game not running")
+DEFEND_BAD_NOT_JOINED = constJmsg("DEFEND-BAD", "Must join the game first")
+DONE_BAD_NOT_RUNNING = constJmsg("DONE-BAD", "Game not running")
+DONE_BAD_NOT_JOINED = constJmsg("DONE-BAD", "Must join the game first")
+DONE_BAD_LENGTH = constJmsg("DONE-BAD", "Invalid message length")
+GIVEUP_BAD_NOT_RUNNING = constJmsg("GIVEUP-BAD", "Game not running")
+GIVEUP_BAD_NOT_JOINED = constJmsg("GIVEUP-BAD", "Must join the game first")
+GIVEUP_BAD_LENGTH = constJmsg("GIVEUP-BAD", "Invalid message length")
+
+ATTACK_SCHEMA = Schema("ATTACK", [
+    ("cards", listOf(cardField(onError=error("Invalid card")),
+                     onError=error("Invalid attacks"),
+                     onEmpty=error("No cards specified", withData=False))),
+])
+
+DEFEND_SCHEMA = Schema("DEFEND", [
+    ("defends", listOf(listOf(cardField(onError=error("Invalid card")),
+                              onError=error("Invalid type for defense"),
+                              length=2, onLength=error("Invalid length of defense")),
+                       onError=error("Invalid defends"),
+                       onEmpty=error("No move specified"))),
+])
+
 class GameState(Enum):
     WAITING_TO_START = 1
     RUNNING = 2
@@ -39,29 +78,14 @@ class Room(GamePlugin):
         self.hostParametersMsgSrc = None
         self.gameOverMsgSrc = None
 
+        self.bots = Bots(self, Bot.botView, Bot.decide, hostParameters.botTimeBudgetSec)
+
     def initGame(self):
         """Called one time after queues are instantiated"""
         self.hostParametersMsgSrc = HostParametersMsgSrc(self.conns, self.hostParameters)
 
-    def processMsg(self, qmsg):
-        if super(Room, self).processMsg(qmsg):
-            return True
-
-        result = False
-        if qmsg.jmsg[0] == "JOIN":
-            result |= self.__processJoin(qmsg)
-
-        if qmsg.jmsg[0] == "ATTACK":
-            result |= self.__processAttack(qmsg)
-
-        if qmsg.jmsg[0] == "DEFEND":
-            result |= self.__processDefend(qmsg)
-
-        if qmsg.jmsg[0] == "DONE":
-            result |= self.__processDone(qmsg)
-
-        if qmsg.jmsg[0] == "GIVEUP":
-            result |= self.__processGiveup(qmsg)
+    def processClientMsg(self, qmsg):
+        result = super(Room, self).processClientMsg(qmsg)
 
         if result and self.state != GameState.GAME_OVER:
             if self.round and self.round.gameOver():
@@ -80,9 +104,14 @@ class Room(GamePlugin):
         player = self.playerByWs[ws]
         if player:
             player.delConn(ws)
+            self.bots.takeoverIfDropped(player.name, player.numConns(),
+                                        self.state == GameState.RUNNING)
         del self.playerByWs[ws]
         self.publishGiStatus()
 
+    def isGameOver(self):
+        return self.state == GameState.GAME_OVER
+
     def postQueueSetup(self):
         """Invoked when the RX+TX queues are set up to the room and
         when the self.conns object is setup to track all clients in the room
@@ -98,6 +127,7 @@ class Room(GamePlugin):
     #--------------------------------------------
     # Join handling
 
+    @handles("JOIN")
     def __processJoin(self, qmsg):
         """
         ["JOIN", playerName]
@@ -105,22 +135,17 @@ class Room(GamePlugin):
         ws = qmsg.initiatorWs
 
         if self.state == GameState.GAME_OVER:
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD",
-                                                 "Game over"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(JOIN_BAD_GAME_OVER, {ws}, initiatorWs=ws))
             return True
 
         assert ws in self.playerByWs, "Join request from an unrecognized connection"
 
         if self.playerByWs[ws]:
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD",
-                                                 "Unexpected JOIN from joined player"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(JOIN_BAD_JOINED, {ws}, initiatorWs=ws))
             return True
 
         if len(qmsg.jmsg) != 2:
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD", "Invalid message length"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(JOIN_BAD_LENGTH, {ws}, initiatorWs=ws))
             return True
 
         _, playerName = qmsg.jmsg
@@ -148,6 +173,10 @@ class Room(GamePlugin):
 
             player = Player(self.txQueue, self.conns, playerName)
             self.playerByName[playerName] = player
+        elif not self.bots.isBot(ws):
+            # The player is back: the bot playing for it leaves
+            self.bots.cancelTakeover(playerName)
+            self.bots.remove(playerName)
 
         player.addConn(ws)
         self.playerByWs[ws] = player
@@ -170,7 +199,7 @@ class Room(GamePlugin):
 
             # - Setup player turn order
             self.playerTurnOrder = list(self.playerByName)
-            random.shuffle(self.playerTurnOrder)
+            self.rng.shuffle(self.playerTurnOrder)
 
 
             # - Create round object
@@ -180,13 +209,33 @@ class Room(GamePlugin):
                 self.hostParameters,
                 self.playerByName,
                 self.playerTurnOrder,
+                rng=self.rng,
             )
 
         self.round.startRound()
+        for player in self.playerByName.values():
+            self.bots.takeoverIfDropped(player.name, player.numConns(),
+                                        self.state == GameState.RUNNING)
+
+    #--------------------------------------------
+    # Bots
+
+    @handles("ADD-BOT")
+    def __processAddBot(self, qmsg):
+        """
+        ["ADD-BOT"]
+        A bot joins as a new player (see fwk.Bot.Bots.processAddBot)
+        """
+        return self.bots.processAddBot(qmsg, self.state == GameState.WAITING_TO_START,
+                                       self.hostParameters.numPlayers)
+
+    def botJoinJmsg(self, name):
+        return ["JOIN", name]
 
     #--------------------------------------------
     # Attack handling
 
+    @handles("ATTACK")
     def __processAttack(self, qmsg):
         """
         ["ATTACK", [ attackCard1, attackCard2, ... ]]
@@ -194,9 +243,7 @@ class Room(GamePlugin):
         ws = qmsg.initiatorWs
 
         if self.state != GameState.RUNNING:
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD",
-                                                 "Game not running"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_NOT_RUNNING, {ws}, initiatorWs=ws))
             return True
 
         assert ws in self.playerByWs, "Attack request from an unrecognized connection"
@@ -205,44 +252,22 @@ class Room(GamePlugin):
 
         if player is None:
             # Spectators are added as None to playerByWs
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD",
-                                                 "Must join the game first"],
-                                                {ws}, initiatorWs=ws))
-            return True
-
-        if len(qmsg.jmsg) != 2:
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD", "Invalid message length"],
-                                                {ws}, initiatorWs=ws))
-            return True
-
-        _, attacks = qmsg.jmsg
-
-        if not isinstance(attacks, list):
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD", "Invalid attacks", attacks],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_NOT_JOINED, {ws}, initiatorWs=ws))
             return True
 
-        if not attacks:
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD", "No cards specified"],
+        try:
+            cards = ATTACK_SCHEMA.decode(qmsg.jmsg).cards
+        except SchemaError as exc:
+            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD"] + exc.toJmsg(),
                                                 {ws}, initiatorWs=ws))
             return True
 
-        cards = []
-        for cardJmsg in attacks:
-            try:
-                card = Card.fromJmsg(cardJmsg)
-            except InvalidDataException as _:
-                self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD", "Invalid card", cardJmsg],
-                                                    {ws}, initiatorWs=ws))
-                return True
-
-            cards.append(card)
-
         return self.round.playerAttack(ws, player, cards)
 
     #--------------------------------------------
     # Defend handling
 
+    @handles("DEFEND")
     def __processDefend(self, qmsg):
         """
         ["DEFEND", [[attackCard1, defendCard1], ... ]]
@@ -250,9 +275,7 @@ class Room(GamePlugin):
         ws = qmsg.initiatorWs
 
         if self.state != GameState.RUNNING:
-            self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD",
-                                                 "Game not running"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DEFEND_BAD_NOT_RUNNING, {ws}, initiatorWs=ws))
             return True
 
         assert ws in self.playerByWs, "Defend request from an unrecognized connection"
@@ -261,60 +284,22 @@ class Room(GamePlugin):
 
         if player is None:
             # Spectators are added as None to playerByWs
-            self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD",
-                                                 "Must join the game first"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DEFEND_BAD_NOT_JOINED, {ws}, initiatorWs=ws))
             return True
 
-        if len(qmsg.jmsg) != 2:
-            self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD", "Invalid message length"],
+        try:
+            defendCards = DEFEND_SCHEMA.decode(qmsg.jmsg).defends
+        except SchemaError as exc:
+            self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD"] + exc.toJmsg(),
                                                 {ws}, initiatorWs=ws))
             return True
 
-        _, defends = qmsg.jmsg
-
-        if not isinstance(defends, list):
-            self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD", "Invalid defends", defends],
-                                                {ws}, initiatorWs=ws))
-            return True
-
-        if not defends:
-            self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD", "No move specified", defends],
-                                                {ws}, initiatorWs=ws))
-            return True
-
-        defendCards = []
-        for attackDefend in defends:
-            if not isinstance(attackDefend, list):
-                self.txQueue.put_nowait(ClientTxMsg(
-                    ["DEFEND-BAD", "Invalid type for defense", attackDefend],
-                    {ws}, initiatorWs=ws))
-                return True
-
-            if len(attackDefend) != 2:
-                self.txQueue.put_nowait(ClientTxMsg(
-                    ["DEFEND-BAD", "Invalid length of defense", attackDefend],
-                    {ws}, initiatorWs=ws))
-                return True
-
-            attackDefendCards = []
-            for cardJmsg in attackDefend:
-                try:
-                    card = Card.fromJmsg(cardJmsg)
-                except InvalidDataException as _:
-                    self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD", "Invalid card", cardJmsg],
-                                                        {ws}, initiatorWs=ws))
-                    return True
-
-                attackDefendCards.append(card)
-
-            defendCards.append(attackDefendCards)
-
         return self.round.playerDefend(ws, player, defendCards)
 
     #--------------------------------------------
     # DONE handling
 
+    @handles("DONE")
     def __processDone(self, qmsg):
         """
         ["DONE"]
@@ -322,9 +307,7 @@ class Room(GamePlugin):
         ws = qmsg.initiatorWs
 
         if self.state != GameState.RUNNING:
-            self.txQueue.put_nowait(ClientTxMsg(["DONE-BAD",
-                                                 "Game not running"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DONE_BAD_NOT_RUNNING, {ws}, initiatorWs=ws))
             return True
 
         assert ws in self.playerByWs, "Done request from an unrecognized connection"
@@ -333,14 +316,11 @@ class Room(GamePlugin):
 
         if player is None:
             # Spectators are added as None to playerByWs
-            self.txQueue.put_nowait(ClientTxMsg(["DONE-BAD",
-                                                 "Must join the game first"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DONE_BAD_NOT_JOINED, {ws}, initiatorWs=ws))
             return True
 
         if len(qmsg.jmsg) != 1:
-            self.txQueue.put_nowait(ClientTxMsg(["DONE-BAD", "Invalid message length"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DONE_BAD_LENGTH, {ws}, initiatorWs=ws))
             return True
 
         return self.round.playerDone(ws, player)
@@ -348,6 +328,7 @@ class Room(GamePlugin):
     #--------------------------------------------
     # GIVEUP handling
 
+    @handles("GIVEUP")
     def __processGiveup(self, qmsg):
         """
         ["GIVEUP"]
@@ -355,9 +336,7 @@ class Room(GamePlugin):
         ws = qmsg.initiatorWs
 
         if self.state != GameState.RUNNING:
-            self.txQueue.put_nowait(ClientTxMsg(["GIVEUP-BAD",
-                                                 "Game not running"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(GIVEUP_BAD_NOT_RUNNING, {ws}, initiatorWs=ws))
             return True
 
         assert ws in self.playerByWs, "Give up request from an unrecognized connection"
@@ -366,14 +345,11 @@ class Room(GamePlugin):
 
         if player is None:
             # Spectators are added as None to playerByWs
-            self.txQueue.put_nowait(ClientTxMsg(["GIVEUP-BAD",
-                                                 "Must join the game first"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(GIVEUP_BAD_NOT_JOINED, {ws}, initiatorWs=ws))
             return True
 
         if len(qmsg.jmsg) != 1:
-            self.txQueue.put_nowait(ClientTxMsg(["GIVEUP-BAD", "Invalid message length"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(GIVEUP_BAD_LENGTH, {ws}, initiatorWs=ws))
             return True
 
         return self.round.playerGiveup(ws, player)
@@ -2,7 +2,7 @@ from collections import defaultdict
 from enum import Enum
 import random
 
-from fwk.Msg import ClientTxMsg
+from fwk.Msg import ClientTxMsg, constJmsg
 from fwk.MsgSrc import (
         Jmai,
         MsgSrc
@@ -14,6 +14,35 @@ from Common.Card import (
 )
 from Durak.ScoreCardMsgSrc import ScoreCardMsgSrc
 
+# Fixed replies, encoded once and sent by reference
+ATTACK_BAD_NOT_NOW = constJmsg("ATTACK-BAD", "Can't attack right now")
+ATTACK_BAD_DONE = constJmsg("ATTACK-BAD", "Can't attack after declaring done")
+ATTACK_BAD_LAST_DEFENDER = constJmsg("ATTACK-BAD", "Last defender can't attack")
+ATTACK_BAD_NO_CARDS = constJmsg("ATTACK-BAD", "You don't have these cards")
+ATTACK_BAD_CARDS = constJmsg("ATTACK-BAD", "Can't attack with these cards")
+ATTACK_BAD_TOO_MANY = constJmsg("ATTACK-BAD", "Attacking with more cards than defender has")
+ATTACK_BAD_OUT_OF_TURN = constJmsg("ATTACK-BAD", "Attacking out of turn")
+ATTACK_BAD_PASS_NOW = constJmsg("ATTACK-BAD", "Can't pass defense to next player now")
+ATTACK_BAD_PASS_TOO_LATE = constJmsg("ATTACK-BAD", "Too late to pass the attack to next player")
+ATTACK_BAD_NEXT_TOO_FEW = constJmsg("ATTACK-BAD",
+                                    "Next player doesn't have enough cards to defend with")
+ATTACK_OKAY = constJmsg("ATTACK-OKAY")
+DEFEND_BAD_NOT_NOW = constJmsg("DEFEND-BAD", "Can't defend right now")
+DEFEND_BAD_NOT_TURN = constJmsg("DEFEND-BAD", "Not your turn to defend")
+DEFEND_BAD_NO_CARDS = constJmsg("DEFEND-BAD", "You don't have defending cards")
+DEFEND_BAD_ATTACKS = constJmsg("DEFEND-BAD", "Some attacks cards being defended are invalid")
+DEFEND_OKAY = constJmsg("DEFEND-OKAY")
+DONE_BAD_NO_ATTACK = constJmsg("DONE-BAD", "Attack must start first")
+DONE_BAD_NOT_ATTACKER = constJmsg("DONE-BAD", "Only attackers can play done")
+DONE_BAD_TWICE = constJmsg("DONE-BAD", "Already played done")
+DONE_BAD_NOTHING_ATTACKED = constJmsg("DONE-BAD", "Can't declare DONE without some attack")
+DONE_OKAY = constJmsg("DONE-OKAY")
+GIVEUP_BAD_NO_ATTACK = constJmsg("GIVEUP-BAD", "Attack must start first")
+GIVEUP_BAD_NOT_DEFENDER = constJmsg("GIVEUP-BAD", "Only defender can give up")
+GIVEUP_BAD_ALL_DEFENDED = constJmsg("GIVEUP-BAD",
+                                    "All attacks are defended against. You can't give up")
+GIVEUP_OKAY = constJmsg("GIVEUP-OKAY")
+
 class RoundState(Enum):
     WAIT_FIRST_ATTACK = 1
     PAST_FIRST_ATTACK = 2
@@ -37,7 +66,10 @@ class Round(MsgSrc):
                  playerTurnOrder,
                  roundNum=0,
                  startTurnIdx=0,
-                 numCardsToStart=6):
+                 numCardsToStart=6,
+                 rng=None):
+        """rng : random.Random (optional), shuffles the deck instead of
+        the random module (e.g. the room's Plugin.rng)"""
         super(Round, self).__init__(conns)
 
         self.txQueue = txQueue
@@ -46,6 +78,7 @@ class Round(MsgSrc):
         self.playerTurnOrder = playerTurnOrder
         self.startTurnIdx = startTurnIdx
         self.numCardsToStart = numCardsToStart # Pending: pass via round parameters
+        self.rng = rng
 
         self.roundNum = roundNum
         self.roundState = RoundState.WAIT_FIRST_ATTACK
@@ -104,7 +137,7 @@ class Round(MsgSrc):
         self.tableCardsMsgSrc = TableCardsMsgSrc(
                 self._conns, self.roundParameters,
                 {pn: player.hand for pn, player in self.playerByName.items()},
-                numCardsToStart=self.numCardsToStart)
+                numCardsToStart=self.numCardsToStart, rng=self.rng)
 
         self.startTurn()
 
@@ -115,7 +148,8 @@ class Round(MsgSrc):
         self.roundState = RoundState.WAIT_FIRST_ATTACK
 
         self.attackerIdxs = [self.firstPlayerIdxWithCards(self.startTurnIdx)]
-        self.defenderIdx = self.firstPlayerIdxWithCards(self.startTurnIdx + 1)
+        # The player at startTurnIdx may have no cards left
+        self.defenderIdx = self.firstPlayerIdxWithCards(self.attackerIdxs[0] + 1)
         self.donePlayers = set()
 
         assert self.attackerIdxs[0] is not None
@@ -215,13 +249,11 @@ class Round(MsgSrc):
 
     def playerAttack(self, ws, attackingPlayer, attackCards):
         if self.roundState in {RoundState.ROUND_OVER, RoundState.DEFENDER_GAVEUP}:
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD", "Can't attack right now"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_NOT_NOW, {ws}, initiatorWs=ws))
             return True
 
         if attackingPlayer in self.donePlayers:
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD", "Can't attack after declaring done"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_DONE, {ws}, initiatorWs=ws))
             return True
 
         # Defender can't attack if there is nobody left to defend
@@ -229,22 +261,19 @@ class Round(MsgSrc):
         if (len(self.attackerIdxs) + len(self.noCardsPlayerIdxs) + 1 ==
             self.roundParameters.numPlayers and
             defenderPlayer.name == attackingPlayer.name):
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD", "Last defender can't attack"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_LAST_DEFENDER, {ws}, initiatorWs=ws))
             return True
 
         # Verify attacker has these cards
         if not attackingPlayer.hand.hasCards(attackCards):
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD", "You don't have these cards"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_NO_CARDS, {ws}, initiatorWs=ws))
             return True
 
         # Verify these cards can be played (are the same rank) if nothing
         # is on the board or match one of the ranks on the board
         validAttack = self.tableCardsMsgSrc.validAttackCards(attackCards)
         if not validAttack:
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-BAD", "Can't attack with these cards"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_CARDS, {ws}, initiatorWs=ws))
             return True
 
 
@@ -257,16 +286,14 @@ class Round(MsgSrc):
             # Existing attacker is adding more cards
             # Ensure defender has enough cards
             if len(undefendedCards) + len(attackCards) > defenderPlayer.cardCount():
-                self.txQueue.put_nowait(ClientTxMsg(
-                    ["ATTACK-BAD", "Attacking with more cards than defender has"],
-                    {ws}, initiatorWs=ws))
+                self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_TOO_MANY, {ws}, initiatorWs=ws))
                 return True
 
             self.tableCardsMsgSrc.updateAttack(attackingPlayer, attackCards)
 
             # PENDING: fold the code so there is one place for attack okay etc
             # Send ATTACK-OKAY
-            self.txQueue.put_nowait(ClientTxMsg(["ATTACK-OKAY"], {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_OKAY, {ws}, initiatorWs=ws))
 
             self.roundState = RoundState.PAST_FIRST_ATTACK
 
@@ -275,38 +302,33 @@ class Round(MsgSrc):
 
         # Someone is playing out of turn
         if attackingPlayer != defenderPlayer:
-            self.txQueue.put_nowait(ClientTxMsg(
-                ["ATTACK-BAD", "Attacking out of turn"],
-                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_OUT_OF_TURN, {ws}, initiatorWs=ws))
             return True
 
         # Defender is trying to attack to pass defense to next player
 
         if defendedAttackCount > 0:
             # Can't pass defense to next player
-            self.txQueue.put_nowait(ClientTxMsg(
-                ["ATTACK-BAD", "Can't pass defense to next player now"],
-                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_PASS_NOW, {ws}, initiatorWs=ws))
             return True
 
         # Only one rank must have been used for attacks so far
         if len({card.rank for card in undefendedCards}) > 1:
-            self.txQueue.put_nowait(ClientTxMsg(
-                ["ATTACK-BAD", "Too late to pass the attack to next player"],
-                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_PASS_TOO_LATE, {ws}, initiatorWs=ws))
             return True
 
         # Ensure next defender has enough cards to defend with
         nextDefenderIdx = self.firstPlayerIdxWithCards(self.defenderIdx + 1)
         assert nextDefenderIdx is not None
         assert nextDefenderIdx not in self.noCardsPlayerIdxs
-        assert nextDefenderIdx not in self.attackerIdxs
+        if nextDefenderIdx in self.attackerIdxs:
+            # The players that aren't attacking have no cards left
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_LAST_DEFENDER, {ws}, initiatorWs=ws))
+            return True
 
         nextDefender = self.getPlayersByIdxs([nextDefenderIdx])[0]
         if nextDefender.cardCount() < len(undefendedCards) + len(attackCards):
-            self.txQueue.put_nowait(ClientTxMsg(
-                ["ATTACK-BAD", "Next player doesn't have enough cards to defend with"],
-                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(ATTACK_BAD_NEXT_TOO_FEW, {ws}, initiatorWs=ws))
             return True
 
         # Advance defender
@@ -317,7 +339,7 @@ class Round(MsgSrc):
         self.tableCardsMsgSrc.updateAttack(attackingPlayer, attackCards)
 
         # Send ATTACK-OKAY
-        self.txQueue.put_nowait(ClientTxMsg(["ATTACK-OKAY"], {ws}, initiatorWs=ws))
+        self.txQueue.put_nowait(ClientTxMsg(ATTACK_OKAY, {ws}, initiatorWs=ws))
         self.roundState = RoundState.PAST_FIRST_ATTACK
 
         if not self.maybeTurnOver():
@@ -335,14 +357,12 @@ class Round(MsgSrc):
         """
         # Ensure round state
         if self.roundState in {RoundState.ROUND_OVER, RoundState.DEFENDER_GAVEUP}:
-            self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD", "Can't defend right now"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DEFEND_BAD_NOT_NOW, {ws}, initiatorWs=ws))
             return True
 
         # Ensure player == defender
         if player != self.defenderPlayer():
-            self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD", "Not your turn to defend"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DEFEND_BAD_NOT_TURN, {ws}, initiatorWs=ws))
             return True
 
         attackCards = [attackCard for attackCard, _ in attackDefendCards]
@@ -350,17 +370,14 @@ class Round(MsgSrc):
 
         # Ensure defender has all these cards
         if not player.hand.hasCards(defendCards):
-            self.txQueue.put_nowait(ClientTxMsg(["DEFEND-BAD", "You don't have defending cards"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DEFEND_BAD_NO_CARDS, {ws}, initiatorWs=ws))
             return True
 
         # Ensure each attack card is undefended
         _, undefendedCards = self.tableCardsMsgSrc.attackDefendStatus()
 
         if not cardListContains(undefendedCards, attackCards):
-            self.txQueue.put_nowait(ClientTxMsg(
-                ["DEFEND-BAD", "Some attacks cards being defended are invalid"],
-                 {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DEFEND_BAD_ATTACKS, {ws}, initiatorWs=ws))
             return True
 
         # Ensure each defense is a valid defense
@@ -391,7 +408,7 @@ class Round(MsgSrc):
         self.tableCardsMsgSrc.updateDefend(player, attackDefendCards)
 
         # Send DEFEND-OKAY
-        self.txQueue.put_nowait(ClientTxMsg(["DEFEND-OKAY"], {ws}, initiatorWs=ws))
+        self.txQueue.put_nowait(ClientTxMsg(DEFEND_OKAY, {ws}, initiatorWs=ws))
 
         if not self.maybeTurnOver():
             # If turn isn't over, do an explicit refresh
@@ -405,32 +422,27 @@ class Round(MsgSrc):
     def playerDone(self, ws, player):
         # Ensure round state
         if self.roundState != RoundState.PAST_FIRST_ATTACK:
-            self.txQueue.put_nowait(ClientTxMsg(["DONE-BAD", "Attack must start first"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DONE_BAD_NO_ATTACK, {ws}, initiatorWs=ws))
             return True
 
         # Ensure only attackers can send DONE
         if player not in self.attackerPlayers():
-            self.txQueue.put_nowait(ClientTxMsg(["DONE-BAD", "Only attackers can play done"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DONE_BAD_NOT_ATTACKER, {ws}, initiatorWs=ws))
             return True
 
         # Ensure DONE can't be sent twice
         if player in self.donePlayers:
-            self.txQueue.put_nowait(ClientTxMsg(["DONE-BAD", "Already played done"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DONE_BAD_TWICE, {ws}, initiatorWs=ws))
             return True
 
         # Ensure there is at least one attack done
         if not self.tableCardsMsgSrc.attackPilesByPlayerName:
-            self.txQueue.put_nowait(ClientTxMsg(
-                ["DONE-BAD", "Can't declare DONE without some attack"],
-                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(DONE_BAD_NOTHING_ATTACKED, {ws}, initiatorWs=ws))
             return True
 
         self.donePlayers.add(player)
 
-        self.txQueue.put_nowait(ClientTxMsg(["DONE-OKAY"], {ws}, initiatorWs=ws))
+        self.txQueue.put_nowait(ClientTxMsg(DONE_OKAY, {ws}, initiatorWs=ws))
 
         if not self.maybeTurnOver():
             # If turn isn't over, do an explicit refresh
@@ -444,30 +456,26 @@ class Round(MsgSrc):
     def playerGiveup(self, ws, player):
         # Ensure round state
         if self.roundState != RoundState.PAST_FIRST_ATTACK:
-            self.txQueue.put_nowait(ClientTxMsg(["GIVEUP-BAD", "Attack must start first"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(GIVEUP_BAD_NO_ATTACK, {ws}, initiatorWs=ws))
             return True
 
         # Ensure only defender can give up
         defender = self.defenderPlayer()
         if player != defender:
-            self.txQueue.put_nowait(ClientTxMsg(["GIVEUP-BAD", "Only defender can give up"],
-                                                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(GIVEUP_BAD_NOT_DEFENDER, {ws}, initiatorWs=ws))
             return True
 
         # Ensure all attacks aren't defended against
         _, undefendedCards = self.tableCardsMsgSrc.attackDefendStatus()
 
         if not undefendedCards:
-            self.txQueue.put_nowait(ClientTxMsg(
-                ["GIVEUP-BAD", "All attacks are defended against. You can't give up"],
-                {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(GIVEUP_BAD_ALL_DEFENDED, {ws}, initiatorWs=ws))
             return True
 
         # Do the needful when someone gives up
         self.tableCardsMsgSrc.updateGiveup(defender)
 
-        self.txQueue.put_nowait(ClientTxMsg(["GIVEUP-OKAY"], {ws}, initiatorWs=ws))
+        self.txQueue.put_nowait(ClientTxMsg(GIVEUP_OKAY, {ws}, initiatorWs=ws))
 
         self.roundState = RoundState.DEFENDER_GAVEUP
         assert self.maybeTurnOver() is True
@@ -489,12 +497,15 @@ class TableCardsMsgSrc(MsgSrc):
      },
     ]
     """
+    deltaEnabled = True
+
     def __init__(self,
                  conns,
                  roundParameters,
                  handByPlayerName,
                  numDecks=1,
-                 numCardsToStart=6): # PENDING: move some to roundParameters
+                 numCardsToStart=6, # PENDING: move some to roundParameters
+                 rng=None):
         assert numDecks >= 1
         super(TableCardsMsgSrc, self).__init__(conns)
         self.roundParameters = roundParameters
@@ -503,10 +514,13 @@ class TableCardsMsgSrc(MsgSrc):
         # Initialize deck. Top of the deck is to the right (-1); bottom
         # to the left (0)
         self.cards = list(Card.deckCards(numDecks=numDecks))
-        random.shuffle(self.cards)
+        (rng or random).shuffle(self.cards)
         self.trumpSuit = self.cards[0].suit
 
         self.attackPilesByPlayerName = {}
+        # JSON representation of attackPilesByPlayerName. Piles are
+        # replaced, never modified, when cards are added to them
+        self.attackJmsgsByPlayerName = {}
 
         self.refresh()
 
@@ -517,6 +531,7 @@ class TableCardsMsgSrc(MsgSrc):
 
     def newTurn(self):
         self.attackPilesByPlayerName = {}
+        self.attackJmsgsByPlayerName = {}
         self.refresh()
 
     def playerDraw(self, player, numCards):
@@ -572,6 +587,9 @@ class TableCardsMsgSrc(MsgSrc):
 
         attackPiles = self.attackPilesByPlayerName[attacker.name]
         attackPiles.extend([[card] for card in cards])
+        self.attackJmsgsByPlayerName[attacker.name] = (
+                self.attackJmsgsByPlayerName.get(attacker.name, []) +
+                [[card.toJmsg()] for card in cards])
 
         # Remove cards from attacker's hand too
         attacker.hand.removeCards(cards)
@@ -586,8 +604,9 @@ class TableCardsMsgSrc(MsgSrc):
         for attackCard, defendCard in attackDefendCards:
             defendCardsByAttackCard[attackCard].append(defendCard)
 
-        for attackPiles in self.attackPilesByPlayerName.values():
-            for pile in attackPiles:
+        for playerName, attackPiles in self.attackPilesByPlayerName.items():
+            pileJmsgs = None
+            for pileIdx, pile in enumerate(attackPiles):
                 if len(pile) == 2:
                     # Already defended
                     continue
@@ -600,6 +619,10 @@ class TableCardsMsgSrc(MsgSrc):
                 # This card is now defended against
                 defenseCard = defendCardsByAttackCard[attackCard].pop()
                 pile.append(defenseCard)
+                if pileJmsgs is None:
+                    pileJmsgs = self.attackJmsgsByPlayerName[playerName][:]
+                    self.attackJmsgsByPlayerName[playerName] = pileJmsgs
+                pileJmsgs[pileIdx] = pileJmsgs[pileIdx] + [defenseCard.toJmsg()]
 
                 if not defendCardsByAttackCard[attackCard]:
                     # All defenses are used up
@@ -626,6 +649,7 @@ class TableCardsMsgSrc(MsgSrc):
 
         defender.hand.addCards(boardCards)
         self.attackPilesByPlayerName = {}
+        self.attackJmsgsByPlayerName = {}
 
         # Explicit self.refresh() isn't needed because we'll start a
         # new turn
@@ -641,7 +665,6 @@ class TableCardsMsgSrc(MsgSrc):
                {"trump": self.trumpSuit,
                 "drawPileSize": len(self.cards),
                 "bottomCard": self.cards[0].toJmsg() if self.cards else None,
-                "attacks": {pn: [[card.toJmsg() for card in pile] for pile in attackPiles]
-                            for pn, attackPiles in self.attackPilesByPlayerName.items()}}
+                "attacks": dict(self.attackJmsgsByPlayerName)}
               ]
         self.setMsgs([Jmai(msg, None)])
@@ -1,3 +1,7 @@
+from fwk.Bot import (
+        BOT_TIME_BUDGET_SEC_DEFAULT,
+        timeBudgetSec,
+)
 from fwk.Common import Map
 from fwk.Exceptions import InvalidDataException
 from fwk.MsgSrc import (
@@ -14,9 +18,11 @@ class RoundParameters:
                  stopPoints,
                  numDecks=1,
                  numCardsToStart=6,
+                 botTimeBudgetSec=BOT_TIME_BUDGET_SEC_DEFAULT,
                  roundNum=0):
         self.msgSrc = None
         self.roundNum = roundNum
+        self.botTimeBudgetSec = timeBudgetSec(botTimeBudgetSec)
 
         if not isinstance(numPlayers, int):
             raise InvalidDataException("Invalid number of players: integer expected", numPlayers)
@@ -37,6 +43,9 @@ class RoundParameters:
 
     def __getattr__(self, name):
         """Convenience accessors for attributes in self.state"""
+        if name == "state":
+            # Not set yet (e.g. while unpickling)
+            raise AttributeError(name)
         return getattr(self.state, name)
 
     def setPostInitParams(self, conns, roundNum):
@@ -47,10 +56,12 @@ class RoundParameters:
 
     @staticmethod
     def fromJmsg(jmsg):
+        """From the HOST parameters: the ctrArgs, optionally with
+        botTimeBudgetSec"""
         if not isinstance(jmsg, list) or len(jmsg) != 1 or not isinstance(jmsg[0], dict):
             raise InvalidDataException("Invalid host parameters type or length", jmsg)
 
-        if set(jmsg[0]) != set(RoundParameters.ctrArgs):
+        if set(jmsg[0]) - {"botTimeBudgetSec"} != set(RoundParameters.ctrArgs):
             raise InvalidDataException("Invalid or unexpected host parameters keys", jmsg)
 
         return RoundParameters(**jmsg[0])
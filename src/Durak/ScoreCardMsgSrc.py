@@ -10,6 +10,8 @@ class ScoreCardMsgSrc(MsgSrc):
      total-score, # playerName --> score
     ]
     """
+    deltaEnabled = True
+
     def __init__(self, conns, playerNames):
         super(ScoreCardMsgSrc, self).__init__(conns)
         self.playerNames = playerNames
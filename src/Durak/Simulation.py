@@ -0,0 +1,211 @@
+"""Durak games played headless (see fwk/Simulation.py).
+
+Game plays through Durak.Round.Round the way Room does, without a room
+or websockets. Round replies to moves (e.g. ATTACK-OKAY, ATTACK-BAD)
+go to a fwk.Simulation.Replies. Moves are chosen by a policy per player:
+
+    policy(game, name, rng) -> ("ATTACK", cards), ("DEFEND", [[attack, defend], ...]),
+                               ("DONE",), ("GIVEUP",) or None (no move)
+
+Every player's policy is asked in turn order and the first valid move
+is played. Invalid moves are counted. A game is abandoned when no
+policy has a move.
+
+    hostParameters = RoundParameters(3, 2)
+    results = runGames(functools.partial(playGame, hostParameters=hostParameters),
+                       range(10000))
+"""
+
+import random
+import traceback
+
+from fwk.Common import Map
+from fwk.MsgSrc import Connections
+from fwk.Simulation import Replies
+from Durak.Player import Player
+from Durak.Round import (
+        Round,
+        RoundState,
+)
+
+SIMULATION_MAX_MOVES = 5000 # A game is abandoned after this many moves (valid or not)
+
+GREEDY_ADD_ATTACK_PROBABILITY = 0.5
+
+class Game:
+    """A Durak game between players named playerNames"""
+    def __init__(self, hostParameters, playerNames):
+        assert len(playerNames) == hostParameters.numPlayers
+        self.hostParameters = hostParameters
+        self.replies = Replies()
+        conns = Connections(None)
+        self.playerByName = {name: Player(None, conns, name) for name in playerNames}
+
+        playerTurnOrder = list(self.playerByName)
+        random.shuffle(playerTurnOrder)
+        self.round = Round(self.replies, conns, hostParameters,
+                           self.playerByName, playerTurnOrder)
+        self.round.startRound()
+
+    def gameOver(self):
+        return self.round.gameOver()
+
+    def totalScore(self):
+        return dict(self.round.scoreCardMsgSrc.totalScore)
+
+    def losers(self):
+        """Players that reached the stop points"""
+        return sorted(self.round.scoreCardMsgSrc.playersReachedScore(
+            self.hostParameters.stopPoints))
+
+    def move(self, name, move):
+        """Player name makes move. Returns False if the move is invalid"""
+        player = self.playerByName[name]
+        if move[0] == "ATTACK":
+            self.round.playerAttack(None, player, move[1])
+        elif move[0] == "DEFEND":
+            self.round.playerDefend(None, player, move[1])
+        elif move[0] == "DONE":
+            self.round.playerDone(None, player)
+        elif move[0] == "GIVEUP":
+            self.round.playerGiveup(None, player)
+        return self.replies.okay()
+
+# -------------------------------------
+# Policies
+
+def cardValue(card, trumpSuit):
+    """Order in which cards are played: lowest rank first (aces are high),
+    trumps after everything else"""
+    value = 14 if card.rank == 1 else card.rank
+    return value + 100 if card.suit == trumpSuit else value
+
+def beats(defendCard, attackCard, trumpSuit):
+    """Whether defendCard can defend against attackCard"""
+    if defendCard.suit == attackCard.suit:
+        return cardValue(defendCard, trumpSuit) > cardValue(attackCard, trumpSuit)
+    return defendCard.suit == trumpSuit
+
+def defends(attackCards, hand, trumpSuit):
+    """[[attack, defend], ...] defending each attack with the lowest card
+    that beats it, or None if some attack can't be defended"""
+    available = sorted(hand, key=lambda card: cardValue(card, trumpSuit))
+    attackDefendCards = []
+    for attackCard in attackCards:
+        defendCard = next((card for card in available if beats(card, attackCard, trumpSuit)),
+                          None)
+        if defendCard is None:
+            return None
+        available.remove(defendCard)
+        attackDefendCards.append([attackCard, defendCard])
+    return attackDefendCards
+
+def playerView(round_, player):
+    """What player knows of round_ that greedyMove() needs, or None if
+    the player has nothing to do"""
+    if round_.roundState not in (RoundState.WAIT_FIRST_ATTACK, RoundState.PAST_FIRST_ATTACK):
+        return None
+
+    defender = round_.defenderPlayer()
+    isDefender = player is defender
+    if not isDefender and (player not in round_.attackerPlayers() or
+                           player in round_.donePlayers):
+        return None
+
+    tableCards = round_.tableCardsMsgSrc
+    trumpSuit = tableCards.trumpSuit
+    _, undefendedCards = tableCards.attackDefendStatus()
+    return Map(trumpSuit=trumpSuit,
+               hand=sorted(player.hand.cards, key=lambda card: cardValue(card, trumpSuit)),
+               isDefender=isDefender,
+               attacked=bool(tableCards.attackPilesByPlayerName),
+               undefendedCards=list(undefendedCards),
+               tableRanks=sorted({card.rank
+                                  for piles in tableCards.attackPilesByPlayerName.values()
+                                  for pile in piles for card in pile}),
+               defenderCardCount=defender.cardCount())
+
+def greedyMove(view, rng):
+    """Attacks with the lowest card and now and then adds cards of ranks
+    on the table before declaring DONE. Defends with the lowest cards
+    that beat the attacks or gives up"""
+    if view.isDefender:
+        if not view.undefendedCards:
+            return None
+        attackDefendCards = defends(view.undefendedCards, view.hand, view.trumpSuit)
+        return ("DEFEND", attackDefendCards) if attackDefendCards else ("GIVEUP",)
+
+    if not view.attacked:
+        return ("ATTACK", view.hand[:1]) if view.hand else None
+
+    if view.undefendedCards:
+        return None
+
+    candidates = [card for card in view.hand if card.rank in view.tableRanks]
+    if (candidates and view.defenderCardCount and
+            rng.random() < GREEDY_ADD_ATTACK_PROBABILITY):
+        return ("ATTACK", candidates[:1])
+    return ("DONE",)
+
+def greedyPolicy(game, name, rng):
+    """greedyMove() for player name"""
+    view = playerView(game.round, game.playerByName[name])
+    return greedyMove(view, rng) if view else None
+
+def randomPolicy(game, name, rng):
+    """Random, often invalid, moves to fuzz Round"""
+    player = game.playerByName[name]
+    hand = list(player.hand.cards)
+    _, undefendedCards = game.round.tableCardsMsgSrc.attackDefendStatus()
+    moveType = rng.choice(("ATTACK", "DEFEND", "DONE", "GIVEUP"))
+    if moveType == "ATTACK" and hand:
+        return ("ATTACK", rng.sample(hand, rng.randint(1, min(len(hand), 2))))
+    if moveType == "DEFEND" and hand and undefendedCards:
+        return ("DEFEND", [[rng.choice(undefendedCards), rng.choice(hand)]])
+    if moveType == "GIVEUP":
+        return ("GIVEUP",)
+    return ("DONE",)
+
+# -------------------------------------
+# Playing games
+
+def playGame(seed, hostParameters, policies=None, maxMoves=SIMULATION_MAX_MOVES):
+    """Play a game of hostParameters.numPlayers players ("p0", "p1", ...)
+    with policies[i] choosing the moves of player i (greedyPolicy by
+    default). Returns a dict with the result. An exception raised while
+    playing (e.g. a failed assertion in Round) is returned as "error"
+    """
+    random.seed(seed)
+    rng = random.Random(seed)
+    names = ["p{}".format(idx) for idx in range(hostParameters.numPlayers)]
+    policyByName = dict(zip(names, policies or [greedyPolicy] * len(names)))
+
+    game = Game(hostParameters, names)
+    moves = 0
+    badMoves = 0
+    error = None
+    try:
+        while not game.gameOver() and moves < maxMoves:
+            movesBefore = moves
+            for name in game.round.playerTurnOrder:
+                move = policyByName[name](game, name, rng)
+                if move is None:
+                    continue
+                moves += 1
+                if game.move(name, move):
+                    break
+                badMoves += 1
+            if moves == movesBefore:
+                break # Nobody has a move
+    except Exception: # pylint: disable=broad-exception-caught
+        error = traceback.format_exc()
+
+    return {"seed": seed,
+            "finished": game.gameOver(),
+            "losers": game.losers(),
+            "totalScore": game.totalScore(),
+            "turnOrder": game.round.playerTurnOrder,
+            "rounds": game.round.roundNum,
+            "moves": moves,
+            "badMoves": badMoves,
+            "error": error}
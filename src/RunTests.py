@@ -8,9 +8,22 @@ Run unittests for bari
 
 from test.LobbyPluginTest import *
 from test.MsgSrcTest import *
+from test.CardTest import *
+from test.SchemaTest import *
 from test.ChatRoomTest import *
 from test.Dirty7RoomTest import *
+from test.Dirty7RulesTest import *
 from test.TabooRoomTest import *
+from test.ServerQueueTaskTest import *
+from test.TraceTest import *
+from test.MetricsTest import *
+from test.ShardTest import *
+from test.TimerWheelTest import *
+from test.StorageTest import *
+from test.EventLogTest import *
+from test.SimulationTest import *
+from test.BotTest import *
+from test.RoomGcTest import *
 
 if __name__ == "__main__":
     unittest.main(failfast=True)
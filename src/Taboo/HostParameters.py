@@ -58,6 +58,9 @@ class HostParameters:
 
     def __getattr__(self, name):
         """When access hostParameters.numTeams, fetch it from self.state instead"""
+        if name == "state":
+            # Not set yet (e.g. while unpickling)
+            raise AttributeError(name)
         return getattr(self.state, name)
 
     def setPostInitParams(self, conns):
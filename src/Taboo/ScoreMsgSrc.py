@@ -12,6 +12,8 @@ class ScoreMsgSrc(MsgSrc):
         ["SCORE", {team<int>: score,
                    team<int>: score}]
     """
+    deltaEnabled = True
+
     def __init__(self, conns, wordsByTurnId, teamIds):
         super(ScoreMsgSrc, self).__init__(conns)
         self._wordsByTurnId = wordsByTurnId
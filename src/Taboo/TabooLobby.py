@@ -1,9 +1,13 @@
 """Taboo lobby. This allows hosting/creating TabooRooms"""
 
 from fwk.Exceptions import InvalidDataException
-from fwk.GamePlugin import GameLobbyPlugin
+from fwk.GamePlugin import (
+        GameLobbyPlugin,
+        handles,
+)
 from fwk.Msg import (
         ClientTxMsg,
+        constJmsg,
         InternalRegisterGi,
 )
 from fwk.MsgType import MTYPE_HOST_BAD
@@ -44,37 +48,29 @@ class TabooLobby(GameLobbyPlugin):
         newRoom = TabooRoom("taboo:{}".format(self.gameIdx),
                             "Taboo Room #{}".format(self.gameIdx),
                             hostParameters)
-        self.rooms[self.gameIdx] = newRoom
+        self.rooms[self.gameIdx] = newRoom.path
         self.txQueue.put_nowait(InternalRegisterGi(newRoom, initiatorWs=qmsg.initiatorWs))
 
         return True
 
+    @handles("REFRESH")
     def processRefresh(self, qmsg):
+        """[ "REFRESH", "WordSetFileName" ]"""
+        if len(qmsg.jmsg) != 2 or not isinstance(qmsg.jmsg[1], str):
+            return False
+
         if qmsg.jmsg[1] in SupportedWordSets:
             try:
                 SupportedWordSets[qmsg.jmsg[1]].loadData()
             except Exception as exc: # pylint: disable=broad-except
                 trace(Level.error, "Failed to refresh", qmsg.jmsg[1], str(exc))
                 self.txQueue.put_nowait(
-                        ClientTxMsg(["REFRESH-BAD"],
+                        ClientTxMsg(constJmsg("REFRESH-BAD"),
                                     {qmsg.initiatorWs},
                                     initiatorWs=qmsg.initiatorWs))
 
         return False # Pretend message wasn't understood
 
-    def processMsg(self, qmsg):
-        if super(TabooLobby, self).processMsg(qmsg):
-            return True
-
-        # [ "REFRESH", "WordSetFileName" ]
-        if (isinstance(qmsg.jmsg, list) and
-                len(qmsg.jmsg) == 2 and
-                qmsg.jmsg[0] == "REFRESH" and
-                isinstance(qmsg.jmsg[1], str)):
-            return self.processRefresh(qmsg)
-
-        return False
-
 def plugin():
     """Register with bari server"""
     return TabooLobby("taboo", "Taboo")
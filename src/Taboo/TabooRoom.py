@@ -3,13 +3,23 @@
 from enum import Enum
 import re
 
-from fwk.GamePlugin import GamePlugin
+from fwk.Exceptions import SchemaError
+from fwk.GamePlugin import (
+        GamePlugin,
+        handles,
+)
+from fwk.Schema import (
+        Schema,
+        error,
+        intField,
+)
 from fwk.Trace import (
         trace,
         Level,
 )
 from fwk.Msg import (
         ClientTxMsg,
+        constJmsg,
         InternalGiStatus,
 )
 from fwk.MsgSrc import (
@@ -24,6 +34,13 @@ from Taboo.WordSets import SupportedWordSets
 
 validPlayerNameRe = re.compile("^[a-zA-Z0-9_]+$")
 
+# ["DISCARD|COMPLETED", turn<int>, wordIdx<int>]
+COMPLETED_OR_DISCARD_SCHEMAS = {
+    mtype: Schema(mtype, [
+        ("turn", intField(onError=error("Invalid message type", withData=False))),
+        ("wordIdx", intField(onError=error("Invalid message type", withData=False))),
+    ]) for mtype in ("COMPLETED", "DISCARD")}
+
 class GameState(Enum):
     WAITING_TO_START = 1
     RUNNING = 2
@@ -54,7 +71,7 @@ class TabooRoom(GamePlugin):
         wordSet = SupportedWordSets[self.hostParameters.wordSets[0]]
         self.turnMgr = TurnManager(self.path, self.txQueue, wordSet,
                                    self.teams, self.hostParameters,
-                                   self.conns, self._gameOver)
+                                   self.conns, self._gameOver, self.rng)
 
     def publishGiStatus(self):
         """Invoked to update the lobby of the game instance (room) status
@@ -72,6 +89,14 @@ class TabooRoom(GamePlugin):
                 "winners": self._winnerTeamIds}]
         self.txQueue.put_nowait(InternalGiStatus(jmsg, self.path))
 
+    def isGameOver(self):
+        return self.state == GameState.GAME_OVER
+
+    def close(self):
+        super(TabooRoom, self).close()
+        if self.turnMgr:
+            self.turnMgr.close()
+
     def postQueueSetup(self):
         """Invoked when the RX+TX queues are set up to the room and
         when the self.conns object is setup to track all clients in the room
@@ -106,28 +131,6 @@ class TabooRoom(GamePlugin):
         self.state = GameState.RUNNING
         self.turnMgr.startNewTurn()
 
-    def processMsg(self, qmsg):
-        """Handle messages from the queue coming to this room
-
-            message-type1: ["JOIN", ...]
-        """
-        if super(TabooRoom, self).processMsg(qmsg):
-            return True
-
-        if qmsg.jmsg[0] == "JOIN":
-            return self.__processJoin(qmsg)
-
-        if qmsg.jmsg[0] == "READY":
-            return self.__processReady(qmsg)
-
-        if qmsg.jmsg[0] == "KICKOFF":
-            return self.__processKickoff(qmsg)
-
-        if qmsg.jmsg[0] == "DISCARD" or qmsg.jmsg[0] == "COMPLETED":
-            return self.__processCompletedOrDiscard(qmsg)
-
-        return False
-
     def __validateCompletedOrDiscard(self, qmsg):
         """ Validates [COMPLETED|DISCARD, turn<int>, wordIdx<int>]
         Replies a DISCARD-BAD or COMPLETED-BAD if the message is incorrect,
@@ -141,20 +144,17 @@ class TabooRoom(GamePlugin):
 
         ws = qmsg.initiatorWs
 
-        if len(qmsg.jmsg) != 3:
-            self.txQueue.put_nowait(ClientTxMsg([badReplyType, "Invalid message length"],
-                                                {ws}, initiatorWs=ws))
-            return False
-
-        if (not isinstance(qmsg.jmsg[1], int)) or (not isinstance(qmsg.jmsg[2], int)):
-            self.txQueue.put_nowait(ClientTxMsg([badReplyType, "Invalid message type"],
+        try:
+            COMPLETED_OR_DISCARD_SCHEMAS[msgType].decode(qmsg.jmsg)
+        except SchemaError as exc:
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg(badReplyType, *exc.toJmsg()),
                                                 {ws}, initiatorWs=ws))
             return False
 
         if self.state != GameState.RUNNING:
             trace(Level.play, "_process{} current state".format(msgType), self.state.name)
-            self.txQueue.put_nowait(ClientTxMsg([badReplyType,
-                                                 "Game not running"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg(badReplyType,
+                                                          "Game not running"),
                                                  {ws}, initiatorWs=ws))
             return False
 
@@ -164,13 +164,14 @@ class TabooRoom(GamePlugin):
                                 player.name if player else None,
                                 "activePlayer", self.turnMgr.activePlayer.name
                                               if self.turnMgr.activePlayer else None)
-            self.txQueue.put_nowait(ClientTxMsg([badReplyType,
-                                                 "It is not your turn"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg(badReplyType,
+                                                          "It is not your turn"),
                                                  {ws}, initiatorWs=ws))
             return False
 
         return True
 
+    @handles("DISCARD", "COMPLETED")
     def __processCompletedOrDiscard(self, qmsg):
         """
         ["DISCARD|COMPLETED", turn<int>, wordIdx<int>]
@@ -179,6 +180,7 @@ class TabooRoom(GamePlugin):
             return True
         return self.turnMgr.processCompletedOrDiscard(qmsg)
 
+    @handles("KICKOFF")
     def __processKickoff(self, qmsg):
         """
         ["KICKOFF"]
@@ -186,14 +188,14 @@ class TabooRoom(GamePlugin):
         ws = qmsg.initiatorWs
 
         if len(qmsg.jmsg) != 1:
-            self.txQueue.put_nowait(ClientTxMsg(["KICKOFF-BAD", "Invalid message length"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("KICKOFF-BAD", "Invalid message length"),
                                                 {ws}, initiatorWs=ws))
             return True
 
         if self.state != GameState.RUNNING:
             trace(Level.play, "_processDiscard current state", self.state.name)
-            self.txQueue.put_nowait(ClientTxMsg(["KICKOFF-BAD",
-                                                 "Game not running"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("KICKOFF-BAD",
+                                                          "Game not running"),
                                                  {ws}, initiatorWs=ws))
             return True
 
@@ -202,13 +204,14 @@ class TabooRoom(GamePlugin):
             trace(Level.play, "_processDiscard msg rcvd from", player.name if player else None,
                               "activePlayer", self.turnMgr.activePlayer.name
                                               if self.turnMgr.activePlayer else None)
-            self.txQueue.put_nowait(ClientTxMsg(["KICKOFF-BAD",
-                                                 "It is not your turn"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("KICKOFF-BAD",
+                                                          "It is not your turn"),
                                                  {ws}, initiatorWs=ws))
             return True
 
         return self.turnMgr.processKickoff(qmsg)
 
+    @handles("READY")
     def __processReady(self, qmsg):
         """
         ["READY"]
@@ -216,7 +219,7 @@ class TabooRoom(GamePlugin):
         ws = qmsg.initiatorWs
 
         if len(qmsg.jmsg) != 1:
-            self.txQueue.put_nowait(ClientTxMsg(["READY-BAD", "Invalid message length"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("READY-BAD", "Invalid message length"),
                                                 {ws}, initiatorWs=ws))
             return True
 
@@ -227,12 +230,12 @@ class TabooRoom(GamePlugin):
 
         player = self.playerByWs.get(ws, None)
         if not player:
-            self.txQueue.put_nowait(ClientTxMsg(["READY-BAD", "Join first"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("READY-BAD", "Join first"),
                                     {ws}, initiatorWs=ws))
             return True
 
         if player.ready:
-            self.txQueue.put_nowait(ClientTxMsg(["READY-BAD", "Already ready"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("READY-BAD", "Already ready"),
                                     {ws}, initiatorWs=ws))
             return True
 
@@ -244,6 +247,7 @@ class TabooRoom(GamePlugin):
 
         return True
 
+    @handles("JOIN")
     def __processJoin(self, qmsg):
         """
         ["JOIN", playerName, team:int={0..T}]
@@ -253,13 +257,14 @@ class TabooRoom(GamePlugin):
         assert ws in self.playerByWs, "Join request from an unrecognized connection"
 
         if self.playerByWs[ws]:
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD",
-                                                 "Unexpected JOIN message from client that "
-                                                 "has already joined"], {ws}, initiatorWs=ws))
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("JOIN-BAD",
+                                                          "Unexpected JOIN message from client "
+                                                          "that has already joined"),
+                                                {ws}, initiatorWs=ws))
             return True
 
         if len(qmsg.jmsg) != 3:
-            self.txQueue.put_nowait(ClientTxMsg(["JOIN-BAD", "Invalid message length"],
+            self.txQueue.put_nowait(ClientTxMsg(constJmsg("JOIN-BAD", "Invalid message length"),
                                                 {ws}, initiatorWs=ws))
             return True
 
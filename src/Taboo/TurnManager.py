@@ -7,6 +7,7 @@ import random
 
 from fwk.Msg import (
         ClientTxMsg,
+        constJmsg,
         TimerRequest,
 )
 from fwk.MsgSrc import (
@@ -35,7 +36,7 @@ class TurnMgrState(Enum):
 
 class TurnManager:
     def __init__(self, path, txQueue, wordSet, teams, hostParameters, allConns,
-                 gameOverCb):
+                 gameOverCb, rng=random):
         """
         Arguments
         ---------
@@ -50,10 +51,13 @@ class TurnManager:
             is invoked from the Bari core), we need a way to call just the gameOver
             function in the Room. An ugly way is to pass the whole room here which
             I am avoiding by passing in gameOverCb instead.
+        rng : random.Random (optional)
+            Chooses the first team and the words (e.g. the room's Plugin.rng)
         """
         self._path = path
         self._txQueue = txQueue
         self._wordSet = wordSet
+        self._rng = rng
         self._teams = teams
         self._hostParameters = hostParameters # Stop the game when every live player
                                               # has played hostParameters.numTurns
@@ -67,6 +71,7 @@ class TurnManager:
         self._activePlayer = None
         self._waitForKickoffMsgSrc = MsgSrc(self._allConns)
         self._utcTimeout = None # UTC epoch of when this turn expires
+        self._turnTimer = None # TimerRequest for the current turn
 
         self._state = TurnMgrState.GAME_START_WAIT
 
@@ -89,12 +94,25 @@ class TurnManager:
     def totalScore(self):
         return self._scoreMsgSrc.score
 
+    def close(self):
+        """Cancel the turn timer and release the words used (the room is
+        being collected)"""
+        if self._turnTimer:
+            self._turnTimer.cancel()
+            self._turnTimer = None
+        self._wordSet.release(self._path)
+
     def updateState(self, newState):
         if self._state == newState:
             return
 
         self._state = newState
 
+        if newState != TurnMgrState.RUNNING and self._turnTimer:
+            # The turn ended (early). Its timer isn't needed
+            self._turnTimer.cancel()
+            self._turnTimer = None
+
         if newState == TurnMgrState.KICKOFF_WAIT:
             self._waitForKickoffMsgSrc.setMsgs([
                 Jmai(["WAIT-FOR-KICKOFF", self._curTurnId, self._activePlayer.name], None),
@@ -126,8 +144,8 @@ class TurnManager:
             return False
 
         if qmsg.jmsg[1] != self._curTurnId:
-            self._txQueue.put_nowait(ClientTxMsg([badReplyType,
-                                                  "Invalid turn"],
+            self._txQueue.put_nowait(ClientTxMsg(constJmsg(badReplyType,
+                                                           "Invalid turn"),
                                                  {ws}, initiatorWs=ws))
             return False
 
@@ -143,14 +161,14 @@ class TurnManager:
         lastWord = self._wordsByTurnId[self._curTurnId][-1]
 
         if qmsg.jmsg[2] != lastWord.wordId:
-            self._txQueue.put_nowait(ClientTxMsg([badReplyType,
-                                                  "Invalid word"],
+            self._txQueue.put_nowait(ClientTxMsg(constJmsg(badReplyType,
+                                                           "Invalid word"),
                                                  {ws}, initiatorWs=ws))
             return False
 
         if lastWord.state != WordState.IN_PLAY:
-            self._txQueue.put_nowait(ClientTxMsg([badReplyType,
-                                                  "The word is no longer in play"],
+            self._txQueue.put_nowait(ClientTxMsg(constJmsg(badReplyType,
+                                                           "The word is no longer in play"),
                                                  {ws}, initiatorWs=ws))
             return False
 
@@ -178,6 +196,7 @@ class TurnManager:
             # game over
             trace(Level.play, "Last word discarded/completed, no more words. Game over")
             self.activePlayer.incTurnsPlayed()
+            self.updateState(TurnMgrState.GAME_OVER)
             self._gameOverCb()
 
         return True
@@ -187,15 +206,16 @@ class TurnManager:
         ws = qmsg.initiatorWs
 
         if self._state != TurnMgrState.KICKOFF_WAIT:
-            self._txQueue.put_nowait(ClientTxMsg(["KICKOFF-BAD",
-                                                  "Can't kickoff a turn"],
+            self._txQueue.put_nowait(ClientTxMsg(constJmsg("KICKOFF-BAD",
+                                                           "Can't kickoff a turn"),
                                                   {ws}, initiatorWs=ws))
             return True
 
         # Start with a new word for the activePlayer
 
         ctx = {"turnId": self._curTurnId}
-        self._txQueue.put_nowait(TimerRequest(self.turnDurationSec, self.timerExpiredCb, ctx))
+        self._turnTimer = TimerRequest(self.turnDurationSec, self.timerExpiredCb, ctx)
+        self._txQueue.put_nowait(self._turnTimer)
         self._utcTimeout = expiryEpoch(self.turnDurationSec)
 
         assert self.startNextWord() is True, "Must always be able to start a new word"
@@ -268,7 +288,7 @@ class TurnManager:
         if self._wordsByTurnId:
             currentTeam = self._wordsByTurnId[self._curTurnId][-1].player.team
         else:
-            currentTeam = random.choice(list(self._teams.values()))
+            currentTeam = self._rng.choice(list(self._teams.values()))
 
         # Identify nextPlayer (preferring a player from the next team)
         teamCount = len(self._teams)
@@ -326,7 +346,7 @@ class TurnManager:
         nextWordId = len(self._wordsByTurnId[self._curTurnId]) + 1
 
         # Fetch a new word
-        found = self._wordSet.nextWord(self._path)
+        found = self._wordSet.nextWord(self._path, self._rng)
         if not found:
             trace(Level.rnd, "Can't start a new turn as no word available")
             # Ran out of words
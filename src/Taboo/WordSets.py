@@ -19,8 +19,8 @@ WORDSETS_PATH = os.path.join(os.path.split(__file__)[0], "wordsets")
 #   filename --> WordSet
 SupportedWordSets = {}
 
-def randomWord(wordPool):
-    return random.sample(list(wordPool), 1)[ 0 ]
+def randomWord(wordPool, rng=random):
+    return rng.sample(list(wordPool), 1)[ 0 ]
 
 class WordSet:
     """
@@ -66,11 +66,12 @@ class WordSet:
     def areWordsAvailable(self, requestor):
         return len(self._usedWordsByRequestor[requestor]) < self.count()
 
-    def nextWord(self, requestor):
+    def nextWord(self, requestor, rng=random):
         """
         Arguments
         ---------
         requestor : unique hashable key
+        rng : random.Random (optional), chooses the word
 
         Returns : Map or None
         ----------------------
@@ -83,13 +84,17 @@ class WordSet:
             return None
 
         candidateWords = self.allWords - self._usedWordsByRequestor[requestor]
-        word = randomWord(candidateWords)
+        word = randomWord(candidateWords, rng)
         disallowed = self.data['words'][word]
 
         self._usedWordsByRequestor[requestor].add(word)
 
         return Map(word=word, disallowed=disallowed)
 
+    def release(self, requestor):
+        """Forget the words used by requestor"""
+        self._usedWordsByRequestor.pop(requestor, None)
+
 if __name__ != "__main__": # When importing
     files = os.listdir(WORDSETS_PATH)
 
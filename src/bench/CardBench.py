@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Benchmark card validation with the previous Card and list helpers
+against the interned Card and CardBag.
+
+Each iteration parses the cards of a play from JSON, checks that a
+13 card hand dealt from two decks holds them and looks them up in a
+dict keyed by Card, as Dirty7 and Durak do when validating moves.
+
+    cd src && python -m bench.CardBench
+"""
+
+import random
+import timeit
+
+from Common.Card import (
+        Card,
+        CardBag,
+        SUITS,
+)
+from fwk.Exceptions import InvalidDataException
+
+ITERATIONS = 20000
+HAND_SIZE = 13
+PLAY_SIZE = 3
+
+class LegacyCard:
+    """Common.Card.Card before interning"""
+    def __init__(self, suit, rank):
+        if suit not in set(SUITS) | {"JOKER"}:
+            raise InvalidDataException("Bad card suit", suit)
+        if rank not in set(range(14)):
+            raise InvalidDataException("Bad card rank", rank)
+        self.suit = suit
+        self.rank = rank
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __str__(self):
+        if self.suit == "JOKER":
+            return "JOKER"
+        return "{}{}".format(self.rank, self.suit)
+
+    @staticmethod
+    def fromJmsg(jmsg):
+        return LegacyCard(jmsg[0], jmsg[1])
+
+def legacyCardListContains(cardBiggerList, cardSmallerList):
+    """Common.Card.cardListContains before CardBag"""
+    biggerList = cardBiggerList[:]
+    for card in cardSmallerList:
+        try:
+            idx = biggerList.index(card)
+        except ValueError:
+            return False
+        biggerList.pop(idx)
+    return True
+
+def run(cardCls, makeHand, contains, handJmsg, playJmsgs):
+    hand = makeHand([cardCls.fromJmsg(jmsg) for jmsg in handJmsg])
+    countByCard = {}
+    for card in hand:
+        countByCard[card] = countByCard.get(card, 0) + 1
+    for playJmsg in playJmsgs:
+        play = [cardCls.fromJmsg(jmsg) for jmsg in playJmsg]
+        contains(hand, play)
+        for card in play:
+            _ = card in countByCard
+
+def main():
+    rng = random.Random(7)
+    deck = [[suit, rank] for suit in SUITS for rank in range(1, 14)] * 2
+    handJmsg = rng.sample(deck, HAND_SIZE)
+    playJmsgs = [rng.sample(deck, PLAY_SIZE) for _ in range(ITERATIONS)]
+
+    before = min(timeit.repeat(lambda: run(LegacyCard, list, legacyCardListContains,
+                                           handJmsg, playJmsgs), number=1, repeat=3))
+    after = min(timeit.repeat(lambda: run(Card, CardBag, CardBag.contains,
+                                          handJmsg, playJmsgs), number=1, repeat=3))
+    print("legacy {:8.3f}us/play  interned {:8.3f}us/play  speedup {:6.1f}x".format(
+        before * 1e6 / ITERATIONS, after * 1e6 / ITERATIONS, before / after))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Measure bytes sent for Durak's SCORE message with and without deltas.
+
+ScoreCardMsgSrc resends the score of every round played so far each
+time a round ends. A websocket that connected with "?delta=1" gets a
+PATCH with just the new round instead.
+
+    cd src && python -m bench.DeltaBench
+"""
+
+import asyncio
+
+from Durak.ScoreCardMsgSrc import ScoreCardMsgSrc
+from fwk.MsgSrc import Connections
+
+NUM_PLAYERS = 6
+ROUNDS = (10, 50, 200)
+
+def scoreBytes(numRounds):
+    txq = asyncio.Queue()
+    conns = Connections(txq)
+    conns.addConn(0)
+    playerNames = ["plyr{}".format(i) for i in range(NUM_PLAYERS)]
+    msgSrc = ScoreCardMsgSrc(conns, playerNames)
+
+    for roundNum in range(1, numRounds + 1):
+        msgSrc.setRoundLosers(roundNum, {playerNames[roundNum % NUM_PLAYERS]})
+
+    snapshotBytes = 0
+    deltaBytes = 0
+    while not txq.empty():
+        qmsg = txq.get_nowait()
+        snapshotBytes += len(qmsg.encoded())
+        deltaBytes += len(qmsg.version.patchEncoded() or qmsg.version.snapshotEncoded())
+    return snapshotBytes, deltaBytes
+
+def main():
+    for numRounds in ROUNDS:
+        snapshotBytes, deltaBytes = scoreBytes(numRounds)
+        print("{:4} rounds  snapshots {:10} bytes  deltas {:8} bytes  ratio {:6.1f}x".format(
+            numRounds, snapshotBytes, deltaBytes, snapshotBytes / deltaBytes))
+
+if __name__ == "__main__":
+    main()
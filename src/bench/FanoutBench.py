@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Benchmark JSON encoding cost of MsgSrc fan-out.
+
+Simulates a room with 8 players and 50 spectators. Every player has
+their own Connections (as in Dirty7/Durak) and the room has a set of
+MsgSrcs publishing TURN/TABLE-CARDS/PLAYER-CARDS like snapshots.
+
+Two scenarios are measured:
+1. broadcast: each MsgSrc publishes a new snapshot
+2. replay: every websocket reconnects and receives all cached messages
+
+The "per-message" mode encodes each ClientTxMsg with json.dumps (the
+previous behavior of giTxQueue). The "encode-once" mode uses
+ClientTxMsg.encoded() which shares the encoding through the Jmai.
+
+    cd src && python -m bench.FanoutBench
+"""
+
+import asyncio
+import json
+import timeit
+
+from fwk.MsgSrc import (
+        Connections,
+        ConnectionsGroup,
+        Jmai,
+        MsgSrc,
+)
+
+NUM_PLAYERS = 8
+NUM_SPECTATORS = 50
+NUM_ROUNDS = 20
+
+def tableCardsJmsg(turn):
+    return ["TABLE-CARDS",
+            {"trump": "H",
+             "drawPileSize": 20 - turn % 20,
+             "bottomCard": ["H", 4],
+             "attacks": {"plyr{}".format(p): [[["S", r], ["S", r + 1]] for r in range(1, 7)]
+                         for p in range(NUM_PLAYERS)}}]
+
+def setUpRoom():
+    txq = asyncio.Queue()
+    allConns = Connections(txq)
+    playerConnsGroup = ConnectionsGroup()
+
+    wsId = 0
+    for _ in range(NUM_PLAYERS):
+        playerConns = Connections(txq)
+        allConns.addConn(wsId)
+        playerConns.addConn(wsId)
+        playerConnsGroup.addConnections(playerConns)
+        wsId += 1
+
+    for _ in range(NUM_SPECTATORS):
+        allConns.addConn(wsId)
+        wsId += 1
+
+    msgSrcs = [MsgSrc(allConns) for _ in range(4)] + [MsgSrc(playerConnsGroup)]
+    return txq, allConns, msgSrcs
+
+def drain(txq, perMessage):
+    count = 0
+    while not txq.empty():
+        qmsg = txq.get_nowait()
+        msg = json.dumps(qmsg.jmsg) if perMessage else qmsg.encoded()
+        count += len(msg)
+    return count
+
+def broadcast(perMessage):
+    txq, _, msgSrcs = setUpRoom()
+    for turn in range(NUM_ROUNDS):
+        for msgSrc in msgSrcs:
+            msgSrc.setMsgs([Jmai(tableCardsJmsg(turn), None)])
+        drain(txq, perMessage)
+
+def replay(perMessage):
+    txq, allConns, msgSrcs = setUpRoom()
+    for msgSrc in msgSrcs:
+        msgSrc.setMsgs([Jmai(tableCardsJmsg(0), None)])
+    drain(txq, perMessage)
+
+    for _ in range(NUM_ROUNDS):
+        for ws in range(NUM_PLAYERS + NUM_SPECTATORS):
+            allConns.delConn(ws)
+            allConns.addConn(ws)
+        drain(txq, perMessage)
+
+def main():
+    for name, func in (("broadcast", broadcast), ("replay", replay)):
+        before = min(timeit.repeat(lambda func=func: func(True), number=5, repeat=3))
+        after = min(timeit.repeat(lambda func=func: func(False), number=5, repeat=3))
+        print("{:10} per-message {:8.2f}ms  encode-once {:8.2f}ms  speedup {:5.2f}x".format(
+            name, before * 1000, after * 1000, before / after))
+
+if __name__ == "__main__":
+    main()
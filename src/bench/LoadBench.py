@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+"""Load test bari with scripted bots playing complete games.
+
+Runs server.main in this process on localhost (in a thread with its own
+event loop) and connects bots over websockets. They host and play
+complete Dirty7, Durak, Taboo and Chat games, up to --concurrency games
+at a time. Every bot moves with its own random.Random seeded from
+--seed and the game's index, and the server's random module is seeded
+too, so a run replays the same scripted games.
+
+Reported (and saved as JSON with --out):
+1. msgsPerSec : messages received by all clients per second
+2. latencyMs p50/p99 : from a bot sending a move to another client in
+   the room receiving the broadcast it caused (Chat: the message itself)
+3. bytesPerGame : bytes received by the clients of a room
+4. rssKb : RSS of this process (server and bots) before and after the
+   games and the max
+
+    cd src && python -m bench.LoadBench --out load.json
+    cd src && python -m bench.LoadBench --baseline load.json --server-arg=--workers=2
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+import websockets
+
+import server
+
+GAMES_DEFAULT = {"dirty7": 100, "durak": 100, "taboo": 50, "chat": 50}
+CONCURRENCY_DEFAULT = 50
+GAME_TIMEOUT_SEC_DEFAULT = 120.0
+SERVER_START_TIMEOUT_SEC = 10.0
+
+DIRTY7_PLAYERS = 4
+DIRTY7_STOP_POINTS = 100
+DIRTY7_DECLARE_POINTS = 10 # Bots declare with a hand worth this much or less ...
+DIRTY7_MAX_PLAYS = (4, 12) # ... or after this many plays in a round
+
+DURAK_PLAYERS = 2
+DURAK_STOP_POINTS = 1
+
+TABOO_TEAMS = 2
+TABOO_PLAYERS = 4
+TABOO_DISCARD_PROBABILITY = 0.1
+
+CHAT_PLAYERS = 8
+CHAT_MSGS = 20
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * pct // 100)]
+
+def latencyMs(latencies):
+    return {"p50": percentile([lat * 1000 for lat in latencies], 50),
+            "p99": percentile([lat * 1000 for lat in latencies], 99),
+            "count": len(latencies)}
+
+def maxRssKb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def rssKb():
+    """Current RSS of this process (the max RSS where /proc isn't available)"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return maxRssKb()
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# -------------------------------------
+# Bots
+
+class GameStats:
+    """Totals for all the games of a kind"""
+    def __init__(self):
+        self.games = 0
+        self.completed = 0
+        self.timedOut = 0
+        self.bots = 0
+        self.rxMsgs = 0
+        self.rxBytes = 0
+        self.txMsgs = 0
+        self.badReplies = 0
+        self.latencies = []
+
+    def toJson(self):
+        return {"games": self.games,
+                "completed": self.completed,
+                "timedOut": self.timedOut,
+                "bots": self.bots,
+                "rxMsgs": self.rxMsgs,
+                "txMsgs": self.txMsgs,
+                "rxBytes": self.rxBytes,
+                "bytesPerGame": self.rxBytes // self.games if self.games else None,
+                "badReplies": self.badReplies,
+                "latencyMs": latencyMs(self.latencies)}
+
+class Room:
+    """A hosted room and the bots in it. Moves are timed until another
+    bot receives the broadcast they caused"""
+    def __init__(self, path, stats):
+        self.path = path
+        self.stats = stats
+        self.moveSentAt = None
+        self.moveBy = None
+
+    def moveSent(self, bot):
+        if self.moveSentAt is None:
+            self.moveSentAt = time.perf_counter()
+            self.moveBy = bot
+
+    def moveRejected(self, bot):
+        if self.moveBy is bot:
+            self.moveSentAt = None
+            self.moveBy = None
+
+    def broadcastReceived(self, bot):
+        if self.moveSentAt is not None and bot is not self.moveBy:
+            self.stats.latencies.append(time.perf_counter() - self.moveSentAt)
+            self.moveSentAt = None
+            self.moveBy = None
+
+class Bot:
+    """A scripted client in a room. Subclasses react to the messages they
+    receive in onMsg() and set done when their game is over"""
+    broadcastTypes = () # Messages that moves cause to be sent to everyone
+
+    def __init__(self, room, idx, rng):
+        self.room = room
+        self.idx = idx
+        self.name = "p{}".format(idx)
+        self.rng = rng
+        self.outbox = []
+        self.done = False
+
+    async def run(self, uri):
+        async with websockets.connect(uri, max_size=None) as ws:
+            self.start()
+            await self.flush(ws)
+            async for frame in ws:
+                self.room.stats.rxBytes += len(frame)
+                jmsg = json.loads(frame)
+                # A list of messages when connected with ?batch=1
+                for msg in jmsg if jmsg and isinstance(jmsg[0], list) else [jmsg]:
+                    self.receive(msg)
+                await self.flush(ws)
+                if self.done:
+                    break
+
+    async def flush(self, ws):
+        outbox, self.outbox = self.outbox, []
+        for text in outbox:
+            await ws.send(text)
+
+    def send(self, jmsg, move=True):
+        if move:
+            self.room.moveSent(self)
+        self.room.stats.txMsgs += 1
+        self.outbox.append(json.dumps(jmsg))
+
+    def receive(self, jmsg):
+        self.room.stats.rxMsgs += 1
+        mtype = jmsg[0]
+        if isinstance(mtype, str) and mtype.endswith("-BAD"):
+            self.room.stats.badReplies += 1
+            self.room.moveRejected(self)
+        if mtype in self.broadcastTypes:
+            self.room.broadcastReceived(self)
+        self.onMsg(jmsg)
+
+    def start(self):
+        raise NotImplementedError
+
+    def onMsg(self, jmsg):
+        raise NotImplementedError
+
+def dirty7Points(card):
+    return min(card[1], 10)
+
+class Dirty7Bot(Bot):
+    """Drops its highest card and draws one from the deck (picks the
+    face up card once the deck is empty). Declares when its hand is worth
+    DIRTY7_DECLARE_POINTS or less or after a seeded number of plays"""
+    broadcastTypes = ("UPDATE",)
+
+    def __init__(self, room, idx, rng):
+        super(Dirty7Bot, self).__init__(room, idx, rng)
+        self.roundNum = None
+        self.turnName = None
+        self.turnCount = 0
+        self.moved = None # (roundNum, turnCount) of the last move
+        self.handByRound = {}
+        self.tableByRound = {}
+        self.playsByRound = {}
+
+    def start(self):
+        self.send(["JOIN", self.name, "1"], move=False)
+
+    def onMsg(self, jmsg):
+        mtype = jmsg[0]
+        if mtype == "TURN":
+            _, self.roundNum, self.turnName = jmsg
+            self.turnCount += 1
+        elif mtype == "PLAYER-CARDS" and jmsg[2] == self.name and len(jmsg) == 5:
+            self.handByRound[jmsg[1]] = jmsg[4]
+        elif mtype == "TABLE-CARDS":
+            self.tableByRound[jmsg[1]] = (jmsg[2], jmsg[4])
+        elif mtype == "GAME-OVER":
+            self.done = True
+            return
+
+        if (self.turnName == self.name and self.moved != (self.roundNum, self.turnCount) and
+                self.roundNum in self.handByRound and self.roundNum in self.tableByRound):
+            self.moved = (self.roundNum, self.turnCount)
+            self.move(self.handByRound[self.roundNum], *self.tableByRound[self.roundNum])
+
+    def move(self, hand, numDeckCards, faceUpCards):
+        if self.roundNum not in self.playsByRound:
+            self.playsByRound[self.roundNum] = self.rng.randint(*DIRTY7_MAX_PLAYS)
+        self.playsByRound[self.roundNum] -= 1
+
+        if (self.playsByRound[self.roundNum] < 0 or
+                sum(dirty7Points(card) for card in hand) <= DIRTY7_DECLARE_POINTS):
+            self.send(["DECLARE"])
+            return
+
+        playDesc = {"dropCards": [max(hand, key=dirty7Points)]}
+        if numDeckCards:
+            playDesc["numDrawCards"] = 1
+        else:
+            playDesc["pickCards"] = [faceUpCards[-1]]
+        self.send(["PLAY", playDesc])
+
+def durakValue(card):
+    return 14 if card[1] == 1 else card[1]
+
+def durakBeats(attackCard, defendCard, trump):
+    if defendCard[0] == attackCard[0]:
+        return attackCard[1] != 1 and durakValue(defendCard) > durakValue(attackCard)
+    return defendCard[0] == trump
+
+class DurakBot(Bot):
+    """Attacks with its lowest card and is DONE once the attack is
+    defended. Defends with the lowest cards that beat the attacks and
+    gives up when it can't. Moves when a ROUND message arrives: the room
+    sends it after the table and hands change"""
+    broadcastTypes = ("TABLE-CARDS", "ROUND")
+
+    def __init__(self, room, idx, rng):
+        super(DurakBot, self).__init__(room, idx, rng)
+        self.round = None
+        self.table = None
+        self.hand = None
+        self.lastState = None
+
+    def start(self):
+        self.send(["JOIN", self.name], move=False)
+
+    def onMsg(self, jmsg):
+        mtype = jmsg[0]
+        if mtype == "ROUND":
+            self.round = jmsg[2]
+        elif mtype == "TABLE-CARDS":
+            self.table = jmsg[1]
+        elif mtype == "PLAYER-HAND" and jmsg[1] == self.name and len(jmsg) == 4:
+            self.hand = jmsg[3]
+        elif mtype == "GAME-OVER":
+            self.done = True
+            return
+
+        if mtype != "ROUND" or not self.round or not self.table or self.hand is None:
+            return
+
+        # Move once per state of the game
+        state = json.dumps([self.round, self.table, self.hand], sort_keys=True)
+        if state == self.lastState:
+            return
+        self.lastState = state
+        self.move(self.table["trump"])
+
+    def lowestCard(self, cards, trump):
+        return min(cards, key=lambda card: (card[0] == trump, durakValue(card)))
+
+    def move(self, trump):
+        piles = [pile for piles in self.table["attacks"].values() for pile in piles]
+        undefended = [pile[0] for pile in piles if len(pile) == 1]
+
+        if self.round["defender"] == self.name:
+            if undefended:
+                defends = self.defends(undefended, trump)
+                self.send(["DEFEND", defends] if defends else ["GIVEUP"])
+            return
+
+        if self.name in self.round["attackers"] and self.name not in self.round["done"]:
+            if not piles and self.hand:
+                self.send(["ATTACK", [self.lowestCard(self.hand, trump)]])
+            elif piles and not undefended:
+                self.send(["DONE"])
+
+    def defends(self, attackCards, trump):
+        """[[attackCard, defendCard], ...] or None if some attack can't be beaten"""
+        hand = list(self.hand)
+        defends = []
+        for attackCard in sorted(attackCards, key=durakValue, reverse=True):
+            candidates = [card for card in hand if durakBeats(attackCard, card, trump)]
+            if not candidates:
+                return None
+            defendCard = self.lowestCard(candidates, trump)
+            hand.remove(defendCard)
+            defends.append([attackCard, defendCard])
+        return defends
+
+class TabooBot(Bot):
+    """Kicks off its turns and completes (now and then discards) every
+    word it is given until the words run out"""
+    broadcastTypes = ("TURN",)
+
+    def __init__(self, room, idx, rng):
+        super(TabooBot, self).__init__(room, idx, rng)
+        self.team = 1 + idx % TABOO_TEAMS
+        self.kickedOff = None
+        self.resolved = None
+
+    def start(self):
+        self.send(["JOIN", self.name, self.team], move=False)
+
+    def onMsg(self, jmsg):
+        mtype = jmsg[0]
+        if mtype == "JOIN-OKAY":
+            self.send(["READY"], move=False)
+        elif mtype == "WAIT-FOR-KICKOFF":
+            _, turn, playerName = jmsg
+            if playerName == self.name and turn != self.kickedOff:
+                self.kickedOff = turn
+                self.send(["KICKOFF"])
+        elif mtype == "TURN":
+            _, turn, wordIdx, desc = jmsg
+            if (desc["player"] == self.name and desc["state"] == "IN_PLAY" and
+                    "secret" in desc and self.resolved != (turn, wordIdx)):
+                self.resolved = (turn, wordIdx)
+                discard = self.rng.random() < TABOO_DISCARD_PROBABILITY
+                self.send(["DISCARD" if discard else "COMPLETED", turn, wordIdx])
+        elif mtype == "GAME-OVER":
+            self.done = True
+
+class ChatBot(Bot):
+    """Sends CHAT_MSGS messages, each once the previous one is echoed
+    back. Latency is measured by the other bots from the send time in
+    each message"""
+    def __init__(self, room, idx, rng):
+        super(ChatBot, self).__init__(room, idx, rng)
+        self.sent = 0
+
+    def start(self):
+        self.sendChat()
+
+    def sendChat(self):
+        self.sent += 1
+        self.send(["CHAT", self.name, self.sent, time.perf_counter()], move=False)
+
+    def onMsg(self, jmsg):
+        if jmsg[0] != "CHAT":
+            return
+        _, name, seq, sentAt = jmsg
+        if name != self.name:
+            self.room.stats.latencies.append(time.perf_counter() - sentAt)
+        elif seq == self.sent:
+            if self.sent < CHAT_MSGS:
+                self.sendChat()
+            else:
+                self.done = True
+
+class Game:
+    """What the bots of a kind of game host and how many play"""
+    def __init__(self, path, botClass, numPlayers, hostParams):
+        self.path = path
+        self.botClass = botClass
+        self.numPlayers = numPlayers
+        self.hostParams = hostParams
+
+Games = {
+    "dirty7": Game("dirty7", Dirty7Bot, DIRTY7_PLAYERS,
+                   [["basic"], DIRTY7_PLAYERS, 1, 0, 7, [None], 40, DIRTY7_STOP_POINTS,
+                    ["standard"]]),
+    "durak": Game("durak", DurakBot, DURAK_PLAYERS,
+                  [{"numPlayers": DURAK_PLAYERS, "stopPoints": DURAK_STOP_POINTS}]),
+    "taboo": Game("taboo", TabooBot, TABOO_PLAYERS,
+                  [{"numTeams": TABOO_TEAMS, "turnDurationSec": 30, "wordSets": ["test"],
+                    "numTurns": 1}]),
+    "chat": Game("chat", ChatBot, CHAT_PLAYERS, []),
+}
+
+# -------------------------------------
+# Server and lobby
+
+class ServerThread(threading.Thread):
+    """Runs server.main on its own event loop"""
+    def __init__(self, argv):
+        super(ServerThread, self).__init__(name="bari-server", daemon=True)
+        self.argv = argv
+        self.loop = None
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server.main("127.0.0.1", self.argv)
+
+    def stop(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join(SERVER_START_TIMEOUT_SEC)
+
+class Lobby:
+    """Hosts rooms one at a time from a lobby connection. The path of a
+    new room is learnt from the first GAME-STATUS about it"""
+    def __init__(self, baseUri):
+        self.baseUri = baseUri
+        self.ws = None
+        self.lock = asyncio.Lock()
+        self.knownPaths = set()
+        self.news = asyncio.Queue() # New paths and HOST-BAD messages
+
+    async def connect(self):
+        deadline = time.monotonic() + SERVER_START_TIMEOUT_SEC
+        while True:
+            try:
+                self.ws = await websockets.connect(self.baseUri + "/lobby", max_size=None)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+        asyncio.get_event_loop().create_task(self.reader())
+
+    async def reader(self):
+        async for frame in self.ws:
+            jmsg = json.loads(frame)
+            for msg in jmsg if jmsg and isinstance(jmsg[0], list) else [jmsg]:
+                if msg[0] == "GAME-STATUS" and msg[1] not in self.knownPaths:
+                    self.knownPaths.add(msg[1])
+                    self.news.put_nowait(msg[1])
+                elif msg[0] == "HOST-BAD":
+                    self.news.put_nowait(msg)
+
+    async def host(self, game):
+        async with self.lock:
+            await self.ws.send(json.dumps(["HOST", game.path] + game.hostParams))
+            while True:
+                news = await asyncio.wait_for(self.news.get(), SERVER_START_TIMEOUT_SEC)
+                if isinstance(news, list):
+                    raise RuntimeError("Failed to host {}: {}".format(game.path, news))
+                if news.startswith(game.path + ":"):
+                    return news
+
+    async def close(self):
+        await self.ws.close()
+
+# -------------------------------------
+# Running games
+
+async def playGame(args, lobby, kind, gameIdx, stats, sem):
+    game = Games[kind]
+    async with sem:
+        room = Room(await lobby.host(game), stats)
+        uri = "{}/{}{}".format(lobby.baseUri, room.path, "?batch=1" if args.batch else "")
+        rng = random.Random("{}:{}:{}".format(args.seed, kind, gameIdx))
+        bots = [game.botClass(room, idx, random.Random(rng.random()))
+                for idx in range(game.numPlayers)]
+        stats.games += 1
+        stats.bots += len(bots)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(bot.run(uri) for bot in bots)),
+                                   args.game_timeout)
+            stats.completed += 1
+        except asyncio.TimeoutError:
+            stats.timedOut += 1
+
+async def runGames(args, baseUri, statsByKind):
+    lobby = Lobby(baseUri)
+    await lobby.connect()
+    sem = asyncio.Semaphore(args.concurrency)
+    await asyncio.gather(*(playGame(args, lobby, kind, gameIdx, statsByKind[kind], sem)
+                           for kind in Games
+                           for gameIdx in range(getattr(args, kind))))
+    await lobby.close()
+
+def run(args):
+    random.seed(args.seed)
+    port = freePort()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        argv = ["--port", str(port),
+                "--d7-storage", os.path.join(tmpdir, "dirty7.sqlite3"),
+                "--trace-file", args.trace_file or os.devnull] + args.server_arg
+        serverThread = ServerThread(argv)
+        serverThread.start()
+
+        rssBefore = rssKb()
+        statsByKind = {kind: GameStats() for kind in Games}
+        start = time.perf_counter()
+        asyncio.run(runGames(args, "ws://127.0.0.1:{}".format(port), statsByKind))
+        wallSec = time.perf_counter() - start
+        rssAfter = rssKb()
+
+        serverThread.stop()
+
+    rxMsgs = sum(stats.rxMsgs for stats in statsByKind.values())
+    txMsgs = sum(stats.txMsgs for stats in statsByKind.values())
+    return {"commit": gitCommit(),
+            "options": vars(args),
+            "wallSec": wallSec,
+            "msgsPerSec": rxMsgs / wallSec,
+            "txMsgsPerSec": txMsgs / wallSec,
+            "latencyMs": latencyMs([lat for stats in statsByKind.values()
+                                    for lat in stats.latencies]),
+            "rssKb": {"before": rssBefore, "after": rssAfter, "max": maxRssKb()},
+            "games": {kind: stats.toJson() for kind, stats in statsByKind.items()
+                      if stats.games}}
+
+# -------------------------------------
+# Reporting
+
+def summary(results):
+    """Metrics compared between runs: {name: value}"""
+    metrics = {"msgsPerSec": results["msgsPerSec"],
+               "latencyMs.p50": results["latencyMs"]["p50"],
+               "latencyMs.p99": results["latencyMs"]["p99"],
+               "rssKb.max": results["rssKb"]["max"]}
+    for kind, stats in results["games"].items():
+        metrics[kind + ".bytesPerGame"] = stats["bytesPerGame"]
+        metrics[kind + ".latencyMs.p99"] = stats["latencyMs"]["p99"]
+        metrics[kind + ".timedOut"] = stats["timedOut"]
+    return metrics
+
+def report(results, baseline=None):
+    print("{} games in {:.1f}s by commit {}".format(
+        sum(stats["games"] for stats in results["games"].values()),
+        results["wallSec"], results["commit"]))
+    before = summary(baseline) if baseline else {}
+    for name, value in summary(results).items():
+        line = "{:28} {:>14}".format(name, "-" if value is None else "{:.2f}".format(value))
+        if before.get(name) and value is not None:
+            line += "  baseline {:14.2f}  {:+7.1%}".format(before[name],
+                                                          value / before[name] - 1)
+        print(line)
+
+def main():
+    parser = ArgumentParser(description="Play scripted games against an in-process server")
+    for kind, count in GAMES_DEFAULT.items():
+        parser.add_argument("--" + kind, metavar="GAMES", type=int, default=count,
+                            help="{} games to play (default={})".format(kind, count))
+    parser.add_argument("--concurrency", metavar="GAMES", type=int,
+                        default=CONCURRENCY_DEFAULT,
+                        help="Games played at a time (default={})".format(CONCURRENCY_DEFAULT))
+    parser.add_argument("--game-timeout", metavar="SEC", type=float,
+                        default=GAME_TIMEOUT_SEC_DEFAULT,
+                        help="Give up on a game after this long (default={})".format(
+                            GAME_TIMEOUT_SEC_DEFAULT))
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default=1)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Bots connect with ?batch=1")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="Extra server option (e.g. --server-arg=--workers=2)")
+    parser.add_argument("--trace-file", help="Server trace file (default: discarded)")
+    parser.add_argument("--out", metavar="JSON", help="Save the results here")
+    parser.add_argument("--baseline", metavar="JSON",
+                        help="Compare with the results of an earlier run")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baselineFile:
+            baseline = json.load(baselineFile)
+    report(results, baseline)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as out:
+            json.dump(results, out, indent=2)
+
+if __name__ == "__main__":
+    main()
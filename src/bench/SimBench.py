@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Play Dirty7 and Durak games headless (fwk/Simulation.py) across a
+process pool.
+
+Reports games per hour and, to check the balance of the rules, how
+often each seat (position in the first turn order) wins Dirty7 and
+loses Durak. Games that raised are reported by seed: replay one with
+Dirty7.Simulation.playGame(seed, ...) in a debugger.
+
+    cd src && python -m bench.SimBench
+    cd src && python -m bench.SimBench --dirty7-rule seq3+ --policy random --out sim.json
+"""
+
+from argparse import ArgumentParser
+import functools
+import json
+import time
+
+from fwk.Simulation import (
+        SIMULATION_TRACE_LEVELS,
+        runGames,
+)
+from fwk.Trace import setTraceLevels
+from Dirty7 import Simulation as Dirty7Simulation
+from Dirty7.Dirty7Round import RoundParameters as Dirty7Parameters
+from Durak import Simulation as DurakSimulation
+from Durak.RoundParameters import RoundParameters as DurakParameters
+
+GAMES_DEFAULT = 2000
+DIRTY7_PLAYERS_DEFAULT = 4
+DURAK_PLAYERS_DEFAULT = 3
+ERROR_SEEDS_REPORTED = 10
+
+POLICIES = ("greedy", "random", "mixed") # mixed: random and greedy players alternate
+
+def policies(module, policy, numPlayers):
+    if policy == "greedy":
+        return [module.greedyPolicy] * numPlayers
+    if policy == "random":
+        return [module.randomPolicy] * numPlayers
+    return [(module.randomPolicy, module.greedyPolicy)[idx % 2] for idx in range(numPlayers)]
+
+def seatShare(results, namesKey):
+    """Share of the games in which the player in each seat is named in
+    result[namesKey]"""
+    counts = [0] * len(results[0]["turnOrder"])
+    for result in results:
+        for seat, name in enumerate(result["turnOrder"]):
+            if name in (result[namesKey] or ()):
+                counts[seat] += 1
+    return [count / len(results) for count in counts]
+
+def summarize(results, wallSec, namesKey):
+    finished = [result for result in results if result["finished"]]
+    errorSeeds = [result["seed"] for result in results if result["error"]]
+    return {"games": len(results),
+            "finished": len(finished),
+            "errors": len(errorSeeds),
+            "errorSeeds": errorSeeds[:ERROR_SEEDS_REPORTED],
+            "wallSec": wallSec,
+            "gamesPerHour": len(results) / wallSec * 3600,
+            "roundsPerGame": sum(result["rounds"] for result in results) / len(results),
+            "movesPerGame": sum(result["moves"] for result in results) / len(results),
+            "badMoves": sum(result["badMoves"] for result in results),
+            namesKey + "BySeat": seatShare(finished, namesKey) if finished else None}
+
+def simulate(name, playGame, args, numGames, namesKey):
+    start = time.perf_counter()
+    results = runGames(playGame, range(args.seed, args.seed + numGames),
+                       processes=args.processes)
+    summary = summarize(results, time.perf_counter() - start, namesKey)
+    print("{}: {games} games ({finished} finished, {errors} errors) in {wallSec:.1f}s, "
+          "{gamesPerHour:,.0f} games/hour, {roundsPerGame:.1f} rounds/game, "
+          "{movesPerGame:.1f} moves/game, {badMoves} bad moves".format(name, **summary))
+    if summary[namesKey + "BySeat"]:
+        print("  {} by seat: {}".format(namesKey, " ".join(
+            "{:.1%}".format(share) for share in summary[namesKey + "BySeat"])))
+    if summary["errorSeeds"]:
+        print("  errors in seeds:", summary["errorSeeds"])
+    return summary
+
+def main():
+    parser = ArgumentParser(description="Play headless Dirty7 and Durak games")
+    parser.add_argument("--dirty7", metavar="GAMES", type=int, default=GAMES_DEFAULT,
+                        help="Dirty7 games to play (default={})".format(GAMES_DEFAULT))
+    parser.add_argument("--durak", metavar="GAMES", type=int, default=GAMES_DEFAULT,
+                        help="Durak games to play (default={})".format(GAMES_DEFAULT))
+    parser.add_argument("--dirty7-players", type=int, default=DIRTY7_PLAYERS_DEFAULT)
+    parser.add_argument("--dirty7-rule", action="append",
+                        help="Dirty7 rule to choose rounds from (default=basic)")
+    parser.add_argument("--dirty7-stop-points", type=int, default=100)
+    parser.add_argument("--durak-players", type=int, default=DURAK_PLAYERS_DEFAULT)
+    parser.add_argument("--durak-stop-points", type=int, default=2)
+    parser.add_argument("--policy", choices=POLICIES, default="greedy",
+                        help="How players choose moves (default=greedy)")
+    parser.add_argument("--processes", type=int,
+                        help="Worker processes (default: one per CPU; 1 plays in this process)")
+    parser.add_argument("--seed", type=int, default=0, help="First game's seed (default=0)")
+    parser.add_argument("--out", metavar="JSON", help="Save the summaries here")
+    args = parser.parse_args()
+    setTraceLevels(SIMULATION_TRACE_LEVELS)
+
+    summaries = {}
+    if args.dirty7:
+        hostParameters = Dirty7Parameters(args.dirty7_rule or ["basic"], args.dirty7_players,
+                                          1, 0, 7, [None], 40, args.dirty7_stop_points,
+                                          ["standard"])
+        playGame = functools.partial(Dirty7Simulation.playGame, hostParameters=hostParameters,
+                                     policies=policies(Dirty7Simulation, args.policy,
+                                                       args.dirty7_players))
+        summaries["dirty7"] = simulate("dirty7", playGame, args, args.dirty7, "winners")
+
+    if args.durak:
+        hostParameters = DurakParameters(args.durak_players, args.durak_stop_points)
+        playGame = functools.partial(DurakSimulation.playGame, hostParameters=hostParameters,
+                                     policies=policies(DurakSimulation, args.policy,
+                                                       args.durak_players))
+        summaries["durak"] = simulate("durak", playGame, args, args.durak, "losers")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as out:
+            json.dump({"options": vars(args), "summaries": summaries}, out, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Benchmark the per-call overhead of trace().
+
+Compares the previous implementation (inspect.getouterframes(),
+datetime formatting and a flush on every call) with fwk.Trace for an
+enabled level and a disabled level. Output goes to os.devnull.
+
+    cd src && python -m bench.TraceBench
+"""
+
+import datetime
+import inspect
+import os
+import timeit
+
+from fwk import Trace
+from fwk.Trace import Level
+
+CALLS = 20000
+
+def legacyTrace(traceout, lvl, *msg):
+    """fwk.Trace.trace before buffering"""
+    if lvl not in Trace.TRACE_LEVELS:
+        return
+
+    now = datetime.datetime.now()
+
+    currentframe = inspect.currentframe()
+    caller = inspect.getouterframes(currentframe, 2)[1]
+    framedesc = "%s:%s %s" % (os.path.split(caller.filename)[-1], caller.lineno, caller.function)
+    traceout.write("%-26s %-5s %-40s" % (now, Level.strep[lvl], framedesc))
+    for m in msg:
+        traceout.write(" " + str(m))
+    traceout.write("\n")
+
+    traceout.flush()
+
+def runLegacy(devnull, lvl):
+    for i in range(CALLS):
+        legacyTrace(devnull, lvl, "foo:1", "received", i)
+
+def runTrace(lvl):
+    for i in range(CALLS):
+        Trace.trace(lvl, "foo:1", "received", i)
+    Trace.flushTrace()
+
+def main():
+    with open(os.devnull, "w", encoding="ascii") as devnull:
+        Trace.traceout = devnull
+        for name, lvl in (("enabled", Level.msg), ("disabled", Level.debug)):
+            before = min(timeit.repeat(lambda: runLegacy(devnull, lvl), number=1, repeat=3)) # pylint: disable=cell-var-from-loop
+            after = min(timeit.repeat(lambda: runTrace(lvl), number=1, repeat=3)) # pylint: disable=cell-var-from-loop
+            print("{:9} legacy {:8.3f}us/call  buffered {:8.3f}us/call  speedup {:6.1f}x".format(
+                name, before * 1e6 / CALLS, after * 1e6 / CALLS, before / after))
+        Trace.setTraceFile(None)
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,6 @@
 WS_SERVER_PORT_DEFAULT = 4001
+CLIENT_TX_MAX_BATCH_DEFAULT = 32
+CLIENT_TX_FLUSH_DELAY_MS_DEFAULT = 0
+CLIENT_TX_QUEUE_MAX_DEFAULT = 1000
+CLIENT_TX_QUEUE_POLICY_DEFAULT = "disconnect"
+WORKERS_DEFAULT = 0
@@ -0,0 +1,316 @@
+"""Server side players (bots) for game rooms.
+
+A bot plays as a BotWs, a stand-in for a websocket. Its connect and the
+messages it sends (JOIN, moves) are put in the room's RX queue, so the
+room handles them, and fwk/EventLog.py logs them, the same way as a
+client's. Messages the room sends to a BotWs are dropped.
+
+A room with bots sets GamePlugin.bots to a Bots. After the room handles
+a message, each bot is asked for its view of the game:
+
+    viewFn(room, ws) -> view (picklable) or None (nothing to do)
+
+When a bot's view has changed, decideFn(view, timeBudgetSec, seed) is run
+in the bot executor, a pool of BOT_PROCESSES_DEFAULT processes (see
+setBotProcesses()), so the room's event loop is never blocked. Decisions
+are CPU bound: run in threads, they would hold the GIL against the
+event loop. The budget counts from when the decision was requested: a
+decision that waited in the pool gets what is left, down to 0. The
+client message it returns, if any, is put in the room's RX queue unless
+the bot's view changed while deciding. A decision must return within
+its budget. One still running BOT_DECISION_GRACE_SEC later is abandoned
+and decideFn(view, 0, seed), which must return right away, is run in
+the pool instead.
+
+A player that drops out of a running game (no websocket left) is taken
+over by a bot after BOT_TAKEOVER_DELAY_SEC (see takeoverIfDropped()).
+The bot leaves when the player joins again.
+
+Bots handle ["ADD-BOT"] for the room (see processAddBot()). A bot joins
+with the room's JOIN message for its player:
+
+    room.botJoinJmsg(name) -> jmsg
+"""
+
+import asyncio
+from concurrent.futures import (
+        ProcessPoolExecutor,
+        ThreadPoolExecutor,
+)
+import multiprocessing
+import random
+import time
+
+from fwk.Exceptions import InvalidDataException
+from fwk.Msg import (
+        ClientRxMsg,
+        ClientTxMsg,
+        InternalConnectWsToGi,
+        InternalDisconnectWsToGi,
+        TimerRequest,
+        constJmsg,
+)
+from fwk.Trace import (
+        Level,
+        trace,
+)
+
+BOT_TIME_BUDGET_SEC_DEFAULT = 1.0
+BOT_TIME_BUDGET_SEC_MAX = 10.0
+BOT_DECISION_GRACE_SEC = 0.5
+BOT_TAKEOVER_DELAY_SEC = 30
+BOT_PROCESSES_DEFAULT = 2
+BOT_THREADS_DEFAULT = 2
+
+ADD_BOT_BAD_STARTED = constJmsg("ADD-BOT-BAD", "Game has started already")
+ADD_BOT_BAD_DISABLED = constJmsg("ADD-BOT-BAD", "Bots are disabled in this game")
+ADD_BOT_BAD_LENGTH = constJmsg("ADD-BOT-BAD", "Invalid message length")
+ADD_BOT_BAD_FULL = constJmsg("ADD-BOT-BAD", "Enough players joined already")
+
+def timeBudgetSec(value):
+    """Validates the botTimeBudgetSec HOST parameter. 0 disables bots"""
+    if (not isinstance(value, (int, float)) or isinstance(value, bool) or
+            not 0 <= value <= BOT_TIME_BUDGET_SEC_MAX):
+        raise InvalidDataException("Invalid bot time budget. Must be between "
+                                   "0..{} seconds".format(BOT_TIME_BUDGET_SEC_MAX), value)
+    return value
+
+class BotWs(str):
+    """The websocket of a bot, named "bot:<player name>". Like
+    EventLog.ReplayWs, it is a str so a replayed room finds the bot's
+    player by the logged name.
+
+    wsId is None: a room in a worker process (fwk/Shard.py) sends it
+    nothing the front process can deliver"""
+    wsId = None
+
+    def __new__(cls, playerName):
+        return str.__new__(cls, "bot:" + playerName)
+
+# -------------------------------------
+# Executor
+
+BotExecutor = None
+
+def botExecutor():
+    if BotExecutor is None:
+        setBotProcesses(BOT_PROCESSES_DEFAULT)
+    return BotExecutor
+
+def setBotProcesses(numProcesses):
+    """Run decisions in a pool of numProcesses processes (0: in a pool
+    of BOT_THREADS_DEFAULT threads, which share the GIL with the event
+    loop)"""
+    global BotExecutor # pylint: disable=global-statement
+    if BotExecutor is not None:
+        BotExecutor.shutdown(wait=False)
+    if numProcesses:
+        BotExecutor = ProcessPoolExecutor(numProcesses,
+                                          mp_context=multiprocessing.get_context("spawn"))
+    else:
+        BotExecutor = ThreadPoolExecutor(BOT_THREADS_DEFAULT, thread_name_prefix="bot")
+
+def runDecision(decideFn, view, deadline, seed):
+    """decideFn(view, the time left until deadline (time.time()), seed),
+    in the executor"""
+    return decideFn(view, max(0, deadline - time.time()), seed)
+
+# -------------------------------------
+# Bots of a room
+
+class Decision:
+    """A decision running in the executor"""
+    def __init__(self, view, seed, future, timer):
+        self.view = view
+        self.seed = seed
+        self.future = future
+        self.timer = timer
+
+class Bots:
+    """The bots playing in a room"""
+    def __init__(self, room, viewFn, decideFn, budgetSec):
+        self.room = room
+        self.viewFn = viewFn
+        self.decideFn = decideFn
+        self.timeBudgetSec = budgetSec
+        self.wsByName = {}
+        self.lastViewByName = {} # View the last decision was made for
+        self.decisionByName = {}
+        self.takeoverTimerByName = {}
+
+    def __getstate__(self):
+        # Pickled with the room (e.g. to a worker process): running
+        # decisions and timers stay behind
+        state = dict(self.__dict__)
+        state["decisionByName"] = {}
+        state["takeoverTimerByName"] = {}
+        return state
+
+    def enabled(self):
+        return self.timeBudgetSec > 0
+
+    def joining(self):
+        """Bots added that haven't joined yet"""
+        return [name for name, ws in self.wsByName.items()
+                if not self.room.playerByWs.get(ws)]
+
+    def add(self, name, joinJmsg):
+        """Connect a bot that sends joinJmsg (the room's JOIN message)
+        to play as player name"""
+        assert name not in self.wsByName
+        ws = BotWs(name)
+        self.wsByName[name] = ws
+        trace(Level.game, self.room.path, "adding bot", ws)
+        self.room.rxQueue.put_nowait(InternalConnectWsToGi(ws))
+        self.room.rxQueue.put_nowait(ClientRxMsg(joinJmsg, initiatorWs=ws))
+
+    def processAddBot(self, qmsg, waiting, numPlayers):
+        """
+        ["ADD-BOT"]
+        A bot joins as a new player of a room that is waiting for
+        numPlayers players
+        """
+        ws = qmsg.initiatorWs
+        txQueue = self.room.txQueue
+
+        if not waiting:
+            txQueue.put_nowait(ClientTxMsg(ADD_BOT_BAD_STARTED, {ws}, initiatorWs=ws))
+            return True
+
+        if not self.enabled():
+            txQueue.put_nowait(ClientTxMsg(ADD_BOT_BAD_DISABLED, {ws}, initiatorWs=ws))
+            return True
+
+        if len(qmsg.jmsg) != 1:
+            txQueue.put_nowait(ClientTxMsg(ADD_BOT_BAD_LENGTH, {ws}, initiatorWs=ws))
+            return True
+
+        playerByName = self.room.playerByName
+        if len(playerByName) + len(self.joining()) >= numPlayers:
+            txQueue.put_nowait(ClientTxMsg(ADD_BOT_BAD_FULL, {ws}, initiatorWs=ws))
+            return True
+
+        name = next("bot{}".format(idx) for idx in range(1, numPlayers + 1)
+                    if "bot{}".format(idx) not in playerByName and
+                    "bot{}".format(idx) not in self.wsByName)
+        self.add(name, self.room.botJoinJmsg(name))
+        txQueue.put_nowait(ClientTxMsg(["ADD-BOT-OKAY", name], {ws}, initiatorWs=ws))
+        return True
+
+    def remove(self, name):
+        """Disconnect the bot playing as name (e.g. the player is back)"""
+        ws = self.wsByName.pop(name, None)
+        if ws is None:
+            return
+        trace(Level.game, self.room.path, "removing bot", ws)
+        self.lastViewByName.pop(name, None)
+        decision = self.decisionByName.pop(name, None)
+        if decision:
+            decision.future.cancel()
+            decision.timer.cancel()
+        self.room.rxQueue.put_nowait(InternalDisconnectWsToGi(ws))
+
+    def isBot(self, ws):
+        return isinstance(ws, BotWs) or ws in self.wsByName.values()
+
+    def close(self):
+        """Stop deciding and taking over (the room is being collected)"""
+        for decision in self.decisionByName.values():
+            decision.future.cancel()
+            decision.timer.cancel()
+        self.decisionByName = {}
+        for name in list(self.takeoverTimerByName):
+            self.cancelTakeover(name)
+
+    # ---------------------------------
+    # Taking over players that dropped
+
+    def takeover(self, name, joinJmsg):
+        """Player name has no websocket left: have a bot join as the
+        player (with joinJmsg) unless someone joins within
+        BOT_TAKEOVER_DELAY_SEC"""
+        if not self.enabled() or name in self.wsByName or name in self.takeoverTimerByName:
+            return
+        timer = TimerRequest(BOT_TAKEOVER_DELAY_SEC, self.takeoverCb, (name, joinJmsg))
+        self.takeoverTimerByName[name] = timer
+        self.room.txQueue.put_nowait(timer)
+
+    def takeoverIfDropped(self, name, numConns, running):
+        """A bot takes over player name of a running game when the
+        player has no websocket left (numConns is 0)"""
+        if numConns or not running:
+            return
+        self.takeover(name, self.room.botJoinJmsg(name))
+
+    def cancelTakeover(self, name):
+        timer = self.takeoverTimerByName.pop(name, None)
+        if timer:
+            timer.cancel()
+
+    def takeoverCb(self, ctx):
+        name, joinJmsg = ctx
+        if self.takeoverTimerByName.pop(name, None) and name not in self.wsByName:
+            self.add(name, joinJmsg)
+
+    # ---------------------------------
+    # Decisions
+
+    def poll(self):
+        """Start a decision for each bot whose view changed"""
+        for name, ws in list(self.wsByName.items()):
+            if name in self.decisionByName:
+                continue
+            view = self.viewFn(self.room, ws)
+            if view is None:
+                # Nothing to do: the next view is new even if it's the same
+                self.lastViewByName.pop(name, None)
+                continue
+            if view == self.lastViewByName.get(name):
+                continue
+            self.lastViewByName[name] = view
+            self.decide(name, view)
+
+    def decide(self, name, view, budgetSec=None, seed=None):
+        """Start deciding the move of bot name for view within budgetSec
+        (default: the room's time budget)"""
+        budgetSec = self.timeBudgetSec if budgetSec is None else budgetSec
+        seed = random.getrandbits(32) if seed is None else seed
+        future = asyncio.get_running_loop().run_in_executor(
+            botExecutor(), runDecision, self.decideFn, view, time.time() + budgetSec, seed)
+        timer = TimerRequest(budgetSec + BOT_DECISION_GRACE_SEC, self.decisionTimeoutCb, name)
+        self.decisionByName[name] = Decision(view, seed, future, timer)
+        self.room.txQueue.put_nowait(timer)
+        future.add_done_callback(lambda _: self.decided(name, future))
+
+    def decided(self, name, future):
+        decision = self.decisionByName.get(name)
+        if decision is None or decision.future is not future:
+            return # Abandoned
+        del self.decisionByName[name]
+        decision.timer.cancel()
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            trace(Level.error, self.room.path, "bot", name, "decision failed:",
+                  repr(future.exception()))
+            return
+        self.play(name, decision.view, future.result())
+
+    def decisionTimeoutCb(self, name):
+        decision = self.decisionByName.pop(name, None)
+        if decision is None:
+            return
+        trace(Level.warn, self.room.path, "bot", name, "decision timed out")
+        decision.future.cancel()
+        # Not run here: it would block the event loop
+        self.decide(name, decision.view, budgetSec=0, seed=decision.seed)
+
+    def play(self, name, view, jmsg):
+        """Send the move decided for view, unless the game has moved on
+        while deciding, and poll for what changed meanwhile"""
+        ws = self.wsByName.get(name)
+        if ws is None:
+            return
+        if jmsg is not None and self.viewFn(self.room, ws) == view:
+            self.room.rxQueue.put_nowait(ClientRxMsg(jmsg, initiatorWs=ws))
+        self.poll()
@@ -6,4 +6,12 @@ class Map(dict):
     """A dictionary that allows access to attributes with
     the dot notation"""
     def __getattr__(self, key):
-        return self[key]
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+def exitOnSignal(signum, _frame):
+    """Signal handler (e.g. for SIGTERM) exiting like sys.exit() so that
+    finally clauses and atexit functions run"""
+    raise SystemExit(128 + signum)
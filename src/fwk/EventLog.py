@@ -0,0 +1,294 @@
+"""Append-only log of what happens in each game room.
+
+When enabled (setEventLogDir), every room registered with the main loop
+writes <dir>/<path>.jsonl. Each line is a JSON list starting with a
+sequence number and a record type:
+
+    [seq, "G", <base64 pickle>]     genesis: the room as it was created
+    [seq, "S", <snapshot>]          Plugin.snapshot() of the room
+    [seq, "C", ws]                  a client connected
+    [seq, "D", ws]                  a client disconnected
+    [seq, "M", ws, seed, jmsg]      a client message handled by the room
+    [seq, "E", event]               a game event (Plugin.logEvent), for analysis
+
+Logged rooms run each handler with their random number generator
+(Plugin.rng) seeded with the record's seed, drawn from the OS: replaying
+the records reproduces the room (replay()).
+Changes made outside of message handlers (e.g. timer callbacks) are not
+logged.
+
+Every snapshotEvery records, rooms that support it (Plugin.snapshot)
+are snapshotted and their log is compacted: rewritten as the genesis,
+the snapshot and then the records that follow. Replay starts from the
+snapshot.
+
+Records are encoded when they are logged and written out in batches by
+a background thread, so logging never waits on the disk.
+"""
+
+import atexit
+import base64
+from collections import deque
+import io
+import json
+import os
+import pickle
+import random
+import threading
+
+from fwk.Msg import (
+        ClientRxMsg,
+        InternalConnectWsToGi,
+        InternalDisconnectWsToGi,
+)
+from fwk.Trace import (
+        Level,
+        trace,
+)
+
+EVENT_LOG_FLUSH_INTERVAL_SEC = 0.5
+EVENT_LOG_SNAPSHOT_EVERY_DEFAULT = 1000
+# Bits of the seed of each message. Enough that a deal can't be found
+# by trying every seed
+EVENT_LOG_SEED_BITS = 128
+
+def encode(record):
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+# -------------------------------------
+# Genesis pickles
+
+class GenesisPickler(pickle.Pickler):
+    """Leaves out objects marked notLogged (e.g. storage handles) so that
+    replaying a room doesn't write to the live database"""
+    def persistent_id(self, obj):
+        if getattr(obj, "notLogged", False):
+            return "notLogged"
+        return None
+
+class GenesisUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        return None
+
+def genesisDumps(gi):
+    data = io.BytesIO()
+    GenesisPickler(data, protocol=pickle.HIGHEST_PROTOCOL).dump(gi)
+    return base64.b64encode(data.getvalue()).decode("ascii")
+
+def genesisLoads(text):
+    return GenesisUnpickler(io.BytesIO(base64.b64decode(text))).load()
+
+# -------------------------------------
+# Buffered writer
+
+class EventLogWriter:
+    """Appends encoded records to log files from a background thread.
+    A write is either ("a", filename, line) to append a record or
+    ("w", filename, lines) to rewrite a log"""
+    def __init__(self):
+        self.writes = deque()
+        self.lock = threading.Lock() # Serializes writes to the files
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.thread = None
+
+    def start(self):
+        """Start the writer thread (again, after a fork)"""
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name="EventLogWriter", daemon=True)
+        self.thread.start()
+
+    def put(self, write):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.start()
+        self.writes.append(write)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(EVENT_LOG_FLUSH_INTERVAL_SEC)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write out all buffered records. Consecutive appends to a file
+        are written with one write"""
+        with self.lock:
+            while self.writes:
+                mode, filename, data = self.writes.popleft()
+                if mode == "a":
+                    data = [data]
+                    while (self.writes and self.writes[0][0] == "a" and
+                           self.writes[0][1] == filename):
+                        data.append(self.writes.popleft()[2])
+                try:
+                    self.write(mode, filename, data)
+                except OSError as exc:
+                    trace(Level.error, "Failed to write", filename, exc)
+
+    @staticmethod
+    def write(mode, filename, lines):
+        if mode == "a":
+            with open(filename, "a", encoding="utf-8") as out:
+                out.write("".join(lines))
+            return
+
+        tmpFilename = filename + ".tmp"
+        with open(tmpFilename, "w", encoding="utf-8") as out:
+            out.write("".join(lines))
+        os.replace(tmpFilename, filename)
+
+Writer = EventLogWriter()
+
+# -------------------------------------
+# Per room log
+
+class RoomLog:
+    """The log of one room"""
+    def __init__(self, filename, gi, snapshotEvery):
+        self.filename = filename
+        self.snapshotEvery = snapshotEvery
+        self.seq = 0
+        self.sinceSnapshot = 0
+        self.seeds = random.SystemRandom()
+        self.events = None # Events logged by the handler running
+
+        self.genesis = self.encoded("G", genesisDumps(gi))
+        Writer.put(("w", self.filename, [self.genesis]))
+
+    def encoded(self, *record):
+        self.seq += 1
+        return encode([self.seq] + list(record))
+
+    def append(self, *record):
+        Writer.put(("a", self.filename, self.encoded(*record)))
+        self.sinceSnapshot += 1
+
+    def event(self, event):
+        if self.events is None:
+            self.append("E", event)
+        else:
+            # Logged after the message that caused it
+            self.events.append(event)
+
+    def handle(self, plugin, handler, qmsg):
+        """Run handler(qmsg) for plugin and log qmsg if it was handled"""
+        seed = self.seeds.getrandbits(EVENT_LOG_SEED_BITS)
+        plugin.rng.seed(seed)
+        self.events = []
+        try:
+            result = handler(qmsg)
+        finally:
+            events, self.events = self.events, None
+
+        if result:
+            if isinstance(qmsg, ClientRxMsg):
+                self.append("M", str(qmsg.initiatorWs), seed, qmsg.jmsg)
+            elif isinstance(qmsg, InternalConnectWsToGi):
+                self.append("C", str(qmsg.ws))
+            elif isinstance(qmsg, InternalDisconnectWsToGi):
+                self.append("D", str(qmsg.ws))
+        for event in events:
+            self.append("E", event)
+
+        if self.sinceSnapshot >= self.snapshotEvery:
+            self.compact(plugin)
+        return result
+
+    def compact(self, plugin):
+        """Snapshot plugin and rewrite the log from the snapshot"""
+        self.sinceSnapshot = 0
+        snapshot = plugin.snapshot()
+        if snapshot is None:
+            return
+        Writer.put(("w", self.filename, [self.genesis, self.encoded("S", snapshot)]))
+
+# -------------------------------------
+# Configuration
+
+EventLogDir = None
+EventLogSnapshotEvery = EVENT_LOG_SNAPSHOT_EVERY_DEFAULT
+
+def setEventLogDir(directory, snapshotEvery=EVENT_LOG_SNAPSHOT_EVERY_DEFAULT):
+    """Log the rooms registered from now on in directory (None to stop)"""
+    global EventLogDir, EventLogSnapshotEvery # pylint: disable=global-statement
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    EventLogDir = directory
+    EventLogSnapshotEvery = snapshotEvery
+
+def logFilename(directory, path):
+    return os.path.join(directory, path.replace(":", "_") + ".jsonl")
+
+def attach(gi):
+    """Start logging a room that is being registered. Must be called
+    before its queues are set up: the genesis is the room as created"""
+    if EventLogDir is None or not gi.logged:
+        return
+    gi.eventLog = RoomLog(logFilename(EventLogDir, gi.path), gi, EventLogSnapshotEvery)
+    trace(Level.info, "Logging", gi.path, "to", gi.eventLog.filename)
+
+def flushEventLog():
+    """Write out buffered records"""
+    Writer.flush()
+
+atexit.register(flushEventLog)
+
+# -------------------------------------
+# Reading and replaying logs
+
+class NullRxQueue:
+    """Stands in for the RX queue of a replayed room. Drops the messages
+    the room queues to itself (e.g. bots joining): they were logged
+    when handled and are replayed from the log"""
+    def put_nowait(self, qmsg):
+        pass
+
+class NullTxQueue:
+    """Drops everything a room being replayed sends"""
+    def put_nowait(self, qmsg):
+        pass
+
+class ReplayWs(str):
+    """A websocket of a replayed room, named as it was logged"""
+
+def readLog(filename):
+    """Returns (genesis room, snapshot or None, records after the snapshot)"""
+    flushEventLog()
+    genesis = None
+    snapshot = None
+    records = []
+    with open(filename, encoding="utf-8") as logFile:
+        for line in logFile:
+            record = json.loads(line)
+            if record[1] == "G":
+                genesis = genesisLoads(record[2])
+            elif record[1] == "S":
+                snapshot = record[2]
+                records = []
+            else:
+                records.append(record)
+    return genesis, snapshot, records
+
+def replay(filename, upto=None):
+    """Rebuild a room from its log, without websockets or the main loop:
+    restore the last snapshot and replay the records after it (up to and
+    including sequence number upto). Messages sent by the room are dropped.
+    Returns the room"""
+    gi, snapshot, records = readLog(filename)
+    gi.setRxTxQueues(NullRxQueue(), NullTxQueue())
+    if snapshot is not None:
+        gi.restoreSnapshot(snapshot, ReplayWs)
+
+    for record in records:
+        if upto is not None and record[0] > upto:
+            break
+        if record[1] == "C":
+            gi.processMsg(InternalConnectWsToGi(ReplayWs(record[2])))
+        elif record[1] == "D":
+            gi.processMsg(InternalDisconnectWsToGi(ReplayWs(record[2])))
+        elif record[1] == "M":
+            gi.rng.seed(record[3])
+            gi.processMsg(ClientRxMsg(record[4], initiatorWs=ReplayWs(record[2])))
+    return gi
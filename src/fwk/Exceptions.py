@@ -6,3 +6,13 @@ class InvalidDataException(Exception):
 
     def toJmsg(self):
         return [self.explanation, str(self.data)]
+
+class SchemaError(Exception):
+    """A client message doesn't match its schema. reply is what follows
+    the "<MTYPE>-BAD" message type in the reply to the client"""
+    def __init__(self, *reply):
+        Exception.__init__(self, *reply)
+        self.reply = list(reply)
+
+    def toJmsg(self):
+        return self.reply
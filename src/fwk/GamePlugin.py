@@ -3,11 +3,31 @@ The Plugin is used as the base for:
 1. the main lobby
 2. the GameLobbyPlugin (defined here), base for a Game Lobby
 3. the GamePlugin (defined here), base for a Game
+
+Messages are dispatched to handlers registered with @handles: by the
+message type (jmsg[0]) for client messages and by class for internal
+messages. Handlers are inherited and can be overridden by name.
+
+    class Room(GamePlugin):
+        @handles("JOIN")
+        def processJoin(self, qmsg):
+            ...
+            return True
+
+Rooms registered while fwk.EventLog is enabled log the messages they
+handle (see fwk/EventLog.py). Rooms that can be snapshotted implement
+snapshot() and restoreSnapshot(). Game rooms can have server side
+players (see fwk/Bot.py). Game rooms nobody is connected to are
+collected (see fwk/RoomGc.py).
 """
 
+import random
 import sys
+import time
 import traceback
 
+from fwk import Metrics
+from fwk.Bot import BotWs
 from fwk.MsgSrc import (
         Connections,
         Jmai,
@@ -15,6 +35,7 @@ from fwk.MsgSrc import (
 from fwk.Msg import (
         InternalConnectWsToGi,
         InternalDisconnectWsToGi,
+        InternalGiClosed,
         InternalHost,
         ClientRxMsg,
         ClientTxMsg,
@@ -25,10 +46,35 @@ from fwk.Trace import (
 )
 
 
+def handles(*keys):
+    """Register a Plugin method as the handler for client messages of
+    the given types (str) and internal messages of the given classes"""
+    def decorate(func):
+        func.handlesKeys = keys
+        return func
+    return decorate
+
+def buildHandlerTable(cls):
+    """Handler method name by message type or class for cls, including
+    handlers registered in base classes"""
+    handlerByKey = {}
+    for klass in reversed(cls.__mro__):
+        for name, attr in vars(klass).items():
+            for key in getattr(attr, "handlesKeys", ()):
+                handlerByKey[key] = name
+    return handlerByKey
+
 class Plugin:
     """
     Base game instance that is registered with the main loop by the name "path".
     """
+    handlerByKey = {}
+    logged = False # Whether fwk.EventLog logs instances when enabled
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.handlerByKey = buildHandlerTable(cls)
+
     def __init__(self, path, name, storage=None):
         """
         Arguments
@@ -48,6 +94,10 @@ class Plugin:
         self.rxQueue = None
         self.txQueue = None
         self.conns = None
+        self.eventLog = None # EventLog.RoomLog when logged
+        # Randomness of the plugin's handlers (deals, turn orders...),
+        # seeded from the OS and reseeded by the event log when logged
+        self.rng = random.Random()
 
     # ---------------------------------
     # Startup related
@@ -81,6 +131,11 @@ class Plugin:
     def postProcessConnect(self, ws):
         """Additional logic to run after a ws connects"""
 
+    @handles(InternalConnectWsToGi)
+    def processConnectMsg(self, qmsg):
+        self.processConnect(qmsg.ws)
+        return True
+
     def processConnect(self, ws):
         """Add client websocket as a member in this game instance"""
         self.conns.addConn(ws)
@@ -89,11 +144,63 @@ class Plugin:
     def postProcessDisconnect(self, ws):
         """Additional logic to run after a ws disconnects"""
 
+    @handles(InternalDisconnectWsToGi)
+    def processDisconnectMsg(self, qmsg):
+        self.processDisconnect(qmsg.ws)
+        return True
+
     def processDisconnect(self, ws):
         """Remove client websocket as a member in this game instance"""
         self.conns.delConn(ws)
         self.postProcessDisconnect(ws)
 
+    def dispatch(self, key, qmsg):
+        """Invoke the handler registered for key. Returns False if there
+        is none"""
+        name = self.handlerByKey.get(key)
+        if name is None:
+            return False
+        self.handlerHook(name, qmsg)
+        return getattr(self, name)(qmsg)
+
+    def handlerHook(self, name, qmsg): # pylint: disable=unused-argument
+        """Called before handler name processes qmsg"""
+        Metrics.HandledMessages.inc((self.path, name))
+
+    @handles(ClientRxMsg)
+    def processClientMsg(self, qmsg):
+        """Dispatch a client message by its message type"""
+        mtype = qmsg.jmsg[0]
+        if not isinstance(mtype, str):
+            return False
+        return self.dispatch(mtype, qmsg)
+
+    # ---------------------------------
+    # Event log
+
+    def snapshot(self):
+        """JSON serializable state of the plugin from which restoreSnapshot()
+        can rebuild it, or None if not supported"""
+        return None
+
+    def restoreSnapshot(self, snapshot, makeWs=None):
+        """Rebuild the plugin (whose queues are set up) from snapshot().
+        Clients connected when the snapshot was taken are reconnected as
+        makeWs(name) unless makeWs is None. Plugins whose snapshot() is
+        None have nothing to restore from"""
+        raise TypeError("{} doesn't support snapshots".format(type(self).__name__))
+
+    def logEvent(self, event):
+        """Add event (JSON serializable) to the event log, if any"""
+        if self.eventLog:
+            self.eventLog.event(event)
+
+    def handleMsg(self, qmsg):
+        """processMsg(qmsg), logged in the event log if there is one"""
+        if self.eventLog:
+            return self.eventLog.handle(self, self.processMsg, qmsg)
+        return self.processMsg(qmsg)
+
     def processMsg(self, qmsg):
         """Act to on the received msg.
 
@@ -101,15 +208,7 @@ class Plugin:
             True => msg was handled
             False => msg was handled
         """
-        if isinstance(qmsg, InternalConnectWsToGi):
-            self.processConnect(qmsg.ws)
-            return True
-
-        if isinstance(qmsg, InternalDisconnectWsToGi):
-            self.processDisconnect(qmsg.ws)
-            return True
-
-        return False
+        return self.dispatch(qmsg.__class__, qmsg)
 
     async def worker(self):
         """The worker task for a plugin. All messages should be processed.
@@ -118,13 +217,16 @@ class Plugin:
         while True:
             qmsg = await self.rxQueue.get()
             self.rxQueue.task_done()
-            trace(Level.msg, self.path, "received", str(qmsg))
+            trace(Level.msg, self.path, "received", qmsg)
 
+            start = time.perf_counter()
             try:
-                processed = self.processMsg(qmsg)
+                processed = self.handleMsg(qmsg)
             except Exception as _: # pylint: disable=broad-exception-caught
                 traceback.print_exc()
                 sys.exit(0)
+            Metrics.ProcessMsgSeconds.observe((self.path, Metrics.mtypeLabel(qmsg)),
+                                              time.perf_counter() - start)
 
             if not processed:
                 if not isinstance(qmsg, ClientRxMsg):
@@ -134,24 +236,38 @@ class Plugin:
                                                     initiatorWs=qmsg.initiatorWs))
 
 
+Plugin.handlerByKey = buildHandlerTable(Plugin)
+
+
 class GameLobbyPlugin(Plugin):
     """Base class for a Game Lobby that allows hosting games"""
+    # Paths of the game instances hosted, by game index. Not the instances:
+    # with worker processes they run elsewhere
+    rooms = {}
+
+    @handles(InternalHost)
     def processHost(self, qmsg):
         """A MTYPE_HOST message should be handled here"""
         raise NotImplementedError
 
-    def processMsg(self, qmsg):
-        if super(GameLobbyPlugin, self).processMsg(qmsg):
-            return True
-
-        if isinstance(qmsg, InternalHost):
-            return self.processHost(qmsg)
-
-        return False
+    @handles(InternalGiClosed)
+    def processGiClosed(self, qmsg):
+        """Forget a game instance that was collected"""
+        for idx in [idx for idx, path in self.rooms.items() if path == qmsg.fromPath]:
+            del self.rooms[idx]
+        return True
 
 
 class GamePlugin(Plugin):
     """Base class for a Game Instance"""
+    logged = True
+    bots = None # fwk.Bot.Bots of a room with server side players
+
+    def handleMsg(self, qmsg):
+        result = super(GamePlugin, self).handleMsg(qmsg)
+        if self.bots is not None and self.bots.wsByName:
+            self.bots.poll()
+        return result
 
     def postQueueSetup(self):
         self.publishGiStatus()
@@ -159,3 +275,20 @@ class GamePlugin(Plugin):
     def publishGiStatus(self):
         """Publish this game instance's status to the lobby"""
         raise NotImplementedError
+
+    # ---------------------------------
+    # Collection (fwk/RoomGc.py)
+
+    def isGameOver(self):
+        """Whether the game is over (the room is collected sooner)"""
+        return False
+
+    def clientCount(self):
+        """Websockets connected, not counting bots"""
+        return sum(1 for ws in self.conns.wss() if not isinstance(ws, BotWs))
+
+    def close(self):
+        """Release what the room holds outside itself (timers, shared
+        state) before it is collected"""
+        if self.bots is not None:
+            self.bots.close()
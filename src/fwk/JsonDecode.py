@@ -0,0 +1,27 @@
+"""Decoding of JSON messages received from clients.
+
+orjson is used when it is installed (pip install orjson), the json
+module otherwise. Both raise a ValueError (DecodeError) on bad input.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DecodeError = ValueError
+
+Decoders = {"json": json.loads}
+if orjson is not None:
+    Decoders["orjson"] = orjson.loads
+
+DECODER_DEFAULT = "orjson" if "orjson" in Decoders else "json"
+
+loads = Decoders[DECODER_DEFAULT]
+
+def setDecoder(name):
+    """Use the decoder name (a key of Decoders)"""
+    global loads # pylint: disable=global-statement
+    loads = Decoders[name]
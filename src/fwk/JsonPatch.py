@@ -0,0 +1,83 @@
+"""Minimal JSON patch (RFC 6902) support for MsgSrc deltas.
+
+Only "add", "remove" and "replace" operations are generated. Documents
+are expected to be plain JSON values (as returned by json.loads): dict
+keys are strings and sequences are lists.
+
+    ops = diff(old, new)
+    assert apply(old, ops) == new
+"""
+
+import copy
+
+def escape(token):
+    """Escape a JSON pointer reference token"""
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+def unescape(token):
+    """Unescape a JSON pointer reference token"""
+    return token.replace("~1", "/").replace("~0", "~")
+
+def diff(old, new, path="", ops=None):
+    """Returns the list of operations that transform old into new"""
+    if ops is None:
+        ops = []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": path + "/" + escape(key)})
+        for key, value in new.items():
+            if key in old:
+                diff(old[key], value, path + "/" + escape(key), ops)
+            else:
+                ops.append({"op": "add", "path": path + "/" + escape(key), "value": value})
+
+    elif isinstance(old, list) and isinstance(new, list):
+        common = min(len(old), len(new))
+        for idx in range(common):
+            diff(old[idx], new[idx], path + "/" + str(idx), ops)
+        for idx in range(len(old) - 1, common - 1, -1):
+            ops.append({"op": "remove", "path": path + "/" + str(idx)})
+        for value in new[common:]:
+            ops.append({"op": "add", "path": path + "/-", "value": value})
+
+    elif type(old) is not type(new) or old != new: # pylint: disable=unidiomatic-typecheck
+        ops.append({"op": "replace", "path": path, "value": new})
+
+    return ops
+
+def apply(doc, ops):
+    """Returns a copy of doc with the operations applied"""
+    doc = copy.deepcopy(doc)
+    for op in ops:
+        tokens = [unescape(token) for token in op["path"].split("/")[1:]]
+        value = copy.deepcopy(op.get("value"))
+
+        if not tokens:
+            assert op["op"] == "replace", "Bad root operation {}".format(op)
+            doc = value
+            continue
+
+        parent = doc
+        for token in tokens[:-1]:
+            parent = parent[int(token) if isinstance(parent, list) else token]
+
+        last = tokens[-1]
+        if isinstance(parent, list):
+            if op["op"] == "add":
+                if last == "-":
+                    parent.append(value)
+                else:
+                    parent.insert(int(last), value)
+            elif op["op"] == "remove":
+                del parent[int(last)]
+            else:
+                parent[int(last)] = value
+        else:
+            if op["op"] == "remove":
+                del parent[last]
+            else:
+                parent[last] = value
+
+    return doc
@@ -5,17 +5,23 @@ The plugin here is responsible for:
    to the correct game lobby
 2. Tracking GAME-STATUS for each game instance
 3. Broadcasts/relays GAME-STATUS for each game instance to lobby connections
+4. Broadcasts GAME-CLOSED when a game instance is collected (fwk/RoomGc.py)
 """
 
 from collections import OrderedDict
 
-from fwk.GamePlugin import Plugin
+from fwk.GamePlugin import (
+        Plugin,
+        handles,
+)
 from fwk.Msg import (
         ClientTxMsg,
         InternalHost,
+        InternalGiClosed,
         InternalGiStatus,
 )
 from fwk.MsgType import (
+        MTYPE_GAME_CLOSED,
         MTYPE_GAME_STATUS,
         MTYPE_HOST,
 )
@@ -33,10 +39,14 @@ class LobbyPlugin(Plugin):
         b. Any change in giStatusByPath is broadcast to all websockets
     3. InternalConnectWsToGi
         a. Flush all MTYPE_GAME_STATUS to the new connection
+    4. InternalGiClosed
+        a. Drops the game instance from giStatusByPath and broadcasts
+           MTYPE_GAME_CLOSED
 
     Emits:
     1. InternalHost
     2. [ MTYPE_GAME_STATUS, "<path to game instance>", (optional) details ]
+    3. [ MTYPE_GAME_CLOSED, "<path to game instance>" ]
     """
     def __init__(self, path, name):
         super(LobbyPlugin, self).__init__(path, name)
@@ -63,6 +73,18 @@ class LobbyPlugin(Plugin):
         for path in self.giStatusByPath:
             self.sendGameStatusToOne(path, ws)
 
+    @handles(InternalGiStatus)
+    def processGiStatus(self, qmsg):
+        self.updateGameStatus(qmsg.fromPath, qmsg.jmsg)
+        return True
+
+    @handles(InternalGiClosed)
+    def processGiClosed(self, qmsg):
+        if self.giStatusByPath.pop(qmsg.fromPath, None) is not None:
+            self.broadcast([MTYPE_GAME_CLOSED, qmsg.fromPath])
+        return True
+
+    @handles(MTYPE_HOST)
     def processHost(self, hostMsg):
         """Process the MTYPE_HOST message.
         hostMsg=[ MTYPE_HOST, <path>, <details> ]
@@ -72,18 +94,5 @@ class LobbyPlugin(Plugin):
                                              initiatorWs=hostMsg.initiatorWs))
         return True
 
-    def processMsg(self, qmsg):
-        if super(LobbyPlugin, self).processMsg(qmsg):
-            return True
-
-        if isinstance(qmsg, InternalGiStatus):
-            self.updateGameStatus(qmsg.fromPath, qmsg.jmsg)
-            return True
-
-        if qmsg.jmsg[0] == MTYPE_HOST:
-            return self.processHost(qmsg)
-
-        return False
-
 def plugin(): # pylint: disable=missing-function-docstring
     return LobbyPlugin(LOBBY_PATH, "Main lobby")
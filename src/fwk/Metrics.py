@@ -0,0 +1,235 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Counters and histograms are updated where things happen. Gauges
+(queue depths, connection counts, ...) are computed by a function
+when metrics are rendered.
+
+With --metrics-port PORT, the server serves render() at
+http://127.0.0.1:PORT/metrics on a listener of its own: metrics name
+every room and aren't meant for clients of the websocket port.
+"""
+
+import asyncio
+import bisect
+from http import HTTPStatus
+import re
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_PATH = "/metrics"
+METRICS_HOST = "127.0.0.1"
+
+def escapeLabelValue(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def formatLabels(labelNames, labelValues, extra=()):
+    pairs = list(zip(labelNames, labelValues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, escapeLabelValue(value))
+                          for name, value in pairs) + "}"
+
+def byLabels(items):
+    """Sort (labelValues, value) items by label values"""
+    return sorted(items, key=lambda item: tuple(str(v) for v in item[0]))
+
+def formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class MetricBase:
+    mtype = None
+
+    def __init__(self, name, helpText, labelNames=()):
+        self.name = name
+        self.helpText = helpText
+        self.labelNames = tuple(labelNames)
+        Registry.append(self)
+
+    def header(self):
+        return ["# HELP {} {}".format(self.name, self.helpText),
+                "# TYPE {} {}".format(self.name, self.mtype)]
+
+    def render(self):
+        raise NotImplementedError
+
+class Counter(MetricBase):
+    """Monotonically increasing value per set of labels"""
+    mtype = "counter"
+
+    def __init__(self, name, helpText, labelNames=()):
+        super(Counter, self).__init__(name, helpText, labelNames)
+        self.values = {}
+
+    def inc(self, labelValues=(), amount=1):
+        self.values[labelValues] = self.values.get(labelValues, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for labelValues, value in byLabels(self.values.items()):
+            lines.append("{}{} {}".format(self.name, formatLabels(self.labelNames, labelValues),
+                                          formatValue(value)))
+        return lines
+
+class Histogram(MetricBase):
+    """Distribution of observed values per set of labels"""
+    mtype = "histogram"
+
+    DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                       0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, name, helpText, labelNames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, helpText, labelNames)
+        self.buckets = tuple(buckets)
+        self.values = {} # labelValues --> [bucket counts..., +Inf count, sum]
+
+    def observe(self, labelValues, value):
+        values = self.values.get(labelValues)
+        if values is None:
+            values = self.values[labelValues] = [0] * (len(self.buckets) + 2)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render(self):
+        lines = self.header()
+        for labelValues, values in byLabels(self.values.items()):
+            count = 0
+            for bound, bucketCount in zip(self.buckets + (float("inf"),), values):
+                count += bucketCount
+                lines.append("{}_bucket{} {}".format(
+                    self.name,
+                    formatLabels(self.labelNames, labelValues, extra=[("le", formatValue(bound))]),
+                    count))
+            labels = formatLabels(self.labelNames, labelValues)
+            lines.append("{}_sum{} {}".format(self.name, labels, formatValue(values[-1])))
+            lines.append("{}_count{} {}".format(self.name, labels, count))
+        return lines
+
+class Gauge(MetricBase):
+    """Value per set of labels computed by a function when rendering.
+
+    func() returns an iterable of (labelValues, value)
+    """
+    mtype = "gauge"
+
+    def __init__(self, name, helpText, labelNames, func):
+        super(Gauge, self).__init__(name, helpText, labelNames)
+        self.func = func
+
+    def render(self):
+        lines = self.header()
+        for labelValues, value in byLabels(self.func()):
+            lines.append("{}{} {}".format(self.name, formatLabels(self.labelNames, labelValues),
+                                          formatValue(value)))
+        return lines
+
+class CounterFunc(Gauge):
+    """Counter kept elsewhere, read by func() when rendering"""
+    mtype = "counter"
+
+Registry = []
+
+def forgetLabelValue(labelName, value):
+    """Drop the series of every metric labelled labelName=value (e.g.
+    the path of a room that was collected)"""
+    for metric in Registry:
+        values = getattr(metric, "values", None)
+        if values is None or labelName not in metric.labelNames:
+            continue
+        idx = metric.labelNames.index(labelName)
+        for labelValues in [labelValues for labelValues in values
+                            if labelValues[idx] == value]:
+            del values[labelValues]
+
+def render():
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in Registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# -------------------------------------
+# Message type label
+
+MTYPE_LABELS_MAX = 64
+MTYPE_RE = re.compile("^[A-Z0-9-]{1,32}$")
+MtypeLabels = set()
+
+def mtypeLabel(qmsg):
+    """Label for a message received by a plugin: the message type for
+    client messages (e.g. "JOIN") and the class name otherwise. Label
+    values are restricted as clients control what they send"""
+    jmsg = getattr(qmsg, "jmsg", None)
+    if jmsg is None:
+        return qmsg.__class__.__name__
+
+    mtype = jmsg[0] if isinstance(jmsg, list) and jmsg else None
+    if not isinstance(mtype, str) or not MTYPE_RE.match(mtype):
+        return "INVALID"
+    if mtype not in MtypeLabels:
+        if len(MtypeLabels) >= MTYPE_LABELS_MAX:
+            return "OTHER"
+        MtypeLabels.add(mtype)
+    return mtype
+
+# -------------------------------------
+# Metrics shared by the framework
+
+ProcessMsgSeconds = Histogram(
+        "bari_process_msg_seconds",
+        "Time taken by a plugin to process a received message",
+        ("path", "mtype"))
+
+HandledMessages = Counter(
+        "bari_handled_messages_total",
+        "Messages dispatched to each plugin handler",
+        ("path", "handler"))
+
+TxMessages = Counter(
+        "bari_tx_messages_total",
+        "Messages sent to websockets connected to a path",
+        ("path",))
+
+TxBytes = Counter(
+        "bari_tx_bytes_total",
+        "Bytes sent to websockets connected to a path",
+        ("path",))
+
+TimersFired = Counter(
+        "bari_timers_fired_total",
+        "Timers that fired")
+
+# -------------------------------------
+# HTTP endpoint
+
+def response(requestLine):
+    """(status, body) for an HTTP request line"""
+    parts = requestLine.split()
+    if len(parts) != 3 or parts[0] != "GET":
+        return HTTPStatus.BAD_REQUEST, b""
+    if parts[1] != METRICS_PATH:
+        return HTTPStatus.NOT_FOUND, b""
+    return HTTPStatus.OK, render().encode()
+
+async def handleRequest(reader, writer):
+    """Answer one HTTP/1.0 style request and close the connection"""
+    try:
+        requestLine = (await reader.readline()).decode("latin-1")
+        while (await reader.readline()).strip():
+            pass # Headers are ignored
+        status, body = response(requestLine)
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n"
+                     "Connection: close\r\n\r\n".format(status.value, status.phrase,
+                                                        CONTENT_TYPE, len(body)).encode()
+                     + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(port, host=METRICS_HOST):
+    """Start the metrics listener. Returns the asyncio.Server"""
+    return await asyncio.start_server(handleRequest, host, port)
@@ -1,5 +1,7 @@
 """Basic message definitions passed within bari."""
 
+import json
+
 # pylint: disable=too-few-public-methods
 # pylint: disable=missing-class-docstring
 
@@ -35,11 +37,62 @@ class ClientRxMsg(MsgBase):
         # pylint: disable=bad-super-call
         return super(self.__class__, self).__str__() + " jmsg=" + str(self.jmsg)
 
+class ConstJmsg:
+    """A message that never changes, such as ["JOIN-OKAY"]. JSON encoded
+    once and shared by every ClientTxMsg sending it. Use constJmsg()"""
+    __slots__ = ("jmsg", "_encoded")
+
+    def __init__(self, jmsg):
+        self.jmsg = jmsg
+        self._encoded = json.dumps(jmsg)
+
+    def encoded(self):
+        return self._encoded
+
+ConstJmsgByItems = {}
+
+def constJmsg(*items):
+    """The ConstJmsg for the message [item, ...]. Items must be constants
+    (message types, fixed reasons): every distinct message is kept"""
+    try:
+        return ConstJmsgByItems[items]
+    except KeyError:
+        constMsg = ConstJmsgByItems[items] = ConstJmsg(list(items))
+        return constMsg
+
 class ClientTxMsg(MsgBase):
-    def __init__(self, jmsg, toWss, initiatorWs=None):
+    def __init__(self, jmsg, toWss, initiatorWs=None, jmai=None, key=None, version=None):
+        """jmsg is a JSON serializable message or a ConstJmsg.
+
+        jmai (optional) is the Jmai this message was created from.
+        When set, the JSON encoding is shared with every other
+        ClientTxMsg created from the same Jmai.
+
+        key (optional) marks the message as a state snapshot. A message
+        with the same key still waiting to be sent to a websocket is
+        superseded by this one.
+
+        version (optional) is the MsgVersion of a message from a delta
+        enabled MsgSrc. It supplies the SNAPSHOT/PATCH encodings sent
+        to websockets that support deltas"""
         super(ClientTxMsg, self).__init__(initiatorWs=initiatorWs)
+        if isinstance(jmsg, ConstJmsg):
+            jmai = jmsg
+            jmsg = jmsg.jmsg
         self.toWss = toWss
         self.jmsg = jmsg
+        self.key = key
+        self.version = version
+        self._jmai = jmai
+        self._encoded = None
+
+    def encoded(self):
+        """JSON encoding of jmsg. Serialized at most once"""
+        if self._jmai is not None:
+            return self._jmai.encoded()
+        if self._encoded is None:
+            self._encoded = json.dumps(self.jmsg)
+        return self._encoded
 
     def __str__(self):
         # pylint: disable=bad-super-call
@@ -95,12 +148,35 @@ class InternalGiStatus(MsgBase):
         return super(self.__class__, self).__str__() + " jmsg=" + str(self.jmsg) + \
                 " fromPath=" + self.fromPath
 
+class InternalGiClosed(MsgBase):
+    """A game instance was collected (see fwk/RoomGc.py). Targeted for
+    the lobby, which stops advertising it, and the game lobby that
+    hosted it, which forgets it"""
+    def __init__(self, fromPath):
+        super(InternalGiClosed, self).__init__(initiatorWs=None)
+        self.fromPath = fromPath
+
+    def __str__(self):
+        # pylint: disable=bad-super-call
+        return super(self.__class__, self).__str__() + " fromPath=" + self.fromPath
+
 class TimerRequest(MsgBase):
     def __init__(self, afterSec, cb, ctx):
+        """cb(ctx) is invoked after afterSec. Keep the TimerRequest
+        to cancel() the timer"""
         super(TimerRequest, self).__init__(initiatorWs=None)
         self.afterSec = afterSec
         self.cb = cb
         self.ctx = ctx
+        self.cancelled = False
+        self.timerWheel = None # Set when scheduled
+        self.timerEntry = None
+
+    def cancel(self):
+        """Cancel the timer. The callback won't be invoked"""
+        self.cancelled = True
+        if self.timerWheel is not None:
+            self.timerWheel.cancel(self.timerEntry)
 
     def __str__(self):
         return super(TimerRequest, self).__str__() + " afterSec={} cb={}.{} ctx={}".format(
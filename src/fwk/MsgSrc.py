@@ -10,13 +10,98 @@ MsgSrc3 --> +-------------+
 If a new connection is added, last cached messages from
 each MsgSrc to the new connection. Any change to MsgSrc
 is sent to all websockets.
+
+Messages from a MsgSrc are state snapshots: each one is sent
+with a key (the MsgSrc's id and the index of the message) so that
+an unsent older snapshot for the same key is replaced rather
+than sent.
+
+Connections(None) are headless: MsgSrcs feeding them only keep their
+messages. Games simulated without websockets use them (fwk/Simulation.py).
+
+A MsgSrc with deltaEnabled also keeps a version and the previous
+encoding of each message. Websockets that connected with
+"?delta=1" then receive
+
+    ["SNAPSHOT", srcId, idx, version, jmsg]
+
+on connect (or whenever a patch can't be used) and
+
+    ["PATCH", srcId, idx, version, ops]
+
+when the message changes. ops is a JSON patch (RFC 6902) to
+apply to the message at version - 1. Patches are only computed
+when a delta websocket is sent one.
 """
 
 from collections import namedtuple
+import itertools
+import json
 
+from fwk import JsonPatch
 from fwk.Msg import ClientTxMsg
+from fwk.MsgType import (
+        MTYPE_PATCH,
+        MTYPE_SNAPSHOT,
+)
 
-Jmai = namedtuple("JmsgAndInitiator", ["jmsg", "initiatorWs"])
+class Jmai(namedtuple("JmsgAndInitiator", ["jmsg", "initiatorWs"])):
+    """A message and the websocket that initiated it.
+
+    The JSON encoding of jmsg is computed lazily and cached so the
+    same message fanned out to many websockets (or replayed to new
+    connections) is serialized only once.
+    """
+    _encoded = None
+
+    @classmethod
+    def withEncodedLast(cls, jmsg, lastEncoded, initiatorWs=None):
+        """Jmai of jmsg whose last item is already JSON encoded
+        (lastEncoded, e.g. CardBag.encoded()): only the items before it
+        are serialized"""
+        jmai = cls(jmsg, initiatorWs)
+        head = json.dumps(jmsg[:-1])[:-1]
+        jmai._encoded = head + (", " if len(jmsg) > 1 else "") + lastEncoded + "]"
+        return jmai
+
+    def encoded(self):
+        """JSON encoding of jmsg"""
+        if self._encoded is None:
+            self._encoded = json.dumps(self.jmsg)
+        return self._encoded
+
+class MsgVersion:
+    """Version of a message from a delta enabled MsgSrc. The patch from
+    the previous version (prevEncoded, if any) is computed on demand"""
+    def __init__(self, srcId, idx, version, jmai, prevEncoded=None):
+        self.srcId = srcId
+        self.idx = idx
+        self.version = version
+        self.jmai = jmai
+        self.prevEncoded = prevEncoded
+        self._snapshotEncoded = None
+        self._patchEncoded = None
+
+    def snapshotEncoded(self):
+        """JSON encoding of the SNAPSHOT message"""
+        if self._snapshotEncoded is None:
+            self._snapshotEncoded = '["{}", {}, {}, {}, {}]'.format(
+                MTYPE_SNAPSHOT, self.srcId, self.idx, self.version, self.jmai.encoded())
+        return self._snapshotEncoded
+
+    def patchEncoded(self):
+        """JSON encoding of the PATCH message. None when there is no patch
+        or the patch isn't smaller than the snapshot"""
+        if self.prevEncoded is None:
+            return None
+        if self._patchEncoded is None:
+            ops = JsonPatch.diff(json.loads(self.prevEncoded), json.loads(self.jmai.encoded()))
+            self._patchEncoded = json.dumps([MTYPE_PATCH, self.srcId, self.idx,
+                                             self.version, ops])
+            if len(self._patchEncoded) >= len(self.snapshotEncoded()):
+                self.prevEncoded = None
+                return None
+        return self._patchEncoded
 
 class ConnectionsBase:
     def __init__(self, txQueue):
@@ -41,7 +126,11 @@ class ConnectionsBase:
         """Number of connections tracked"""
         raise NotImplementedError
 
-    def send(self, jmaiList, wss=None):
+    def headless(self):
+        """Whether messages are never sent (there's no TX queue)"""
+        return False
+
+    def send(self, jmaiList, wss=None, keys=None, versions=None):
         """Send the messages to a subset (or all) connections
         Arguments
         ---------
@@ -49,6 +138,8 @@ class ConnectionsBase:
         wss : (optional) set of websockets
             Websockets to send the messages. If not specified,
             send the message to all websockets.
+        keys : (optional) list of snapshot keys, one per message
+        versions : (optional) list of MsgVersion, one per message
         """
         raise NotImplementedError
 
@@ -65,14 +156,15 @@ class Connections(ConnectionsBase):
         """Register a new MsgSrc for all websockets"""
         ConnectionsBase.addMsgSrc(self, msgSrc)
         jmaiList = msgSrc.getMsgs()
-        self.send(jmaiList)
+        self.send(jmaiList, keys=msgSrc.keys(len(jmaiList)), versions=msgSrc.snapshots())
 
     def addConn(self, ws):
         """Add a websocket to the set of connections"""
         self._wss.add(ws)
         for msgSrc in self._msgSrcs:
             jmaiList = msgSrc.getMsgs()
-            self.send(jmaiList, wss={ws})
+            self.send(jmaiList, wss={ws}, keys=msgSrc.keys(len(jmaiList)),
+                      versions=msgSrc.snapshots())
 
     def delConn(self, ws):
         """Remove a websocket from the set of connections"""
@@ -83,7 +175,14 @@ class Connections(ConnectionsBase):
         """Number of connections being tracked"""
         return len(self._wss)
 
-    def send(self, jmaiList, wss=None):
+    def wss(self):
+        """The websockets being tracked"""
+        return set(self._wss)
+
+    def headless(self):
+        return self._txQueue is None
+
+    def send(self, jmaiList, wss=None, keys=None, versions=None):
         """Send the messages to a subset (or all) connections
         Arguments
         ---------
@@ -91,13 +190,18 @@ class Connections(ConnectionsBase):
         wss : (optional) set of websockets
             Websockets to send the messages. If not specified,
             send the message to all websockets.
+        keys : (optional) list of snapshot keys, one per message
+        versions : (optional) list of MsgVersion, one per message
         """
         wss = wss or self._wss
         if not wss:
             return
 
-        for jmai in jmaiList:
-            self._txQueue.put_nowait(ClientTxMsg(jmai.jmsg, wss, initiatorWs=jmai.initiatorWs))
+        keys = keys or [None] * len(jmaiList)
+        versions = versions or [None] * len(jmaiList)
+        for jmai, key, version in zip(jmaiList, keys, versions):
+            self._txQueue.put_nowait(ClientTxMsg(jmai.jmsg, wss, initiatorWs=jmai.initiatorWs,
+                                                 jmai=jmai, key=key, version=version))
 
 class ConnectionsGroup(ConnectionsBase):
     """ConnectionsGroup allows collecting multiple Connections as
@@ -142,22 +246,34 @@ class ConnectionsGroup(ConnectionsBase):
     def count(self):
         return sum(conn for conn in self._conns)
 
-    def send(self, jmaiList, conns=None): # pylint: disable=arguments-differ
+    def send(self, jmaiList, conns=None, keys=None, versions=None): # pylint: disable=arguments-differ
         """Send the messages to all connections within all conns
         Arguments
         ---------
         jmsgs : list of messages
+        keys : (optional) list of snapshot keys, one per message
+        versions : (optional) list of MsgVersion, one per message
         """
         for conn in conns or self._conns:
-            conn.send(jmaiList)
+            conn.send(jmaiList, keys=keys, versions=versions)
+
+MsgSrcIdAllocator = itertools.count()
 
 class MsgSrc:
     """A source of messages that needs to be sent to
     all connections.
+
+    Subclasses publishing large snapshots that change a little
+    at a time set deltaEnabled to send patches to websockets
+    that support them.
     """
+    deltaEnabled = False
+
     def __init__(self, conns):
         self._conns = conns
         self._jmaiList = []
+        self._srcId = next(MsgSrcIdAllocator)
+        self._versions = []  # Per message: current MsgVersion
         self._conns.addMsgSrc(self)
 
     def __del__(self):
@@ -165,16 +281,53 @@ class MsgSrc:
 
     def addMsgs(self, jmaiList):
         self._jmaiList.append(jmaiList)
+        if self._conns.headless():
+            return
         self._conns.send(jmaiList)
 
     def replaceMsg(self, idx, jmai):
         self._jmaiList[idx] = jmai
-        self._conns.send([jmai])
+        if self._conns.headless():
+            return
+        versions = [self._newVersion(idx, jmai)] if self.deltaEnabled else None
+        self._conns.send([jmai], keys=[(self._srcId, idx)], versions=versions)
 
     def setMsgs(self, jmaiList):
         """Buffer messages each with initiator"""
         self._jmaiList = jmaiList
-        self._conns.send(self._jmaiList)
+        if self._conns.headless():
+            return
+        versions = None
+        if self.deltaEnabled:
+            del self._versions[len(jmaiList):]
+            versions = [self._newVersion(idx, jmai) for idx, jmai in enumerate(jmaiList)]
+        self._conns.send(self._jmaiList, keys=self.keys(len(jmaiList)), versions=versions)
+
+    def _newVersion(self, idx, jmai):
+        """Bump the version of message idx. The encoding is taken now:
+        jmsg may be mutated in place before the patch is computed"""
+        jmai.encoded()
+        if idx < len(self._versions):
+            prev = self._versions[idx]
+            msgVersion = MsgVersion(self._srcId, idx, prev.version + 1, jmai,
+                                    prevEncoded=prev.jmai.encoded())
+            self._versions[idx] = msgVersion
+        else:
+            msgVersion = MsgVersion(self._srcId, idx, 1, jmai)
+            self._versions.append(msgVersion)
+        return msgVersion
+
+    def keys(self, count):
+        """Snapshot keys for the first count messages"""
+        return [(self._srcId, idx) for idx in range(count)]
+
+    def snapshots(self):
+        """MsgVersion (without patches) of the current messages. None if
+        deltas are not enabled"""
+        if not self.deltaEnabled:
+            return None
+        return [MsgVersion(self._srcId, idx, msgVersion.version, msgVersion.jmai)
+                for idx, msgVersion in enumerate(self._versions)]
 
     def getMsgs(self):
         """Get messages and initiator websocket for the messages"""
@@ -3,5 +3,10 @@
 # Common commands. These should not be game specific
 MTYPE_ERROR = "ERROR"
 MTYPE_GAME_STATUS = "GAME-STATUS"
+MTYPE_GAME_CLOSED = "GAME-CLOSED"
 MTYPE_HOST = "HOST"
 MTYPE_HOST_BAD = "HOST-BAD"
+
+# Delta protocol (clients connecting with "?delta=1")
+MTYPE_SNAPSHOT = "SNAPSHOT"
+MTYPE_PATCH = "PATCH"
@@ -0,0 +1,116 @@
+"""Collection of idle game rooms.
+
+Game rooms are registered with the main loop when they are hosted
+(fwk/ServerQueueTask.py). roomGcTask() sweeps them every
+ROOM_GC_INTERVAL_SEC: a room without clients (bots don't count) is
+collected once it stayed that way for
+
+    gameOverTtlSec : if the game is over
+    idleTtlSec     : otherwise
+
+A collected room is closed (GamePlugin.close), deregistered from the
+main loop and, if an archive is configured, its snapshot is written to
+the ArchivedRoom table. InternalGiClosed is then sent through the room's
+TX queue so that the main loop (server.py) tells the lobby and the game
+lobby to forget it.
+
+With worker processes (fwk/Shard.py), each worker collects the rooms
+it runs and InternalGiClosed is relayed to the front process which
+deregisters its RemotePlugin.
+"""
+
+import asyncio
+import time
+
+from fwk import ServerQueueTask
+from fwk.GamePlugin import GamePlugin
+from fwk.Msg import InternalGiClosed
+from fwk.Storage import (
+        Bool,
+        DbExecutor,
+        Int,
+        Json,
+        PrimaryKey,
+        Table,
+        Txt,
+)
+from fwk.Trace import (
+        Level,
+        trace,
+)
+
+ROOM_GC_INTERVAL_SEC = 60
+ROOM_IDLE_TTL_SEC_DEFAULT = 3600
+ROOM_GAME_OVER_TTL_SEC_DEFAULT = 300
+
+class ArchivedRoom(Table):
+    fields = [
+        Txt("path", qualifier="not null"),
+        Txt("name"),
+        Int("closedAt", qualifier="not null"), # Seconds since the epoch
+        Bool("gameOver"),
+        Json("snapshot"), # Plugin.snapshot(), null if not supported
+        PrimaryKey("path", "closedAt"),
+    ]
+
+RoomGcIdleTtlSec = ROOM_IDLE_TTL_SEC_DEFAULT
+RoomGcGameOverTtlSec = ROOM_GAME_OVER_TTL_SEC_DEFAULT
+Archive = None # ArchivedRoom table, if rooms are archived
+
+def setRoomGc(idleTtlSec=ROOM_IDLE_TTL_SEC_DEFAULT,
+              gameOverTtlSec=ROOM_GAME_OVER_TTL_SEC_DEFAULT, archiveFile=None):
+    """Configure room collection. A TTL of 0 never collects those rooms.
+    Collected rooms are archived in the sqlite3 file archiveFile, if set"""
+    global RoomGcIdleTtlSec, RoomGcGameOverTtlSec, Archive # pylint: disable=global-statement
+    assert idleTtlSec >= 0 and gameOverTtlSec >= 0
+    RoomGcIdleTtlSec = idleTtlSec
+    RoomGcGameOverTtlSec = gameOverTtlSec
+    if Archive is not None:
+        Archive.db.close()
+    Archive = ArchivedRoom(DbExecutor(archiveFile)) if archiveFile else None
+
+# Monotonic time since which each room has had no clients
+IdleSinceByPath = {}
+
+def isIdle(gi):
+    """No clients and nothing left to process"""
+    return (not gi.clientCount() and gi.rxQueue.empty() and
+            not ServerQueueTask.WsByPath.get(gi.path))
+
+def ttlSec(gi):
+    return RoomGcGameOverTtlSec if gi.isGameOver() else RoomGcIdleTtlSec
+
+def sweep(now):
+    """Collect the rooms idle for longer than their TTL at now
+    (time.monotonic()). Returns the paths collected"""
+    collected = []
+    for path, gi in list(ServerQueueTask.GiByPath.items()):
+        if not isinstance(gi, GamePlugin) or not isIdle(gi):
+            IdleSinceByPath.pop(path, None)
+            continue
+        since = IdleSinceByPath.setdefault(path, now)
+        ttl = ttlSec(gi)
+        if ttl and now - since >= ttl:
+            collect(gi)
+            collected.append(path)
+
+    for path in [path for path in IdleSinceByPath if path not in ServerQueueTask.GiByPath]:
+        del IdleSinceByPath[path]
+    return collected
+
+def collect(gi):
+    """Close, archive and deregister gi"""
+    trace(Level.game, "Collecting", gi.path, "game over" if gi.isGameOver() else "idle")
+    if Archive is not None:
+        Archive.insert(path=gi.path, name=gi.name, closedAt=int(time.time()),
+                       gameOver=gi.isGameOver(), snapshot=gi.snapshot())
+    gi.close()
+    ServerQueueTask.deregisterGameClass(gi.path)
+    IdleSinceByPath.pop(gi.path, None)
+    gi.txQueue.put_nowait(InternalGiClosed(gi.path))
+
+async def roomGcTask(intervalSec=ROOM_GC_INTERVAL_SEC):
+    """Task sweeping the rooms registered with the main loop"""
+    while True:
+        await asyncio.sleep(intervalSec)
+        sweep(time.monotonic())
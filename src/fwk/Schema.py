@@ -0,0 +1,82 @@
+"""Schemas for messages received from clients.
+
+A Schema is built once per message type from decoders. A decoder is a
+function that takes the JSON value of a field and returns the decoded
+value (a Card for a card, a list of cards for a list, ...) or raises
+SchemaError. The SchemaError carries the explanation sent back in the
+"<MTYPE>-BAD" reply.
+
+    ATTACK_SCHEMA = Schema("ATTACK", [
+        ("cards", listOf(cardField(onError=error("Invalid card")),
+                         onError=error("Invalid attacks"),
+                         onEmpty=error("No cards specified", withData=False))),
+    ])
+
+    try:
+        attack = ATTACK_SCHEMA.decode(qmsg.jmsg)
+    except SchemaError as exc:
+        ... ClientTxMsg(["ATTACK-BAD"] + exc.toJmsg(), ...)
+    attack.cards
+"""
+
+from collections import namedtuple
+
+from fwk.Exceptions import SchemaError
+
+def error(explanation, withData=True):
+    """Error for a decoder: SchemaError(explanation, value) or, without
+    data, SchemaError(explanation)"""
+    if withData:
+        return lambda value: SchemaError(explanation, value)
+    return lambda value: SchemaError(explanation)
+
+def intField(onError):
+    def decode(value):
+        if not isinstance(value, int):
+            raise onError(value)
+        return value
+    return decode
+
+def listOf(itemDecoder, onError, onEmpty=None, length=None, onLength=None):
+    """A list decoded with itemDecoder. onEmpty rejects empty lists and
+    length (with onLength) fixes the number of items"""
+    def decode(value):
+        if not isinstance(value, list):
+            raise onError(value)
+        if onEmpty and not value:
+            raise onEmpty(value)
+        if length is not None and len(value) != length:
+            raise onLength(value)
+        return [itemDecoder(item) for item in value]
+    return decode
+
+def dictOf(fields, onError, onUnknown):
+    """A dict with optional keys. fields is a list of (key, decoder,
+    default). Keys are decoded in order; other keys are rejected"""
+    def decode(value):
+        if not isinstance(value, dict):
+            raise onError(value)
+        value = dict(value)
+        decoded = {}
+        for key, decoder, default in fields:
+            decoded[key] = decoder(value.pop(key, default))
+        if value:
+            raise onUnknown(value)
+        return decoded
+    return decode
+
+class Schema:
+    """Message [mtype, field1, field2, ...] decoded into a namedtuple"""
+    def __init__(self, mtype, fields,
+                 onLength=error("Invalid message length", withData=False)):
+        self.mtype = mtype
+        self.names = [name for name, _ in fields]
+        self.decoders = [decoder for _, decoder in fields]
+        self.onLength = onLength
+        self.struct = namedtuple(mtype.title().replace("-", "") + "Msg", self.names)
+
+    def decode(self, jmsg):
+        """Returns the decoded namedtuple or raises SchemaError"""
+        if len(jmsg) != len(self.decoders) + 1:
+            raise self.onLength(jmsg)
+        return self.struct(*[decoder(value) for decoder, value in zip(self.decoders, jmsg[1:])])
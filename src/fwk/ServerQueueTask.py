@@ -4,6 +4,13 @@
 import asyncio
 from collections import defaultdict
 
+from fwk import (
+        EventLog,
+        Metrics,
+)
+from fwk.Bot import BotWs
+from fwk.Msg import ClientTxMsg
+from fwk.TimerWheel import TimerWheel
 from fwk.Trace import (
         Level,
         trace,
@@ -14,35 +21,224 @@ from fwk.Trace import (
 # Queue + task for sending messages to
 # clients asynchronously
 
-ClientTxQueueByWs = {}
-ClientTxTaskByWs = {}
+class ClientTxFrame:
+    """An encoded message waiting in a ClientTxQueue"""
+    __slots__ = ("msg", "key")
+
+    def __init__(self, msg, key=None):
+        self.msg = msg
+        self.key = key
+
+class ClientTxQueue(asyncio.Queue):
+    """Queue of encoded messages for a websocket.
+
+    Messages put with putLatest() carry a key (e.g. a MsgSrc and the
+    index of the message in it). Only the latest message for a key is
+    of interest: if one is still waiting to be sent, it is replaced in
+    place instead of queuing the new one behind it.
 
-def clientTxQueueAdd(ws):
-    """Add a TX queue + task for a websocket"""
-    clientTxQueue = asyncio.Queue()
+    When delta is set, the websocket receives SNAPSHOT/PATCH messages
+    for delta enabled MsgSrcs. A PATCH is only queued if the websocket
+    received (or will receive) the previous version: if the previous
+    version is still pending or was dropped, a SNAPSHOT is sent instead.
+    """
+    def __init__(self, maxsize=0, delta=False):
+        super(ClientTxQueue, self).__init__(maxsize)
+        self.delta = delta
+
+    def _init(self, maxsize):
+        super(ClientTxQueue, self)._init(maxsize)
+        self._pendingByKey = {}
+        self._resyncKeys = set()
+
+    def _put(self, item):
+        self._queue.append(ClientTxFrame(item))
+
+    def _get(self):
+        frame = self._queue.popleft()
+        if frame.key is not None:
+            del self._pendingByKey[frame.key]
+        return frame.msg
+
+    def coalesce(self, msg, key):
+        """Replace the unsent message for key. Returns False if there
+        isn't one"""
+        frame = self._pendingByKey.get(key)
+        if frame is None:
+            return False
+        frame.msg = msg
+        return True
+
+    def putLatest(self, msg, key, patch=None):
+        """Queue msg for key, replacing the unsent message for key if any.
+        patch (optional) is queued instead of msg if the previous message
+        for key wasn't lost"""
+        if self.coalesce(msg, key):
+            return
+        if patch is not None and key not in self._resyncKeys:
+            msg = patch
+        self._resyncKeys.discard(key)
+        self.put_nowait(msg)
+        frame = self._queue[-1]
+        frame.key = key
+        self._pendingByKey[key] = frame
+
+    def dropOldest(self):
+        """Drop the oldest queued message"""
+        frame = self._queue[0]
+        self.get_nowait()
+        self.task_done()
+        if frame.key is not None:
+            self._resyncKeys.add(frame.key)
+
+ClientTxQueueByWs = {}   # ws --> ClientTxQueue (None once the ws is evicted)
+ClientTxTaskByWs = {}
+ClientTxPathByWs = {}
+
+# Bound on the number of messages queued per websocket. When a queue
+# is full, ClientTxQueuePolicy decides what happens:
+#   POLICY_DROP_OLDEST : the oldest queued message is dropped
+#   POLICY_DISCONNECT : the websocket is evicted (closed)
+# A ClientTxQueueMaxSize of 0 means the queues are unbounded.
+POLICY_DROP_OLDEST = "drop-oldest"
+POLICY_DISCONNECT = "disconnect"
+ClientTxPolicies = (POLICY_DROP_OLDEST, POLICY_DISCONNECT)
+
+ClientTxQueueMaxSize = 0
+ClientTxQueuePolicy = POLICY_DISCONNECT
+
+class ClientTxStats:
+    """Per path counters for client TX queues"""
+    def __init__(self):
+        self.drops = 0
+        self.evictions = 0
+
+ClientTxStatsByPath = defaultdict(ClientTxStats)
+
+# Batching of messages sent to a websocket. Everything queued for a
+# websocket (up to ClientTxMaxBatch messages) is drained before
+# awaiting ws.send(). ClientTxFlushDelaySec allows waiting a little
+# for more messages to show up before sending a batch.
+ClientTxMaxBatch = 32
+ClientTxFlushDelaySec = 0.0
+
+def clientTxConfig(maxBatch, flushDelaySec):
+    """Configure batching for client TX tasks"""
+    global ClientTxMaxBatch, ClientTxFlushDelaySec # pylint: disable=global-statement
+    assert maxBatch >= 1
+    assert flushDelaySec >= 0
+    ClientTxMaxBatch = maxBatch
+    ClientTxFlushDelaySec = flushDelaySec
+
+def clientTxQueueConfig(maxSize, policy):
+    """Configure the bound on client TX queues and the policy applied
+    when a queue is full"""
+    global ClientTxQueueMaxSize, ClientTxQueuePolicy # pylint: disable=global-statement
+    assert maxSize >= 0
+    assert policy in ClientTxPolicies
+    ClientTxQueueMaxSize = maxSize
+    ClientTxQueuePolicy = policy
+
+def clientTxQueueAdd(ws, path=None, batchEnvelope=False, delta=False):
+    """Add a TX queue + task for a websocket
+
+    path : str
+        Path the websocket is connected to (used for stats)
+    batchEnvelope : bool
+        When True, each batch is sent as a single JSON array of messages
+        (the client opted in at connect time). Otherwise messages in a
+        batch are sent back-to-back as individual frames.
+    delta : bool
+        When True, messages from delta enabled MsgSrcs are sent as
+        SNAPSHOT/PATCH messages (the client opted in at connect time)
+    """
+    clientTxQueue = ClientTxQueue(maxsize=ClientTxQueueMaxSize, delta=delta)
     ClientTxQueueByWs[ws] = clientTxQueue
-    ClientTxTaskByWs[ws] = asyncio.get_event_loop().create_task(clientTxTask(clientTxQueue, ws))
+    ClientTxPathByWs[ws] = path
+    ClientTxTaskByWs[ws] = asyncio.get_event_loop().create_task(
+            clientTxTask(clientTxQueue, ws, batchEnvelope=batchEnvelope, path=path))
 
 def clientTxQueueRemove(ws):
     """Remove a TX queue + task for a websocket"""
     del ClientTxQueueByWs[ws]
-    ClientTxTaskByWs[ws].cancel()
+    del ClientTxPathByWs[ws]
+    task = ClientTxTaskByWs.pop(ws, None)
+    if task:
+        task.cancel()
     #await asyncio.gather(ClientTxTaskByWs[ws]) # When is this called?
-    del ClientTxTaskByWs[ws]
 
     # Client disconnected
     trace(Level.conn, "Client", ws, "disconnected")
 
-async def clientTxTask(queue, clientWs):
+def clientTxEvict(ws):
+    """Stop sending to a websocket that isn't keeping up and close it.
+    The websocket stays in ClientTxQueueByWs (as None) until the
+    connection handler calls clientTxQueueRemove()"""
+    trace(Level.warn, "Evicting slow client", ws,
+          "path", ClientTxPathByWs[ws],
+          "queued", ClientTxQueueByWs[ws].qsize())
+    ClientTxStatsByPath[ClientTxPathByWs[ws]].evictions += 1
+    ClientTxQueueByWs[ws] = None
+    ClientTxTaskByWs.pop(ws).cancel()
+    asyncio.ensure_future(ws.close(code=1008, reason="Client too slow"))
+
+def clientTxStats():
+    """Returns TX queue stats by path
+
+        {path: {"wsCount": int, "queueDepth": int, "drops": int, "evictions": int}}
+    """
+    stats = defaultdict(lambda: {"wsCount": 0, "queueDepth": 0, "drops": 0, "evictions": 0})
+    for path, pathStats in ClientTxStatsByPath.items():
+        stats[path]["drops"] = pathStats.drops
+        stats[path]["evictions"] = pathStats.evictions
+    for ws, queue in ClientTxQueueByWs.items():
+        path = ClientTxPathByWs[ws]
+        stats[path]["wsCount"] += 1
+        stats[path]["queueDepth"] += queue.qsize() if queue else 0
+    return dict(stats)
+
+async def clientTxBatch(queue):
+    """Wait for at least one message in the queue. Returns a list of
+    up to ClientTxMaxBatch messages collected within ClientTxFlushDelaySec
+    of the first message"""
+    msgs = [await queue.get()]
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + ClientTxFlushDelaySec
+
+    while len(msgs) < ClientTxMaxBatch:
+        if not queue.empty():
+            msgs.append(queue.get_nowait())
+            continue
+
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+
+        try:
+            msgs.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+
+    return msgs
+
+async def clientTxTask(queue, clientWs, batchEnvelope=False, path=None):
     """
     Task to drain the queue with messages meant to be
     sent to the client's websocket.
     """
+    labels = (path,)
     while True:
-        msg = await queue.get()
-        trace(Level.msg, "clientTxTask: sending", "'%s'" % msg, "to", clientWs)
-        await clientWs.send(msg)
-        queue.task_done()
+        msgs = await clientTxBatch(queue)
+        trace(Level.msg, "clientTxTask: sending", len(msgs), "messages to", clientWs)
+        if batchEnvelope:
+            await clientWs.send("[" + ",".join(msgs) + "]")
+        else:
+            for msg in msgs:
+                await clientWs.send(msg)
+        for _ in msgs:
+            queue.task_done()
+        Metrics.TxMessages.inc(labels, len(msgs))
+        Metrics.TxBytes.inc(labels, sum(len(msg) for msg in msgs))
 
 # -------------------------------------
 # Queue + tasks to talk between the
@@ -51,14 +247,37 @@ async def clientTxTask(queue, clientWs):
 TxQueue = asyncio.Queue()
 
 def txQueue():
-    """Returns the common TX queue used by each Plugin"""
+    """Returns the common TX queue drained by the main loop"""
     return TxQueue
 
+class PluginTxQueue:
+    """The TX queue handed to each Plugin.
+
+    ClientTxMsg are encoded and handed straight to the TX queues of the
+    destination websockets. Everything else (InternalHost, InternalRegisterGi,
+    InternalGiStatus, TimerRequest) is put in the common TxQueue drained
+    by the main loop.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def put_nowait(self, qmsg):
+        if isinstance(qmsg, ClientTxMsg):
+            clientTxSend(qmsg)
+            return
+        TxQueue.put_nowait(qmsg)
+
 GiRxQueueByPath = {}
 GiRxTaskByPath = {}
 
-def giRxMsg(path, msg): # pylint: disable=missing-function-docstring
-    GiRxQueueByPath[path].put_nowait(msg)
+def giRxMsg(path, msg):
+    """Queue msg for the game instance at path. Dropped if the game
+    instance was collected (fwk/RoomGc.py)"""
+    queue = GiRxQueueByPath.get(path)
+    if queue is None:
+        trace(Level.warn, "giRxMsg: no game instance at", path, "for", msg)
+        return
+    queue.put_nowait(msg)
 
 # -------------------------------------
 # Tracks websockets connected to a
@@ -71,7 +290,10 @@ def wsPathAdd(ws, path): # pylint: disable=missing-function-docstring
     trace(Level.conn, "WsByPath: add", ws, "path", path)
 
 def wsPathRemove(ws, path): # pylint: disable=missing-function-docstring
-    WsByPath[path].remove(ws)
+    wss = WsByPath.get(path, set())
+    wss.discard(ws)
+    if not wss:
+        WsByPath.pop(path, None)
     trace(Level.conn, "WsByPath: remove", ws, "path", path)
 
 def socketsByPath(path): # pylint: disable=missing-function-docstring
@@ -87,52 +309,203 @@ def giByPath(path):
     path is not recognized"""
     return GiByPath.get(path, None)
 
-async def clientTxMsg(msg, toWs):
-    """Helper to queue a message to be sent to 'toWs'"""
+def clientTxPut(msg, toWs, key=None, version=None):
+    """Queue an encoded message to be sent to 'toWs'. If the queue is full,
+    ClientTxQueuePolicy is applied.
+
+    key : hashable (optional)
+        Identifies a state snapshot. An unsent message queued with the
+        same key is replaced by msg.
+    version : MsgVersion (optional)
+        Used instead of msg for websockets that support deltas
+    """
     if toWs not in ClientTxQueueByWs:
-        trace(Level.error, "clientTxMsg: unable to queue",
+        if isinstance(toWs, BotWs):
+            return # Bots read the game, not its messages
+        trace(Level.error, "clientTxPut: unable to queue",
               "'%s'" % msg,
               "for sending to client", toWs)
         return
-    trace(Level.debug, "clientTxMsg:", toWs, "'%s'" % msg)
-    ClientTxQueueByWs[toWs].put_nowait(msg)
+
+    queue = ClientTxQueueByWs[toWs]
+    if queue is None:
+        # Evicted. Waiting for the connection to close
+        return
+
+    patch = None
+    if version is not None and queue.delta:
+        msg = version.snapshotEncoded()
+        patch = version.patchEncoded()
+
+    if key is not None and queue.coalesce(msg, key):
+        trace(Level.debug, "clientTxPut: coalesced", toWs, msg)
+        return
+
+    if queue.full():
+        if ClientTxQueuePolicy == POLICY_DISCONNECT:
+            clientTxEvict(toWs)
+            return
+
+        queue.dropOldest()
+        ClientTxStatsByPath[ClientTxPathByWs[toWs]].drops += 1
+
+    trace(Level.debug, "clientTxPut:", toWs, msg)
+    if key is None:
+        queue.put_nowait(msg)
+    else:
+        queue.putLatest(msg, key, patch=patch)
+
+def clientTxSend(qmsg):
+    """Encode a ClientTxMsg once and queue it for every destination websocket"""
+    try:
+        msg = qmsg.encoded()
+    except TypeError as exc:
+        trace(Level.error, "Error serializing as JSON:", str(qmsg.jmsg), str(exc))
+        return
+
+    for toWs in qmsg.toWss:
+        clientTxPut(msg, toWs, key=qmsg.key, version=qmsg.version)
+
+async def clientTxMsg(msg, toWs):
+    """Helper to queue a message to be sent to 'toWs'"""
+    clientTxPut(msg, toWs)
 
 # -------------------------------------
 # Register a game instance with the
 # main loop
 
-def registerGameClass(gi):
-    """Register game instance with the main loop"""
+def registerGameClass(gi, giTxQueue=None):
+    """Register game instance with the main loop. giTxQueue defaults
+    to a PluginTxQueue"""
     trace(Level.game, "Registering {} ({})".format(gi.name, gi.path))
 
     assert gi.path not in GiByPath
     GiByPath[gi.path] = gi
 
+    EventLog.attach(gi)
+
     giRxQueue = asyncio.Queue()
-    gi.setRxTxQueues(giRxQueue, TxQueue)
+    gi.setRxTxQueues(giRxQueue, giTxQueue or PluginTxQueue(gi.path))
 
     GiRxTaskByPath[gi.path] = \
             asyncio.get_event_loop().create_task(gi.worker())
 
     GiRxQueueByPath[gi.path] = giRxQueue
 
+def deregisterGameClass(path):
+    """Forget the game instance registered at path: its worker task is
+    cancelled and nothing here refers to it anymore. Returns it"""
+    trace(Level.game, "Deregistering", path)
+    gi = GiByPath.pop(path)
+    GiRxTaskByPath.pop(path).cancel()
+    del GiRxQueueByPath[path]
+    WsByPath.pop(path, None)
+    ClientTxStatsByPath.pop(path, None)
+    Metrics.forgetLabelValue("path", path)
+    return gi
+
 # -------------------------------------
 # Timer handling
 
-timerByQmsg = {}
+# All TimerRequests share one TimerWheel. A single event loop callback
+# is scheduled per tick while timers are pending and expires all timers
+# due in that tick.
+TIMER_TICK_SEC = 0.1
+
+class TimerScheduler:
+    """Runs TimerRequest callbacks from a TimerWheel"""
+    def __init__(self, tickSec=TIMER_TICK_SEC):
+        self.tickSec = tickSec
+        self.wheel = None
+        self.handle = None
+
+    def __len__(self):
+        return len(self.wheel) if self.wheel else 0
+
+    def add(self, qmsg):
+        if qmsg.cancelled:
+            return
+        loop = asyncio.get_event_loop()
+        if self.wheel is None:
+            self.wheel = TimerWheel(self.tickSec, now=loop.time())
+        elif not self.wheel:
+            # The wheel isn't advanced while it is empty
+            self.wheel.advance(loop.time())
+        qmsg.timerWheel = self.wheel
+        qmsg.timerEntry = self.wheel.add(loop.time() + qmsg.afterSec, qmsg)
+        trace(Level.msg, "Timer added", qmsg)
+        if self.handle is None:
+            self._schedule(loop)
+
+    def _schedule(self, loop):
+        self.handle = loop.call_at((self.wheel.currTick + 1) * self.tickSec, self._tick)
+
+    def _tick(self):
+        self.handle = None
+        loop = asyncio.get_event_loop()
+        for entry in self.wheel.advance(loop.time()):
+            qmsg = entry.cb
+            trace(Level.msg, "Firing callback for", qmsg)
+            Metrics.TimersFired.inc()
+            try:
+                qmsg.cb(qmsg.ctx)
+            except Exception as exc: # pylint: disable=broad-exception-caught
+                trace(Level.error, "Timer callback failed", qmsg, repr(exc))
+        if self.wheel:
+            self._schedule(loop)
+
+Timers = TimerScheduler()
+
+def timerSchedule(qmsg):
+    """Schedule a TimerRequest. Cancel it with qmsg.cancel()"""
+    Timers.add(qmsg)
 
 async def timerAdd(qmsg):
-    timerByQmsg[qmsg] = Timer(qmsg)
-
-class Timer:
-    def __init__(self, qmsg):
-        self._qmsg = qmsg
-        self._task = asyncio.ensure_future(self._job())
-
-    async def _job(self):
-        trace(Level.msg, "Starting sleep for", self._qmsg)
-        await asyncio.sleep(self._qmsg.afterSec)
-        trace(Level.msg, "Firing callback for", self._qmsg)
-        self._qmsg.cb(self._qmsg.ctx)
-        trace(Level.msg, "Callback returned for", self._qmsg)
-        del timerByQmsg[self._qmsg] # This is funky? Losing reference to self
+    timerSchedule(qmsg)
+
+# -------------------------------------
+# Metrics read from the state above
+
+Metrics.Gauge("bari_rx_queue_depth",
+              "Messages waiting to be processed by a plugin",
+              ("path",),
+              lambda: (((path,), queue.qsize()) for path, queue in GiRxQueueByPath.items()))
+
+Metrics.Gauge("bari_connections",
+              "Websockets connected to a path",
+              ("path",),
+              lambda: (((path,), len(wss)) for path, wss in WsByPath.items()))
+
+def clientTxQueueDepths(aggregate):
+    """aggregate() of the TX queue depths of the websockets of each path"""
+    depthsByPath = defaultdict(list)
+    for ws, queue in ClientTxQueueByWs.items():
+        if queue is not None:
+            depthsByPath[ClientTxPathByWs[ws]].append(queue.qsize())
+    return (((path,), aggregate(depths)) for path, depths in depthsByPath.items())
+
+Metrics.Gauge("bari_client_tx_queue_depth",
+              "Messages waiting to be sent to the websockets connected to a path",
+              ("path",),
+              lambda: clientTxQueueDepths(sum))
+
+Metrics.Gauge("bari_client_tx_queue_depth_max",
+              "Messages waiting to be sent to the most backed up websocket of a path",
+              ("path",),
+              lambda: clientTxQueueDepths(max))
+
+Metrics.CounterFunc("bari_client_tx_drops_total",
+                    "Messages dropped because a websocket's queue was full",
+                    ("path",),
+                    lambda: (((path,), stats.drops) for path, stats in ClientTxStatsByPath.items()))
+
+Metrics.CounterFunc("bari_client_tx_evictions_total",
+                    "Websockets closed because their queue was full",
+                    ("path",),
+                    lambda: (((path,), stats.evictions)
+                             for path, stats in ClientTxStatsByPath.items()))
+
+Metrics.Gauge("bari_timers_active",
+              "Timers waiting to fire",
+              (),
+              lambda: [((), len(Timers))])
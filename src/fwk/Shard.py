@@ -0,0 +1,399 @@
+"""Running game rooms in worker processes.
+
+    Front process                                   Worker process k
+    +-------------------------------+               +----------------------+
+    | websockets                    |               |                      |
+    | lobby, game lobbies           |  socketpair   | game rooms           |
+    | RemotePlugin (per room) ------+-------------->| (registered as usual)|
+    | clientTxPut() <---------------+---------------+ WorkerTxQueue        |
+    +-------------------------------+               +----------------------+
+
+With --workers N, every game room (a path like "dirty7:3") created by
+a game lobby is pickled and sent to the worker picked by consistent
+hashing of its path. The front registers a RemotePlugin for the path
+that relays connects, disconnects and client messages to the worker.
+The worker relays encoded messages for websockets, InternalGiStatus and
+InternalGiClosed back. Timers and room collection (fwk/RoomGc.py) stay
+in the worker that owns the room.
+
+Websockets are known to workers as RemoteWs (an id and a name).
+
+Writes wait (StreamWriter.drain) while the socketpair is backed up: a
+RemotePlugin stops taking messages from its RX queue and a worker stops
+reading frames. If a worker exits, its rooms are closed like collected
+rooms (InternalGiClosed), their websockets are closed and new rooms go
+to the remaining workers.
+
+Frames on the socketpair are length prefixed pickles:
+
+    front --> worker
+        ("register", gi)
+        ("connect", path, wsId, wsName)
+        ("rx", path, wsId, jmsg)
+        ("disconnect", path, wsId)
+    worker --> front
+        ("tx", wsIds, msg, key, version)
+            version: None or (srcId, idx, version, prevEncoded) of a
+            MsgVersion, rebuilt in the front so that patches are only
+            computed for delta websockets
+        ("internal", qmsg)
+"""
+
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import pickle
+import signal
+import socket
+import struct
+
+from fwk.Bot import (
+        BOT_PROCESSES_DEFAULT,
+        setBotProcesses,
+)
+from fwk.Common import exitOnSignal
+from fwk.EventLog import (
+        EVENT_LOG_SNAPSHOT_EVERY_DEFAULT,
+        setEventLogDir,
+)
+from fwk.GamePlugin import Plugin
+from fwk.Msg import (
+        ClientRxMsg,
+        ClientTxMsg,
+        InternalConnectWsToGi,
+        InternalDisconnectWsToGi,
+        InternalGiClosed,
+        InternalGiStatus,
+        TimerRequest,
+)
+from fwk.RoomGc import (
+        ROOM_GAME_OVER_TTL_SEC_DEFAULT,
+        ROOM_IDLE_TTL_SEC_DEFAULT,
+        roomGcTask,
+        setRoomGc,
+)
+from fwk.MsgSrc import MsgVersion
+from fwk import ServerQueueTask
+from fwk.Trace import (
+        Level,
+        setTraceFile,
+        trace,
+)
+
+FRAME_HEADER = struct.Struct("!I")
+WORKER_STOP_TIMEOUT_SEC = 5
+
+def writeFrame(writer, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(FRAME_HEADER.pack(len(data)) + data)
+
+async def readFrame(reader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    return pickle.loads(await reader.readexactly(FRAME_HEADER.unpack(header)[0]))
+
+def isShardedPath(path):
+    """Game rooms (e.g. "dirty7:3") run in workers. Lobbies don't"""
+    return ":" in path
+
+class HashRing:
+    """Consistent hashing of paths onto nodes"""
+    def __init__(self, nodes, vnodes=64):
+        self._ring = sorted((self.hash("{}-{}".format(node, vnode)), node)
+                            for node in nodes for vnode in range(vnodes))
+        self._hashes = [h for h, _ in self._ring]
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def node(self, key):
+        """Node owning key"""
+        idx = bisect.bisect(self._hashes, self.hash(key)) % len(self._ring)
+        return self._ring[idx][1]
+
+class RelayedJmai:
+    """An encoded message relayed from a worker (stands in for a Jmai
+    in a MsgVersion)"""
+    def __init__(self, msg):
+        self.msg = msg
+
+    def encoded(self):
+        return self.msg
+
+# -------------------------------------
+# Front process
+
+class WorkerLink:
+    """Front side of the connection to a worker process"""
+    def __init__(self, idx, process, sock):
+        self.idx = idx
+        self.process = process
+        self.sock = sock
+        self.reader = None
+        self.writer = None
+        self.closed = False
+
+    async def connect(self, router):
+        self.reader, self.writer = await asyncio.open_connection(sock=self.sock)
+        asyncio.get_event_loop().create_task(self.rxTask(router))
+
+    def send(self, frame):
+        writeFrame(self.writer, frame)
+
+    async def close(self):
+        """The worker exits on the end of the stream"""
+        self.closed = True
+        if self.writer is None:
+            self.sock.close()
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass # The worker exited
+
+    async def drain(self):
+        """Wait while the socketpair is backed up"""
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass # The worker exited: see rxTask
+
+    async def rxTask(self, router):
+        while True:
+            try:
+                frame = await readFrame(self.reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                if self.closed:
+                    return
+                trace(Level.error, "Worker", self.idx, "exited")
+                router.linkLost(self)
+                return
+
+            if frame[0] == "tx":
+                _, wsIds, msg, key, version = frame
+                if version is not None:
+                    srcId, msgIdx, versionNum, prevEncoded = version
+                    version = MsgVersion(srcId, msgIdx, versionNum, RelayedJmai(msg),
+                                         prevEncoded=prevEncoded)
+                key = None if key is None else (self.idx,) + key
+                for wsId in wsIds:
+                    ws = router.wsById.get(wsId)
+                    if ws is not None:
+                        ServerQueueTask.clientTxPut(msg, ws, key=key, version=version)
+            elif frame[0] == "internal":
+                ServerQueueTask.txQueue().put_nowait(frame[1])
+            else:
+                trace(Level.error, "Unexpected frame from worker", self.idx, frame[0])
+
+class RemotePlugin(Plugin):
+    """Stands in for a game room running in a worker process"""
+    def __init__(self, path, name, router, link):
+        super(RemotePlugin, self).__init__(path, name)
+        self.router = router
+        self.link = link
+
+    def processMsg(self, qmsg):
+        if isinstance(qmsg, ClientRxMsg):
+            self.link.send(("rx", self.path, self.router.wsId(qmsg.initiatorWs), qmsg.jmsg))
+            return True
+
+        if isinstance(qmsg, InternalConnectWsToGi):
+            self.link.send(("connect", self.path, self.router.wsId(qmsg.ws), str(qmsg.ws)))
+            return True
+
+        if isinstance(qmsg, InternalDisconnectWsToGi):
+            self.link.send(("disconnect", self.path, self.router.wsId(qmsg.ws)))
+            self.router.wsRelease(qmsg.ws)
+            return True
+
+        return False
+
+    async def worker(self):
+        """Relay messages to the worker, waiting while the link is backed up"""
+        while True:
+            qmsg = await self.rxQueue.get()
+            self.rxQueue.task_done()
+            if not self.processMsg(qmsg):
+                trace(Level.error, "Unexpected message not relayed:", str(qmsg))
+            await self.link.drain()
+
+class Router:
+    """Starts worker processes and places game rooms on them"""
+    def __init__(self, numWorkers, traceFile=None, traceJson=False, eventLogDir=None,
+                 eventLogSnapshotEvery=EVENT_LOG_SNAPSHOT_EVERY_DEFAULT,
+                 botProcesses=BOT_PROCESSES_DEFAULT,
+                 roomGc=(ROOM_IDLE_TTL_SEC_DEFAULT, ROOM_GAME_OVER_TTL_SEC_DEFAULT, None)):
+        """roomGc : setRoomGc() arguments of the workers"""
+        assert numWorkers >= 1
+        ctx = multiprocessing.get_context("spawn")
+        self.links = []
+        for idx in range(numWorkers):
+            frontSock, workerSock = socket.socketpair()
+            process = ctx.Process(target=workerMain, name="bari-worker-{}".format(idx),
+                                  args=(idx, workerSock, traceFile, traceJson,
+                                        eventLogDir, eventLogSnapshotEvery, botProcesses,
+                                        roomGc),
+                                  daemon=True)
+            process.start()
+            workerSock.close()
+            self.links.append(WorkerLink(idx, process, frontSock))
+
+        self.liveLinks = list(self.links)
+        self.ring = HashRing(range(numWorkers))
+        self.wsIdByWs = {}
+        self.wsById = {}
+        self.nextWsId = 0
+
+    async def connect(self):
+        for link in self.links:
+            await link.connect(self)
+
+    def wsId(self, ws):
+        if ws not in self.wsIdByWs:
+            self.nextWsId += 1
+            self.wsIdByWs[ws] = self.nextWsId
+            self.wsById[self.nextWsId] = ws
+        return self.wsIdByWs[ws]
+
+    def wsRelease(self, ws):
+        wsId = self.wsIdByWs.pop(ws, None)
+        self.wsById.pop(wsId, None)
+
+    def register(self, gi):
+        """Send a game room to its worker and register a RemotePlugin for it"""
+        if not self.liveLinks:
+            trace(Level.warn, "No worker left. Running", gi.path, "in this process")
+            ServerQueueTask.registerGameClass(gi)
+            return
+        link = self.links[self.ring.node(gi.path)]
+        trace(Level.game, "Placing", gi.path, "on worker", link.idx)
+        link.send(("register", gi))
+        ServerQueueTask.registerGameClass(RemotePlugin(gi.path, gi.name, self, link))
+
+    def linkLost(self, link):
+        """Close the rooms of a worker that exited and place new rooms on
+        the remaining workers"""
+        self.liveLinks = [live for live in self.liveLinks if live is not link]
+        if self.liveLinks:
+            self.ring = HashRing([live.idx for live in self.liveLinks])
+
+        for path, gi in list(ServerQueueTask.GiByPath.items()):
+            if not isinstance(gi, RemotePlugin) or gi.link is not link:
+                continue
+            trace(Level.error, "Lost", path, "on worker", link.idx)
+            for ws in list(ServerQueueTask.WsByPath.get(path, ())):
+                asyncio.get_event_loop().create_task(ws.close(1011, "Game room lost"))
+            ServerQueueTask.txQueue().put_nowait(InternalGiClosed(path))
+
+    async def stop(self):
+        """Close the links, which makes the workers exit cleanly, and wait
+        for them. A worker still running after WORKER_STOP_TIMEOUT_SEC is
+        terminated"""
+        for link in self.links:
+            await link.close()
+        for link in self.links:
+            link.process.join(WORKER_STOP_TIMEOUT_SEC)
+            if link.process.is_alive():
+                link.process.terminate()
+                link.process.join()
+            link.process.close()
+
+# -------------------------------------
+# Worker process
+
+class RemoteWs:
+    """A websocket owned by the front process"""
+    def __init__(self, wsId, name):
+        self.wsId = wsId
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    def __lt__(self, other):
+        return self.wsId < other.wsId
+
+class WorkerTxQueue:
+    """The TX queue handed to each plugin in a worker"""
+    def __init__(self, writer):
+        self.writer = writer
+
+    def put_nowait(self, qmsg):
+        if isinstance(qmsg, ClientTxMsg):
+            try:
+                msg = qmsg.encoded()
+            except TypeError as exc:
+                trace(Level.error, "Error serializing as JSON:", str(qmsg.jmsg), str(exc))
+                return
+            version = qmsg.version
+            if version is not None:
+                version = (version.srcId, version.idx, version.version, version.prevEncoded)
+            writeFrame(self.writer, ("tx", [ws.wsId for ws in qmsg.toWss], msg,
+                                     qmsg.key, version))
+            return
+
+        if isinstance(qmsg, TimerRequest):
+            ServerQueueTask.timerSchedule(qmsg)
+            return
+
+        if isinstance(qmsg, (InternalGiStatus, InternalGiClosed)):
+            writeFrame(self.writer, ("internal", qmsg))
+            return
+
+        trace(Level.error, "Unexpected message from plugin in worker:", qmsg)
+
+async def workerLoop(sock):
+    reader, writer = await asyncio.open_connection(sock=sock)
+    try:
+        await workerRelay(reader, writer)
+    finally:
+        writer.close()
+
+async def workerRelay(reader, writer):
+    """Relay frames from the front process until it closes the link"""
+    txQueue = WorkerTxQueue(writer)
+    wsById = {}
+    asyncio.get_event_loop().create_task(roomGcTask())
+
+    while True:
+        try:
+            frame = await readFrame(reader)
+        except asyncio.IncompleteReadError:
+            return
+
+        if frame[0] == "rx":
+            _, path, wsId, jmsg = frame
+            ServerQueueTask.giRxMsg(path, ClientRxMsg(jmsg, initiatorWs=wsById[wsId]))
+        elif frame[0] == "connect":
+            _, path, wsId, wsName = frame
+            wsById[wsId] = RemoteWs(wsId, wsName)
+            ServerQueueTask.giRxMsg(path, InternalConnectWsToGi(wsById[wsId]))
+        elif frame[0] == "disconnect":
+            _, path, wsId = frame
+            ServerQueueTask.giRxMsg(path, InternalDisconnectWsToGi(wsById.pop(wsId)))
+        elif frame[0] == "register":
+            ServerQueueTask.registerGameClass(frame[1], giTxQueue=txQueue)
+        else:
+            trace(Level.error, "Unexpected frame", frame[0])
+
+        # Stop reading while the front isn't keeping up
+        try:
+            await writer.drain()
+        except ConnectionError:
+            return
+
+def workerMain(idx, sock, traceFile, traceJson, eventLogDir=None,
+               eventLogSnapshotEvery=EVENT_LOG_SNAPSHOT_EVERY_DEFAULT,
+               botProcesses=BOT_PROCESSES_DEFAULT,
+               roomGc=(ROOM_IDLE_TTL_SEC_DEFAULT, ROOM_GAME_OVER_TTL_SEC_DEFAULT, None)):
+    """Entry point of a worker process. Stopped (SIGTERM) or on losing
+    the front process, it exits cleanly: atexit functions flush storage"""
+    signal.signal(signal.SIGTERM, exitOnSignal)
+    setTraceFile(traceFile, jsonLines=traceJson)
+    setEventLogDir(eventLogDir, eventLogSnapshotEvery)
+    setBotProcesses(botProcesses)
+    setRoomGc(*roomGc)
+    trace(Level.info, "Worker", idx, "started")
+    asyncio.run(workerLoop(sock))
@@ -0,0 +1,57 @@
+"""Play games headless: without websockets, queues or the main loop.
+
+Games are played by calling their rounds and rule engines directly (see
+Dirty7/Simulation.py and Durak/Simulation.py). Their MsgSrcs are given
+Connections(None), which keep the last messages without building or
+sending anything, and client replies go to Replies.
+
+Every game is played from a seed (the random module is seeded with it)
+so a game can be replayed by its seed. runGames() plays games across a
+process pool:
+
+    results = runGames(functools.partial(Dirty7.Simulation.playGame,
+                                         hostParameters=...),
+                       range(100000))
+"""
+
+import multiprocessing
+
+from fwk.Msg import ClientTxMsg
+from fwk.Trace import (
+        Level,
+        setTraceLevels,
+)
+
+SIMULATION_CHUNKSIZE = 64 # Games sent to a worker process at a time
+SIMULATION_TRACE_LEVELS = {Level.error, Level.warn}
+
+class Replies:
+    """Stands in for the TX queue of a game being simulated. Keeps the
+    message type of the last reply sent to a client (e.g. "ATTACK-OKAY")"""
+    def __init__(self):
+        self.last = None
+
+    def put_nowait(self, qmsg):
+        if isinstance(qmsg, ClientTxMsg):
+            self.last = qmsg.jmsg[0]
+
+    def okay(self):
+        """Whether the last reply was an *-OKAY. Clears it"""
+        last, self.last = self.last, None
+        return last is not None and last.endswith("-OKAY")
+
+def initWorker():
+    setTraceLevels(SIMULATION_TRACE_LEVELS)
+
+def runGames(playGame, seeds, processes=None, chunksize=SIMULATION_CHUNKSIZE):
+    """[playGame(seed) for seed in seeds] played across processes worker
+    processes (os.cpu_count() if None; in this process if 1). playGame
+    must be picklable (a module level function or a functools.partial of
+    one) and so must its results. Worker processes only trace errors and
+    warnings"""
+    if processes == 1:
+        return [playGame(seed) for seed in seeds]
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes, initializer=initWorker) as pool:
+        return pool.map(playGame, seeds, chunksize)
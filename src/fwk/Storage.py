@@ -1,6 +1,10 @@
+import asyncio
 from collections import namedtuple
+from concurrent.futures import Future
 import json
+import queue
 import sqlite3
+import threading
 
 from fwk.Trace import (
     Level,
@@ -54,105 +58,317 @@ class Json(Field):
     def decode(self, value):
         return json.loads(value)
 
+# -------------------------------------
+# DB executor
+
+DB_MAX_BATCH_DEFAULT = 256
+DB_SYNCHRONOUS_DEFAULT = "normal"
+DbSynchronousLevels = ("off", "normal", "full", "extra")
+
+# Prepared statements kept by each connection. Tables build a handful of
+# distinct statements each (see Table.sql)
+DB_CACHED_STATEMENTS = 256
+
+class DbJob:
+    """A statement (sql, params) or a function called with the connection.
+    future is None when nobody waits for the result"""
+    __slots__ = ("sql", "params", "func", "future")
+
+    def __init__(self, sql=None, params=(), func=None, future=None):
+        self.sql = sql
+        self.params = params
+        self.func = func
+        self.future = future
+
+    def run(self, conn):
+        if self.func:
+            return self.func(conn)
+        return conn.execute(self.sql, self.params).fetchall()
+
+class DbExecutor:
+    """Owns a sqlite3 connection and runs everything on it in a dedicated
+    writer thread, so that a slow disk doesn't stall the event loop.
+
+    Jobs are queued and run in order. The writer thread takes up to
+    maxBatch queued jobs at a time and runs them in one transaction
+    (group commit: one commit and fsync per batch instead of per
+    statement). Consecutive fire-and-forget statements with the same SQL
+    are run with one executemany.
+
+    Callers either fire and forget (execute, executemany) or get a
+    concurrent.futures.Future (query, submit) to wait on or await with
+    fetch/call.
+    """
+    def __init__(self, filename, maxBatch=DB_MAX_BATCH_DEFAULT,
+                 synchronous=DB_SYNCHRONOUS_DEFAULT):
+        """
+        synchronous : str
+            sqlite's synchronous level (one of DbSynchronousLevels). The
+            database is run in WAL mode: "normal" doesn't fsync on every
+            commit but can't corrupt the database
+        """
+        assert synchronous in DbSynchronousLevels
+        self.filename = filename
+        self.maxBatch = maxBatch
+        self.synchronous = synchronous
+        self.jobs = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name="db:" + filename, daemon=True)
+        self.thread.start()
+
+    def execute(self, sql, params=()):
+        self.jobs.put(DbJob(sql=sql, params=params))
+
+    def executemany(self, sql, seqOfParams):
+        """One job: the statement is run for every params or for none"""
+        seqOfParams = list(seqOfParams)
+        self.jobs.put(DbJob(func=lambda conn: conn.executemany(sql, seqOfParams)))
+
+    def query(self, sql, params=()):
+        """Future of the rows returned by the statement"""
+        future = Future()
+        self.jobs.put(DbJob(sql=sql, params=params, future=future))
+        return future
+
+    def submit(self, func):
+        """Future of func(conn) run on the writer thread as part of a
+        batch's transaction"""
+        future = Future()
+        self.jobs.put(DbJob(func=func, future=future))
+        return future
+
+    async def fetch(self, sql, params=()):
+        return await asyncio.wrap_future(self.query(sql, params))
+
+    async def call(self, func):
+        return await asyncio.wrap_future(self.submit(func))
+
+    def sync(self):
+        """Block until all jobs queued so far are committed"""
+        self.submit(lambda conn: None).result()
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+    # ---------------------------------
+    # Writer thread
+
+    def run(self):
+        conn = sqlite3.connect(self.filename, cached_statements=DB_CACHED_STATEMENTS)
+        conn.execute("pragma journal_mode = wal;")
+        conn.execute("pragma synchronous = {};".format(self.synchronous))
+        while True:
+            jobs = [self.jobs.get()]
+            while len(jobs) < self.maxBatch:
+                try:
+                    jobs.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in jobs
+            jobs = [job for job in jobs if job]
+            if jobs:
+                self.runBatch(conn, jobs)
+            if stop:
+                conn.close()
+                return
+
+    @staticmethod
+    def groups(jobs):
+        """Split jobs in runs of fire-and-forget statements with the same SQL"""
+        groups = []
+        for job in jobs:
+            if (groups and job.sql and not job.future and
+                    groups[-1][0].sql == job.sql and not groups[-1][0].future):
+                groups[-1].append(job)
+            else:
+                groups.append([job])
+        return groups
+
+    def runBatch(self, conn, jobs):
+        groups = self.groups(jobs)
+        try:
+            with conn:
+                results = []
+                for group in groups:
+                    if len(group) > 1:
+                        conn.executemany(group[0].sql, [job.params for job in group])
+                        results.append(None)
+                    else:
+                        results.append(group[0].run(conn))
+        except Exception as exc: # pylint: disable=broad-except
+            if len(jobs) > 1:
+                # Rolled back. Run each job in its own transaction so that
+                # one bad statement doesn't lose the others
+                for job in jobs:
+                    self.runBatch(conn, [job])
+                return
+
+            trace(Level.error, "DB job failed", jobs[0].sql or jobs[0].func, exc)
+            if jobs[0].future:
+                jobs[0].future.set_exception(exc)
+            return
+
+        for group, result in zip(groups, results):
+            if group[0].future:
+                group[0].future.set_result(result)
+
+# -------------------------------------
+# Keys and indexes, declared in Table.fields next to the columns
+#
+#     fields = [
+#         Txt("path", qualifier="not null"),
+#         Txt("alias", qualifier="not null"),
+#         Txt("passwd"),
+#         PrimaryKey("path", "alias"),
+#         Index("passwd"),
+#     ]
+
+class PrimaryKey():
+    """Primary key of the table. Rows are upserted by it"""
+    def __init__(self, *cols):
+        self.cols = cols
+
+class Index():
+    def __init__(self, *cols, unique=False):
+        self.cols = cols
+        self.unique = unique
+
+    def name(self, table):
+        return "{}_{}".format(table, "_".join(self.cols))
+
+    def create_cmd(self, table):
+        return ("create {unique}index if not exists {name} on {table} ({cols});".format(
+            unique="unique " if self.unique else "",
+            name=self.name(table),
+            table=table,
+            cols=", ".join(self.cols)),)
+
 # -------------------------------------
 # Storage table
 
 class Table():
+    """A table of a database run by a DbExecutor. Writes are queued to the
+    executor. Reads (get) wait for the executor: they are meant for startup,
+    not for the event loop.
+
+    The SQL text of each statement is built once per (operation, columns)
+    and cached: the same text is also what lets sqlite3 reuse its prepared
+    statement.
+    """
     fields = []
-    def __init__(self, cursor):
-        self.cursor = cursor
+    def __init__(self, db):
+        self.db = db
         self.name = self.__class__.__name__
+        self.columns = [field for field in self.fields if isinstance(field, Field)]
+        self.primary_key = next((field.cols for field in self.fields
+                                 if isinstance(field, PrimaryKey)), None)
+        self.indexes = [field for field in self.fields if isinstance(field, Index)]
+        self.field_by_name = {field.name: field for field in self.columns}
+        self.sql_cache = {}
         self.create()
-        self.field_by_name = {field.name: field for field in self.fields}
 
     def execute(self, *cmd):
+        """Run a statement and wait for the rows it returns"""
+        trace(Level.db, "table", self.name, "query", cmd)
+        return self.db.query(*cmd).result()
+
+    def executeNoWait(self, *cmd):
         trace(Level.db, "table", self.name, "query", cmd)
-        return self.cursor.execute(*cmd)
+        self.db.execute(*cmd)
+
+    def sql(self, key, build):
+        """SQL text for key, built with build(*key[1:]) the first time"""
+        cmd = self.sql_cache.get(key)
+        if cmd is None:
+            cmd = self.sql_cache[key] = build(*key[1:])
+        return cmd
 
     @property
     def row_type(self):
         if not hasattr(self, "type_"):
             setattr(self, "type_",
                     namedtuple(self.name + "Row",
-                        [row.name for row in self.fields]))
+                        [row.name for row in self.columns]))
         return getattr(self, "type_")
 
-    def get(self, cols, where=None, group_by=None):
-        # pylint: disable=unused-variable,possibly-unused-variable
-        where = where or {}
-        group_by = group_by or []
-        values = []
-
-        cols = ", ".join(cols)
-        table = self.name
-        cmd = "select {cols} from {table}"
+    def get_sql(self, cols, where, group_by):
+        cmd = "select {} from {}".format(", ".join(cols), self.name)
         if where:
-            where_unspec = " and ".join("%s = ?" % w for w in where)
-            values = self.encoded_values(where)
-            cmd += " where {where_unspec}"
+            cmd += " where " + " and ".join("%s = ?" % w for w in where)
         if group_by:
-            group_by = ", ".join(group_by)
-            cmd += " group by {group_by}"
+            cmd += " group by " + ", ".join(group_by)
+        return cmd + ";"
 
-        cmd += ";"
+    def get(self, cols, where=None, group_by=None):
+        where = where or {}
+        cmd = self.sql(("get", tuple(cols), tuple(where), tuple(group_by or ())),
+                       self.get_sql)
 
-        self.execute(cmd.format(**locals()), values)
+        rows = self.execute(cmd, self.encoded_values(where))
         # pylint: disable=not-callable
-        if cols == "*":
+        if list(cols) == ["*"]:
             def deserialized_row(row):
-                return self.row_type(*[field.decode(val) for field, val in zip(self.fields, row)])
-            return [deserialized_row(row) for row in self.cursor.fetchall()]
+                return self.row_type(*[field.decode(val)
+                                       for field, val in zip(self.columns, row)])
+            return [deserialized_row(row) for row in rows]
 
-        return self.cursor.fetchall()
+        return rows
 
     def create_cmd(self):
         # pylint: disable=unused-variable,possibly-unused-variable
         table = self.name
-        name_attrs = ", ".join(field.create_desc() for field in self.fields)
+        name_attrs = ", ".join(field.create_desc() for field in self.columns)
+        if self.primary_key:
+            name_attrs += ", primary key ({})".format(", ".join(self.primary_key))
         return ("""create table {table} ({name_attrs})""".format(**locals()),)
 
     def create(self):
-        cmd_args = self.create_cmd()
-        try:
-            res = self.execute(*cmd_args)
-        except sqlite3.OperationalError as _:
-            return None
-        print("Created table", self.name)
+        if self.execute("select name from sqlite_master where type = 'table' and name = ?;",
+                        (self.name,)):
+            if self.primary_key:
+                # Tables created before the primary key was declared get
+                # a unique index on it instead
+                self.execute(*Index(*self.primary_key, unique=True).create_cmd(self.name))
+            # Columns declared after the table was created are added
+            existing = {row[1] for row in self.execute("pragma table_info({});".format(self.name))}
+            for field in self.columns:
+                if field.name not in existing:
+                    self.execute("alter table {} add column {};".format(self.name,
+                                                                       field.create_desc()))
+            res = None
+        else:
+            res = self.execute(*self.create_cmd())
+            print("Created table", self.name)
+
+        for index in self.indexes:
+            self.execute(*index.create_cmd(self.name))
         return res
 
     def encoded_values(self, dic):
         return [self.field_by_name[k].encode(v) for k, v in dic.items()]
 
+    def insert_sql(self, cells):
+        return "insert into {} ({}) values ({});".format(
+            self.name, ", ".join(cells), ", ".join("?" for _ in cells))
+
     def insert_cmd(self, **kwargs):
-        # pylint: disable=unused-variable,possibly-unused-variable
-        table = self.name
-        cells = ", ".join(kwargs.keys())
-        values = self.encoded_values(kwargs)
-        values_unspec = ", ".join("?" for _ in range(len(kwargs)))
-        cmd = "insert into {table} ({cells}) values ({values_unspec});".format(**locals())
-        return (cmd, values)
+        return (self.sql(("insert", tuple(kwargs)), self.insert_sql),
+                self.encoded_values(kwargs))
 
     def insert(self, **kwargs):
         cmd_args = self.insert_cmd(**kwargs)
-        return self.execute(*cmd_args)
+        self.executeNoWait(*cmd_args)
 
-    def update_cmd(self, values, where):
-        # pylint: disable=unused-variable,possibly-unused-variable
-        table = self.name
-        ret_values = []
-        where_unspec = None
-
-        cols_unspec = ", ".join("%s = ?" % col for col in values)
-        ret_values.extend(self.encoded_values(values))
-
-        cmd = "update {table} set {cols_unspec}"
+    def update_sql(self, cols, where):
+        cmd = "update {} set {}".format(self.name, ", ".join("%s = ?" % col for col in cols))
         if where:
-            where_unspec = " and ".join("%s = ?" % col for col in where)
-            ret_values.extend(self.encoded_values(where))
-            cmd += " where {where_unspec};"
-        else:
-            cmd += ";"
-        return (cmd.format(**locals()), ret_values)
+            cmd += " where " + " and ".join("%s = ?" % col for col in where)
+        return cmd + ";"
+
+    def update_cmd(self, values, where):
+        return (self.sql(("update", tuple(values), tuple(where)), self.update_sql),
+                self.encoded_values(values) + self.encoded_values(where))
 
     def update(self, values, where):
         """
@@ -164,4 +380,128 @@ class Table():
             Dictionary of values to add
         """
         cmd_args = self.update_cmd(values, where)
-        return self.execute(*cmd_args)
+        self.executeNoWait(*cmd_args)
+
+    def upsert_sql(self, keys, cols):
+        action = "nothing"
+        if cols:
+            action = "update set " + ", ".join("{0} = excluded.{0}".format(col) for col in cols)
+        return "{} on conflict ({}) do {};".format(self.insert_sql(keys + cols)[:-1],
+                                                   ", ".join(keys), action)
+
+    def upsert_cmd(self, values, where):
+        """A single statement upserting the row when where is the primary
+        key (None otherwise)"""
+        if not self.primary_key or set(where) != set(self.primary_key):
+            return None
+        row = dict(where)
+        row.update(values)
+        return (self.sql(("upsert", tuple(where), tuple(values)), self.upsert_sql),
+                self.encoded_values(row))
+
+    def upsert_cmds(self, values, where):
+        """Commands for upsertRows: update the rows matching where, or
+        insert one if there are none"""
+        return (self.update_cmd(values, where), self.insert_cmd(**where, **values))
+
+def writeRows(conn, paramsBySql, cmds):
+    """Run a WriteBehind flush on the writer thread of a DbExecutor"""
+    for sql, params in paramsBySql.items():
+        conn.executemany(sql, params)
+    return upsertRows(conn, cmds)
+
+def upsertRows(conn, cmds):
+    """Run upsert_cmds on the writer thread of a DbExecutor"""
+    for updateCmd, insertCmd in cmds:
+        if not conn.execute(*updateCmd).rowcount:
+            conn.execute(*insertCmd)
+    return len(cmds)
+
+# -------------------------------------
+# Write-behind buffering
+
+class WriteBehindBuffer:
+    """Pending row writes of one owner (e.g. a game room). A row is
+    identified by its table and where clause. Writing a row again before
+    it is flushed updates the pending write instead of adding another"""
+    def __init__(self, writeBehind):
+        self.writeBehind = writeBehind
+        self.rows = {}
+
+    def upsert(self, table, where, values):
+        key = (table.name, tuple(where.items()))
+        pending = self.rows.get(key)
+        if pending:
+            pending[2].update(values)
+        else:
+            self.rows[key] = (table, where, dict(values))
+        self.writeBehind.markDirty(self)
+
+    def drain(self):
+        rows = self.rows
+        self.rows = {}
+        return rows.values()
+
+class WriteBehind:
+    """Writes the rows of WriteBehindBuffers to the database in batched
+    transactions: one transaction, flushDelaySec after the first pending
+    write, covers everything written since the last flush. Game state
+    changes cost a dict update instead of a commit each.
+
+    Flushes are scheduled on the running event loop. Without one (e.g. at
+    startup), rows stay buffered until flush() is called. A flush only
+    builds the statements: they run on the DbExecutor's writer thread as
+    a single job, so they are committed together or not at all.
+    """
+    def __init__(self, db, flushDelaySec):
+        self.db = db
+        self.flushDelaySec = flushDelaySec
+        self.dirtyBuffers = {} # WriteBehindBuffer --> None (ordered set)
+        self.flushHandle = None
+
+    def buffer(self):
+        return WriteBehindBuffer(self)
+
+    def markDirty(self, buffer):
+        self.dirtyBuffers[buffer] = None
+        if self.flushHandle:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.flushHandle = loop.call_later(self.flushDelaySec, self.flush)
+
+    def flush(self):
+        """Queue all pending rows to be written in one transaction. Returns
+        the number of rows queued"""
+        if self.flushHandle:
+            self.flushHandle.cancel()
+            self.flushHandle = None
+
+        buffers = self.dirtyBuffers
+        self.dirtyBuffers = {}
+
+        # Rows upserted with the same statement are grouped to run with
+        # one executemany. Rows of tables without a primary key are
+        # updated or inserted one by one
+        paramsBySql = {}
+        cmds = []
+        count = 0
+        for buffer in buffers:
+            for table, where, values in buffer.drain():
+                count += 1
+                cmd = table.upsert_cmd(values, where)
+                if cmd:
+                    paramsBySql.setdefault(cmd[0], []).append(cmd[1])
+                else:
+                    cmds.append(table.upsert_cmds(values, where))
+
+        if count:
+            # One job, so the flush is committed in one transaction even
+            # when other jobs of its batch fail
+            self.db.submit(lambda conn: writeRows(conn, paramsBySql, cmds))
+
+        trace(Level.db, "flushed", count, "rows")
+        return count
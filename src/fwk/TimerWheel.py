@@ -0,0 +1,130 @@
+"""Hierarchical timer wheel.
+
+Time is counted in ticks of tickSec. Level 0 has one slot per tick;
+each higher level has slots spanning a full rotation of the level
+below. A timer is put in the slot of the lowest level that can hold
+its expiry. When a level wraps around, the next slot of the level
+above is cascaded down. Adding and cancelling a timer are O(1);
+advance() expires every timer due in a tick in one batch and skips
+the ticks of the lowest levels while they are empty.
+
+    wheel = TimerWheel(tickSec=0.1)
+    handle = wheel.add(now + 30, cb)
+    wheel.cancel(handle)
+    for entry in wheel.advance(now):
+        entry.cb()
+"""
+
+import math
+
+class TimerEntry:
+    """A timer in the wheel. Returned by TimerWheel.add() as the handle
+    to cancel the timer"""
+    __slots__ = ("expiryTick", "cb", "slot", "level")
+
+    def __init__(self, expiryTick, cb):
+        self.expiryTick = expiryTick
+        self.cb = cb
+        self.slot = None # dict holding the entry while scheduled
+        self.level = None
+
+class TimerWheel:
+    def __init__(self, tickSec=0.1, slotsPerLevel=(256, 64, 64, 64), now=0.0):
+        self.tickSec = tickSec
+        self.slotsPerLevel = slotsPerLevel
+        self.levels = [[{} for _ in range(numSlots)] for numSlots in slotsPerLevel]
+        # Ticks covered by one slot of each level
+        self.ticksPerSlot = []
+        ticks = 1
+        for numSlots in slotsPerLevel:
+            self.ticksPerSlot.append(ticks)
+            ticks *= numSlots
+        self.maxTicks = ticks - 1
+        self.currTick = self.tick(now)
+        self.count = 0
+        self.countByLevel = [0] * len(slotsPerLevel)
+
+    def __len__(self):
+        return self.count
+
+    def tick(self, when):
+        """Tick for a time"""
+        return math.floor(when / self.tickSec)
+
+    def add(self, when, cb):
+        """Schedule cb to be returned by advance() at 'when'. Returns a
+        TimerEntry handle"""
+        entry = TimerEntry(max(math.ceil(when / self.tickSec), self.currTick + 1), cb)
+        self._insert(entry)
+        self.count += 1
+        return entry
+
+    def cancel(self, entry):
+        """Cancel a timer. Returns False if it already expired or was cancelled"""
+        if entry.slot is None:
+            return False
+        del entry.slot[entry]
+        entry.slot = None
+        self.count -= 1
+        self.countByLevel[entry.level] -= 1
+        return True
+
+    def _insert(self, entry):
+        delta = min(entry.expiryTick - self.currTick, self.maxTicks)
+        for level, numSlots in enumerate(self.slotsPerLevel):
+            if delta < self.ticksPerSlot[level] * numSlots:
+                break
+        idx = (entry.expiryTick // self.ticksPerSlot[level]) % numSlots # pylint: disable=undefined-loop-variable
+        entry.slot = self.levels[level][idx]
+        entry.slot[entry] = None
+        entry.level = level
+        self.countByLevel[level] += 1
+
+    def _cascade(self, level):
+        """Move the timers in the current slot of level down"""
+        if level == len(self.levels):
+            return
+        numSlots = self.slotsPerLevel[level]
+        idx = (self.currTick // self.ticksPerSlot[level]) % numSlots
+        if idx == 0:
+            self._cascade(level + 1)
+        slot = self.levels[level][idx]
+        entries = list(slot)
+        slot.clear()
+        self.countByLevel[level] -= len(entries)
+        for entry in entries:
+            self._insert(entry)
+
+    def advance(self, now):
+        """Move the wheel up to 'now'. Returns the expired TimerEntry list"""
+        expired = []
+        target = self.tick(now)
+        while self.currTick < target and self.count:
+            # Nothing expires or cascades before the next slot of the
+            # lowest level holding timers
+            emptyLevels = 0
+            while not self.countByLevel[emptyLevels]:
+                emptyLevels += 1
+            if emptyLevels:
+                span = self.ticksPerSlot[emptyLevels]
+                nextTick = (self.currTick // span + 1) * span
+                if nextTick > target:
+                    self.currTick = target
+                    break
+                self.currTick = nextTick - 1
+
+            self.currTick += 1
+            if self.currTick % self.slotsPerLevel[0] == 0:
+                self._cascade(1)
+
+            slot = self.levels[0][self.currTick % self.slotsPerLevel[0]]
+            for entry in slot:
+                entry.slot = None
+            expired.extend(slot)
+            self.count -= len(slot)
+            self.countByLevel[0] -= len(slot)
+            slot.clear()
+
+        if not self.count:
+            self.currTick = max(self.currTick, target)
+        return expired
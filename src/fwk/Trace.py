@@ -1,7 +1,27 @@
+"""Tracing.
+
+trace() checks the level first and returns before touching its
+arguments when the level is disabled. Enabled calls capture the caller
+with sys._getframe() and append a record to a buffer. A background
+thread formats the records and writes them out, flushing every
+TRACE_FLUSH_INTERVAL_SEC (immediately for errors).
+
+Records are written as text lines by default or as JSON lines
+(setTraceFile(filename, jsonLines=True)):
+
+    {"ts": 1700000000.123, "level": "INFO", "file": "server.py",
+     "line": 204, "func": "main", "msg": "Starting server ..."}
+"""
+
+import atexit
+from collections import deque
+import contextlib
 import datetime
-import inspect
+import json
 import os
 import sys
+import threading
+import time
 
 class Level:
     error = 0
@@ -32,7 +52,7 @@ class Level:
 #   None => no tracing
 #   "*" => all tracing levels
 #   set of numbers => levels to trace
-TRACE_LEVELS = {Level.error, Level.warn,
+TRACE_LEVELS_DEFAULT = {Level.error, Level.warn,
                 Level.game,
                 Level.rnd,
                 Level.play,
@@ -41,32 +61,126 @@ TRACE_LEVELS = {Level.error, Level.warn,
                 #Level.debug,
                 Level.conn,
                 Level.db}
+TRACE_LEVELS = TRACE_LEVELS_DEFAULT
+
+TRACE_FLUSH_INTERVAL_SEC = 0.5
+
+def enabledLevels(levels):
+    """Set of levels enabled by a TRACE_LEVELS like value"""
+    if levels is None:
+        return frozenset()
+    if levels == "*":
+        return frozenset(Level.strep)
+    return frozenset(levels)
+
+TraceEnabled = enabledLevels(TRACE_LEVELS)
+
+def setTraceLevels(levels):
+    """Change the levels being traced (see TRACE_LEVELS)"""
+    global TRACE_LEVELS, TraceEnabled # pylint: disable=global-statement
+    TRACE_LEVELS = levels
+    TraceEnabled = enabledLevels(levels)
+
+def traceEnabled(lvl):
+    """Use to skip building expensive trace arguments"""
+    return lvl in TraceEnabled
 
 # Trace output
-traceout=sys.stderr
+traceout = sys.stderr
+traceJsonLines = False
 
-def setTraceFile(filename):
-    global traceout # pylint: disable=global-statement
+def setTraceFile(filename, jsonLines=False):
+    global traceout, traceJsonLines # pylint: disable=global-statement
+    flushTrace()
     if filename:
         traceout = open(filename, "a", encoding="ascii") # pylint: disable=consider-using-with
     else:
         traceout = sys.stderr
+    traceJsonLines = jsonLines
 
-def trace(lvl, *msg):
-    if TRACE_LEVELS is None:
-        return
-    if not TRACE_LEVELS == "*":
-        if lvl not in TRACE_LEVELS:
-            return
+# -------------------------------------
+# Buffered writer
+
+class TraceWriter:
+    """Drains trace records to traceout from a background thread"""
+    def __init__(self):
+        self.records = deque()
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock() # Serializes writes to traceout
+        self.pid = None
+        self.thread = None
+
+    def start(self):
+        """Start the writer thread (again, after a fork)"""
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name="TraceWriter", daemon=True)
+        self.thread.start()
 
-    now = datetime.datetime.now()
+    def put(self, record):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.start()
+        self.records.append(record)
+        if record[1] == Level.error:
+            self.wakeup.set()
 
-    currentframe = inspect.currentframe()
-    caller = inspect.getouterframes(currentframe, 2)[1]
-    framedesc = "%s:%s %s" % (os.path.split(caller.filename)[-1], caller.lineno, caller.function)
-    traceout.write("%-26s %-5s %-40s" % (now, Level.strep[lvl], framedesc))
-    for m in msg:
-        traceout.write(" " + str(m))
-    traceout.write("\n")
+    def run(self):
+        while True:
+            self.wakeup.wait(TRACE_FLUSH_INTERVAL_SEC)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write out all buffered records"""
+        with self.lock:
+            if not self.records:
+                return
+            fmt = formatJson if traceJsonLines else formatText
+            lines = []
+            while self.records:
+                lines.append(fmt(self.records.popleft()))
+            traceout.write("".join(lines))
+            traceout.flush()
+
+def formatText(record):
+    ts, lvl, filename, lineno, func, msg = record
+    framedesc = "%s:%s %s" % (os.path.basename(filename), lineno, func)
+    return "%-26s %-5s %-40s %s\n" % (datetime.datetime.fromtimestamp(ts),
+                                      Level.strep[lvl], framedesc, msg)
+
+def formatJson(record):
+    ts, lvl, filename, lineno, func, msg = record
+    return json.dumps({"ts": ts, "level": Level.strep[lvl], "file": os.path.basename(filename),
+                       "line": lineno, "func": func, "msg": msg}) + "\n"
+
+Writer = TraceWriter()
+
+def flushTrace():
+    """Write out buffered trace records"""
+    Writer.flush()
+
+atexit.register(flushTrace)
+
+TraceMuted = threading.local()
+
+@contextlib.contextmanager
+def mutedTraces():
+    """Drop the traces, other than errors and warnings, made by this
+    thread in the block (e.g. by the games a bot simulates)"""
+    TraceMuted.muted = True
+    try:
+        yield
+    finally:
+        TraceMuted.muted = False
+
+def trace(lvl, *msg):
+    if lvl not in TraceEnabled:
+        return
+    if lvl > Level.warn and getattr(TraceMuted, "muted", False):
+        return
 
-    traceout.flush()
+    frame = sys._getframe(1) # pylint: disable=protected-access
+    code = frame.f_code
+    Writer.put((time.time(), lvl, code.co_filename, frame.f_lineno,
+                code.co_name, " ".join([str(m) for m in msg])))
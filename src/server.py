@@ -9,16 +9,27 @@ versa.
 from argparse import ArgumentParser
 import asyncio
 import itertools
-import json
+import signal
+from urllib.parse import parse_qs
 import websockets
 
 from config import (
+        CLIENT_TX_FLUSH_DELAY_MS_DEFAULT,
+        CLIENT_TX_MAX_BATCH_DEFAULT,
+        CLIENT_TX_QUEUE_MAX_DEFAULT,
+        CLIENT_TX_QUEUE_POLICY_DEFAULT,
+        WORKERS_DEFAULT,
         WS_SERVER_PORT_DEFAULT,
 )
 from fwk.ServerQueueTask import (
+        ClientTxPolicies,
+        clientTxConfig,
         clientTxMsg,
+        clientTxQueueConfig,
         clientTxQueueAdd,
         clientTxQueueRemove,
+        clientTxSend,
+        deregisterGameClass,
         giByPath,
         giRxMsg,
         registerGameClass,
@@ -27,21 +38,46 @@ from fwk.ServerQueueTask import (
         wsPathAdd,
         wsPathRemove,
 )
+from fwk import JsonDecode
 from fwk.LobbyPlugin import LOBBY_PATH
 from fwk.Msg import (
         InternalConnectWsToGi,
         InternalDisconnectWsToGi,
+        InternalGiClosed,
         InternalGiStatus,
         InternalHost,
         InternalRegisterGi,
         ClientRxMsg,
         ClientTxMsg,
         TimerRequest,
+        constJmsg,
 )
 from fwk.MsgType import (
         MTYPE_ERROR,
+        MTYPE_HOST_BAD,
+)
+from fwk.Bot import (
+        BOT_PROCESSES_DEFAULT,
+        setBotProcesses,
+)
+from fwk.EventLog import (
+        EVENT_LOG_SNAPSHOT_EVERY_DEFAULT,
+        setEventLogDir,
 )
 import fwk.LobbyPlugin
+import fwk.Metrics
+from fwk.RoomGc import (
+        ROOM_GAME_OVER_TTL_SEC_DEFAULT,
+        ROOM_IDLE_TTL_SEC_DEFAULT,
+        roomGcTask,
+        setRoomGc,
+)
+import fwk.Storage
+from fwk.Common import exitOnSignal
+from fwk.Shard import (
+        Router,
+        isShardedPath,
+)
 from fwk.Trace import (
         Level,
         setTraceFile,
@@ -49,6 +85,7 @@ from fwk.Trace import (
 )
 import Chat.ChatLobbyPlugin
 import Dirty7.Dirty7Lobby
+import Dirty7.Storage
 import Durak.DurakLobbyPlugin
 import Taboo.TabooLobby
 
@@ -67,20 +104,29 @@ async def rxClient(clientWs, path):
     """
     Method to handle each client websocket connecting to
     the server.
+
+    Clients may opt in to features with query parameters in the
+    path. For example, "/dirty7:1?batch=1"
+        batch=1 : receive messages batched in a JSON array
+        delta=1 : receive SNAPSHOT/PATCH messages for large snapshots
     """
+    path, _, query = path.partition("?")
     path = path.strip("/")
+    options = parse_qs(query)
     wsSetBariName(clientWs)
 
     # GxRxQueue + task must exist if the path is valid in this check
     if giByPath(path) is None:
-        await clientWs.send(json.dumps([MTYPE_ERROR, "Bad path"]))
+        await clientWs.send(constJmsg(MTYPE_ERROR, "Bad path").encoded())
         return
 
     # Register ws <--> path
     wsPathAdd(clientWs, path)
 
     # Queue+task for messages to ws
-    clientTxQueueAdd(clientWs)
+    clientTxQueueAdd(clientWs, path=path,
+                     batchEnvelope=options.get("batch") == ["1"],
+                     delta=options.get("delta") == ["1"])
 
     # Queue+task
     giRxMsg(path, InternalConnectWsToGi(clientWs))
@@ -88,17 +134,19 @@ async def rxClient(clientWs, path):
     try:
         async for message in clientWs:
             try:
-                jmsg = json.loads(message)
-            except json.decoder.JSONDecodeError:
-                await clientTxMsg([MTYPE_ERROR, "Bad JSON message"], clientWs)
+                jmsg = JsonDecode.loads(message)
+            except JsonDecode.DecodeError:
+                await clientTxMsg(constJmsg(MTYPE_ERROR, "Bad JSON message").encoded(), clientWs)
                 continue
 
             if not isinstance(jmsg, list):
-                await clientTxMsg([MTYPE_ERROR, "Bad message: not a list"], clientWs)
+                await clientTxMsg(constJmsg(MTYPE_ERROR, "Bad message: not a list").encoded(),
+                                  clientWs)
                 continue
 
             if not jmsg:
-                await clientTxMsg([MTYPE_ERROR, "Bad message: empty list"], clientWs)
+                await clientTxMsg(constJmsg(MTYPE_ERROR, "Bad message: empty list").encoded(),
+                                  clientWs)
                 continue
 
             giRxMsg(path, ClientRxMsg(jmsg, initiatorWs=clientWs))
@@ -112,11 +160,15 @@ async def rxClient(clientWs, path):
 
     clientTxQueueRemove(clientWs)
 
-async def giTxQueue(queue):
+async def giTxQueue(queue, router=None):
     """
-    Task to drain the queue with messages from game instances.
-    These messages can be meant for other game instances (only lobby)
-    or to client websockets.
+    Task to drain the queue with control messages from game instances.
+    Messages to client websockets are normally dispatched directly by
+    each plugin's PluginTxQueue and only show up here if they were
+    queued in the common TX queue.
+
+    router : fwk.Shard.Router (optional)
+        When set, game rooms are placed on worker processes
     """
     while True:
         qmsg = await queue.get()
@@ -124,68 +176,167 @@ async def giTxQueue(queue):
 
         if isinstance(qmsg, InternalHost):
             if giByPath(qmsg.path) is None:
-                await clientTxMsg("Bad path", qmsg.initiatorWs)
+                await clientTxMsg(constJmsg(MTYPE_HOST_BAD, "Bad path").encoded(), qmsg.initiatorWs)
                 continue
             giRxMsg(qmsg.path, qmsg)
             continue
 
         if isinstance(qmsg, InternalRegisterGi):
-            registerGameClass(qmsg.gi)
+            if router and isShardedPath(qmsg.gi.path):
+                router.register(qmsg.gi)
+            else:
+                registerGameClass(qmsg.gi)
             continue
 
         if isinstance(qmsg, InternalGiStatus):
             giRxMsg(LOBBY_PATH, qmsg)
             continue
 
-        if isinstance(qmsg, TimerRequest):
-            await timerAdd(qmsg)
+        if isinstance(qmsg, InternalGiClosed):
+            # Rooms in this process were deregistered when collected.
+            # Rooms in workers are still registered as a RemotePlugin
+            if giByPath(qmsg.fromPath) is not None:
+                deregisterGameClass(qmsg.fromPath)
+            giRxMsg(LOBBY_PATH, qmsg)
+            giRxMsg(qmsg.fromPath.partition(":")[0], qmsg)
             continue
 
-        try:
-            msg = json.dumps(qmsg.jmsg)
-        except TypeError as exc:
-            trace(Level.error, "Error serializing as JSON:", str(qmsg.jmsg), str(exc))
+        if isinstance(qmsg, TimerRequest):
+            await timerAdd(qmsg)
             continue
 
         assert isinstance(qmsg, ClientTxMsg)
-        for toWs in qmsg.toWss:
-            await clientTxMsg(msg, toWs)
+        clientTxSend(qmsg)
 
 
-def main(wsAddr="0.0.0.0"):
-    """Initialize websocket serving server and load plugins"""
+def main(wsAddr="0.0.0.0", argv=None):
+    """Initialize websocket serving server and load plugins. Options
+    are parsed from argv (default: sys.argv)"""
 
     parser = ArgumentParser()
     parser.add_argument("-p", "--port", metavar="PORT",
                         help="Listen port (default={})".format(WS_SERVER_PORT_DEFAULT),
                         default=WS_SERVER_PORT_DEFAULT)
+    parser.add_argument("--metrics-port", metavar="PORT", type=int,
+                        help="Serve metrics at http://{}:PORT{} (default: not served)".format(
+                            fwk.Metrics.METRICS_HOST, fwk.Metrics.METRICS_PATH),
+                        default=0)
     parser.add_argument("--d7-storage", metavar="SQLITE3_FILE",
                         help="Dirty7 sqlite3 storage file (default={})".format(
                             Dirty7.Dirty7Lobby.DefaultStorageFile),
                         default=Dirty7.Dirty7Lobby.DefaultStorageFile)
+    parser.add_argument("--d7-flush-delay-ms", metavar="MSEC", type=float,
+                        help="Max time Dirty7 game state changes are buffered before "
+                             "being written to storage (default={})".format(
+                                 Dirty7.Storage.FLUSH_DELAY_SEC_DEFAULT * 1000),
+                        default=Dirty7.Storage.FLUSH_DELAY_SEC_DEFAULT * 1000)
+    parser.add_argument("--d7-synchronous", choices=fwk.Storage.DbSynchronousLevels,
+                        help="sqlite synchronous level of Dirty7 storage (default={})".format(
+                            fwk.Storage.DB_SYNCHRONOUS_DEFAULT),
+                        default=fwk.Storage.DB_SYNCHRONOUS_DEFAULT)
     parser.add_argument("--trace-file",
                         help="Trace file (default=STDERR)")
-
-    args = parser.parse_args()
-    setTraceFile(args.trace_file)
+    parser.add_argument("--trace-json", action="store_true",
+                        help="Write traces as JSON lines")
+    parser.add_argument("--event-log-dir", metavar="DIR",
+                        help="Log the messages handled by each game room in DIR "
+                             "(default: no event log)")
+    parser.add_argument("--event-log-snapshot-every", metavar="COUNT", type=int,
+                        help="Records after which a room's event log is compacted to a "
+                             "snapshot (default={})".format(EVENT_LOG_SNAPSHOT_EVERY_DEFAULT),
+                        default=EVENT_LOG_SNAPSHOT_EVERY_DEFAULT)
+    parser.add_argument("--json-decoder", choices=sorted(JsonDecode.Decoders),
+                        help="JSON decoder for client messages (default={})".format(
+                            JsonDecode.DECODER_DEFAULT),
+                        default=JsonDecode.DECODER_DEFAULT)
+    parser.add_argument("--workers", metavar="COUNT", type=int,
+                        help="Worker processes running game rooms, 0 to run "
+                             "everything in this process (default={})".format(WORKERS_DEFAULT),
+                        default=WORKERS_DEFAULT)
+    parser.add_argument("--bot-processes", metavar="COUNT", type=int,
+                        help="Processes (per worker) deciding the moves of bots, 0 to "
+                             "decide them in threads, holding the GIL (default=%d)" %
+                             BOT_PROCESSES_DEFAULT,
+                        default=BOT_PROCESSES_DEFAULT)
+    parser.add_argument("--room-idle-ttl-sec", metavar="SEC", type=float,
+                        help="Time after which a room without clients is collected, 0 "
+                             "to keep it (default={})".format(ROOM_IDLE_TTL_SEC_DEFAULT),
+                        default=ROOM_IDLE_TTL_SEC_DEFAULT)
+    parser.add_argument("--room-game-over-ttl-sec", metavar="SEC", type=float,
+                        help="Time after which a room whose game is over and without "
+                             "clients is collected, 0 to keep it (default={})".format(
+                                 ROOM_GAME_OVER_TTL_SEC_DEFAULT),
+                        default=ROOM_GAME_OVER_TTL_SEC_DEFAULT)
+    parser.add_argument("--room-archive", metavar="SQLITE3_FILE",
+                        help="Archive collected rooms in SQLITE3_FILE (default: no archive)")
+    parser.add_argument("--tx-max-batch", metavar="COUNT", type=int,
+                        help="Max messages sent to a client per batch (default={})".format(
+                            CLIENT_TX_MAX_BATCH_DEFAULT),
+                        default=CLIENT_TX_MAX_BATCH_DEFAULT)
+    parser.add_argument("--tx-flush-delay-ms", metavar="MSEC", type=float,
+                        help="Max time to wait for more messages before sending a "
+                             "batch to a client (default={})".format(
+                                 CLIENT_TX_FLUSH_DELAY_MS_DEFAULT),
+                        default=CLIENT_TX_FLUSH_DELAY_MS_DEFAULT)
+    parser.add_argument("--tx-queue-max", metavar="COUNT", type=int,
+                        help="Max messages queued per client, 0 for unbounded "
+                             "(default={})".format(CLIENT_TX_QUEUE_MAX_DEFAULT),
+                        default=CLIENT_TX_QUEUE_MAX_DEFAULT)
+    parser.add_argument("--tx-queue-policy", choices=ClientTxPolicies,
+                        help="What to do when a client's queue is full (default={})".format(
+                            CLIENT_TX_QUEUE_POLICY_DEFAULT),
+                        default=CLIENT_TX_QUEUE_POLICY_DEFAULT)
+
+    args = parser.parse_args(argv)
+    setTraceFile(args.trace_file, jsonLines=args.trace_json)
+    setEventLogDir(args.event_log_dir, args.event_log_snapshot_every)
+    JsonDecode.setDecoder(args.json_decoder)
+    clientTxConfig(args.tx_max_batch, args.tx_flush_delay_ms / 1000)
+    clientTxQueueConfig(args.tx_queue_max, args.tx_queue_policy)
+    setBotProcesses(args.bot_processes)
+    roomGc = (args.room_idle_ttl_sec, args.room_game_over_ttl_sec, args.room_archive)
 
     trace(Level.info, "Starting server. Listening on", wsAddr, "port", args.port)
     wsServer = websockets.serve(rxClient, wsAddr, args.port) # pylint: disable=no-member
-
-    asyncio.get_event_loop().create_task(giTxQueue(txQueue()))
+    if args.metrics_port:
+        trace(Level.info, "Serving metrics on", fwk.Metrics.METRICS_HOST, "port",
+              args.metrics_port)
+        asyncio.get_event_loop().run_until_complete(fwk.Metrics.serve(args.metrics_port))
+
+    router = None
+    if args.workers:
+        router = Router(args.workers, traceFile=args.trace_file, traceJson=args.trace_json,
+                        eventLogDir=args.event_log_dir,
+                        eventLogSnapshotEvery=args.event_log_snapshot_every,
+                        botProcesses=args.bot_processes, roomGc=roomGc)
+        asyncio.get_event_loop().run_until_complete(router.connect())
+
+    asyncio.get_event_loop().create_task(giTxQueue(txQueue(), router=router))
+    if not router:
+        # Otherwise the workers collect the rooms they run
+        setRoomGc(*roomGc)
+        asyncio.get_event_loop().create_task(roomGcTask())
 
     plugins = [
             fwk.LobbyPlugin.plugin(),
             Chat.ChatLobbyPlugin.plugin(),
-            Dirty7.Dirty7Lobby.plugin(args.d7_storage),
+            Dirty7.Dirty7Lobby.plugin(args.d7_storage, args.d7_flush_delay_ms / 1000,
+                                      args.d7_synchronous),
             Durak.DurakLobbyPlugin.plugin(),
             Taboo.TabooLobby.plugin(),
     ]
     for plugin in plugins:
         registerGameClass(plugin)
 
+    # Exit cleanly, so that storage is flushed (see Dirty7.Storage.closeStorages)
+    signal.signal(signal.SIGTERM, exitOnSignal)
     asyncio.get_event_loop().run_until_complete(wsServer)
-    asyncio.get_event_loop().run_forever()
+    try:
+        asyncio.get_event_loop().run_forever()
+    finally:
+        if router:
+            # Workers exit cleanly too when their link is closed
+            asyncio.get_event_loop().run_until_complete(router.stop())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,264 @@
+import asyncio
+import random
+import tempfile
+import threading
+import time
+import unittest
+
+from test.MsgTestLib import MsgTestLib
+from Dirty7 import (
+        Dirty7Room,
+        Dirty7Round,
+)
+from Dirty7 import Bot as Dirty7Bot
+from Durak import Room as DurakRoom
+from Durak.RoundParameters import RoundParameters as DurakParameters
+from fwk import EventLog
+from fwk.Bot import (
+        BOT_DECISION_GRACE_SEC,
+        BOT_PROCESSES_DEFAULT,
+        Bots,
+        BotWs,
+        runDecision,
+        setBotProcesses,
+        timeBudgetSec,
+)
+from fwk.Exceptions import InvalidDataException
+from fwk.Msg import (
+        ClientRxMsg,
+        ClientTxMsg,
+        InternalConnectWsToGi,
+        InternalDisconnectWsToGi,
+        TimerRequest,
+)
+
+def dirty7Parameters(botTimeBudgetSec=0.01, stopPoints=100):
+    return Dirty7Round.RoundParameters(["basic"], 2, 2, 1, 7, [7], 40,
+                                       stopPoints=stopPoints,
+                                       scoringSystems=['standard'],
+                                       botTimeBudgetSec=botTimeBudgetSec)
+
+def drain(queue):
+    msgs = []
+    while not queue.empty():
+        msgs.append(queue.get_nowait())
+    return msgs
+
+class BotTest(unittest.TestCase, MsgTestLib):
+    def setUp(self):
+        random.seed(1)
+
+    def setUpDirty7Room(self, botTimeBudgetSec=0.01):
+        room = Dirty7Room.Dirty7Room("dirty7:1", "Dirty7 #1", None,
+                                     dirty7Parameters(botTimeBudgetSec))
+        room.setRxTxQueues(asyncio.Queue(), asyncio.Queue())
+        room.processMsg(InternalConnectWsToGi("ws1"))
+        drain(room.txQueue)
+        return room
+
+    def processQueued(self, room):
+        """Process the messages the room queued to itself"""
+        for qmsg in drain(room.rxQueue):
+            room.processMsg(qmsg)
+
+    def testBotWs(self):
+        ws = BotWs("bot1")
+        self.assertEqual(ws, "bot:bot1")
+        self.assertIsNone(ws.wsId)
+
+    def testTimeBudget(self):
+        self.assertEqual(timeBudgetSec(0), 0)
+        self.assertEqual(timeBudgetSec(2.5), 2.5)
+        for value in (-1, 11, "1", True, None):
+            with self.assertRaises(InvalidDataException):
+                timeBudgetSec(value)
+
+        params = Dirty7Round.RoundParameters.fromJmsg([["basic"], 2, 2, 1, 7, [7], 40, 100,
+                                                       ["standard"]])
+        self.assertEqual(params.botTimeBudgetSec, 1.0)
+        params = Dirty7Round.RoundParameters.fromJmsg([["basic"], 2, 2, 1, 7, [7], 40, 100,
+                                                       ["standard"], 0])
+        self.assertEqual(params.botTimeBudgetSec, 0)
+        self.assertNotIn("botTimeBudgetSec", params.state)
+
+        params = DurakParameters.fromJmsg([{"numPlayers": 2, "stopPoints": 1,
+                                            "botTimeBudgetSec": 0.5}])
+        self.assertEqual(params.botTimeBudgetSec, 0.5)
+        with self.assertRaises(InvalidDataException):
+            DurakParameters.fromJmsg([{"numPlayers": 2, "stopPoints": 1,
+                                       "botTimeBudgetSec": 20}])
+
+    def testAddBot(self):
+        room = self.setUpDirty7Room()
+        room.processMsg(ClientRxMsg(["ADD-BOT"], initiatorWs="ws1"))
+        self.assertGiTxQueueMsgs(room.txQueue, [
+            ClientTxMsg(["ADD-BOT-OKAY", "bot1"], {"ws1"}, initiatorWs="ws1")])
+
+        room.processMsg(ClientRxMsg(["JOIN", "plyr1", "1"], initiatorWs="ws1"))
+        drain(room.txQueue)
+
+        # The bot's JOIN is pending: its seat is taken
+        room.processMsg(ClientRxMsg(["ADD-BOT"], initiatorWs="ws1"))
+        self.assertGiTxQueueMsgs(room.txQueue, [
+            ClientTxMsg(["ADD-BOT-BAD", "Enough players joined already"], {"ws1"},
+                        initiatorWs="ws1")])
+
+        self.processQueued(room)
+        self.assertEqual(room.playerByWs[BotWs("bot1")].name, "bot1")
+        self.assertEqual(room.currRound.roundParams.roundNum, 1)
+        drain(room.txQueue)
+
+        room.processMsg(ClientRxMsg(["ADD-BOT"], initiatorWs="ws1"))
+        self.assertGiTxQueueMsgs(room.txQueue, [
+            ClientTxMsg(["ADD-BOT-BAD", "Game has started already"], {"ws1"},
+                        initiatorWs="ws1")])
+
+    def testAddBotDisabled(self):
+        room = self.setUpDirty7Room(botTimeBudgetSec=0)
+        room.processMsg(ClientRxMsg(["ADD-BOT"], initiatorWs="ws1"))
+        self.assertGiTxQueueMsgs(room.txQueue, [
+            ClientTxMsg(["ADD-BOT-BAD", "Bots are disabled in this game"], {"ws1"},
+                        initiatorWs="ws1")])
+
+    def testDecide(self):
+        room = self.setUpDirty7Room()
+        room.processMsg(ClientRxMsg(["ADD-BOT"], initiatorWs="ws1"))
+        self.processQueued(room)
+        room.processMsg(ClientRxMsg(["JOIN", "plyr1", "1"], initiatorWs="ws1"))
+        if room.currRound.turn.current() != "bot1":
+            card = room.currRound.playerRoundStatus["plyr1"].hand.cards[0]
+            room.processMsg(ClientRxMsg(["PLAY", {"dropCards": [card.toJmsg()],
+                                                  "numDrawCards": 1}], initiatorWs="ws1"))
+        drain(room.txQueue)
+
+        ws = BotWs("bot1")
+        self.assertIsNone(Dirty7Bot.botView(room, "ws1"))
+        view = Dirty7Bot.botView(room, ws)
+        for budget in (0, 0.05):
+            start = time.monotonic()
+            jmsg = Dirty7Bot.decide(view, budget, 1)
+            self.assertLess(time.monotonic() - start, budget + BOT_DECISION_GRACE_SEC)
+            self.assertIn(jmsg[0], ("PLAY", "DECLARE"))
+
+        room.processMsg(ClientRxMsg(jmsg, initiatorWs=ws))
+        self.assertFalse([msg for msg in drain(room.txQueue)
+                          if isinstance(msg, ClientTxMsg) and msg.jmsg[0].endswith("-BAD")])
+
+    def testTakeover(self):
+        room = self.setUpDirty7Room()
+        room.processMsg(InternalConnectWsToGi("ws2"))
+        room.processMsg(ClientRxMsg(["JOIN", "plyr1", "1"], initiatorWs="ws1"))
+        room.processMsg(ClientRxMsg(["JOIN", "plyr2", "2"], initiatorWs="ws2"))
+        drain(room.txQueue)
+
+        room.processMsg(InternalDisconnectWsToGi("ws2"))
+        timers = [msg for msg in drain(room.txQueue) if isinstance(msg, TimerRequest)]
+        self.assertEqual(len(timers), 1)
+        timers[0].cb(timers[0].ctx)
+        self.processQueued(room)
+        self.assertIs(room.playerByWs[BotWs("plyr2")], room.playerByName["plyr2"])
+
+        # The player is back: the bot leaves
+        room.processMsg(InternalConnectWsToGi("ws3"))
+        room.processMsg(ClientRxMsg(["JOIN", "plyr2", "2"], initiatorWs="ws3"))
+        qmsgs = drain(room.rxQueue)
+        self.assertEqual([(type(qmsg), qmsg.ws) for qmsg in qmsgs],
+                         [(InternalDisconnectWsToGi, BotWs("plyr2"))])
+        room.processMsg(qmsgs[0])
+        self.assertEqual(drain(room.rxQueue), [])
+        self.assertNotIn("plyr2", room.bots.wsByName)
+        self.assertNotIn(BotWs("plyr2"), room.playerByWs)
+
+    def testTakeoverCancelled(self):
+        room = self.setUpDirty7Room()
+        room.processMsg(InternalConnectWsToGi("ws2"))
+        room.processMsg(ClientRxMsg(["JOIN", "plyr1", "1"], initiatorWs="ws1"))
+        room.processMsg(ClientRxMsg(["JOIN", "plyr2", "2"], initiatorWs="ws2"))
+        room.processMsg(InternalDisconnectWsToGi("ws2"))
+        timers = [msg for msg in drain(room.txQueue) if isinstance(msg, TimerRequest)]
+        room.processMsg(InternalConnectWsToGi("ws3"))
+        room.processMsg(ClientRxMsg(["JOIN", "plyr2", "2"], initiatorWs="ws3"))
+        self.assertTrue(timers[0].cancelled)
+
+    def testDecisionTimeoutOffLoop(self):
+        calls = [] # (budget, thread) of each decision
+        release = threading.Event()
+        def decideFn(view, budget, seed):
+            calls.append((budget, threading.current_thread()))
+            if budget:
+                release.wait(10)
+            return ["PLAY", view, seed]
+
+        room = Dirty7Room.Dirty7Room("dirty7:1", "Dirty7 #1", None, dirty7Parameters())
+        bots = Bots(room, None, decideFn, 5)
+        played = []
+        bots.play = lambda name, view, jmsg: played.append((name, view, jmsg))
+
+        async def run():
+            room.setRxTxQueues(asyncio.Queue(), asyncio.Queue())
+            bots.decide("bot1", "view1", seed=7)
+            while not calls:
+                await asyncio.sleep(0.01)
+            bots.decisionTimeoutCb("bot1")
+            self.assertFalse(played)
+            while not played:
+                await asyncio.sleep(0.01)
+            release.set()
+
+        setBotProcesses(0)
+        try:
+            asyncio.run(run())
+        finally:
+            release.set()
+            setBotProcesses(BOT_PROCESSES_DEFAULT)
+        self.assertEqual(calls[1][0], 0)
+        self.assertIsNot(calls[1][1], threading.main_thread())
+        self.assertListEqual(played, [("bot1", "view1", ["PLAY", "view1", 7])])
+
+        # A decision that waited past its deadline has no time left
+        self.assertEqual(runDecision(lambda view, budget, seed: budget, None,
+                                     time.time() - 1, 0), 0)
+
+    async def playBots(self, room, done, timeoutSec=30):
+        """Run room's worker until done()"""
+        worker = asyncio.create_task(room.worker())
+        deadline = time.monotonic() + timeoutSec
+        while not done() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        worker.cancel()
+        self.assertTrue(done())
+
+    def testDirty7BotsPlayAndReplay(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            EventLog.setEventLogDir(tmpdir)
+            try:
+                room = Dirty7Room.Dirty7Room("dirty7:1", "Dirty7 #1", None, dirty7Parameters())
+                EventLog.attach(room)
+
+                async def run():
+                    room.setRxTxQueues(asyncio.Queue(), asyncio.Queue())
+                    for qmsg in (InternalConnectWsToGi("ws1"),
+                                 ClientRxMsg(["ADD-BOT"], initiatorWs="ws1"),
+                                 ClientRxMsg(["ADD-BOT"], initiatorWs="ws1")):
+                        room.rxQueue.put_nowait(qmsg)
+                    await self.playBots(room, lambda: len(room.rounds) >= 2)
+                asyncio.run(run())
+
+                EventLog.flushEventLog()
+                replayed = EventLog.replay(room.eventLog.filename)
+                self.assertEqual(replayed.snapshot(), room.snapshot())
+            finally:
+                EventLog.setEventLogDir(None)
+                EventLog.flushEventLog()
+
+    def testDurakBotsPlay(self):
+        room = DurakRoom.Room("durak:1", "Durak #1", DurakParameters(2, 1, botTimeBudgetSec=0.01))
+
+        async def run():
+            room.setRxTxQueues(asyncio.Queue(), asyncio.Queue())
+            for qmsg in (InternalConnectWsToGi("ws1"),
+                         ClientRxMsg(["ADD-BOT"], initiatorWs="ws1"),
+                         ClientRxMsg(["ADD-BOT"], initiatorWs="ws1")):
+                room.rxQueue.put_nowait(qmsg)
+            await self.playBots(room, lambda: room.state == DurakRoom.GameState.GAME_OVER)
+        asyncio.run(run())
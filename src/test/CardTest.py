@@ -0,0 +1,97 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+
+import copy
+import json
+import pickle
+import unittest
+
+from Common.Card import (
+        Card,
+        CardBag,
+        JOKER,
+        cardListContains,
+)
+from fwk.Exceptions import InvalidDataException
+
+class CardTest(unittest.TestCase):
+    def testInterned(self):
+        self.assertIs(Card("H", 5), Card("H", 5))
+        self.assertIs(Card.fromJmsg(["H", 5]), Card("H", 5))
+        self.assertIs(Card.fromCode(Card("S", 13).code), Card("S", 13))
+        self.assertIs(pickle.loads(pickle.dumps(Card(JOKER, 0))), Card(JOKER, 0))
+        self.assertIs(copy.deepcopy([Card("C", 1)])[0], Card("C", 1))
+
+    def testCodes(self):
+        deck = list(Card.deckCards(numDecks=1))
+        self.assertEqual([card.code for card in deck], list(range(52)))
+        self.assertEqual(Card(JOKER, 0).code, 52)
+        self.assertEqual(len(set(deck)), 52)
+        self.assertEqual(str(Card("D", 10)), "10D")
+        self.assertEqual(Card("D", 10).toJmsg(), ["D", 10])
+
+    def testInvalid(self):
+        for jmsg in (["X", 1], ["H", 0], ["H", 14], [JOKER, 1], ["H", [1]], ["H"]):
+            with self.assertRaises(InvalidDataException):
+                Card.fromJmsg(jmsg)
+
+    def testImmutable(self):
+        with self.assertRaises(AttributeError):
+            Card("H", 5).rank = 6
+
+class CardBagTest(unittest.TestCase):
+    def setUp(self):
+        self.h1, self.h2, self.s3 = Card("H", 1), Card("H", 2), Card("S", 3)
+        self.bag = CardBag([self.h1, self.s3, self.h1, self.h2])
+
+    def testContains(self):
+        self.assertTrue(self.bag.contains([self.h1, self.h1]))
+        self.assertTrue(self.bag.contains([]))
+        self.assertFalse(self.bag.contains([self.h2, self.h2]))
+        self.assertFalse(self.bag.contains([Card(JOKER, 0)]))
+        self.assertIn(self.s3, self.bag)
+        self.assertEqual(self.bag.count(self.h1), 2)
+
+    def testRemoveKeepsOrder(self):
+        self.bag.remove([self.h1, self.h2])
+        self.assertEqual(list(self.bag), [self.s3, self.h1])
+        self.bag.add([self.h2])
+        self.assertEqual(self.bag.toJmsg(), [["S", 3], ["H", 1], ["H", 2]])
+        self.assertEqual(len(self.bag), 3)
+
+    def testJmsgReplacedOnChange(self):
+        jmsg = self.bag.toJmsg()
+        self.assertIs(self.bag.toJmsg(), jmsg)
+        self.bag.add([self.s3])
+        self.bag.remove([self.h1])
+        self.assertEqual(jmsg, [["H", 1], ["S", 3], ["H", 1], ["H", 2]])
+        self.assertEqual(self.bag.toJmsg(), [["S", 3], ["H", 1], ["H", 2], ["S", 3]])
+
+    def testEncodedCachedUntilChange(self):
+        encoded = self.bag.encoded()
+        self.assertEqual(json.loads(encoded), self.bag.toJmsg())
+        self.assertIs(self.bag.encoded(), encoded)
+        self.bag.remove([self.h1])
+        self.bag.add([Card(JOKER, 0)])
+        self.assertEqual(self.bag.encoded(), json.dumps(self.bag.toJmsg()))
+        self.assertEqual(CardBag().encoded(), "[]")
+
+    def testRemoveMissing(self):
+        with self.assertRaises(ValueError):
+            self.bag.remove([self.s3, self.s3])
+        self.assertEqual(list(self.bag), [self.h1, self.s3, self.h1, self.h2])
+        self.assertEqual(self.bag.count(self.s3), 1)
+
+    def testRankSuitCounts(self):
+        self.assertEqual(self.bag.rankCounts[1], 2)
+        self.assertEqual(self.bag.suitCounts["H"], 3)
+        self.bag.remove([self.h1, self.s3])
+        self.bag.add([Card(JOKER, 0)])
+        self.assertEqual(self.bag.rankCounts[:4], [1, 1, 1, 0])
+        self.assertEqual(self.bag.suitCounts, {"C": 0, "D": 0, "H": 2, "S": 0, JOKER: 1})
+
+    def testCardListContains(self):
+        cards = list(self.bag)
+        self.assertTrue(cardListContains(cards, [self.h1, self.h1, self.s3]))
+        self.assertFalse(cardListContains(cards, [self.s3, self.s3]))
+        self.assertTrue(cardListContains(self.bag, [self.h2]))
@@ -1,14 +1,24 @@
 import asyncio
+import os
+import pickle
 import random
+import tempfile
+import threading
 import unittest
 
 from test.MsgTestLib import MsgTestLib
 from Common import Card
 from Dirty7 import (
         Dirty7Game,
+        Dirty7Lobby,
         Dirty7Room,
         Dirty7Round,
 )
+from Dirty7.Storage import (
+        Storage,
+        StorageByFilename,
+        closeStorages,
+)
 from fwk.Common import Map
 from fwk.MsgSrc import Connections
 from fwk.Msg import (
@@ -66,14 +76,15 @@ class Dirty7RoomTest(unittest.TestCase, MsgTestLib):
         assert False, "Unhandled case"
         return {}
 
-    def setUpDirty7Room(self, stopPoints=100):
+    def setUpDirty7Room(self, stopPoints=100, storage=None):
         rxq = asyncio.Queue()
         txq = asyncio.Queue()
 
         hostParameters = Dirty7Round.RoundParameters(["basic"], 2, 2, 1, 7, [7], 40,
                                                      stopPoints=stopPoints,
                                                      scoringSystems=['standard'])
-        room = Dirty7Room.Dirty7Room("dirty7:1", "Dirty7 #1", None, hostParameters)
+        room = Dirty7Room.Dirty7Room("dirty7:1", "Dirty7 #1", storage, hostParameters)
+        room.rng = random.Random(1)
 
         ws1 = 1
         ws2 = 2
@@ -225,6 +236,105 @@ class Dirty7RoomTest(unittest.TestCase, MsgTestLib):
                                               {ws10}, initiatorWs=ws10),
                                  ])
 
+    def testStorageRestore(self):
+        """Room state written behind to storage restores the room"""
+        storage = Storage(":memory:")
+        env = self.setUpDirty7Room(storage=storage)
+
+        turnPlayerName = env.room.currRound.turn.current()
+        turnWs = env.ws1 if turnPlayerName == "plyr1" else env.ws2
+        dropCard = env.room.currRound.playerRoundStatus[turnPlayerName].hand.cards[0]
+        env.room.processMsg(ClientRxMsg(["PLAY", {"dropCards": [dropCard.toJmsg()],
+                                                  "numDrawCards": 1}],
+                                        initiatorWs=turnWs))
+        self.assertNotEqual(env.room.currRound.turn.current(), turnPlayerName)
+
+        # Room, host and round parameters, 2 players, the round and 2 hands
+        self.assertEqual(storage.flush(), 8)
+        self.assertEqual(storage.flush(), 0)
+
+        playerTurn = Dirty7Game.GameStateTypes.index(Dirty7Game.StatePlayerTurn)
+        self.assertEqual(storage.loadRooms({0}), [])
+        rooms = storage.loadRooms({playerTurn})
+        self.assertEqual(len(rooms), 1)
+        saved = rooms[0]
+        room = Dirty7Room.Dirty7Room(saved.path, "Dirty7 #1", storage,
+                                     Dirty7Round.RoundParameters.fromRow(saved.hostParams),
+                                     saved=saved)
+        room.setRxTxQueues(asyncio.Queue(), asyncio.Queue())
+
+        self.assertIsInstance(room.gameState, Dirty7Game.StatePlayerTurn)
+        self.assertEqual(room.hostParameters.state, env.hostParameters.state)
+        self.assertEqual({name: plyr.passwd for name, plyr in room.playerByName.items()},
+                         {"plyr1": "1", "plyr2": "2"})
+
+        before, after = env.room.currRound, room.currRound
+        self.assertEqual(after.roundParams.toJmsg(), before.roundParams.toJmsg())
+        self.assertEqual(after.turn.playerNameInTurnOrder, before.turn.playerNameInTurnOrder)
+        self.assertEqual(after.turn.current(), before.turn.current())
+        self.assertEqual(after.tableCards.deckCards, before.tableCards.deckCards)
+        self.assertEqual(list(after.tableCards.revealedCards), [dropCard])
+        self.assertEqual(after.tableCards.hiddenCards, before.tableCards.hiddenCards)
+        for name, prs in before.playerRoundStatus.items():
+            self.assertEqual(list(after.playerRoundStatus[name].hand.cards), list(prs.hand.cards))
+
+    def testStorageClosedRooms(self):
+        """Rooms nobody joined and collected rooms aren't restored"""
+        storage = Storage(":memory:")
+        env = self.setUpDirty7Room(storage=storage)
+        unjoined = Dirty7Room.Dirty7Room("dirty7:2", "Dirty7 #2", storage,
+                                         env.hostParameters)
+        unjoined.setRxTxQueues(asyncio.Queue(), asyncio.Queue())
+        storage.flush()
+        allStates = set(range(len(Dirty7Game.GameStateTypes)))
+        self.assertEqual([saved.path for saved in storage.loadRooms(allStates)],
+                         ["dirty7:1", "dirty7:2"])
+
+        lobby = Dirty7Lobby.Dirty7Lobby("dirty7", "Dirty7", storage)
+        saved = dict(lobby.rooms)
+        try:
+            txq = asyncio.Queue()
+            lobby.setRxTxQueues(asyncio.Queue(), txq)
+            registered = []
+            while not txq.empty():
+                registered.append(txq.get_nowait().gi.path)
+            self.assertEqual(registered, ["dirty7:1"])
+        finally:
+            lobby.rooms.clear()
+            lobby.rooms.update(saved)
+        storage.flush()
+        self.assertEqual([saved.path for saved in storage.loadRooms(allStates)], ["dirty7:1"])
+
+        env.room.close()
+        storage.flush()
+        self.assertEqual(storage.loadRooms(allStates), [])
+
+    def testStorageClosedAtExit(self):
+        """closeStorages (run at exit) commits the rows still buffered"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "d7.sqlite3")
+            storage = Storage(filename, flushDelaySec=60)
+            storage.saveMaxGameIdx(5)
+            closeStorages()
+            self.assertNotIn(filename, StorageByFilename)
+            self.assertFalse(storage.db.thread.is_alive())
+
+            storage = Storage(filename)
+            try:
+                self.assertEqual(storage.maxGameIdx(), 5)
+            finally:
+                storage.close()
+
+    def testStorageSharedWhenUnpickled(self):
+        """Rooms unpickled in a process share the Storage of their file"""
+        storage = Storage(":memory:")
+        threadCount = threading.active_count()
+        # Each room is pickled on its own
+        stores = [pickle.loads(pickle.dumps(storage.roomStore("dirty7:{}".format(idx))))
+                  for idx in range(20)]
+        self.assertEqual({id(store.storage) for store in stores}, {id(storage)})
+        self.assertEqual(threading.active_count(), threadCount)
+
     def testDirty7RoomBasicDeclare(self):
         env = self.setUpDirty7Room()
         self.drainGiTxQueue(env.txq)
@@ -568,6 +678,7 @@ class Dirty7RoomTest(unittest.TestCase, MsgTestLib):
         hostParameters = Dirty7Round.RoundParameters(["basic"], 2, 2, 1, 7, [7],
                                                      40, 100, ['standard'])
         room = Dirty7Room.Dirty7Room("dirty7:1", "Dirty7 #1", None, hostParameters)
+        room.rng = random.Random(1)
 
         ws1 = 1
         ws2 = 2
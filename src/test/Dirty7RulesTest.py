@@ -0,0 +1,88 @@
+import itertools
+import random
+import unittest
+
+from Common.Card import (
+        Card,
+        CardBag,
+        JOKER,
+)
+from Dirty7.Dirty7Round import PlayerHand
+from Dirty7.Dirty7Rules import (
+        SupportedRules,
+        SupportedScoringSystems,
+        dropKey,
+        keyCards,
+        multisets,
+)
+from fwk.MsgSrc import Connections
+from fwk.Trace import (
+        Level,
+        TRACE_LEVELS,
+        setTraceLevels,
+)
+
+class Dirty7RulesTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+        setTraceLevels({Level.error})
+
+    def tearDown(self):
+        setTraceLevels(TRACE_LEVELS)
+
+    def validDrops(self, rule, cards):
+        """Keys of the drops from cards that a move processor validates
+        card by card"""
+        keys = set()
+        for numCards in range(1, len(cards) + 1):
+            for drop in itertools.combinations(cards, numCards):
+                if rule.validDrop(list(drop)):
+                    keys.add(dropKey(drop))
+        return keys
+
+    def testLegalDropsMatchValidation(self):
+        deck = list(Card.deckCards(numDecks=2)) + [Card(JOKER, 0)] * 2
+        for rule in SupportedRules.values():
+            for _ in range(20):
+                cards = random.sample(deck, 8)
+                self.assertEqual(rule.legalDrops(CardBag(cards)),
+                                 self.validDrops(rule, cards),
+                                 (rule.shortName, cards))
+
+    def testMultisets(self):
+        counts = {1: 2, 2: 0, 3: 1, 4: 3}
+        for minCardCount, maxCardCount in ((1, None), (2, 3), (3, 3), (0, 1)):
+            expected = {tuple(code for code, num in zip((1, 3, 4), nums) for _ in range(num))
+                        for nums in itertools.product(range(3), range(2), range(4))
+                        if max(minCardCount, 1) <= sum(nums) <= (maxCardCount or 6)}
+            drops = list(multisets([1, 2, 3, 4], counts, minCardCount, maxCardCount))
+            self.assertEqual(len(drops), len(expected))
+            self.assertEqual(set(drops), expected)
+
+    def testLegalDrops(self):
+        h1, h2, h3 = Card("H", 1), Card("H", 2), Card("H", 3)
+        s3, joker = Card("S", 3), Card(JOKER, 0)
+        cards = CardBag([h1, h2, h3, s3, joker, joker])
+        drops = {tuple(map(str, keyCards(key)))
+                 for key in SupportedRules["seq3"].legalDrops(cards)}
+        self.assertEqual(drops, {("1H",), ("2H",), ("3H",), ("3S",), ("JOKER",),
+                                 ("1H", "2H", "3H"), ("1H", "2H", "3S"),
+                                 ("1H", "2H", "JOKER")})
+        self.assertIn(dropKey([s3, joker, joker]),
+                      SupportedRules["suit3"].legalDrops(cards))
+        self.assertIn(dropKey([joker, joker]), SupportedRules["basic"].legalDrops(cards))
+        self.assertNotIn(dropKey([h3, s3]), SupportedRules["suit3+"].legalDrops(cards))
+
+    def testPlayerHandLegalDrops(self):
+        rule = SupportedRules["basic"]
+        hand = PlayerHand(Connections(None), {}, 1, "p1", [Card("H", 1), Card("S", 1)],
+                          SupportedScoringSystems["standard"])
+        keys = hand.legalDrops(rule)
+        self.assertIs(hand.legalDrops(rule), keys)
+        self.assertEqual(len(keys), 3)
+
+        hand.delta([Card("S", 1)], [Card("C", 1)])
+        self.assertEqual(hand.legalDrops(rule),
+                         {dropKey(drop) for drop in ([Card("H", 1)], [Card("C", 1)],
+                                                     [Card("C", 1), Card("H", 1)])})
+        self.assertEqual(len(hand.legalDrops(SupportedRules["seq3"])), 2)
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from Dirty7 import (
+        Dirty7Room,
+        Dirty7Round,
+)
+from Dirty7.Storage import Storage
+from fwk import EventLog
+from fwk.Msg import (
+        ClientRxMsg,
+        InternalConnectWsToGi,
+        InternalDisconnectWsToGi,
+)
+
+class EventLogTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+        self.tmpdir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+
+    def tearDown(self):
+        EventLog.setEventLogDir(None)
+        EventLog.flushEventLog()
+        self.tmpdir.cleanup()
+
+    def setUpRoom(self, snapshotEvery=1000, storage=None):
+        EventLog.setEventLogDir(self.tmpdir.name, snapshotEvery)
+        hostParameters = Dirty7Round.RoundParameters(["basic"], 2, 2, 1, 7, [7], 40,
+                                                     stopPoints=100,
+                                                     scoringSystems=['standard'])
+        room = Dirty7Room.Dirty7Room("dirty7:1", "Dirty7 #1", storage, hostParameters)
+        EventLog.attach(room)
+        room.setRxTxQueues(asyncio.Queue(), asyncio.Queue())
+        for msg in (InternalConnectWsToGi("ws1"),
+                    InternalConnectWsToGi("ws2"),
+                    ClientRxMsg(["JOIN", "plyr1", "1"], initiatorWs="ws1"),
+                    ClientRxMsg(["JOIN", "plyr2", "2"], initiatorWs="ws2"),
+                   ):
+            room.handleMsg(msg)
+        return room
+
+    def play(self, room):
+        """Current player drops their first card and draws one"""
+        name = room.currRound.turn.current()
+        card = room.currRound.playerRoundStatus[name].hand.cards[0]
+        ws = "ws1" if name == "plyr1" else "ws2"
+        self.assertTrue(room.handleMsg(ClientRxMsg(["PLAY", {"dropCards": [card.toJmsg()],
+                                                             "numDrawCards": 1}],
+                                                   initiatorWs=ws)))
+
+    def records(self, room):
+        EventLog.flushEventLog()
+        with open(room.eventLog.filename, encoding="utf-8") as logFile:
+            return [json.loads(line) for line in logFile]
+
+    def assertSameRoom(self, room, replayed):
+        self.assertIs(type(replayed.gameState), type(room.gameState))
+        self.assertEqual(replayed.snapshot(), room.snapshot())
+        self.assertEqual(set(replayed.playerByWs), set(room.playerByWs))
+
+    def testOwnRandomness(self):
+        """Logged messages reseed the room's own generator with a large
+        seed, not the random module"""
+        state = random.getstate()
+        room = self.setUpRoom()
+        self.assertEqual(random.getstate(), state)
+        seeds = [rec[3] for rec in self.records(room) if rec[1] == "M"]
+        self.assertTrue(all(0 <= seed < 1 << EventLog.EVENT_LOG_SEED_BITS for seed in seeds))
+        self.assertGreater(max(seeds), 1 << 32)
+
+    def testRecords(self):
+        room = self.setUpRoom()
+        # Not handled: not logged
+        self.assertFalse(room.handleMsg(ClientRxMsg(["FOO"], initiatorWs="ws1")))
+        room.handleMsg(InternalDisconnectWsToGi("ws2"))
+
+        records = self.records(room)
+        self.assertEqual([rec[0] for rec in records], list(range(1, len(records) + 1)))
+        self.assertEqual([rec[1:] for rec in records[1:4]],
+                         [["C", "ws1"], ["C", "ws2"], ["M", "ws1", records[3][3],
+                                                       ["JOIN", "plyr1", "1"]]])
+        # Events are logged after the message that caused them
+        self.assertEqual(records[4][1:], ["E", "plyr1 joined"])
+        self.assertEqual(records[6][1:], ["E", "plyr2 joined"])
+        self.assertEqual(records[-1][1:], ["D", "ws2"])
+
+    def testReplay(self):
+        room = self.setUpRoom()
+        for _ in range(5):
+            self.play(room)
+        room.handleMsg(InternalDisconnectWsToGi("ws2"))
+
+        self.assertSameRoom(room, EventLog.replay(room.eventLog.filename))
+
+    def testSnapshotCompaction(self):
+        room = self.setUpRoom(snapshotEvery=4)
+        for _ in range(5):
+            self.play(room)
+
+        records = self.records(room)
+        self.assertEqual([rec[1] for rec in records[:2]], ["G", "S"])
+        self.assertLess(len(records), 10)
+
+        _, snapshot, after = EventLog.readLog(room.eventLog.filename)
+        self.assertIsNotNone(snapshot)
+        self.assertEqual(after, records[2:])
+        self.assertSameRoom(room, EventLog.replay(room.eventLog.filename))
+
+    def testStorageNotLogged(self):
+        room = self.setUpRoom(storage=Storage(":memory:"))
+        self.play(room)
+
+        replayed = EventLog.replay(room.eventLog.filename)
+        self.assertIsNone(replayed.storage)
+        self.assertIsNone(replayed.store)
+        self.assertSameRoom(room, replayed)
+
+    def testNotEnabled(self):
+        room = self.setUpRoom()
+        EventLog.setEventLogDir(None)
+        other = Dirty7Room.Dirty7Room("dirty7:2", "Dirty7 #2", None, room.hostParameters)
+        EventLog.attach(other)
+        self.assertIsNone(other.eventLog)
+        self.assertFalse(os.path.exists(EventLog.logFilename(self.tmpdir.name, "dirty7:2")))
@@ -5,6 +5,11 @@ import asyncio
 import unittest
 
 from test.MsgTestLib import MsgTestLib
+from fwk import Metrics
+from fwk.GamePlugin import (
+        Plugin,
+        handles,
+)
 from fwk.LobbyPlugin import plugin
 from fwk.Msg import (
         ClientRxMsg,
@@ -107,3 +112,51 @@ class LobbyPluginTest(unittest.TestCase, MsgTestLib):
         self.plugin.processMsg(msg)
         self.assertGiTxQueueMsgs(self.txq, [ClientTxMsg(["GAME-STATUS", "foo:1", True],
                                                         {self.connWs2}, initiatorWs=None)])
+
+class HandlerTableTest(unittest.TestCase):
+    class Base(Plugin):
+        @handles("A")
+        def processA(self, qmsg): # pylint: disable=unused-argument
+            return "base-a"
+
+        @handles("B", "C")
+        def processBC(self, qmsg): # pylint: disable=unused-argument
+            return "base-bc"
+
+    class Derived(Base):
+        def processA(self, qmsg):
+            return "derived-a"
+
+        @handles("C")
+        def processC(self, qmsg): # pylint: disable=unused-argument
+            return "derived-c"
+
+    def setUp(self):
+        self.plugin = self.Derived("test-handlers", "Test")
+
+    def testTable(self):
+        """Handlers are inherited and overridden by name"""
+        self.assertEqual(self.Base.handlerByKey["C"], "processBC")
+        self.assertEqual(self.Derived.handlerByKey["C"], "processC")
+        self.assertEqual(self.Derived.handlerByKey[ClientRxMsg], "processClientMsg")
+        self.assertEqual(self.Derived.handlerByKey[InternalConnectWsToGi], "processConnectMsg")
+
+    def testDispatch(self):
+        """Client messages are dispatched by message type"""
+        def rx(jmsg):
+            return self.plugin.processMsg(ClientRxMsg(jmsg, initiatorWs=1))
+
+        self.assertEqual(rx(["A"]), "derived-a")
+        self.assertEqual(rx(["B", 1]), "base-bc")
+        self.assertEqual(rx(["C"]), "derived-c")
+        self.assertFalse(rx(["D"]))
+        self.assertFalse(rx([1]))
+        self.assertFalse(rx([["A"]]))
+        self.assertFalse(self.plugin.processMsg(InternalGiStatus([], "foo:1")))
+
+    def testMetric(self):
+        """Dispatched messages are counted per handler"""
+        labels = ("test-handlers", "processA")
+        before = Metrics.HandledMessages.values.get(labels, 0)
+        self.plugin.processMsg(ClientRxMsg(["A"], initiatorWs=1))
+        self.assertEqual(Metrics.HandledMessages.values[labels], before + 1)
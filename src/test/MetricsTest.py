@@ -0,0 +1,75 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+
+import asyncio
+import unittest
+
+from fwk import Metrics
+from fwk.Msg import (
+        ClientRxMsg,
+        InternalConnectWsToGi,
+)
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = list(Metrics.Registry)
+
+    def tearDown(self):
+        Metrics.Registry[:] = self.registry
+
+    def testRender(self):
+        counter = Metrics.Counter("test_msgs_total", "Messages", ("path",))
+        counter.inc(("foo:1",))
+        counter.inc(("foo:1",), 2)
+        counter.inc(('a"b',))
+        histogram = Metrics.Histogram("test_seconds", "Latency", ("path",), buckets=(0.1, 1))
+        histogram.observe(("foo:1",), 0.1)
+        histogram.observe(("foo:1",), 0.5)
+        histogram.observe(("foo:1",), 2.0)
+        Metrics.Gauge("test_depth", "Depth", (), lambda: [((), 3)])
+
+        text = Metrics.render()
+        self.assertIn('''# HELP test_msgs_total Messages
+# TYPE test_msgs_total counter
+test_msgs_total{path="a\\"b"} 1
+test_msgs_total{path="foo:1"} 3
+# HELP test_seconds Latency
+# TYPE test_seconds histogram
+test_seconds_bucket{path="foo:1",le="0.1"} 1
+test_seconds_bucket{path="foo:1",le="1"} 2
+test_seconds_bucket{path="foo:1",le="+Inf"} 3
+test_seconds_sum{path="foo:1"} 2.6
+test_seconds_count{path="foo:1"} 3
+# HELP test_depth Depth
+# TYPE test_depth gauge
+test_depth 3
+''', text)
+
+    def testMtypeLabel(self):
+        self.assertEqual(Metrics.mtypeLabel(ClientRxMsg(["JOIN", "foo"], 1)), "JOIN")
+        self.assertEqual(Metrics.mtypeLabel(ClientRxMsg(["join"], 1)), "INVALID")
+        self.assertEqual(Metrics.mtypeLabel(ClientRxMsg([1], 1)), "INVALID")
+        self.assertEqual(Metrics.mtypeLabel(InternalConnectWsToGi(1)), "InternalConnectWsToGi")
+
+    def testEndpoint(self):
+        async def get(port, path):
+            reader, writer = await asyncio.open_connection(Metrics.METRICS_HOST, port)
+            writer.write("GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(path).encode())
+            data = await reader.read()
+            writer.close()
+            return data
+
+        async def run():
+            server = await Metrics.serve(0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                return await get(port, "/lobby"), await get(port, "/metrics")
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        notFound, found = asyncio.run(run())
+        self.assertTrue(notFound.startswith(b"HTTP/1.1 404 "))
+        self.assertTrue(found.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertIn("Content-Type: {}".format(Metrics.CONTENT_TYPE).encode(), found)
+        self.assertIn(b"# TYPE bari_process_msg_seconds histogram", found)
@@ -2,9 +2,11 @@
 # pylint: disable=missing-class-docstring
 
 import asyncio
+import json
 import unittest
 
 from test.MsgTestLib import MsgTestLib
+from fwk import JsonPatch
 from fwk.Msg import ClientTxMsg
 from fwk.MsgSrc import (
         Connections,
@@ -194,3 +196,98 @@ class MsgSrcConnectionsGroupTest(unittest.TestCase, MsgTestLib):
                                             ClientTxMsg([2], {clientWs3, clientWs4},
                                                         initiatorWs=clientWs3)],
                                  anyOrder=True)
+
+class MsgSrcEncodingTest(unittest.TestCase):
+    def testEncodedOncePerJmai(self):
+        """ClientTxMsgs created from the same Jmai share one JSON encoding"""
+        txq = asyncio.Queue()
+        conns = Connections(txq)
+        conns.addConn(clientWs1)
+        msgSrc = MsgSrc(conns)
+        msgSrc.setMsgs([Jmai(["TURN", 1, "foo"], initiatorWs=None)])
+
+        conns.addConn(clientWs2)
+        qmsg1 = txq.get_nowait()
+        qmsg2 = txq.get_nowait()
+        self.assertTrue(txq.empty())
+
+        self.assertEqual(qmsg1.encoded(), '["TURN", 1, "foo"]')
+        self.assertIs(qmsg1.encoded(), qmsg2.encoded())
+
+    def testEncodedLast(self):
+        """A Jmai built from the encoding of its last item encodes as
+        json.dumps would"""
+        for jmsg in (["PLAYER-CARDS", 1, "foo", 2, [["H", 1], ["S", 3]]], [[]]):
+            jmai = Jmai.withEncodedLast(jmsg, json.dumps(jmsg[-1]))
+            self.assertEqual(jmai.encoded(), json.dumps(jmsg))
+            self.assertEqual(jmai, Jmai(jmsg, None))
+
+    def testEncodedWithoutJmai(self):
+        qmsg = ClientTxMsg(["JOIN-OKAY"], {clientWs1})
+        self.assertEqual(qmsg.encoded(), '["JOIN-OKAY"]')
+        self.assertIs(qmsg.encoded(), qmsg.encoded())
+
+class ScoreMsgSrc(MsgSrc):
+    deltaEnabled = True
+
+class MsgSrcDeltaTest(unittest.TestCase):
+    def testJsonPatch(self):
+        old = {"a": 1, "b": [1, 2, 3], "c": {"x/y": "z"}, "d": True}
+        new = {"a": 2, "b": [1, 5], "c": {"x/y": "z", "~": None}, "d": 1}
+        ops = JsonPatch.diff(old, new)
+        self.assertListEqual(ops, [
+            {"op": "replace", "path": "/a", "value": 2},
+            {"op": "replace", "path": "/b/1", "value": 5},
+            {"op": "remove", "path": "/b/2"},
+            {"op": "add", "path": "/c/~0", "value": None},
+            {"op": "replace", "path": "/d", "value": 1},
+        ])
+        self.assertEqual(JsonPatch.apply(old, ops), new)
+        self.assertEqual(JsonPatch.apply([1], JsonPatch.diff([1], [1, [2], 3])), [1, [2], 3])
+        self.assertEqual(JsonPatch.apply([1], JsonPatch.diff([1], "x")), "x")
+
+    def testVersions(self):
+        txq = asyncio.Queue()
+        conns = Connections(txq)
+        conns.addConn(clientWs1)
+        msgSrc = ScoreMsgSrc(conns)
+
+        def roundScore(roundNum):
+            return {"plyr{}".format(i): roundNum * i for i in range(8)}
+
+        scoreByRound = {0: roundScore(0)}
+        msgSrc.setMsgs([Jmai(["SCORE", scoreByRound], None)])
+        qmsg = txq.get_nowait()
+        self.assertEqual(json.loads(qmsg.version.snapshotEncoded()),
+                         ["SNAPSHOT", qmsg.version.srcId, 0, 1, ["SCORE", {"0": roundScore(0)}]])
+        self.assertIsNone(qmsg.version.patchEncoded())
+
+        # Mutated in place: the patch is computed against the previous encoding
+        doc = json.loads(qmsg.encoded())
+        for roundNum in range(1, 10):
+            scoreByRound[roundNum] = roundScore(roundNum)
+            msgSrc.setMsgs([Jmai(["SCORE", scoreByRound], None)])
+            qmsg = txq.get_nowait()
+            # Patches are computed when a delta websocket needs one
+            self.assertIsNone(qmsg.version._patchEncoded) # pylint: disable=protected-access
+            patch = json.loads(qmsg.version.patchEncoded())
+            self.assertEqual(patch[:4], ["PATCH", qmsg.version.srcId, 0, roundNum + 1])
+            doc = JsonPatch.apply(doc, patch[4])
+            self.assertEqual(doc, json.loads(qmsg.encoded()))
+            self.assertLess(len(qmsg.version.patchEncoded()), len(qmsg.encoded()))
+
+        # New connections get a snapshot of the current version
+        conns.addConn(clientWs2)
+        qmsg = txq.get_nowait()
+        self.assertSetEqual(qmsg.toWss, {clientWs2})
+        self.assertEqual(json.loads(qmsg.version.snapshotEncoded()),
+                         ["SNAPSHOT", qmsg.version.srcId, 0, 10, doc])
+        self.assertIsNone(qmsg.version.patchEncoded())
+
+    def testDeltaDisabled(self):
+        txq = asyncio.Queue()
+        conns = Connections(txq)
+        conns.addConn(clientWs1)
+        msgSrc = MsgSrc(conns)
+        msgSrc.setMsgs([Jmai(["SCORE", {}], None)])
+        self.assertIsNone(txq.get_nowait().version)
@@ -0,0 +1,163 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+from test.MsgTestLib import MsgTestLib
+from Chat.ChatLobbyPlugin import ChatLobbyPlugin
+from Chat.ChatRoom import ChatRoom
+from Durak import Room as DurakRoom
+from Durak.RoundParameters import RoundParameters as DurakParameters
+from fwk import (
+        Metrics,
+        RoomGc,
+        ServerQueueTask,
+)
+from fwk.Bot import BotWs
+from fwk.LobbyPlugin import plugin as lobbyPlugin
+from fwk.Msg import (
+        ClientTxMsg,
+        InternalConnectWsToGi,
+        InternalDisconnectWsToGi,
+        InternalGiClosed,
+        InternalGiStatus,
+)
+from fwk.Storage import DbExecutor
+from Taboo.WordSets import SupportedWordSets
+
+def drain(queue):
+    msgs = []
+    while not queue.empty():
+        msgs.append(queue.get_nowait())
+    return msgs
+
+class RoomGcTest(unittest.TestCase, MsgTestLib):
+    def setUp(self):
+        RoomGc.setRoomGc(10, 5)
+        self.txq = None
+
+    def tearDown(self):
+        RoomGc.setRoomGc()
+        RoomGc.IdleSinceByPath.clear()
+        for path in [path for path in ServerQueueTask.GiByPath if path.startswith("gc")]:
+            ServerQueueTask.deregisterGameClass(path)
+
+    def sweep(self, room, steps):
+        """Register room and sweep at each (now, qmsgs processed first).
+        Returns the paths collected by each sweep"""
+        async def run():
+            self.txq = asyncio.Queue()
+            ServerQueueTask.registerGameClass(room, giTxQueue=self.txq)
+            collected = []
+            for now, qmsgs in steps:
+                for qmsg in qmsgs:
+                    room.processMsg(qmsg)
+                collected.append(RoomGc.sweep(now))
+            return collected
+        return asyncio.run(run())
+
+    def assertCollected(self, path):
+        for registry in (ServerQueueTask.GiByPath, ServerQueueTask.GiRxQueueByPath,
+                         ServerQueueTask.GiRxTaskByPath, RoomGc.IdleSinceByPath):
+            self.assertNotIn(path, registry)
+        self.assertIn(InternalGiClosed(path), drain(self.txq))
+
+    def testIdleRoom(self):
+        room = ChatRoom("gc:1", "Chat Room")
+        self.assertListEqual(self.sweep(room, [(0, []), (9, []), (10, [])]),
+                             [[], [], ["gc:1"]])
+        self.assertCollected("gc:1")
+
+        # Messages for a collected room are dropped
+        ServerQueueTask.giRxMsg("gc:1", InternalConnectWsToGi(101))
+
+    def testClientsRestartIdleClock(self):
+        room = ChatRoom("gc:1", "Chat Room")
+        self.assertListEqual(self.sweep(room, [
+            (0, []),
+            (5, [InternalConnectWsToGi(101)]),
+            (20, [InternalDisconnectWsToGi(101)]),
+            (29, []),
+            (30, []),
+        ]), [[], [], [], [], ["gc:1"]])
+        self.assertCollected("gc:1")
+
+    def testBotsAreNotClients(self):
+        room = ChatRoom("gc:1", "Chat Room")
+        self.assertListEqual(self.sweep(room, [(0, [InternalConnectWsToGi(BotWs("bot1"))]),
+                                               (10, [])]),
+                             [[], ["gc:1"]])
+        self.assertEqual(room.clientCount(), 0)
+
+    def testGameOverTtl(self):
+        room = DurakRoom.Room("gc:1", "Durak #1", DurakParameters(2, 1))
+        room.state = DurakRoom.GameState.GAME_OVER
+        self.assertListEqual(self.sweep(room, [(0, []), (5, [])]), [[], ["gc:1"]])
+
+        RoomGc.setRoomGc(10, 0)
+        room = DurakRoom.Room("gc:2", "Durak #2", DurakParameters(2, 1))
+        room.state = DurakRoom.GameState.GAME_OVER
+        self.assertListEqual(self.sweep(room, [(0, []), (1000, [])]), [[], []])
+
+    def testArchive(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "archive.sqlite3")
+            RoomGc.setRoomGc(10, 5, archiveFile=filename)
+            room = ChatRoom("gc:1", "Chat Room")
+            self.sweep(room, [(0, []), (10, [])])
+            RoomGc.setRoomGc()
+
+            db = DbExecutor(filename)
+            try:
+                rows = db.query("select path, name, gameOver, snapshot "
+                                "from ArchivedRoom;").result()
+            finally:
+                db.close()
+        self.assertListEqual(rows, [("gc:1", "Chat Room", 0, "null")])
+
+    def testMetricsForgotten(self):
+        room = ChatRoom("gc:1", "Chat Room")
+        Metrics.ProcessMsgSeconds.observe(("gc:1", "x"), 0.1)
+        self.sweep(room, [(0, []), (10, [])])
+        self.assertFalse([labels for labels in Metrics.ProcessMsgSeconds.values
+                          if labels[0] == "gc:1"])
+
+class RoomGcLobbiesTest(unittest.TestCase, MsgTestLib):
+    def testLobbyGameClosed(self):
+        lobby = lobbyPlugin()
+        txq = asyncio.Queue()
+        lobby.setRxTxQueues(asyncio.Queue(), txq)
+        lobby.processMsg(InternalGiStatus([{"clients": 0}], "chat:1"))
+        lobby.processMsg(InternalConnectWsToGi(101))
+        drain(txq)
+
+        lobby.processMsg(InternalGiClosed("chat:1"))
+        self.assertGiTxQueueMsgs(txq, [ClientTxMsg(["GAME-CLOSED", "chat:1"], {101})])
+        self.assertNotIn("chat:1", lobby.giStatusByPath)
+
+        # Already forgotten
+        lobby.processMsg(InternalGiClosed("chat:1"))
+        self.assertGiTxQueueMsgs(txq, [])
+
+    def testGameLobbyForgetsRoom(self):
+        lobby = ChatLobbyPlugin("chat", "The Chat Game")
+        lobby.setRxTxQueues(asyncio.Queue(), asyncio.Queue())
+        saved = dict(lobby.rooms)
+        try:
+            lobby.rooms.update({1001: "chat:1001", 1002: "chat:1002"})
+            self.assertTrue(lobby.processMsg(InternalGiClosed("chat:1001")))
+            self.assertNotIn(1001, lobby.rooms)
+            self.assertIn(1002, lobby.rooms)
+        finally:
+            lobby.rooms.clear()
+            lobby.rooms.update(saved)
+
+    def testWordSetRelease(self):
+        wordSet = SupportedWordSets["test"]
+        wordSet.nextWord("taboo:1")
+        wordSet.release("taboo:1")
+        # pylint: disable=protected-access
+        self.assertNotIn("taboo:1", wordSet._usedWordsByRequestor)
@@ -0,0 +1,61 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+
+import unittest
+
+from fwk import JsonDecode
+from fwk.Exceptions import SchemaError
+from Common.Card import Card
+from Dirty7.Dirty7Room import PLAY_SCHEMA
+from Durak.Room import (
+        ATTACK_SCHEMA,
+        DEFEND_SCHEMA,
+)
+
+class SchemaTest(unittest.TestCase):
+    def assertReply(self, schema, jmsg, reply):
+        with self.assertRaises(SchemaError) as ctx:
+            schema.decode(jmsg)
+        self.assertEqual(ctx.exception.toJmsg(), reply)
+
+    def testDecode(self):
+        play = PLAY_SCHEMA.decode(["PLAY", {"dropCards": [["H", 1], ["H", 1]],
+                                            "pickCards": [["JOKER", 0]]}])
+        self.assertEqual(play.playDesc, {"dropCards": [Card("H", 1), Card("H", 1)],
+                                         "numDrawCards": 0,
+                                         "pickCards": [Card("JOKER", 0)]})
+
+        defend = DEFEND_SCHEMA.decode(["DEFEND", [[["H", 1], ["H", 2]]]])
+        self.assertEqual(defend.defends, [[Card("H", 1), Card("H", 2)]])
+
+    def testErrors(self):
+        self.assertReply(ATTACK_SCHEMA, ["ATTACK"], ["Invalid message length"])
+        self.assertReply(ATTACK_SCHEMA, ["ATTACK", {}], ["Invalid attacks", {}])
+        self.assertReply(ATTACK_SCHEMA, ["ATTACK", []], ["No cards specified"])
+        self.assertReply(ATTACK_SCHEMA, ["ATTACK", [["H", 1], ["H", 0]]],
+                         ["Invalid card", ["H", 0]])
+
+        self.assertReply(DEFEND_SCHEMA, ["DEFEND", []], ["No move specified", []])
+        self.assertReply(DEFEND_SCHEMA, ["DEFEND", [[["H", 1]]]],
+                         ["Invalid length of defense", [["H", 1]]])
+        self.assertReply(DEFEND_SCHEMA, ["DEFEND", ["x"]], ["Invalid type for defense", "x"])
+
+        self.assertReply(PLAY_SCHEMA, ["PLAY", []], ["Invalid move description"])
+        self.assertReply(PLAY_SCHEMA, ["PLAY", {"dropCards": [["X", 1]]}],
+                         ["Bad card suit", "X"])
+        self.assertReply(PLAY_SCHEMA, ["PLAY", {"numDrawCards": "1"}],
+                         ["Drawing invalid number of cards", "1"])
+        self.assertReply(PLAY_SCHEMA, ["PLAY", {"foo": 1}],
+                         ["Unrecognized play description", {"foo": 1}])
+
+class JsonDecodeTest(unittest.TestCase):
+    def tearDown(self):
+        JsonDecode.setDecoder(JsonDecode.DECODER_DEFAULT)
+
+    def testDecoders(self):
+        for name in JsonDecode.Decoders:
+            JsonDecode.setDecoder(name)
+            self.assertEqual(JsonDecode.loads('["PLAY", {"dropCards": [["H", 1]]}]'),
+                             ["PLAY", {"dropCards": [["H", 1]]}])
+            with self.assertRaises(JsonDecode.DecodeError):
+                JsonDecode.loads('["PLAY"')
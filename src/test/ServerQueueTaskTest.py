@@ -0,0 +1,291 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+
+import asyncio
+import json
+import unittest
+
+from fwk import ServerQueueTask
+from fwk.Msg import (
+        ClientTxMsg,
+        InternalGiStatus,
+        TimerRequest,
+        constJmsg,
+)
+from fwk.MsgSrc import (
+        Connections,
+        Jmai,
+        MsgSrc,
+)
+
+class FakeWs:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send(self, msg):
+        self.sent.append(msg)
+
+    async def close(self, code, reason): # pylint: disable=unused-argument
+        self.closed = True
+
+class ClientTxTaskTest(unittest.TestCase):
+    def tearDown(self):
+        ServerQueueTask.clientTxConfig(32, 0.0)
+
+    def runTxTask(self, msgs, batchEnvelope, settleSec=0.01):
+        ws = FakeWs()
+
+        async def run():
+            queue = asyncio.Queue()
+            for msg in msgs:
+                queue.put_nowait(msg)
+            task = asyncio.ensure_future(ServerQueueTask.clientTxTask(
+                queue, ws, batchEnvelope=batchEnvelope))
+            await asyncio.sleep(settleSec)
+            task.cancel()
+
+        asyncio.run(run())
+        return ws.sent
+
+    def testBackToBack(self):
+        sent = self.runTxTask(['["A"]', '["B"]', '["C"]'], batchEnvelope=False)
+        self.assertListEqual(sent, ['["A"]', '["B"]', '["C"]'])
+
+    def testEnvelope(self):
+        sent = self.runTxTask(['["A"]', '["B"]', '["C"]'], batchEnvelope=True)
+        self.assertListEqual(sent, ['[["A"],["B"],["C"]]'])
+
+    def testMaxBatch(self):
+        ServerQueueTask.clientTxConfig(2, 0.0)
+        sent = self.runTxTask(['["A"]', '["B"]', '["C"]'], batchEnvelope=True)
+        self.assertListEqual(sent, ['[["A"],["B"]]', '[["C"]]'])
+
+    def testFlushDelay(self):
+        """Messages arriving within the flush delay are part of the same batch"""
+        ServerQueueTask.clientTxConfig(32, 0.05)
+        ws = FakeWs()
+
+        async def run():
+            queue = asyncio.Queue()
+            task = asyncio.ensure_future(ServerQueueTask.clientTxTask(
+                queue, ws, batchEnvelope=True))
+            queue.put_nowait('["A"]')
+            await asyncio.sleep(0.01)
+            queue.put_nowait('["B"]')
+            await asyncio.sleep(0.1)
+            queue.put_nowait('["C"]')
+            await asyncio.sleep(0.1)
+            task.cancel()
+
+        asyncio.run(run())
+        self.assertListEqual(ws.sent, ['[["A"],["B"]]', '[["C"]]'])
+
+class PluginTxQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.ws1 = FakeWs()
+        self.ws2 = FakeWs()
+        self.clientQueues = {self.ws1: asyncio.Queue(), self.ws2: asyncio.Queue()}
+        ServerQueueTask.ClientTxQueueByWs.update(self.clientQueues)
+
+    def tearDown(self):
+        for ws in self.clientQueues:
+            del ServerQueueTask.ClientTxQueueByWs[ws]
+        while not ServerQueueTask.TxQueue.empty():
+            ServerQueueTask.TxQueue.get_nowait()
+
+    def testClientTxMsgSkipsCommonQueue(self):
+        txq = ServerQueueTask.PluginTxQueue("foo:1")
+        txq.put_nowait(ClientTxMsg(["TURN", 1], {self.ws1, self.ws2}))
+
+        self.assertTrue(ServerQueueTask.TxQueue.empty())
+        for queue in self.clientQueues.values():
+            self.assertEqual(queue.get_nowait(), '["TURN", 1]')
+            self.assertTrue(queue.empty())
+
+    def testControlMsgUsesCommonQueue(self):
+        txq = ServerQueueTask.PluginTxQueue("foo:1")
+        qmsg = InternalGiStatus([], "foo:1")
+        txq.put_nowait(qmsg)
+
+        self.assertEqual(ServerQueueTask.TxQueue.get_nowait(), qmsg)
+        for queue in self.clientQueues.values():
+            self.assertTrue(queue.empty())
+
+    def testConstJmsg(self):
+        txq = ServerQueueTask.PluginTxQueue("foo:1")
+        constMsg = constJmsg("PLAY-BAD", "It is not your turn")
+        self.assertIs(constJmsg("PLAY-BAD", "It is not your turn"), constMsg)
+
+        qmsg = ClientTxMsg(constMsg, {self.ws1})
+        self.assertEqual(qmsg, ClientTxMsg(["PLAY-BAD", "It is not your turn"], {self.ws1}))
+        self.assertIs(qmsg.encoded(), constMsg.encoded())
+
+        txq.put_nowait(qmsg)
+        self.assertIs(self.clientQueues[self.ws1].get_nowait(), constMsg.encoded())
+
+class TimerSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.fired = []
+
+    def timerCb(self, ctx):
+        self.fired.append(ctx)
+
+    def testFireAndCancel(self):
+        fired = self.fired
+        timers = ServerQueueTask.TimerScheduler(tickSec=0.01)
+
+        async def run():
+            kept = TimerRequest(0.02, self.timerCb, "kept")
+            cancelled = TimerRequest(0.02, self.timerCb, "cancelled")
+            cancelledEarly = TimerRequest(0.02, self.timerCb, "cancelledEarly")
+            cancelledEarly.cancel()
+            for qmsg in (kept, cancelled, cancelledEarly):
+                timers.add(qmsg)
+            self.assertEqual(len(timers), 2)
+            cancelled.cancel()
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(fired, ["kept"])
+        self.assertEqual(len(timers), 0)
+        self.assertIsNone(timers.handle)
+
+    def testIdleWheelCatchesUp(self):
+        timers = ServerQueueTask.TimerScheduler(tickSec=0.01)
+
+        async def run():
+            # The wheel was last advanced a day ago
+            loop = asyncio.get_running_loop()
+            timers.wheel = ServerQueueTask.TimerWheel(0.01, now=loop.time() - 86400)
+            timers.add(TimerRequest(0.02, self.timerCb, "late"))
+            self.assertGreaterEqual(timers.handle.when(), loop.time())
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(self.fired, ["late"])
+
+class ClientTxQueueBoundTest(unittest.TestCase):
+    def tearDown(self):
+        ServerQueueTask.clientTxQueueConfig(0, ServerQueueTask.POLICY_DISCONNECT)
+        ServerQueueTask.ClientTxStatsByPath.clear()
+
+    def testDropOldest(self):
+        ServerQueueTask.clientTxQueueConfig(2, ServerQueueTask.POLICY_DROP_OLDEST)
+        ws = FakeWs()
+
+        async def run():
+            ServerQueueTask.clientTxQueueAdd(ws, path="foo:1")
+            for msg in ('["A"]', '["B"]', '["C"]'):
+                ServerQueueTask.clientTxPut(msg, ws)
+            stats = ServerQueueTask.clientTxStats()
+            await asyncio.sleep(0.01)
+            ServerQueueTask.clientTxQueueRemove(ws)
+            return stats
+
+        stats = asyncio.run(run())
+        self.assertDictEqual(stats["foo:1"],
+                             {"wsCount": 1, "queueDepth": 2, "drops": 1, "evictions": 0})
+        self.assertListEqual(ws.sent, ['["B"]', '["C"]'])
+
+    def testDisconnect(self):
+        ServerQueueTask.clientTxQueueConfig(2, ServerQueueTask.POLICY_DISCONNECT)
+        ws = FakeWs()
+
+        async def run():
+            ServerQueueTask.clientTxQueueAdd(ws, path="foo:1")
+            for msg in ('["A"]', '["B"]', '["C"]', '["D"]'):
+                ServerQueueTask.clientTxPut(msg, ws)
+            await asyncio.sleep(0.01)
+            stats = ServerQueueTask.clientTxStats()
+            ServerQueueTask.clientTxQueueRemove(ws)
+            return stats
+
+        stats = asyncio.run(run())
+        self.assertDictEqual(stats["foo:1"],
+                             {"wsCount": 1, "queueDepth": 0, "drops": 0, "evictions": 1})
+        self.assertListEqual(ws.sent, [])
+        self.assertTrue(ws.closed)
+
+class ClientTxCoalesceTest(unittest.TestCase):
+    def testLatestSnapshotReplacesUnsent(self):
+        ws = FakeWs()
+
+        async def run():
+            ServerQueueTask.clientTxQueueAdd(ws, path="foo:1")
+            ServerQueueTask.clientTxPut('["TABLE-CARDS", 1]', ws, key=("src", 0))
+            ServerQueueTask.clientTxPut('["JOIN-OKAY"]', ws)
+            ServerQueueTask.clientTxPut('["TABLE-CARDS", 2]', ws, key=("src", 0))
+            ServerQueueTask.clientTxPut('["TURN", 1]', ws, key=("src", 1))
+            ServerQueueTask.clientTxPut('["TABLE-CARDS", 3]', ws, key=("src", 0))
+            depth = ServerQueueTask.ClientTxQueueByWs[ws].qsize()
+            await asyncio.sleep(0.01)
+            # Sent snapshots are not replaced
+            ServerQueueTask.clientTxPut('["TABLE-CARDS", 4]', ws, key=("src", 0))
+            await asyncio.sleep(0.01)
+            ServerQueueTask.clientTxQueueRemove(ws)
+            return depth
+
+        depth = asyncio.run(run())
+        self.assertEqual(depth, 3)
+        self.assertListEqual(ws.sent, ['["TABLE-CARDS", 3]', '["JOIN-OKAY"]', '["TURN", 1]',
+                                       '["TABLE-CARDS", 4]'])
+
+    def testMsgSrcKeys(self):
+        ws = FakeWs()
+        txq = ServerQueueTask.PluginTxQueue("foo:1")
+
+        async def run():
+            ServerQueueTask.clientTxQueueAdd(ws, path="foo:1")
+            conns = Connections(txq)
+            conns.addConn(ws)
+            msgSrc = MsgSrc(conns)
+            for i in range(5):
+                msgSrc.setMsgs([Jmai(["TABLE-CARDS", i], None), Jmai(["TURN", i], None)])
+            msgSrc.replaceMsg(1, Jmai(["TURN", 9], None))
+            await asyncio.sleep(0.01)
+            ServerQueueTask.clientTxQueueRemove(ws)
+
+        asyncio.run(run())
+        self.assertListEqual(ws.sent, ['["TABLE-CARDS", 4]', '["TURN", 9]'])
+
+class ClientTxDeltaTest(unittest.TestCase):
+    def testDeltaWs(self):
+        ws1 = FakeWs()
+        ws2 = FakeWs()
+        txq = ServerQueueTask.PluginTxQueue("foo:1")
+
+        class DeltaMsgSrc(MsgSrc):
+            deltaEnabled = True
+
+        def score(a, b, c):
+            return ["SCORE", dict({"a": a, "b": b, "c": c},
+                                  **{"plyr{}".format(i): 0 for i in range(10)})]
+
+        async def run():
+            ServerQueueTask.clientTxQueueAdd(ws1, path="foo:1", delta=True)
+            ServerQueueTask.clientTxQueueAdd(ws2, path="foo:1")
+            conns = Connections(txq)
+            conns.addConn(ws1)
+            conns.addConn(ws2)
+            msgSrc = DeltaMsgSrc(conns)
+            msgSrc.setMsgs([Jmai(score(1, 0, 0), None)])
+            await asyncio.sleep(0.01)
+            msgSrc.setMsgs([Jmai(score(1, 1, 0), None)])
+            await asyncio.sleep(0.01)
+            # Coalesced: the pending PATCH is replaced by a SNAPSHOT
+            msgSrc.setMsgs([Jmai(score(1, 1, 1), None)])
+            msgSrc.setMsgs([Jmai(score(2, 1, 1), None)])
+            await asyncio.sleep(0.01)
+            ServerQueueTask.clientTxQueueRemove(ws1)
+            ServerQueueTask.clientTxQueueRemove(ws2)
+            return msgSrc._srcId # pylint: disable=protected-access
+
+        srcId = asyncio.run(run())
+        self.assertListEqual([json.loads(msg) for msg in ws1.sent], [
+            ["SNAPSHOT", srcId, 0, 1, score(1, 0, 0)],
+            ["PATCH", srcId, 0, 2, [{"op": "replace", "path": "/1/b", "value": 1}]],
+            ["SNAPSHOT", srcId, 0, 4, score(2, 1, 1)],
+        ])
+        self.assertListEqual([json.loads(msg) for msg in ws2.sent],
+                             [score(1, 0, 0), score(1, 1, 0), score(2, 1, 1)])
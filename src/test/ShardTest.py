@@ -0,0 +1,113 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+
+import asyncio
+import json
+import unittest
+
+from Chat.ChatRoom import ChatRoom
+from fwk import ServerQueueTask
+from fwk.Msg import (
+        ClientRxMsg,
+        InternalConnectWsToGi,
+        InternalGiClosed,
+        InternalGiStatus,
+)
+from fwk.Shard import (
+        HashRing,
+        Router,
+        isShardedPath,
+)
+
+class FakeWs:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, msg):
+        self.sent.append(msg)
+
+class HashRingTest(unittest.TestCase):
+    def testPlacement(self):
+        ring = HashRing(range(4))
+        paths = ["dirty7:{}".format(i) for i in range(1000)]
+        nodes = [ring.node(path) for path in paths]
+        self.assertListEqual(nodes, [HashRing(range(4)).node(path) for path in paths])
+        for node in range(4):
+            self.assertGreater(nodes.count(node), 150)
+
+        # Adding a node only moves paths to the new node
+        ring5 = HashRing(range(5))
+        for path, node in zip(paths, nodes):
+            self.assertIn(ring5.node(path), (node, 4))
+
+    def testShardedPath(self):
+        self.assertTrue(isShardedPath("taboo:3"))
+        self.assertFalse(isShardedPath("taboo"))
+        self.assertFalse(isShardedPath("lobby"))
+
+class RouterTest(unittest.TestCase):
+    def testRelay(self):
+        path = "chat:101"
+        ws = FakeWs()
+
+        async def waitFor(cond):
+            for _ in range(1000):
+                if cond():
+                    return
+                await asyncio.sleep(0.01)
+
+        async def run():
+            router = Router(2)
+            try:
+                await router.connect()
+                ServerQueueTask.clientTxQueueAdd(ws, path=path)
+                router.register(ChatRoom(path, "Chat Room"))
+                ServerQueueTask.giRxMsg(path, InternalConnectWsToGi(ws))
+                ServerQueueTask.giRxMsg(path, ClientRxMsg(["hello"], initiatorWs=ws))
+                await waitFor(lambda: ws.sent)
+
+                statuses = []
+                while not ServerQueueTask.TxQueue.empty():
+                    statuses.append(ServerQueueTask.TxQueue.get_nowait())
+            finally:
+                await router.stop()
+                ServerQueueTask.clientTxQueueRemove(ws)
+                ServerQueueTask.GiRxTaskByPath.pop(path).cancel()
+                del ServerQueueTask.GiRxQueueByPath[path]
+                del ServerQueueTask.GiByPath[path]
+            return statuses
+
+        statuses = asyncio.run(run())
+        self.assertListEqual([json.loads(msg) for msg in ws.sent], [["hello"]])
+        self.assertIn(InternalGiStatus([{"clients": 1}], path), statuses)
+
+    def testWorkerLost(self):
+        path, nextPath = "chat:102", "chat:103"
+
+        async def run():
+            router = Router(1)
+            try:
+                await router.connect()
+                router.register(ChatRoom(path, "Chat Room"))
+                router.links[0].process.terminate()
+                for _ in range(1000):
+                    if not router.liveLinks:
+                        break
+                    await asyncio.sleep(0.01)
+
+                # No worker left: new rooms run in this process
+                router.register(ChatRoom(nextPath, "Chat Room"))
+                local = ServerQueueTask.GiByPath[nextPath]
+
+                qmsgs = []
+                while not ServerQueueTask.TxQueue.empty():
+                    qmsgs.append(ServerQueueTask.TxQueue.get_nowait())
+            finally:
+                await router.stop()
+                for registered in (path, nextPath):
+                    ServerQueueTask.deregisterGameClass(registered)
+            return qmsgs, local
+
+        qmsgs, local = asyncio.run(run())
+        self.assertIn(InternalGiClosed(path), qmsgs)
+        self.assertIsInstance(local, ChatRoom)
@@ -0,0 +1,99 @@
+import functools
+import unittest
+
+from Dirty7 import Simulation as Dirty7Simulation
+from Dirty7.Dirty7Round import RoundParameters as Dirty7Parameters
+from Dirty7.Dirty7Rules import SupportedRules
+from Durak import Simulation as DurakSimulation
+from Durak.RoundParameters import RoundParameters as DurakParameters
+from Durak.Round import TableCardsMsgSrc
+from fwk.MsgSrc import (
+        Connections,
+        Jmai,
+        MsgSrc,
+)
+from fwk.Simulation import runGames
+from fwk.Trace import (
+        Level,
+        TRACE_LEVELS,
+        setTraceLevels,
+)
+
+class SimulationTest(unittest.TestCase):
+    def setUp(self):
+        setTraceLevels({Level.error})
+
+    def tearDown(self):
+        setTraceLevels(TRACE_LEVELS)
+
+    def dirty7Parameters(self, ruleNames=None):
+        return Dirty7Parameters(ruleNames or ["basic"], 3, 1, 0, 7, [None], 40, 100,
+                                ["standard"])
+
+    def testHeadlessConnections(self):
+        conns = Connections(None)
+        self.assertTrue(conns.headless())
+        self.assertFalse(Connections([]).headless())
+
+        msgSrc = MsgSrc(conns)
+        msgSrc.setMsgs([Jmai(["FOO", 1], None), Jmai(["BAR"], None)])
+        msgSrc.replaceMsg(1, Jmai(["BAR", 2], None))
+        self.assertEqual([jmai.jmsg for jmai in msgSrc.getMsgs()], [["FOO", 1], ["BAR", 2]])
+
+        # No versions are kept for deltas
+        self.assertTrue(TableCardsMsgSrc.deltaEnabled)
+        tableCards = TableCardsMsgSrc(conns, DurakParameters(2, 1), {})
+        self.assertEqual(tableCards.snapshots(), [])
+
+    def testDirty7(self):
+        playGame = functools.partial(Dirty7Simulation.playGame,
+                                     hostParameters=self.dirty7Parameters())
+        result = playGame(1)
+        self.assertEqual(result, playGame(1))
+        self.assertTrue(result["finished"])
+        self.assertIsNone(result["error"])
+        self.assertEqual(result["badMoves"], 0)
+        self.assertEqual(sorted(result["turnOrder"]), ["p0", "p1", "p2"])
+        self.assertTrue(max(result["totalScore"].values()) >= 100)
+        self.assertEqual(result["winners"],
+                         [name for name, score in result["totalScore"].items()
+                          if score == min(result["totalScore"].values())])
+
+    def testDirty7Fuzz(self):
+        policies = [Dirty7Simulation.randomPolicy, Dirty7Simulation.greedyPolicy,
+                    Dirty7Simulation.randomPolicy]
+        for ruleName in SupportedRules:
+            for seed in range(5):
+                result = Dirty7Simulation.playGame(seed, self.dirty7Parameters([ruleName]),
+                                                   policies)
+                self.assertIsNone(result["error"], ruleName)
+                self.assertTrue(result["finished"], ruleName)
+                self.assertGreater(result["badMoves"], 0)
+
+    def testDurak(self):
+        playGame = functools.partial(DurakSimulation.playGame,
+                                     hostParameters=DurakParameters(3, 2))
+        result = playGame(1)
+        self.assertEqual(result, playGame(1))
+        self.assertTrue(result["finished"])
+        self.assertIsNone(result["error"])
+        self.assertEqual(result["badMoves"], 0)
+        self.assertTrue(result["losers"])
+        self.assertEqual(result["losers"],
+                         sorted(name for name, score in result["totalScore"].items()
+                                if score >= 2))
+
+    def testDurakFuzz(self):
+        policies = [DurakSimulation.randomPolicy, DurakSimulation.greedyPolicy] * 2
+        for numPlayers in (2, 3, 4):
+            for seed in range(10):
+                result = DurakSimulation.playGame(seed, DurakParameters(numPlayers, 1),
+                                                  policies[:numPlayers])
+                self.assertIsNone(result["error"], (numPlayers, seed))
+
+    def testRunGames(self):
+        playGame = functools.partial(DurakSimulation.playGame,
+                                     hostParameters=DurakParameters(2, 1))
+        expected = [playGame(seed) for seed in range(4)]
+        self.assertEqual(runGames(playGame, range(4), processes=1), expected)
+        self.assertEqual(runGames(playGame, range(4), processes=2, chunksize=1), expected)
@@ -0,0 +1,199 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from fwk.Storage import (
+        DbExecutor,
+        DbJob,
+        Index,
+        Int,
+        PrimaryKey,
+        Table,
+        Txt,
+        WriteBehind,
+)
+
+class Item(Table):
+    fields = [
+        Txt("name", qualifier="not null"),
+        Int("count"),
+    ]
+
+class KeyedItem(Table):
+    fields = [
+        Txt("name", qualifier="not null"),
+        Int("count"),
+        Txt("color"),
+        PrimaryKey("name"),
+        Index("color"),
+    ]
+
+class DbExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.db = DbExecutor(":memory:")
+        self.db.execute("create table t (x integer);")
+
+    def tearDown(self):
+        self.db.close()
+
+    def testOrder(self):
+        """Jobs run in order: a query sees earlier fire-and-forget writes"""
+        self.db.executemany("insert into t values (?);", [(1,), (2,)])
+        self.db.execute("insert into t values (?);", (3,))
+        self.assertEqual(self.db.query("select x from t;").result(), [(1,), (2,), (3,)])
+        self.assertEqual(self.db.submit(lambda conn: conn.total_changes).result(), 3)
+
+    def testGroups(self):
+        """Only consecutive fire-and-forget statements with the same SQL are grouped"""
+        jobs = [DbJob(sql="a"), DbJob(sql="a"), DbJob(sql="b"),
+                DbJob(sql="b", future=1), DbJob(sql="b"), DbJob(func=len), DbJob(func=len)]
+        self.assertEqual([len(group) for group in DbExecutor.groups(jobs)], [2, 1, 1, 1, 1, 1])
+
+    def testFailure(self):
+        """A failing statement doesn't roll back the rest of its batch"""
+        self.db.execute("insert into t values (?);", (1,))
+        self.db.execute("insert into nosuchtable values (?);", (2,))
+        bad = self.db.query("select y from t;")
+        self.db.execute("insert into t values (?);", (3,))
+        with self.assertRaises(sqlite3.OperationalError):
+            bad.result()
+        self.assertEqual(self.db.query("select x from t;").result(), [(1,), (3,)])
+
+    def testFetch(self):
+        """Results can be awaited from the event loop"""
+        self.db.execute("insert into t values (?);", (1,))
+        self.assertEqual(asyncio.run(self.db.fetch("select x from t;")), [(1,)])
+
+    def testWal(self):
+        """File databases run in WAL mode with the requested synchronous level"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = DbExecutor(os.path.join(tmpdir, "test.sqlite3"), synchronous="full")
+            self.assertEqual(db.query("pragma journal_mode;").result(), [("wal",)])
+            self.assertEqual(db.query("pragma synchronous;").result(), [(2,)])
+            db.close()
+
+class TableTest(unittest.TestCase):
+    def setUp(self):
+        self.db = DbExecutor(":memory:")
+
+    def tearDown(self):
+        self.db.close()
+
+    def indexes(self, table):
+        return self.db.query("select name from sqlite_master where type = 'index' "
+                             "and tbl_name = ? order by name;", (table,)).result()
+
+    def testKeys(self):
+        """Primary keys and indexes declared in fields are created"""
+        table = KeyedItem(self.db)
+        self.assertEqual([field.name for field in table.columns], ["name", "count", "color"])
+        self.assertEqual(self.indexes("KeyedItem"),
+                         [("KeyedItem_color",), ("sqlite_autoindex_KeyedItem_1",)])
+
+    def testPrimaryKeyOnExistingTable(self):
+        """A table created without its primary key gets a unique index"""
+        self.db.execute("create table KeyedItem (name text not null, count integer, "
+                        "color text);")
+        KeyedItem(self.db)
+        self.assertEqual(self.indexes("KeyedItem"),
+                         [("KeyedItem_color",), ("KeyedItem_name",)])
+
+    def testColumnsAddedToExistingTable(self):
+        """Columns declared after a table was created are added to it"""
+        self.db.execute("create table KeyedItem (name text not null, count integer);")
+        table = KeyedItem(self.db)
+        table.insert(name="a", color="red")
+        self.assertEqual(table.get(["name", "count", "color"]), [("a", None, "red")])
+
+    def testSqlCache(self):
+        """SQL text is built once per operation and column set"""
+        table = KeyedItem(self.db)
+        cmd1 = table.update_cmd({"count": 1}, {"name": "a"})
+        cmd2 = table.update_cmd({"count": 2}, {"name": "b"})
+        self.assertIs(cmd1[0], cmd2[0])
+        self.assertEqual(cmd2[1], [2, "b"])
+        self.assertIsNot(table.update_cmd({"color": "red"}, {"name": "a"})[0], cmd1[0])
+
+    def testUpsert(self):
+        """Rows are upserted by their primary key"""
+        table = KeyedItem(self.db)
+        self.assertIsNone(table.upsert_cmd({"count": 1}, {"color": "red"}))
+        self.db.execute(*table.upsert_cmd({"count": 1, "color": "red"}, {"name": "a"}))
+        self.db.execute(*table.upsert_cmd({"count": 2}, {"name": "a"}))
+        self.db.execute(*table.upsert_cmd({}, {"name": "b"}))
+        self.assertEqual(table.get(["*"]), [("a", 2, "red"), ("b", None, None)])
+
+class WriteBehindTest(unittest.TestCase):
+    def setUp(self):
+        self.db = DbExecutor(":memory:")
+        self.table = Item(self.db)
+        self.writeBehind = WriteBehind(self.db, flushDelaySec=60)
+
+    def tearDown(self):
+        self.db.close()
+
+    def testCoalesce(self):
+        """Writes to the same row are coalesced until flushed"""
+        buf1 = self.writeBehind.buffer()
+        buf2 = self.writeBehind.buffer()
+        buf1.upsert(self.table, {"name": "a"}, {"count": 1})
+        buf1.upsert(self.table, {"name": "a"}, {"count": 2})
+        buf2.upsert(self.table, {"name": "b"}, {"count": 1})
+        self.assertEqual(self.table.get(["*"]), [])
+
+        self.assertEqual(self.writeBehind.flush(), 2)
+        self.assertEqual(self.table.get(["name", "count"]), [("a", 2), ("b", 1)])
+
+        # Update an existing row
+        buf1.upsert(self.table, {"name": "a"}, {"count": 3})
+        self.assertEqual(self.writeBehind.flush(), 1)
+        self.assertEqual(self.writeBehind.flush(), 0)
+        self.assertEqual(self.table.get(["count"], where={"name": "a"}), [(3,)])
+
+    def testCoalesceKeyed(self):
+        """Rows of tables with a primary key are upserted"""
+        table = KeyedItem(self.db)
+        buf = self.writeBehind.buffer()
+        for idx in range(3):
+            buf.upsert(table, {"name": str(idx)}, {"count": idx})
+        buf.upsert(table, {"name": "0"}, {"color": "red"})
+        self.assertEqual(self.writeBehind.flush(), 3)
+        self.assertEqual(table.get(["*"]), [("0", 0, "red"), ("1", 1, None), ("2", 2, None)])
+
+    def testFlushIsOneTransaction(self):
+        """A flush larger than a batch commits all its rows or none"""
+        db = DbExecutor(":memory:", maxBatch=4)
+        try:
+            table = KeyedItem(db)
+            writeBehind = WriteBehind(db, flushDelaySec=60)
+            buf = writeBehind.buffer()
+            for idx in range(600):
+                buf.upsert(table, {"name": str(idx)}, {"count": idx})
+            db.execute("insert into nosuchtable values (1);")
+            self.assertEqual(writeBehind.flush(), 600)
+            self.assertEqual(table.get(["count(*)"]), [(600,)])
+
+            for idx in range(600):
+                buf.upsert(table, {"name": str(idx)}, {"count": -1})
+            buf.upsert(table, {"name": None}, {"count": 0})
+            self.assertEqual(writeBehind.flush(), 601)
+            self.assertEqual(table.get(["count(*)"], where={"count": -1}), [(0,)])
+        finally:
+            db.close()
+
+    def testScheduledFlush(self):
+        """A flush is scheduled on the running event loop"""
+        async def run():
+            writeBehind = WriteBehind(self.db, flushDelaySec=0.01)
+            writeBehind.buffer().upsert(self.table, {"name": "a"}, {"count": 1})
+            self.assertTrue(writeBehind.flushHandle)
+            await asyncio.sleep(0.05)
+            self.assertFalse(writeBehind.flushHandle)
+            return await self.db.fetch("select name, count from Item;")
+
+        self.assertEqual(asyncio.run(run()), [("a", 1)])
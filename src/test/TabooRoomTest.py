@@ -83,7 +83,7 @@ def mockPlyrTeam(txq, allConns, teamId : int,
 
 class TabooRoomTest(unittest.TestCase, MsgTestLib):
     def setUp(self):
-        def mockNextWord(requestor, remainingWords=[ # pylint: disable= unused-argument
+        def mockNextWord(requestor, rng=None, remainingWords=[ # pylint: disable= unused-argument
                             Map(word="c", disallowed=["c1", "c2"]),
                             Map(word="a", disallowed=["a1", "a2"]),
                             Map(word="b", disallowed=["b1", "b2"]),
@@ -959,7 +959,7 @@ class TabooWordSetTest(unittest.TestCase):
 
 class TabooTurnManagerTest(unittest.TestCase, MsgTestLib):
     def setUp(self):
-        def mockNextWord(requestor, remainingWords=[ # pylint: disable= unused-argument
+        def mockNextWord(requestor, rng=None, remainingWords=[ # pylint: disable= unused-argument
                             Map(word="c", disallowed=["c1", "c2"]),
                             Map(word="a", disallowed=["a1", "a2"]),
                             Map(word="b", disallowed=["b1", "b2"]),
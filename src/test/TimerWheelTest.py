@@ -0,0 +1,71 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+
+import unittest
+
+from fwk.TimerWheel import TimerWheel
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.wheel = TimerWheel(tickSec=1, slotsPerLevel=(4, 4, 4))
+
+    def expired(self, now):
+        return [entry.cb for entry in self.wheel.advance(now)]
+
+    def testExpiry(self):
+        self.wheel.add(2, "a")
+        self.wheel.add(2.5, "b")
+        self.wheel.add(3, "c")
+        self.assertEqual(len(self.wheel), 3)
+
+        self.assertEqual(self.expired(1), [])
+        self.assertEqual(self.expired(2), ["a"])
+        self.assertEqual(sorted(self.expired(10)), ["b", "c"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def testPastExpiresOnNextTick(self):
+        self.wheel.advance(5)
+        self.wheel.add(1, "late")
+        self.assertEqual(self.expired(5.5), [])
+        self.assertEqual(self.expired(6), ["late"])
+
+    def testCascade(self):
+        # Timers on levels 1 and 2 are cascaded down and expire on time
+        whens = [3, 5, 9, 17, 30, 50, 63]
+        for when in whens:
+            self.wheel.add(when, when)
+
+        for now in range(64):
+            for cb in self.expired(now):
+                self.assertEqual(cb, now)
+                whens.remove(cb)
+        self.assertEqual(whens, [])
+
+    def testBeyondRange(self):
+        # Timers past the last level are held there until they are in range
+        self.wheel.add(100, "far")
+        self.assertEqual(self.expired(63), [])
+        self.assertEqual(self.expired(99), [])
+        self.assertEqual(self.expired(100), ["far"])
+
+    def testCancel(self):
+        entry = self.wheel.add(20, "x")
+        self.wheel.add(20, "y")
+        self.assertTrue(self.wheel.cancel(entry))
+        self.assertFalse(self.wheel.cancel(entry))
+        self.assertEqual(len(self.wheel), 1)
+        self.assertEqual(self.expired(20), ["y"])
+
+    def testIdleWheelJumpsAhead(self):
+        self.wheel.advance(1000000)
+        self.assertEqual(self.wheel.currTick, 1000000)
+        self.wheel.add(1000003, "z")
+        self.assertEqual(self.expired(1000003), ["z"])
+
+    def testIdleFarTimerSkipsTicks(self):
+        # Empty lower levels are skipped rather than walked tick by tick
+        wheel = TimerWheel(tickSec=0.1)
+        wheel.add(86400, "day")
+        self.assertEqual(wheel.advance(86399.9), [])
+        self.assertEqual([entry.cb for entry in wheel.advance(86400)], ["day"])
+        self.assertEqual(wheel.countByLevel, [0, 0, 0, 0])
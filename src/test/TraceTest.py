@@ -0,0 +1,44 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+
+import io
+import json
+import unittest
+
+from fwk import Trace
+from fwk.Trace import (
+        Level,
+        trace,
+)
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        Trace.flushTrace()
+        self.out = io.StringIO()
+        Trace.traceout = self.out
+
+    def tearDown(self):
+        Trace.setTraceLevels(Trace.TRACE_LEVELS_DEFAULT)
+        Trace.setTraceFile(None)
+
+    def testJsonLines(self):
+        Trace.traceJsonLines = True
+        trace(Level.info, "foo", 1, ["bar"])
+        Trace.flushTrace()
+        record = json.loads(self.out.getvalue())
+        self.assertEqual(record["level"], "INFO")
+        self.assertEqual(record["file"], "TraceTest.py")
+        self.assertEqual(record["func"], "testJsonLines")
+        self.assertEqual(record["msg"], "foo 1 ['bar']")
+
+    def testDisabledLevel(self):
+        class Unprintable:
+            def __str__(self):
+                raise AssertionError("Formatted a disabled trace")
+
+        Trace.setTraceLevels({Level.error})
+        trace(Level.info, Unprintable())
+        trace(Level.error, "foo")
+        Trace.flushTrace()
+        self.assertRegex(self.out.getvalue(),
+                         r"^\S+ \S+ ERR +TraceTest.py:\d+ testDisabledLevel +foo\n$")